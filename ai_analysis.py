@@ -5,8 +5,6 @@ from flask import jsonify, request, render_template, session
 import requests
 from werkzeug.utils import secure_filename
 import json
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from PIL import Image
 import io
 import re  # 添加re模块导入
@@ -14,25 +12,33 @@ import PyPDF2  # 添加PDF处理库
 import docx  # 添加Word文档处理库
 import csv
 import chardet  # 添加字符编码检测库
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from sheet_cache import read_excel_cached
+from task_runner import TaskHandle, TaskCancelled
+from llm_client import LLMClient, CircuitOpenError
 
 # OpenRouter API配置
-OPENROUTER_API_KEY = ""
-OPENROUTER_API_URL = ""
-OPENROUTER_MODEL = ""
-
-# 创建一个带有重试机制的session
-def create_retry_session():
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=3,  # 最多重试3次
-        backoff_factor=1,  # 重试间隔时间
-        status_forcelist=[429, 500, 502, 503, 504],  # 需要重试的HTTP状态码
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', "")
+OPENROUTER_API_URL = os.environ.get('OPENROUTER_API_URL', "")  # 本地测试时可指向llm_stub_server.py
+OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', "")
+
+# 上传文件的内容提取
+# 文件提取同时包含磁盘读取和解析，即使只有一个CPU也至少使用2个工作线程
+AI_EXTRACT_WORKERS = int(os.environ.get('AI_EXTRACT_WORKERS', max(2, min(8, os.cpu_count() or 1))))
+AI_FILE_TIMEOUT = float(os.environ.get('AI_FILE_TIMEOUT', 30))  # 单个文件内容提取的最长时间（秒）
+AI_FILE_MAX_BYTES = int(os.environ.get('AI_FILE_MAX_BYTES', 50 * 1024 * 1024))  # 超过该大小的文件不读取内容
+AI_TOTAL_MAX_BYTES = int(os.environ.get('AI_TOTAL_MAX_BYTES', 200 * 1024 * 1024))  # 一次请求读取内容的文件总大小
+EXTRACT_POLL_INTERVAL = 0.1  # 等待提取结果时检查超时的间隔（秒）
+
+# 所有请求共用的文件提取线程池（不为每个请求创建进程池）
+# 提取函数在处理过程中调用cancel_check，超时的文件会在下一次检查时中断并释放工作线程
+extract_executor = ThreadPoolExecutor(max_workers=AI_EXTRACT_WORKERS, thread_name_prefix='ai-extract')
+
+# 所有请求共用的LLM接口客户端：连接池复用长连接，带重试、熔断和指标统计
+llm_client = LLMClient()
 
 def handle_ai_analysis(app):
     # 注册路由
@@ -43,8 +49,12 @@ def handle_ai_analysis(app):
 def ai_analysis_page():
     return render_template('ai_analysis.html')
 
-def process_image(file_path):
-    """处理图片文件，转换为base64编码，并提取图片基本信息"""
+def process_image(file_path, cancel_check=None):
+    """处理图片文件，转换为base64编码，并提取图片基本信息
+
+    cancel_check: 可选的回调，在各个处理步骤之间调用，抛出TaskCancelled时中断处理
+    """
+    check = cancel_check or (lambda: None)
     try:
         # 使用PIL打开图片并转换为RGB模式
         with Image.open(file_path) as img:
@@ -57,12 +67,15 @@ def process_image(file_path):
             }
             
             # 转换为RGB模式（如果不是的话）
+            check()
             if img.mode != 'RGB':
                 img = img.convert('RGB')
             
             # 调整图片大小以确保不超过API限制
+            check()
             max_size = (1024, 1024)  # 增加最大尺寸以提高清晰度
             img.thumbnail(max_size, Image.Resampling.LANCZOS)
+            check()
             
             # 将图片转换为JPEG格式的bytes
             buffer = io.BytesIO()
@@ -76,12 +89,17 @@ def process_image(file_path):
                 "base64": base64_image,
                 "info": img_info
             }
+    except TaskCancelled:
+        raise
     except Exception as e:
         print(f"处理图片时出错: {str(e)}")
         return None
 
-def extract_text_from_pdf(file_path):
-    """从PDF文件中提取文本内容"""
+def extract_text_from_pdf(file_path, cancel_check=None):
+    """从PDF文件中提取文本内容
+
+    cancel_check: 可选的回调，每解析一页前调用，抛出TaskCancelled时中断提取
+    """
     try:
         text = ""
         with open(file_path, 'rb') as file:
@@ -91,6 +109,8 @@ def extract_text_from_pdf(file_path):
             # 提取文本（最多前10页，避免过大）
             max_pages = min(num_pages, 10)
             for page_num in range(max_pages):
+                if cancel_check is not None:
+                    cancel_check()
                 page = pdf_reader.pages[page_num]
                 text += page.extract_text() + "\n\n"
             
@@ -102,23 +122,31 @@ def extract_text_from_pdf(file_path):
             "text": text,
             "pages": num_pages
         }
+    except TaskCancelled:
+        raise
     except Exception as e:
         print(f"提取PDF文本时出错: {str(e)}")
         return {"text": f"无法提取PDF内容: {str(e)}", "pages": 0}
 
-def extract_text_from_docx(file_path):
-    """从Word文档中提取文本内容"""
+def extract_text_from_docx(file_path, cancel_check=None):
+    """从Word文档中提取文本内容
+
+    cancel_check: 可选的回调，提取每个段落和表格行时调用，抛出TaskCancelled时中断提取
+    """
+    check = cancel_check or (lambda: None)
     try:
         doc = docx.Document(file_path)
         text = ""
         
         # 提取段落文本
         for para in doc.paragraphs:
+            check()
             text += para.text + "\n"
             
         # 提取表格文本
         for table in doc.tables:
             for row in table.rows:
+                check()
                 row_text = []
                 for cell in row.cells:
                     row_text.append(cell.text)
@@ -126,6 +154,8 @@ def extract_text_from_docx(file_path):
             text += "\n"
             
         return text
+    except TaskCancelled:
+        raise
     except Exception as e:
         print(f"提取Word文档文本时出错: {str(e)}")
         return f"无法提取Word文档内容: {str(e)}"
@@ -193,6 +223,249 @@ def extract_text_from_csv(file_path):
         print(f"提取CSV文件内容时出错: {str(e)}")
         return f"无法提取CSV文件内容: {str(e)}"
 
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
+
+def format_file_size(file_size):
+    return f"{file_size/1024/1024:.1f}MB" if file_size > 1024*1024 else f"{file_size/1024:.1f}KB"
+
+def extract_file(file_path, filename, found=False, cancel_check=None):
+    """提取单个文件的内容（在文件提取线程池中执行）
+
+    表格文件在这里直接生成统计描述。
+    found为True时表示编辑消息时找到的之前上传的文件，描述中使用"已找到"。
+    cancel_check为可选的回调，传给各个提取函数；抛出的TaskCancelled不会被当作文件内容错误，而是直接抛出。
+
+    返回:
+    - dict: description（文件信息）、content_text（文件内容）、data_description（表格数据描述）、image（图片数据）
+    """
+    verb = '已找到' if found else '已上传'
+    result = {'description': None, 'content_text': None, 'data_description': None, 'image': None}
+    try:
+        # 获取文件扩展名
+        ext = os.path.splitext(filename)[1].lower() if '.' in filename else ''
+        
+        # 根据文件类型处理
+        if ext in ['.xlsx', '.xls']:
+            try:
+                df = read_excel_cached(file_path, cancel_check=cancel_check)
+                if cancel_check is not None:
+                    cancel_check()
+                result['data_description'] = prepare_data_description([{'name': filename, 'data': df}])
+                result['description'] = f"Excel文件 '{filename}' {verb}，包含 {len(df)} 行数据。"
+            except TaskCancelled:
+                raise
+            except Exception as e:
+                result['description'] = f"Excel文件 '{filename}' 读取失败：{str(e)}"
+        
+        elif ext in IMAGE_EXTENSIONS:
+            # 处理图片文件
+            img_data = process_image(file_path, cancel_check)
+            if img_data:
+                result['image'] = {
+                    'name': filename,
+                    'data': img_data['base64'],
+                    'path': file_path  # 添加文件路径以便后续引用
+                }
+                # 添加图片信息到描述
+                info = img_data['info']
+                result['description'] = f"图片文件 '{filename}' {verb}。尺寸: {info['width']}x{info['height']}，格式: {info['format']}。"
+            else:
+                result['description'] = f"图片文件 '{filename}' 处理失败。"
+        
+        elif ext == '.pdf':
+            # 处理PDF文件
+            pdf_data = extract_text_from_pdf(file_path, cancel_check)
+            if pdf_data:
+                result['description'] = f"PDF文件 '{filename}' {verb}，共 {pdf_data['pages']} 页。"
+                result['content_text'] = f"文件名: {filename}\n类型: pdf\n内容:\n{pdf_data['text']}"
+                print(f"成功处理PDF文件: {filename}")
+            else:
+                result['description'] = f"PDF文件 '{filename}' 处理失败。"
+        
+        elif ext in ['.doc', '.docx']:
+            # 处理Word文档
+            doc_text = extract_text_from_docx(file_path, cancel_check)
+            result['description'] = f"Word文档 '{filename}' {verb}。"
+            result['content_text'] = f"文件名: {filename}\n类型: doc\n内容:\n{doc_text}"
+            print(f"成功处理Word文档: {filename}")
+        
+        elif ext == '.txt' or filename == 'requirements.txt' or filename == 'README.md':
+            # 处理文本文件 (保留对特殊文件的支持)
+            txt_content = extract_text_from_txt(file_path)
+            result['description'] = f"文本文件 '{filename}' {verb}。"
+            result['content_text'] = f"文件名: {filename}\n类型: txt\n内容:\n{txt_content}"
+            print(f"成功处理文本文件: {filename}")
+        
+        elif ext == '.csv':
+            # 处理CSV文件
+            csv_content = extract_text_from_csv(file_path)
+            result['description'] = f"CSV文件 '{filename}' {verb}。"
+            result['content_text'] = f"文件名: {filename}\n类型: csv\n内容:\n{csv_content}"
+            print(f"成功处理CSV文件: {filename}")
+        
+        else:
+            # 对于其他类型的文件，尝试读取内容（如果是文本文件）
+            try:
+                # 检测文件是否为文本
+                is_text = True
+                with open(file_path, 'rb') as f:
+                    chunk = f.read(1024)
+                    if b'\x00' in chunk:  # 包含空字节表示是二进制文件
+                        is_text = False
+                
+                if is_text:
+                    # 尝试检测编码
+                    try:
+                        with open(file_path, 'rb') as f:
+                            raw_data = f.read(4096)  # 读取前4KB来检测编码
+                            encoding = chardet.detect(raw_data)['encoding'] or 'utf-8'
+                    except:
+                        encoding = 'utf-8'  # 如果检测失败，默认使用UTF-8
+                    
+                    # 读取文件内容
+                    with open(file_path, 'r', encoding=encoding, errors='replace') as f:
+                        file_content = f.read(50000)  # 限制读取的内容大小，避免过大
+                        # 如果内容太长，截断并添加说明
+                        if len(file_content) > 50000:
+                            file_content = file_content[:50000] + "\n\n[... 内容过长，已截断 ...]"
+                        result['description'] = f"文件 '{filename}' {verb}并成功读取内容。"
+                        result['content_text'] = f"文件名: {filename}\n类型: 文本\n内容:\n{file_content}"
+                        print(f"成功处理通用文本文件: {filename}")
+                else:
+                    # 二进制文件，只添加基本信息
+                    result['description'] = f"文件 '{filename}' ({format_file_size(os.path.getsize(file_path))}) {verb}。"
+            except TaskCancelled:
+                raise
+            except Exception as e:
+                # 如果读取失败，只添加基本信息
+                result['description'] = f"文件 '{filename}' ({format_file_size(os.path.getsize(file_path))}) {verb}。"
+                print(f"尝试读取文件 {filename} 内容时出错: {str(e)}")  # 调试日志
+    
+    except TaskCancelled:
+        raise
+    except Exception as e:
+        print(f"处理文件 {filename} 时出错: {str(e)}")  # 调试日志
+        result['description'] = f"处理文件 '{filename}' 时出错: {str(e)}"
+    return result
+
+def _skipped_file(description):
+    return {'description': description, 'content_text': None, 'data_description': None, 'image': None}
+
+def _extract_task(file_path, filename, found, task):
+    """在提取线程池中执行extract_file：从开始执行时计时，超过AI_FILE_TIMEOUT或任务被取消时中断"""
+    task.set_stage('extracting')
+    started = time.time()
+
+    def cancel_check():
+        task.check()
+        if time.time() - started > AI_FILE_TIMEOUT:
+            raise TaskCancelled(f"超过{AI_FILE_TIMEOUT:g}秒")
+
+    return extract_file(file_path, filename, found, cancel_check=cancel_check)
+
+def _timeout_file(filename):
+    return _skipped_file(f"文件 '{filename}' 处理超时（超过{AI_FILE_TIMEOUT:g}秒），未读取内容。")
+
+def extract_files(items, found=False):
+    """并行提取多个文件的内容，结果按items的顺序返回（与完成的先后无关）
+
+    - 文件在共用的提取线程池（extract_executor）中处理，同时处理的文件数受AI_EXTRACT_WORKERS限制
+    - 超过AI_FILE_MAX_BYTES的文件、以及累计超过AI_TOTAL_MAX_BYTES之后的文件不读取内容
+    - 每个文件从开始处理起最多AI_FILE_TIMEOUT秒，排队的文件最多等待到AI_FILE_TIMEOUT × 批数；
+      超时的文件跳过，其取消令牌被置位，提取函数在下一次检查时中断，不会在后台继续解析
+    用户上传多个文件时，等待时间取决于最慢的文件，而不是所有文件的处理时间之和。
+
+    参数:
+    - items: [(file_path, filename), ...]
+
+    返回:
+    - list: 与items一一对应的extract_file结果
+    """
+    results = [None] * len(items)
+    pending = []
+    total_size = 0
+    for i, (file_path, filename) in enumerate(items):
+        file_size = os.path.getsize(file_path)
+        if file_size > AI_FILE_MAX_BYTES:
+            results[i] = _skipped_file(f"文件 '{filename}' ({format_file_size(file_size)}) 已上传，"
+                                       f"超过单个文件{format_file_size(AI_FILE_MAX_BYTES)}的限制，未读取内容。")
+        elif total_size + file_size > AI_TOTAL_MAX_BYTES:
+            results[i] = _skipped_file(f"文件 '{filename}' ({format_file_size(file_size)}) 已上传，"
+                                       f"超过本次上传文件总大小{format_file_size(AI_TOTAL_MAX_BYTES)}的限制，未读取内容。")
+        else:
+            total_size += file_size
+            pending.append(i)
+    if not pending:
+        return results
+
+    deadline = time.time() + AI_FILE_TIMEOUT * math.ceil(len(pending) / AI_EXTRACT_WORKERS)
+    tasks = {i: TaskHandle(items[i][1], label='ai_extract') for i in pending}
+    futures = {i: extract_executor.submit(_extract_task, items[i][0], items[i][1], found, tasks[i])
+               for i in pending}
+    remaining = set(pending)
+    try:
+        while remaining:
+            wait([futures[i] for i in remaining], timeout=EXTRACT_POLL_INTERVAL)
+            now = time.time()
+            for i in sorted(remaining):
+                future = futures[i]
+                task = tasks[i]
+                filename = items[i][1]
+                if future.done():
+                    remaining.discard(i)
+                    try:
+                        results[i] = future.result()
+                    except TaskCancelled:
+                        print(f"提取文件 {filename} 超时")
+                        results[i] = _timeout_file(filename)
+                    except Exception as e:
+                        print(f"处理文件 {filename} 时出错: {str(e)}")
+                        results[i] = _skipped_file(f"处理文件 '{filename}' 时出错: {str(e)}")
+                    continue
+                # 提取函数通常会自己在超时后中断；卡在无法检查的步骤中时这里不再等待
+                running = task.stage == 'extracting'
+                if (running and now - task.stage_started_at > AI_FILE_TIMEOUT) or now > deadline:
+                    remaining.discard(i)
+                    task.cancel('文件处理超时')
+                    future.cancel()
+                    print(f"提取文件 {filename} 超时")
+                    results[i] = _timeout_file(filename)
+    finally:
+        # 请求异常结束时，尚未完成的文件也停止处理
+        for i in remaining:
+            tasks[i].cancel('请求已结束')
+            futures[i].cancel()
+    return results
+
+def collect_file_results(slots, results):
+    """按文件顺序汇总提取结果
+
+    参数:
+    - slots: 每个文件对应extract_files结果的序号，或无法处理时的描述文本
+    - results: extract_files的结果
+
+    返回:
+    - (file_descriptions, file_content_texts, data_description, image_data)
+    """
+    file_descriptions = []
+    file_content_texts = []
+    data_descriptions = []
+    image_data = []
+    for slot in slots:
+        if isinstance(slot, str):
+            file_descriptions.append(slot)
+            continue
+        result = results[slot]
+        if result['description']:
+            file_descriptions.append(result['description'])
+        if result['content_text']:
+            file_content_texts.append(result['content_text'])
+        if result['data_description']:
+            data_descriptions.append(result['data_description'])
+        if result['image']:
+            image_data.append(result['image'])
+    return file_descriptions, file_content_texts, "\n\n".join(data_descriptions), image_data
+
 def record_ai_analysis(username, file_count, response_time=0):
     """记录AI分析操作"""
     try:
@@ -321,8 +594,8 @@ def ai_analysis():
         if files:
             print(f"收到 {len(files)} 个文件")  # 调试日志
             print("文件名列表:", [f.filename for f in files])
-            dataframes = []
-            file_descriptions = []
+            items = []  # 需要提取内容的文件 (路径, 文件名)
+            slots = []  # 每个文件在items中的序号，保存失败时为错误描述
             
             # 确保uploads目录存在
             uploads_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
@@ -339,122 +612,18 @@ def ai_analysis():
                 file_path = os.path.join(uploads_dir, filename)
                 
                 try:
-                    # 保存文件
+                    # 保存文件（不再删除上传的文件，使其可用于预览）
                     file.save(file_path)
                     print(f"文件已保存到: {file_path}")  # 调试日志
-                    
-                    # 获取文件扩展名
-                    ext = os.path.splitext(filename)[1].lower() if '.' in filename else ''
-                    
-                    # 根据文件类型处理
-                    if ext in ['.xlsx', '.xls']:
-                        try:
-                            df = pd.read_excel(file_path)
-                            dataframes.append({
-                                'name': filename,
-                                'data': df
-                            })
-                            file_descriptions.append(f"Excel文件 '{filename}' 已上传，包含 {len(df)} 行数据。")
-                        except Exception as e:
-                            file_descriptions.append(f"Excel文件 '{filename}' 读取失败：{str(e)}")
-                    
-                    elif ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
-                        # 处理图片文件
-                        img_data = process_image(file_path)
-                        if img_data:
-                            image_data.append({
-                                'name': filename,
-                                'data': img_data['base64'],
-                                'path': file_path  # 添加文件路径以便后续引用
-                            })
-                            # 添加图片信息到描述
-                            info = img_data['info']
-                            file_descriptions.append(f"图片文件 '{filename}' 已上传。尺寸: {info['width']}x{info['height']}，格式: {info['format']}。")
-                        else:
-                            file_descriptions.append(f"图片文件 '{filename}' 处理失败。")
-                    
-                    elif ext == '.pdf':
-                        # 处理PDF文件
-                        pdf_data = extract_text_from_pdf(file_path)
-                        if pdf_data:
-                            file_descriptions.append(f"PDF文件 '{filename}' 已上传，共 {pdf_data['pages']} 页。")
-                            file_content_texts.append(f"文件名: {filename}\n类型: pdf\n内容:\n{pdf_data['text']}")
-                            print(f"成功处理PDF文件: {filename}")
-                        else:
-                            file_descriptions.append(f"PDF文件 '{filename}' 处理失败。")
-                    
-                    elif ext in ['.doc', '.docx']:
-                        # 处理Word文档
-                        doc_text = extract_text_from_docx(file_path)
-                        file_descriptions.append(f"Word文档 '{filename}' 已上传。")
-                        file_content_texts.append(f"文件名: {filename}\n类型: doc\n内容:\n{doc_text}")
-                        print(f"成功处理Word文档: {filename}")
-                    
-                    elif ext == '.txt' or filename == 'requirements.txt' or filename == 'README.md':
-                        # 处理文本文件 (保留对特殊文件的支持)
-                        txt_content = extract_text_from_txt(file_path)
-                        file_descriptions.append(f"文本文件 '{filename}' 已上传。")
-                        file_content_texts.append(f"文件名: {filename}\n类型: txt\n内容:\n{txt_content}")
-                        print(f"成功处理文本文件: {filename}")
-                    
-                    elif ext == '.csv':
-                        # 处理CSV文件
-                        csv_content = extract_text_from_csv(file_path)
-                        file_descriptions.append(f"CSV文件 '{filename}' 已上传。")
-                        file_content_texts.append(f"文件名: {filename}\n类型: csv\n内容:\n{csv_content}")
-                        print(f"成功处理CSV文件: {filename}")
-                    
-                    else:
-                        # 对于其他类型的文件，尝试读取内容（如果是文本文件）
-                        try:
-                            # 检测文件是否为文本
-                            is_text = True
-                            with open(file_path, 'rb') as f:
-                                chunk = f.read(1024)
-                                if b'\x00' in chunk:  # 包含空字节表示是二进制文件
-                                    is_text = False
-                            
-                            if is_text:
-                                # 尝试检测编码
-                                try:
-                                    import chardet
-                                    with open(file_path, 'rb') as f:
-                                        raw_data = f.read(4096)  # 读取前4KB来检测编码
-                                        result = chardet.detect(raw_data)
-                                        encoding = result['encoding'] or 'utf-8'
-                                except:
-                                    encoding = 'utf-8'  # 如果检测失败，默认使用UTF-8
-                                
-                                # 读取文件内容
-                                with open(file_path, 'r', encoding=encoding, errors='replace') as f:
-                                    file_content = f.read(50000)  # 限制读取的内容大小，避免过大
-                                    # 如果内容太长，截断并添加说明
-                                    if len(file_content) > 50000:
-                                        file_content = file_content[:50000] + "\n\n[... 内容过长，已截断 ...]"
-                                    file_descriptions.append(f"文件 '{filename}' 已上传并成功读取内容。")
-                                    file_content_texts.append(f"文件名: {filename}\n类型: 文本\n内容:\n{file_content}")
-                                    print(f"成功处理通用文本文件: {filename}")
-                            else:
-                                # 二进制文件，只添加基本信息
-                                file_size = os.path.getsize(file_path)
-                                size_str = f"{file_size/1024/1024:.1f}MB" if file_size > 1024*1024 else f"{file_size/1024:.1f}KB"
-                                file_descriptions.append(f"文件 '{filename}' ({size_str}) 已上传。")
-                        except Exception as e:
-                            # 如果读取失败，只添加基本信息
-                            file_size = os.path.getsize(file_path)
-                            size_str = f"{file_size/1024/1024:.1f}MB" if file_size > 1024*1024 else f"{file_size/1024:.1f}KB"
-                            file_descriptions.append(f"文件 '{filename}' ({size_str}) 已上传。")
-                            print(f"尝试读取文件 {filename} 内容时出错: {str(e)}")  # 调试日志
-                
+                    slots.append(len(items))
+                    items.append((file_path, filename))
                 except Exception as e:
                     print(f"处理文件 {filename} 时出错: {str(e)}")  # 调试日志
-                    file_descriptions.append(f"处理文件 '{filename}' 时出错: {str(e)}")
-                
-                # 移除finally块，不再删除上传的文件，使其可用于预览
+                    slots.append(f"处理文件 '{filename}' 时出错: {str(e)}")
             
-            # 准备文件数据描述
-            if dataframes:
-                data_description = prepare_data_description(dataframes)
+            # 并行提取所有文件的内容，按上传顺序汇总
+            file_descriptions, file_content_texts, data_description, image_data = collect_file_results(
+                slots, extract_files(items))
             
             # 添加文件处理结果到消息中
             if file_descriptions:
@@ -473,7 +642,6 @@ def ai_analysis():
             print("这是编辑的消息，尝试查找已上传的文件")
             print(f"需要查找的文件名: {original_filenames}")
             file_names = original_filenames.split(',')
-            dataframes = []
             file_descriptions = []
             file_content_texts = []
             
@@ -489,6 +657,8 @@ def ai_analysis():
                     print(f"  {idx+1}. {f}")
                 
                 # 尝试找到匹配的文件
+                items = []
+                slots = []
                 for file_name in file_names:
                     file_name = file_name.strip()
                     found = False
@@ -511,135 +681,15 @@ def ai_analysis():
                     if found and matched_file:
                         file_path = os.path.join(uploads_dir, matched_file)
                         print(f"处理找到的文件: {file_path}")
-                        
-                        try:
-                            # 获取文件扩展名
-                            ext = os.path.splitext(file_path)[1].lower()
-                            print(f"文件扩展名: {ext}")
-                            
-                            # 根据文件类型处理
-                            if ext in ['.xlsx', '.xls']:
-                                try:
-                                    df = pd.read_excel(file_path)
-                                    dataframes.append({
-                                        'name': os.path.basename(file_path),
-                                        'data': df
-                                    })
-                                    file_descriptions.append(f"Excel文件 '{os.path.basename(file_path)}' 已找到，包含 {len(df)} 行数据。")
-                                    print(f"成功处理Excel文件: {file_path}")
-                                except Exception as e:
-                                    file_descriptions.append(f"Excel文件 '{os.path.basename(file_path)}' 读取失败：{str(e)}")
-                                    print(f"处理Excel文件失败: {str(e)}")
-                            
-                            elif ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
-                                # 处理图片文件
-                                img_data = process_image(file_path)
-                                if img_data:
-                                    image_data.append({
-                                        'name': os.path.basename(file_path),
-                                        'data': img_data['base64'],
-                                        'path': file_path  # 添加文件路径以便后续引用
-                                    })
-                                    # 添加图片信息到描述
-                                    info = img_data['info']
-                                    file_descriptions.append(f"图片文件 '{os.path.basename(file_path)}' 已找到。尺寸: {info['width']}x{info['height']}，格式: {info['format']}。")
-                                    print(f"成功处理图片文件: {file_path}")
-                                else:
-                                    file_descriptions.append(f"图片文件 '{os.path.basename(file_path)}' 处理失败。")
-                                    print(f"处理图片文件失败")
-                            
-                            elif ext == '.pdf':
-                                # 处理PDF文件
-                                pdf_data = extract_text_from_pdf(file_path)
-                                if pdf_data:
-                                    file_content_texts.append(f"文件名: {os.path.basename(file_path)}\n类型: pdf\n内容:\n{pdf_data['text']}")
-                                    file_descriptions.append(f"PDF文件 '{os.path.basename(file_path)}' 已找到，共 {pdf_data['pages']} 页。")
-                                    print(f"成功处理PDF文件: {file_path}")
-                                else:
-                                    file_descriptions.append(f"PDF文件 '{os.path.basename(file_path)}' 处理失败。")
-                                    print(f"处理PDF文件失败")
-                            
-                            elif ext == '.docx' or ext == '.doc':
-                                # 处理Word文档
-                                text = extract_text_from_docx(file_path)
-                                file_content_texts.append(f"文件名: {os.path.basename(file_path)}\n类型: doc\n内容:\n{text}")
-                                file_descriptions.append(f"Word文档 '{os.path.basename(file_path)}' 已找到，提取了 {len(text.split())} 个单词。")
-                                print(f"成功处理Word文件: {file_path}")
-                            
-                            elif ext == '.txt':
-                                # 处理文本文件
-                                text = extract_text_from_txt(file_path)
-                                file_content_texts.append(f"文件名: {os.path.basename(file_path)}\n类型: txt\n内容:\n{text}")
-                                file_descriptions.append(f"文本文件 '{os.path.basename(file_path)}' 已找到，提取了 {len(text.split())} 个单词。")
-                                print(f"成功处理文本文件: {file_path}")
-                            
-                            elif ext == '.csv':
-                                # 处理CSV文件
-                                try:
-                                    df, text = extract_text_from_csv(file_path)
-                                    dataframes.append({
-                                        'name': os.path.basename(file_path),
-                                        'data': df
-                                    })
-                                    file_content_texts.append(f"文件名: {os.path.basename(file_path)}\n类型: csv\n内容:\n{text}")
-                                    file_descriptions.append(f"CSV文件 '{os.path.basename(file_path)}' 已找到，包含 {len(df)} 行数据。")
-                                    print(f"成功处理CSV文件: {file_path}")
-                                except Exception as e:
-                                    file_descriptions.append(f"CSV文件 '{os.path.basename(file_path)}' 读取失败：{str(e)}")
-                                    print(f"处理CSV文件失败: {str(e)}")
-                            
-                            else:
-                                # 尝试作为通用文件处理
-                                try:
-                                    with open(file_path, 'rb') as f:
-                                        is_binary = False
-                                        try:
-                                            for block in f:
-                                                if b'\0' in block:
-                                                    is_binary = True
-                                                    break
-                                        except:
-                                            is_binary = True
-                                    
-                                    if not is_binary:
-                                        # 文本文件，尝试读取内容
-                                        try:
-                                            import chardet
-                                            with open(file_path, 'rb') as f:
-                                                raw_data = f.read(4096)  # 读取前4KB来检测编码
-                                                result = chardet.detect(raw_data)
-                                                encoding = result['encoding'] or 'utf-8'
-                                        except:
-                                            encoding = 'utf-8'  # 如果检测失败，默认使用UTF-8
-                                        
-                                        # 读取文件内容
-                                        with open(file_path, 'r', encoding=encoding, errors='replace') as f:
-                                            file_content = f.read(50000)  # 限制读取的内容大小，避免过大
-                                            # 如果内容太长，截断并添加说明
-                                            if len(file_content) > 50000:
-                                                file_content = file_content[:50000] + "\n\n[... 内容过长，已截断 ...]"
-                                            file_content_texts.append(f"文件名: {os.path.basename(file_path)}\n类型: 文本\n内容:\n{file_content}")
-                                            file_descriptions.append(f"文件 '{os.path.basename(file_path)}' 已找到并成功读取内容。")
-                                            print(f"成功作为文本文件处理: {file_path}")
-                                    else:
-                                        # 二进制文件，只添加基本信息
-                                        file_size = os.path.getsize(file_path)
-                                        size_str = f"{file_size/1024/1024:.1f}MB" if file_size > 1024*1024 else f"{file_size/1024:.1f}KB"
-                                        file_descriptions.append(f"文件 '{os.path.basename(file_path)}' ({size_str}) 已找到，但无法读取二进制内容。")
-                                        print(f"文件是二进制格式: {file_path}")
-                                except Exception as e:
-                                    file_descriptions.append(f"不支持的文件类型: {os.path.basename(file_path)}")
-                                    print(f"不支持的文件类型: {ext}, 错误: {str(e)}")
-                        except Exception as e:
-                            print(f"处理文件时出错: {str(e)}")
-                            file_descriptions.append(f"处理文件 '{os.path.basename(file_path)}' 时出错: {str(e)}")
+                        slots.append(len(items))
+                        items.append((file_path, matched_file))
                     else:
                         print(f"未找到匹配的文件: {file_name}")
-                        file_descriptions.append(f"未找到文件 '{file_name}'")
+                        slots.append(f"未找到文件 '{file_name}'")
                 
-                # 处理找到的DataFrame数据
-                if dataframes:
-                    data_description = prepare_data_description(dataframes)
+                # 并行提取找到的文件的内容，按文件名的顺序汇总
+                file_descriptions, file_content_texts, data_description, image_data = collect_file_results(
+                    slots, extract_files(items, found=True))
                 
                 # 添加文件处理结果到消息中
                 if file_descriptions:
@@ -656,9 +706,8 @@ def ai_analysis():
                 print(f"上传目录不存在: {uploads_dir}")
                 file_descriptions.append("上传目录不存在，无法找到之前上传的文件")
                 
-            # 处理找到的DataFrame数据
-            if dataframes:
-                data_description = prepare_data_description(dataframes)
+            # 处理找到的表格数据
+            if data_description:
                 # 将数据文件描述添加到请求中
                 message += "\n\n数据文件：\n" + "\n".join(file_descriptions)
         
@@ -831,14 +880,12 @@ def get_deepseek_analysis(user_message, data_description="", image_data=None):
 
         #print(f"发送请求到OpenRouter API...")  # 调试日志
 
-        # 使用带有重试机制的session发送请求
-        session = create_retry_session()
+        # 使用共享的客户端发送请求（复用连接，失败时自动重试）
         try:
-            response = session.post(
-                OPENROUTER_API_URL, 
-                headers=headers, 
-                json=data,
-                timeout=(10, 90)
+            response = llm_client.post(
+                OPENROUTER_API_URL,
+                headers=headers,
+                json=data
             )
             
             #print(f"API响应状态码: {response.status_code}")  # 调试日志
@@ -869,6 +916,9 @@ def get_deepseek_analysis(user_message, data_description="", image_data=None):
 
             return content
 
+        except CircuitOpenError:
+            print("AI服务熔断中，跳过请求")  # 调试日志
+            return "AI服务暂时不可用（最近的请求连续失败），请稍后重试"
         except requests.exceptions.Timeout:
             print("API请求超时")  # 调试日志
             return "API请求超时，请稍后重试"
@@ -17,11 +17,17 @@ from contextlib import contextmanager
 from werkzeug.security import generate_password_hash, check_password_hash
 import random
 import re
-from ai_analysis import handle_ai_analysis
+from ai_analysis import handle_ai_analysis, llm_client
 from sales_trend import handle_sales_trend
+from excel_loader import ExcelWorkbook, clean_sheet_name, is_valid_key, probe_sheet
+from compare_engine import ComparisonIndex
+from result_writer import ResultWriter, result_extension
+from job_queue import JobQueue
+from upload_store import UploadStore
 from urllib.parse import unquote
 import traceback
 import zipfile
+import shutil
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -356,6 +362,18 @@ app.config['SYSTEM_SETTINGS'] = {
     'temp_file_lifetime': 24 * 3600  # 24小时
 }
 
+# 后台分析任务队列，任务状态和结果文件保存在上传目录下的analysis_jobs目录中
+analysis_jobs = JobQueue(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'analysis_jobs'),
+    max_workers=app.config['SYSTEM_SETTINGS']['max_analysis_threads']
+)
+
+# 按内容哈希缓存上传的工作簿，/get_sheets、/get_columns、/analyze之间通过file_id复用，无需重复上传和解析
+upload_store = UploadStore(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'upload_store'),
+    ttl=app.config['SYSTEM_SETTINGS']['temp_file_lifetime']
+)
+
 # 记录登录失败次数
 login_attempts = {}
 
@@ -1136,13 +1154,61 @@ def secure_excel_filename(filename):
     # 返回处理后的完整文件名
     return f"{safe_name}{ext}"
 
-def suggest_column(columns):
-    """推荐可能的IMEI列名"""
+def _imei_content_score(values):
+    """根据样本值评估列内容像IMEI/串码的程度，返回0~1之间的分数
+    
+    15位纯数字（IMEI）记1分，14/16/17位纯数字（MEID、IMEISV等）记0.7分，
+    同时包含字母和数字的8~20位序列号记0.5分。
+    """
+    if not values:
+        return 0
+    total = 0
+    for value in values:
+        text = str(value).strip()
+        if text.isdigit():
+            if len(text) == 15:
+                total += 1
+            elif 14 <= len(text) <= 17:
+                total += 0.7
+        elif 8 <= len(text) <= 20 and text.isalnum() and any(c.isdigit() for c in text) and any(c.isalpha() for c in text):
+            total += 0.5
+    return total / len(values)
+
+def suggest_column(columns, samples=None):
+    """推荐可能的IMEI列名
+    
+    参数:
+    - columns: 列名列表
+    - samples: 可选，{列名: [样本值, ...]}，提供时同时根据列内容评分
+    """
     possible_names = [
         '串码', 'IMEI', 'imei', 'Imei', 'IMei', 'ImEi', 'IMEI码', 'imei码',
         'Imei码', '串号', '机器码', '设备码', '设备号', '机身码', '手机串码',
         'Serial', 'serial', 'SerialNumber', 'serialnumber', 'SERIAL'
     ]
+    keywords = ['imei', '串码', '串号', 'serial']
+    
+    if samples:
+        # 列名匹配和内容匹配综合评分：精确匹配3分，不区分大小写匹配2分，包含关键词1分，
+        # 内容评分最高4分，列名不规范但内容全是IMEI的列也能被识别出来
+        lower_names = {name.lower() for name in possible_names}
+        best_column = None
+        best_score = 0
+        for col in columns:
+            if col in possible_names:
+                name_score = 3
+            elif col.lower() in lower_names:
+                name_score = 2
+            elif any(keyword in col.lower() for keyword in keywords):
+                name_score = 1
+            else:
+                name_score = 0
+            score = name_score + 4 * _imei_content_score(samples.get(col, []))
+            if score > best_score:
+                best_column = col
+                best_score = score
+        if best_column is not None:
+            return best_column
     
     # 检查精确匹配
     for name in possible_names:
@@ -1156,7 +1222,6 @@ def suggest_column(columns):
             return lower_columns[name.lower()]
             
     # 检查包含关键词的列名
-    keywords = ['imei', '串码', '串号', 'serial']
     for col in columns:
         for keyword in keywords:
             if keyword.lower() in col.lower():
@@ -1164,18 +1229,6 @@ def suggest_column(columns):
     
     return columns[0] if columns else None
 
-def clean_sheet_name(sheet_name):
-    """清理工作表名称中的特殊字符"""
-    # 移除或替换不允许的字符
-    invalid_chars = [':', '/', '\\', '?', '*', '[', ']', "'"]
-    result = sheet_name
-    for char in invalid_chars:
-        result = result.replace(char, '_')
-    # 确保工作表名称不超过31个字符（Excel的限制）
-    if len(result) > 31:
-        result = result[:31]
-    return result
-
 def safe_sheet_name(filename, sheet_name):
     """生成安全的工作表名称"""
     # 从文件名和工作表名生成一个唯一的名称
@@ -1204,149 +1257,138 @@ def read_excel_sheets(file_path):
         except Exception as e2:
             raise ValueError(f"读取Excel工作表失败: {str(e2)}")
 
-def read_excel_file(file_path, sheet_name=None):
-    """安全地读取Excel文件，处理大数据量的情况"""
-    try:
-        # 直接使用传入的工作表名称
-        df = pd.read_excel(
-            file_path,
-            engine='openpyxl',
-            sheet_name=sheet_name,
-            nrows=1  # 只读取第一行
-        )
-        
-        # 获取实际的列名，并处理特殊字符
-        columns = []
-        for col in df.columns:
-            col_str = str(col).strip()
-            if col_str:  # 只添加非空列名
-                # 替换或移除可能导致问题的特殊字符
-                col_str = ''.join(c for c in col_str if c.isprintable())
-                columns.append(col_str)
-        
-        #print(f"实际的列名: {columns}")  # 调试信息
-        
-        # 然后读取完整数据
-        df = pd.read_excel(
-            file_path,
-            engine='openpyxl',
-            sheet_name=sheet_name,
-            dtype=str  # 将所有列都作为字符串读取，避免类型推断问题
-        )
-        
-        # 重命名列名，确保它们与之前处理的列名一致
-        df.columns = columns
-        
-        return df, columns
-    except Exception as e:
-        print(f"读取Excel文件时出错: {str(e)}")  # 调试信息
-        raise ValueError(f"读取Excel文件失败: {str(e)}")
-
-def process_excel_files(file_paths, selected_columns):
-    """处理上传的Excel文件并分析选定列的数据"""
+def process_excel_files(file_paths, selected_columns, output_format='xlsx', progress=None):
+    """处理上传的Excel文件并分析选定列的数据
+    
+    每个工作簿只打开一次，第一遍只读取选定列用于集合运算，
+    写结果时再流式读取属于独特/共同数据的完整行。
+    output_format: 结果文件格式，xlsx（默认）、csv或parquet（后两者打包为zip）
+    progress: 可选的进度回调 progress(stage, fraction)，后台任务用于汇报进度
+    """
     file_data = {}
-    all_values = {}
     first_file_order = {}  # 用于存储第一个文件中值的顺序
     is_first_file = True
+    workbooks = []
+    total_files = max(len(file_paths), 1)
     
-    # 读取所有文件数据
-    for filename, temp_path in file_paths:
-        try:
-            # 获取该文件的所有工作表选择
-            file_sheets = {key: value for key, value in selected_columns.items() if key.startswith(f"{filename}|")}
-            
-            if not file_sheets:
-                continue  # 跳过未选择列的文件
-            
-            # 读取每个选定的工作表
-            for unique_key, selection in file_sheets.items():
-                if not isinstance(selection, dict) or 'sheet' not in selection or 'column' not in selection:
-                    continue  # 跳过格式不正确的选择
-            
-                # 读取Excel文件的指定工作表
-                df = pd.read_excel(
-                    temp_path,
-                    engine='openpyxl',
-                    sheet_name=selection['sheet'],
-                    dtype=str  # 强制所有列都作为字符串读取
-                )
-            
-                selected_column = selection['column']
-                if selected_column not in df.columns:
-                    continue  # 跳过未找到列的工作表
-                
-                # 使用文件名和工作表名的组合作为键
-                display_name = f"{filename} (工作表: {selection['sheet']})"
-                
-                # 预处理选定列的数据：转换为字符串并清理
-                df_column = df[selected_column].astype(str).str.strip()
-                df[selected_column] = df_column
-                
-                # 如果是第一个文件，记录值的顺序
-                if is_first_file:
-                    # 创建值到位置的映射，只记录非空值
-                    first_file_order = {val: idx for idx, val in enumerate(df_column) if val and val.lower() != 'nan'}
-                    is_first_file = False
+    try:
+        # 读取所有文件数据
+        for file_idx, (filename, temp_path) in enumerate(file_paths):
+            if progress:
+                progress('reading', file_idx / total_files, f"正在读取 {filename}")
+            try:
+                # 获取该文件的所有工作表选择
+                file_sheets = {key: value for key, value in selected_columns.items() if key.startswith(f"{filename}|")}
                 
-                file_data[display_name] = {
-                    'df': df,
-                    'selected_column': selected_column,
-                    'sheet_name': selection['sheet']
-                }
+                if not file_sheets:
+                    continue  # 跳过未选择列的文件
                 
-                # 获取当前工作表选定列的值集合（已经清理过的数据）
-                values = set(x for x in df_column if x and x.lower() != 'nan')
-                all_values[display_name] = values
+                # 同一文件的所有工作表共用一个只读工作簿
+                workbook = ExcelWorkbook(temp_path)
+                workbooks.append(workbook)
                 
-        except Exception as e:
-            logger.error(f"处理文件 {filename} 时出错：{str(e)}")
-            continue
-    
+                # 读取每个选定的工作表
+                for unique_key, selection in file_sheets.items():
+                    if not isinstance(selection, dict) or 'sheet' not in selection or 'column' not in selection:
+                        continue  # 跳过格式不正确的选择
+                    
+                    # 只扫描选定列，未找到列时跳过该工作表
+                    selected_column = selection['column']
+                    source = workbook.sheet_source(selection['sheet'], selected_column)
+                    if source is None:
+                        continue
+                    
+                    # 使用文件名和工作表名的组合作为键
+                    display_name = f"{filename} (工作表: {selection['sheet']})"
+                    
+                    # 选定列的数据已转换为字符串并清理
+                    df_column = pd.Series(source.keys, dtype=object)
+                    
+                    # 如果是第一个文件，记录值的顺序
+                    if is_first_file:
+                        # 创建值到位置的映射，只记录非空值
+                        first_file_order = {val: idx for idx, val in enumerate(source.keys) if is_valid_key(val)}
+                        is_first_file = False
+                    
+                    file_data[display_name] = {
+                        'source': source,
+                        'keys': df_column,
+                        'selected_column': selected_column,
+                        'sheet_name': selection['sheet']
+                    }
+                    
+            except Exception as e:
+                logger.error(f"处理文件 {filename} 时出错：{str(e)}")
+                continue
+        
+        return _write_comparison_results(file_data, first_file_order, output_format, progress)
+    finally:
+        for workbook in workbooks:
+            workbook.close()
+
+def _write_comparison_results(file_data, first_file_order, output_format='xlsx', progress=None):
+    """根据各数据源选定列的值计算独特/共同数据并生成结果文件与图表"""
     # 检查有效的数据源数量
     if len(file_data) < 2:
         raise ValueError("请至少选择两个数据源（可以是不同文件或同一文件的不同工作表）进行比较")
     
-    # 计算所有数据源中的共同值
-    common_values = set.intersection(*all_values.values())
+    # 一次遍历建立 值→数据源位掩码 索引，独特值和共同值均由索引直接得出
+    if progress:
+        progress('indexing', 0, "正在比较数据")
+    display_names = list(file_data)
+    index = ComparisonIndex([file_data[name]['keys'] for name in display_names])
     
     # 计算每个数据源的独特值
     unique_results = {}
-    result_path = get_temp_path('analysis_result.xlsx')
+    result_path = get_temp_path(f"analysis_result{result_extension(output_format)}")
     
-    with pd.ExcelWriter(result_path, engine='openpyxl') as writer:
-        for display_name in file_data:
-            # 计算当前数据源独特的值
-            other_values = set.union(*[values for name, values in all_values.items() if name != display_name])
-            unique_values = all_values[display_name] - other_values
-            
-            # 获取包含这些值的完整数据行
+    # 行在分类的同时直接写出，不再为每个数据源构建完整的DataFrame
+    with ResultWriter(result_path, output_format) as writer:
+        for source_idx, display_name in enumerate(display_names):
+            if progress:
+                progress('writing', source_idx / len(display_names), f"正在写入 {display_name}")
             current_data = file_data[display_name]
-            df_column = current_data['df'][current_data['selected_column']]
+            source = current_data['source']
+            df_column = current_data['keys']
             
-            # 使用预处理过的列数据进行过滤
-            unique_rows = current_data['df'][df_column.isin(unique_values)]
+            unique_mask = index.unique_row_mask(source_idx)
+            common_mask = index.common_row_mask(source_idx)
             
-            # 获取共同数据
-            common_mask = df_column.isin(common_values)
-            common_rows = current_data['df'][common_mask].copy()
+            # 根据第一个文件的顺序确定共同数据的输出顺序，已经有序时无需缓存
+            common_order = None
+            if first_file_order and common_mask.any():
+                sort_key = df_column[common_mask].map(first_file_order).to_numpy()
+                order = np.argsort(sort_key, kind='stable')
+                if np.any(order != np.arange(len(order))):
+                    common_order = order
             
-            # 根据第一个文件的顺序对共同数据进行排序
-            if first_file_order:
-                common_rows['__sort_key'] = common_rows[current_data['selected_column']].map(first_file_order)
-                common_rows = common_rows.sort_values('__sort_key')
-                common_rows = common_rows.drop('__sort_key', axis=1)
-            
-            # 保存到Excel
             base_name = display_name.split(' (工作表:')[0]
             safe_unique_sheet = clean_sheet_name(f"{os.path.splitext(base_name)[0][:15]}_{current_data['sheet_name']}_独特数据")
             safe_common_sheet = clean_sheet_name(f"{os.path.splitext(base_name)[0][:15]}_{current_data['sheet_name']}_共同数据")
+            unique_sheet = writer.add_sheet(safe_unique_sheet, source.columns)
+            common_sheet = writer.add_sheet(safe_common_sheet, source.columns)
+            
+            # 一次流式读取同时输出独特数据和共同数据
+            keep = unique_mask | common_mask
+            is_unique = unique_mask[keep]
+            pending_common = [] if common_order is not None else None
+            for row_is_unique, row in zip(is_unique, source.iter_rows(keep)):
+                if row_is_unique:
+                    unique_sheet.append(row)
+                elif pending_common is not None:
+                    pending_common.append(row)
+                else:
+                    common_sheet.append(row)
             
-            unique_rows.to_excel(writer, sheet_name=safe_unique_sheet, index=False)
-            common_rows.to_excel(writer, sheet_name=safe_common_sheet, index=False)
+            # 只有需要重新排序时才缓存共同数据
+            if pending_common is not None:
+                for position in common_order:
+                    common_sheet.append(pending_common[position])
+                pending_common = None
             
             unique_results[display_name] = {
-                'unique_count': len(unique_values),
-                'common_count': len(common_values),
+                'unique_count': index.unique_counts[source_idx],
+                'common_count': index.common_count,
                 'description': "在此数据源中独有的数据",
                 'common_description': "在所有数据源中都存在的数据"
             }
@@ -1376,8 +1418,8 @@ def process_excel_files(file_paths, selected_columns):
     
     # 为每个文件添加一个独立的饼图
     for idx, (display_name, data) in enumerate(file_data.items()):
-        unique_count = len(all_values[display_name] - set.union(*[values for name, values in all_values.items() if name != display_name]))
-        common_count = len(common_values)
+        unique_count = index.unique_counts[idx]
+        common_count = index.common_count
         
         # 根据数据值的大小调整标签的位置和显示格式
         pie_chart = {
@@ -1438,48 +1480,53 @@ def get_temp_path(filename):
     unique_filename = f"{uuid.uuid4().hex}_{safe_filename}"
     return os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
 
-def analyze_single_file(file_path, sheet_name, column_name):
-    """分析单个文件中指定列的数据，找出独特值和重复值"""
+def analyze_single_file(file_path, sheet_name, column_name, output_format='xlsx', progress=None):
+    """分析单个文件中指定列的数据，找出独特值和重复值
+    
+    第一遍只读取指定列统计出现次数，第二遍流式读取完整行并边分类边写出结果文件。
+    progress: 可选的进度回调 progress(stage, fraction)，后台任务用于汇报进度
+    """
     try:
-        # 读取Excel文件
-        df = pd.read_excel(
-            file_path,
-            engine='openpyxl',
-            sheet_name=sheet_name,
-            dtype=str  # 将所有列都作为字符串读取
-        )
-        
-        if column_name not in df.columns:
-            raise ValueError(f"未找到列 {column_name}")
-            
-        # 获取指定列的数据
-        column_data = df[column_name].astype(str).str.strip()
-        
-        # 计算每个值的出现次数
-        value_counts = column_data.value_counts()
-        
-        # 获取独特值（只出现一次的值）
-        unique_values = value_counts[value_counts == 1].index
-        # 获取重复值（出现多次的值）
-        duplicate_values = value_counts[value_counts > 1].index
-        
-        # 获取包含这些值的完整数据行
-        unique_rows = df[column_data.isin(unique_values)]
-        duplicate_rows = df[column_data.isin(duplicate_values)]
-        
-        # 创建结果文件
-        result_file = f"analysis_result_{uuid.uuid4().hex[:8]}.xlsx"
-        result_path = os.path.join(app.config['UPLOAD_FOLDER'], result_file)
-        
-        with pd.ExcelWriter(result_path, engine='openpyxl') as writer:
-            unique_rows.to_excel(writer, sheet_name='独特数据', index=False)
-            duplicate_rows.to_excel(writer, sheet_name='重复数据', index=False)
+        if progress:
+            progress('reading', 0, "正在读取文件")
+        with ExcelWorkbook(file_path) as workbook:
+            source = workbook.sheet_source(sheet_name, column_name)
+            if source is None:
+                raise ValueError(f"未找到列 {column_name}")
+            
+            # 获取指定列的数据（空值记为'nan'，与原先的astype(str)一致）
+            column_data = pd.Series(source.keys, dtype=object)
+            
+            # 计算每个值的出现次数，出现一次的为独特值，多次的为重复值
+            if progress:
+                progress('indexing', 0, "正在统计重复数据")
+            occurrences = column_data.map(column_data.value_counts()).to_numpy()
+            unique_mask = occurrences == 1
+            unique_count = int(unique_mask.sum())
+            duplicate_count = int(len(occurrences) - unique_count)
+            
+            # 创建结果文件
+            result_file = f"analysis_result_{uuid.uuid4().hex[:8]}{result_extension(output_format)}"
+            result_path = os.path.join(app.config['UPLOAD_FOLDER'], result_file)
+            
+            with ResultWriter(result_path, output_format) as writer:
+                unique_sheet = writer.add_sheet('独特数据', source.columns)
+                duplicate_sheet = writer.add_sheet('重复数据', source.columns)
+                # 输出原始单元格值，不替换为清理后的键
+                total_rows = max(len(unique_mask), 1)
+                for row_idx, (row_is_unique, row) in enumerate(zip(unique_mask, source.iter_rows(clean_key=False))):
+                    if progress and row_idx % 10000 == 0:
+                        progress('writing', row_idx / total_rows, "正在写入结果文件")
+                    if row_is_unique:
+                        unique_sheet.append(row)
+                    else:
+                        duplicate_sheet.append(row)
         
         # 创建图表数据
         plot_data = {
             'data': [
                 {
-                    'values': [len(unique_rows), len(duplicate_rows)],
+                    'values': [unique_count, duplicate_count],
                     'labels': ['独特数据', '重复数据'],
                     'type': 'pie',
                     'hole': 0.4,
@@ -1526,28 +1573,111 @@ def analyze_single_file(file_path, sheet_name, column_name):
         
         return {
             'plot': json.dumps(plot_data),
-            'unique_count': len(unique_rows),
-            'duplicate_count': len(duplicate_rows),
+            'unique_count': unique_count,
+            'duplicate_count': duplicate_count,
             'result_file': result_file
         }
         
     except Exception as e:
         raise ValueError(f"分析文件失败: {str(e)}")
 
+def run_file_analysis(username, mode, temp_paths, selected_columns, output_format='xlsx', progress=None):
+    """执行一次文件分析并记录分析操作，同步请求和后台任务共用
+    
+    参数:
+    - temp_paths: [(原始文件名, 临时文件路径), ...]
+    - progress: 可选的进度回调，后台任务用于汇报进度
+    """
+    # 开始计时
+    start_time = time.time()
+    
+    # 根据模式选择分析方法
+    if mode == 'single':
+        # 获取第一个文件的工作表和列选择
+        first_file = temp_paths[0]
+        file_key = next(iter(selected_columns))  # 获取第一个键
+        selection = selected_columns[file_key]
+        sheet_name = selection['sheet']
+        column_name = selection['column']
+        
+        # 分析单个文件
+        results = analyze_single_file(first_file[1], sheet_name, column_name, output_format, progress)
+    else:
+        # 比较模式
+        results = process_excel_files(temp_paths, selected_columns, output_format, progress)
+    
+    # 结束计时并计算处理时间（毫秒）
+    end_time = time.time()
+    process_time = round((end_time - start_time) * 1000)
+    
+    # 收集文件名
+    file_names = [filename for filename, _ in temp_paths]
+    
+    # 记录分析操作
+    if username:
+        record_analysis(username, len(temp_paths), mode, process_time, file_names)
+    
+    return results
+
+def is_async_request():
+    """请求是否要求以后台任务方式执行（async=true）"""
+    return request.form.get('async', 'false').lower() in ('1', 'true', 'yes')
+
+def get_job_owner():
+    """后台任务的所属者：登录用户为用户名，未登录时为保存在会话中的随机令牌
+    
+    只有提交任务的用户（未登录时为提交任务的浏览器会话）能查询任务状态和下载结果。
+    """
+    username = session.get('username')
+    if username:
+        return username
+    if 'job_owner_token' not in session:
+        session['job_owner_token'] = uuid.uuid4().hex
+    return f"anonymous:{session['job_owner_token']}"
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    """处理文件分析请求"""
+    """处理文件分析请求
+    
+    携带async=true时提交后台任务并立即返回job_id，通过 /api/jobs/<job_id> 查询进度和结果。
+    """
     try:
         files = request.files.getlist('files[]')
+        # 已通过/get_sheets缓存的文件，按[{file_id, filename}, ...]引用，无需重新上传
+        file_refs = json.loads(request.form.get('file_ids', '[]'))
         mode = request.form.get('mode', 'single')
         selected_columns = json.loads(request.form.get('selected_columns', '{}'))
+        output_format = request.form.get('output_format', 'xlsx')
+        run_async = is_async_request()
         
-        if not files:
+        if not files and not file_refs:
             return jsonify({'success': False, 'message': '请选择要分析的文件'})
+        
+        # 提前校验结果文件格式，避免保存文件后才报错
+        result_extension(output_format)
+            
+        # 缓存中的文件不能在分析后删除，单独记录
+        stored_paths = []
+        for ref in file_refs:
+            entry = upload_store.get(ref.get('file_id'))
+            if entry is None:
+                return jsonify({'success': False, 'message': '文件已过期，请重新上传', 'file_expired': True})
+            stored_paths.append((ref.get('filename') or entry['filename'], entry['path']))
             
         # 保存文件
         temp_paths = []
         try:
+            if run_async:
+                # 缓存文件可能在任务开始前被淘汰，为后台任务创建独立的硬链接
+                for filename, stored_path in stored_paths:
+                    temp_path = get_temp_path(filename)
+                    try:
+                        os.link(stored_path, temp_path)
+                    except OSError:
+                        shutil.copyfile(stored_path, temp_path)
+                    temp_paths.append((filename, temp_path))
+                stored_paths = []
+            
             # 保存所有文件到临时目录
             for file in files:
                 if file and allowed_file(file.filename):
@@ -1555,37 +1685,27 @@ def analyze():
                     file.save(temp_path)
                     temp_paths.append((file.filename, temp_path))
             
-            if not temp_paths:
+            analysis_paths = stored_paths + temp_paths
+            if not analysis_paths:
                 return jsonify({'success': False, 'message': '没有有效的Excel文件'})
             
+            if run_async:
+                # 临时文件交给后台任务，任务结束后删除
+                job_id = analysis_jobs.submit(
+                    run_file_analysis, session.get('username'), mode, analysis_paths, selected_columns, output_format,
+                    result_dir=app.config['UPLOAD_FOLDER'],
+                    cleanup_paths=[temp_path for _, temp_path in temp_paths],
+                    owner=get_job_owner()
+                )
+                temp_paths = []
+                return jsonify({
+                    'success': True,
+                    'message': '分析任务已提交',
+                    'job_id': job_id
+                })
+            
             try:
-                # 开始计时
-                start_time = time.time()
-                
-                # 根据模式选择分析方法
-                if mode == 'single':
-                    # 获取第一个文件的工作表和列选择
-                    first_file = temp_paths[0]
-                    file_key = next(iter(selected_columns))  # 获取第一个键
-                    selection = selected_columns[file_key]
-                    sheet_name = selection['sheet']
-                    column_name = selection['column']
-                    
-                    # 分析单个文件
-                    results = analyze_single_file(first_file[1], sheet_name, column_name)
-                else:
-                    # 比较模式
-                    results = process_excel_files(temp_paths, selected_columns)
-                
-                # 结束计时并计算处理时间（毫秒）
-                end_time = time.time()
-                process_time = round((end_time - start_time) * 1000)
-                
-                # 收集文件名
-                file_names = [filename for filename, _ in temp_paths]
-                
-                # 记录分析操作
-                record_analysis(session['username'], len(temp_paths), mode, process_time, file_names)
+                results = run_file_analysis(session['username'], mode, analysis_paths, selected_columns, output_format)
                 
                 return jsonify({
                     'success': True,
@@ -1609,88 +1729,94 @@ def analyze():
         logger.error(f'文件分析失败: {str(e)}')
         return jsonify({'success': False, 'message': str(e)})
 
-@app.route('/get_sheets', methods=['POST'])
-def get_sheets():
+def get_stored_upload():
+    """获取请求中的工作簿：优先使用file_id引用已缓存的文件，否则保存上传的文件
+    
+    返回:
+    - (entry, error): entry为上传缓存中的文件条目，出错时entry为None，error为错误响应
+    """
+    file_id = request.form.get('file_id')
+    if file_id:
+        entry = upload_store.get(file_id)
+        if entry is None:
+            return None, jsonify({'error': '文件已过期，请重新上传', 'file_expired': True})
+        return entry, None
+    
     if 'file' not in request.files:
-        return jsonify({'error': '没有选择文件'})
+        return None, jsonify({'error': '没有选择文件'})
     
     file = request.files['file']
     if not file or file.filename == '':
-        return jsonify({'error': '没有选择文件'})
+        return None, jsonify({'error': '没有选择文件'})
         
     if not allowed_file(file.filename):
-        return jsonify({'error': '不支持的文件格式'})
+        return None, jsonify({'error': '不支持的文件格式'})
     
-    temp_path = None
+    return upload_store.put(file), None
+
+@app.route('/get_sheets', methods=['POST'])
+def get_sheets():
     try:
-        # 保存文件到临时目录
-        temp_path = get_temp_path(file.filename)
-        file.save(temp_path)
-        
-        # 读取工作表列表
-        sheets = read_excel_sheets(temp_path)
-        #print(f"文件 {file.filename} 的工作表: {sheets}")  # 调试信息
+        entry, error = get_stored_upload()
+        if error is not None:
+            return error
+    except Exception as e:
+        print(f"保存上传文件时出错: {str(e)}")  # 调试信息
+        return jsonify({'error': f'读取文件失败：{str(e)}'})
+    
+    try:
+        # 读取工作表列表，同一文件只解析一次
+        sheets = entry.get('sheets')
+        if sheets is None:
+            sheets = read_excel_sheets(entry['path'])
+            upload_store.update(entry['file_id'], sheets=sheets)
+        #print(f"文件 {entry['filename']} 的工作表: {sheets}")  # 调试信息
         
         return jsonify({
-            'sheets': sheets
+            'sheets': sheets,
+            'file_id': entry['file_id']
         })
     except Exception as e:
-        print(f"读取文件 {file.filename} 的工作表时出错: {str(e)}")  # 调试信息
+        print(f"读取文件 {entry['filename']} 的工作表时出错: {str(e)}")  # 调试信息
         return jsonify({'error': f'读取文件失败：{str(e)}'})
-    finally:
-        # 确保在任何情况下都删除临时文件
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
 
 @app.route('/get_columns', methods=['POST'])
 def get_columns():
-    if 'file' not in request.files:
-        return jsonify({'error': '没有选择文件'})
-    
-    file = request.files['file']
     sheet_name = request.form.get('sheet_name')
+    try:
+        entry, error = get_stored_upload()
+        if error is not None:
+            return error
+    except Exception as e:
+        print(f"保存上传文件时出错: {str(e)}")  # 调试信息
+        return jsonify({'error': f'读取文件失败：{str(e)}'})
     
-    if not file or file.filename == '':
-        return jsonify({'error': '没有选择文件'})
-        
-    if not allowed_file(file.filename):
-        return jsonify({'error': '不支持的文件格式'})
-    
-    temp_path = None
     try:
-        # 保存文件到临时目录
-        temp_path = get_temp_path(file.filename)
-        file.save(temp_path)
-        
-        # 读取Excel文件
-        df, columns = read_excel_file(temp_path, sheet_name)
-        
-        if not columns:
-            raise ValueError("未能读取到有效的列名")
-            
-        #print(f"文件 {file.filename} 工作表 {sheet_name} 的列名: {columns}")  # 调试信息
-        
-        # 获取建议的列名
-        suggested_column = suggest_column(columns)
+        # 读取列名，同一工作表只解析一次
+        columns = (entry.get('columns') or {}).get(str(sheet_name))
+        suggested_column = (entry.get('suggested_columns') or {}).get(str(sheet_name))
+        if columns is None:
+            # 只流式读取表头和少量样本行，不解析整个工作表
+            probe = probe_sheet(entry['path'], sheet_name)
+            columns = probe['columns']
+            if not columns:
+                raise ValueError("未能读取到有效的列名")
+            
+            # 根据列名和样本内容获取建议的列名
+            suggested_column = suggest_column(columns, probe['samples'])
+            upload_store.set_columns(entry['file_id'], sheet_name, columns, suggested_column)
+            
+        #print(f"文件 {entry['filename']} 工作表 {sheet_name} 的列名: {columns}")  # 调试信息
         #print(f"建议的列名: {suggested_column}")  # 调试信息
         
         return jsonify({
             'columns': columns,
-            'suggested_column': suggested_column
+            'suggested_column': suggested_column,
+            'file_id': entry['file_id']
         })
     except Exception as e:
-        print(f"读取文件 {file.filename} 时出错: {str(e)}")  # 调试信息
+        print(f"读取文件 {entry['filename']} 时出错: {str(e)}")  # 调试信息
         return jsonify({'error': f'读取文件失败：{str(e)}'})
-    finally:
-        # 确保在任何情况下都删除临时文件
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
@@ -1710,6 +1836,12 @@ def upload_files():
     if not selected_columns:
         return jsonify({'error': '请为每个文件选择要分析的列'})
     
+    output_format = request.form.get('output_format', 'xlsx')
+    try:
+        result_extension(output_format)
+    except ValueError as e:
+        return jsonify({'error': str(e)})
+    
     temp_paths = []
     try:
         # 保存所有文件到临时目录
@@ -1718,8 +1850,19 @@ def upload_files():
             file.save(temp_path)
             temp_paths.append((file.filename, temp_path))
         
+        if is_async_request():
+            # 临时文件交给后台任务，任务结束后删除
+            job_id = analysis_jobs.submit(
+                process_excel_files, temp_paths, selected_columns, output_format,
+                result_dir=app.config['UPLOAD_FOLDER'],
+                cleanup_paths=[temp_path for _, temp_path in temp_paths],
+                owner=get_job_owner()
+            )
+            temp_paths = []
+            return jsonify({'job_id': job_id})
+        
         # 处理文件
-        results = process_excel_files(temp_paths, selected_columns)
+        results = process_excel_files(temp_paths, selected_columns, output_format)
         
         # 返回结果
         return jsonify({
@@ -1755,11 +1898,11 @@ def download_file(filename):
         if not os.path.exists(file_path):
             return jsonify({'error': '文件不存在或已过期'}), 404
             
-        # 发送文件
+        # 发送文件，csv/parquet结果为zip压缩包
         return send_file(
             file_path,
             as_attachment=True,
-            download_name='分析结果.xlsx'
+            download_name=f"分析结果{os.path.splitext(filename)[1] or '.xlsx'}"
         )
     except Exception as e:
         return jsonify({'error': f'下载文件失败：{str(e)}'}), 500
@@ -1771,6 +1914,42 @@ def download_file(filename):
             except:
                 pass
 
+@app.route('/api/jobs/<job_id>')
+def get_analysis_job(job_id):
+    """查询后台分析任务的状态、阶段进度和结果"""
+    job = analysis_jobs.get(job_id, owner=get_job_owner())
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
+    
+    response = {
+        'success': True,
+        'job_id': job_id,
+        'status': job.get('status'),
+        'stage': job.get('stage'),
+        'progress': job.get('progress', 0),
+        'message': job.get('message'),
+        'created_at': job.get('created_at'),
+        'finished_at': job.get('finished_at'),
+        'expires_at': job.get('expires_at')
+    }
+    if job.get('status') == 'done':
+        response['data'] = job.get('result')
+    elif job.get('status') == 'failed':
+        response['error'] = job.get('error')
+    return jsonify(response)
+
+@app.route('/api/jobs/<job_id>/download')
+def download_job_result(job_id):
+    """下载后台任务的结果文件，文件在任务过期前可以重复下载"""
+    result_path = analysis_jobs.result_path(job_id, owner=get_job_owner())
+    if result_path is None:
+        return jsonify({'error': '文件不存在或已过期'}), 404
+    return send_file(
+        result_path,
+        as_attachment=True,
+        download_name=f"分析结果{os.path.splitext(result_path)[1]}"
+    )
+
 # 管理员相关路由
 # 定义全局IP白名单变量，确保全系统一致性
 ADMIN_IP_WHITELIST = ['127.0.0.1']  # 默认只允许本地访问，添加其他管理员IP
@@ -2060,6 +2239,13 @@ def admin_ai_stats():
         print(f"获取AI分析统计数据时出错: {str(e)}")  # 调试信息
         return jsonify({'error': '获取AI统计数据失败'}), 500
 
+# AI接口客户端指标API
+@app.route('/admin/ai_client_metrics')
+@require_admin
+def admin_ai_client_metrics():
+    """获取LLM接口客户端的请求、重试、延迟、连接池和熔断状态"""
+    return jsonify(llm_client.metrics())
+
 # 数据可视化API
 @app.route('/admin/visualization_data')
 @require_admin
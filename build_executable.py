@@ -39,6 +39,19 @@ def build_executable():
         "app.py",
         "ai_analysis.py", 
         "sales_trend.py",
+        "compare_engine.py",
+        "excel_loader.py",
+        "result_writer.py",
+        "job_queue.py",
+        "upload_store.py",
+        "sheet_cache.py",
+        "data_cleaning.py",
+        "holiday_calendar.py",
+        "chart_payload.py",
+        "trend_session.py",
+        "task_runner.py",
+        "stream_ingest.py",
+        "llm_client.py",
         "requirements.txt",
         "create_all_tables.sql"
     ]
@@ -0,0 +1,116 @@
+import os
+import json
+import base64
+import numpy as np
+import pandas as pd
+
+CHART_POINT_BUDGET = int(os.environ.get('CHART_POINT_BUDGET', 2000))  # 每条曲线最多传输的数据点数
+
+# 所有图表共用的布局，外观与plotly_white模板一致，不再随每个图表传输完整的模板数据
+AXIS_STYLE = {
+    'gridcolor': '#EBF0F8',
+    'linecolor': '#EBF0F8',
+    'zerolinecolor': '#EBF0F8',
+    'automargin': True
+}
+
+BASE_LAYOUT = {
+    'paper_bgcolor': 'white',
+    'plot_bgcolor': 'white',
+    'font': {'color': '#2a3f5f'},
+    'title': {'x': 0.05},
+    'margin': {'t': 60},
+    'hovermode': 'closest'
+}
+
+
+def lttb_indices(x, y, threshold=CHART_POINT_BUDGET):
+    """Largest-Triangle-Three-Buckets降采样，返回保留的数据点的位置
+
+    首尾两点总是保留，中间的点分成threshold-2个桶，每个桶保留与前一个保留点、下一个桶均值
+    构成的三角形面积最大的点，从而保留峰值、谷值等视觉特征。数据点不超过threshold时全部保留。
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[ns]').astype(np.int64)
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))  # 缺失值只在选点时按0处理
+
+    # 桶的边界，以及每个桶的均值（用累计和一次算出）
+    every = (n - 2) / (threshold - 2)
+    edges = np.minimum(np.floor(np.arange(threshold - 1) * every).astype(int) + 1, n - 1)
+    edges[-1] = n - 1
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    next_start = edges[1:]
+    next_end = np.append(edges[2:], n)
+    avg_x = (cum_x[next_end] - cum_x[next_start]) / (next_end - next_start)
+    avg_y = (cum_y[next_end] - cum_y[next_start]) / (next_end - next_start)
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        area = np.abs((x[a] - avg_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def encode_array(values):
+    """数值数组编码为Plotly typed array格式 {'dtype': 'f8', 'bdata': base64}，缺失值保留为NaN"""
+    array = np.ascontiguousarray(np.asarray(values, dtype=float), dtype='<f8')
+    return {'dtype': 'f8', 'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def encode_dates(dates):
+    """日期编码为ISO字符串列表（全部为零点时只保留日期部分）"""
+    dates = pd.to_datetime(pd.Series(dates), errors='coerce')
+    has_time = (dates.dropna() != dates.dropna().dt.normalize()).any()
+    return dates.dt.strftime('%Y-%m-%d %H:%M:%S' if has_time else '%Y-%m-%d').fillna('').tolist()
+
+
+def line_trace(x, y, name=None, color=None, width=2, hovertemplate=None, customdata=None, hoverinfo=None):
+    """折线trace"""
+    trace = {
+        'type': 'scatter',
+        'mode': 'lines',
+        'x': encode_dates(x),
+        'y': encode_array(y),
+        'line': {'color': color, 'width': width}
+    }
+    if name is not None:
+        trace['name'] = name
+    if hovertemplate is not None:
+        trace['hovertemplate'] = hovertemplate
+    if customdata is not None:
+        trace['customdata'] = list(customdata)
+    if hoverinfo is not None:
+        trace['hoverinfo'] = hoverinfo
+    return trace
+
+
+def marker_trace(x, y, name=None, color=None, size=8, opacity=0.7, hovertemplate=None, customdata=None):
+    """散点trace"""
+    trace = line_trace(x, y, name=name, hovertemplate=hovertemplate, customdata=customdata)
+    trace['mode'] = 'markers'
+    del trace['line']
+    trace['marker'] = {'size': size, 'opacity': opacity, 'color': color}
+    return trace
+
+
+def chart_json(traces, title=None, xaxis=None, yaxis=None, **layout):
+    """组装图表JSON字符串 {'data': [...], 'layout': {...}}，与fig.to_json()的结构一致，前端可以直接解析"""
+    chart_layout = dict(BASE_LAYOUT)
+    if title is not None:
+        chart_layout['title'] = dict(BASE_LAYOUT['title'], text=title)
+    chart_layout['xaxis'] = dict(AXIS_STYLE, **(xaxis or {}))
+    chart_layout['yaxis'] = dict(AXIS_STYLE, **(yaxis or {}))
+    chart_layout.update(layout)
+    return json.dumps({'data': traces, 'layout': chart_layout}, ensure_ascii=False, separators=(',', ':'))
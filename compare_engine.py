@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+
+class ComparisonIndex:
+    """N路数据源比较索引
+
+    一次遍历所有数据源，为每个不同的值建立"值→数据源位掩码"的哈希索引：
+    第i个数据源包含该值时，掩码的第i位为1。独特值、共同值以及任意
+    "至少/恰好出现在k个数据源中"的查询都直接由掩码得出，无需反复做集合并集。
+    """
+
+    MAX_SOURCES = 64  # 掩码使用uint64存储
+
+    def __init__(self, key_lists):
+        """
+        参数:
+        - key_lists: 每个数据源一组按行排列的键（已清理的字符串，空值为'nan'或空串）
+        """
+        source_count = len(key_lists)
+        if source_count > self.MAX_SOURCES:
+            raise ValueError(f"最多支持同时比较{self.MAX_SOURCES}个数据源")
+
+        self.source_count = source_count
+        self.full_mask = np.uint64((1 << source_count) - 1) if source_count else np.uint64(0)
+        self._bits = np.array([1 << i for i in range(source_count)], dtype=np.uint64)
+
+        lengths = [len(keys) for keys in key_lists]
+        self._offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+        all_keys = pd.Series(
+            np.concatenate([np.asarray(keys, dtype=object) for keys in key_lists]) if source_count else [],
+            dtype=object
+        )
+        # 空值和'nan'不参与比较
+        valid = all_keys.notna() & (all_keys != '') & (all_keys.str.lower() != 'nan')
+        codes, uniques = pd.factorize(all_keys.where(valid))
+        self._row_codes = codes
+        self.values = np.asarray(uniques, dtype=object)
+
+        # 构建位掩码：每个数据源只对其去重后的编码置位一次
+        masks = np.zeros(len(self.values), dtype=np.uint64)
+        for i in range(source_count):
+            source_codes = self._source_codes(i)
+            source_codes = pd.unique(source_codes[source_codes >= 0])
+            masks[source_codes] |= self._bits[i]
+        self.masks = masks
+
+        # 每个值出现在多少个数据源中
+        membership = np.zeros(len(masks), dtype=np.int64)
+        for i in range(source_count):
+            membership += ((masks >> np.uint64(i)) & np.uint64(1)).astype(np.int64)
+        self.membership = membership
+
+        # 预先计算各数据源的统计数据，避免重复推导
+        single = membership == 1
+        owner = np.log2(masks[single].astype(np.float64)).astype(np.int64)
+        self.unique_counts = np.bincount(owner, minlength=source_count).tolist() if source_count else []
+        self.source_sizes = [
+            int(((masks >> np.uint64(i)) & np.uint64(1)).sum()) for i in range(source_count)
+        ]
+        self.common_count = int((membership == source_count).sum()) if source_count else 0
+
+    def _source_codes(self, source):
+        """返回第source个数据源逐行的值编码（无效值为-1）"""
+        return self._row_codes[self._offsets[source]:self._offsets[source + 1]]
+
+    def unique_values(self, source):
+        """只出现在第source个数据源中的值"""
+        return self.values[self.masks == self._bits[source]]
+
+    def common_values(self):
+        """在所有数据源中都出现的值"""
+        return self.values[self.membership == self.source_count]
+
+    def values_in(self, k, exact=False):
+        """出现在至少k个（exact=True时为恰好k个）数据源中的值"""
+        if exact:
+            return self.values[self.membership == k]
+        return self.values[self.membership >= k]
+
+    def row_masks(self, source):
+        """第source个数据源每一行所对应值的位掩码，无效行为0"""
+        codes = self._source_codes(source)
+        return np.where(codes >= 0, self.masks[np.maximum(codes, 0)], np.uint64(0))
+
+    def row_membership(self, source):
+        """第source个数据源每一行的值出现在多少个数据源中，无效行为0"""
+        codes = self._source_codes(source)
+        return np.where(codes >= 0, self.membership[np.maximum(codes, 0)], 0)
+
+    def unique_row_mask(self, source):
+        """第source个数据源中属于独特值的行"""
+        return self.row_masks(source) == self._bits[source]
+
+    def common_row_mask(self, source):
+        """第source个数据源中属于共同值的行"""
+        return (self.row_membership(source) == self.source_count) & (self.source_count > 0)
+
+    def summary(self):
+        """各数据源的统计数据"""
+        return {
+            'source_sizes': list(self.source_sizes),
+            'unique_counts': list(self.unique_counts),
+            'common_count': self.common_count,
+            'total_values': int(len(self.values))
+        }
@@ -0,0 +1,312 @@
+import re
+import warnings
+import numpy as np
+import pandas as pd
+
+# 日期格式识别规则，按顺序匹配，每个值只归入第一个匹配的格式
+DATE_PATTERNS = [
+    ('yyyymmdd', r'\d{8}'),                                          # 20250109
+    ('chinese', r'\d+年\d+月\d+日.*'),                                # 2025年01月09日
+    ('iso', r'\d{4}[-/.]\d{1,2}[-/.]\d{1,2}(?:[ T]\d{1,2}:\d{2}.*)?'),  # 2025-01-09 / 2025/1/9 10:00
+]
+
+
+DETECT_SAMPLE_SIZE = 200  # 识别主要日期格式时的样本数
+
+
+def _convert_dates(text, name, dayfirst):
+    """按指定格式把日期文本整体转换为datetime64，无法转换的为NaT"""
+    if name == 'yyyymmdd':
+        return pd.to_datetime(text, format='%Y%m%d', errors='coerce')
+    if name == 'chinese':
+        parts = text.str.extract(r'^(\d+)年(\d+)月(\d+)日')
+        parts.columns = ['year', 'month', 'day']
+        parts = parts.apply(pd.to_numeric, errors='coerce')
+        return pd.to_datetime(parts, errors='coerce')
+    if name == 'iso':
+        return pd.to_datetime(text, format='ISO8601', errors='coerce')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        converted = pd.to_datetime(text, errors='coerce', dayfirst=dayfirst)
+        if getattr(converted.dt, 'tz', None) is not None:
+            converted = converted.dt.tz_localize(None)
+        failed = converted.isna()
+        if failed.any():
+            # 推断的格式只适用于部分值时，剩余的值逐个按混合格式解析
+            try:
+                retry = pd.to_datetime(text[failed], errors='coerce', format='mixed', dayfirst=dayfirst)
+                if getattr(retry.dt, 'tz', None) is not None:
+                    retry = retry.dt.tz_localize(None)
+                converted[failed] = retry
+            except (ValueError, TypeError):
+                pass
+    return converted
+
+
+def _detect_date_format(text):
+    """在均匀抽取的样本上识别主要的日期格式"""
+    if len(text) == 0:
+        return 'other'
+    positions = np.unique(np.linspace(0, len(text) - 1, min(len(text), DETECT_SAMPLE_SIZE)).astype(int))
+    sample = text.iloc[positions].str.strip()
+    best_name, best_count = 'other', 0
+    for name, pattern in DATE_PATTERNS:
+        count = int(sample.str.fullmatch(pattern).sum())
+        if count > best_count:
+            best_name, best_count = name, count
+    return best_name
+
+
+def _parse_distinct_dates(values, dayfirst):
+    """解析去重后的日期值
+
+    先在样本上识别主要格式并对整列一次性转换，只有转换失败的值才逐个识别格式。
+
+    返回:
+    - (converted, formats): converted为与values等长的datetime64数组，formats为每个值所属的格式名称
+    """
+    values = pd.Series(values)
+    # 整数值的浮点列（如20250109.0）先转换为整数，以便识别为yyyymmdd
+    if pd.api.types.is_float_dtype(values) and len(values) and (values == np.floor(values)).all():
+        values = values.astype('int64')
+    text = values.astype(str)
+
+    # 1. 主要格式整体转换（非字符串的值如整数时间戳保持pd.to_datetime原有的处理方式）
+    main_format = _detect_date_format(text)
+    if main_format == 'iso' and text.iloc[:DETECT_SAMPLE_SIZE].str.contains('/', regex=False).any():
+        result = _convert_dates(text.str.replace('/', '-', regex=False), main_format, dayfirst)
+    elif main_format == 'other':
+        result = _convert_dates(values, main_format, dayfirst)
+    else:
+        result = _convert_dates(text, main_format, dayfirst)
+    result = pd.Series(result.to_numpy(dtype='datetime64[ns]'), index=values.index)
+    formats = np.full(len(values), main_format, dtype=object)
+
+    # 2. 转换失败的值按格式规则逐个归类后再转换
+    remaining = result.isna()
+    if remaining.any():
+        text = text[remaining].str.strip()
+        for name, pattern in DATE_PATTERNS + [('other', r'.*')]:
+            mask = text.str.fullmatch(pattern)
+            if not mask.any():
+                continue
+            subset = text[mask]
+            text = text[~mask]
+            if name == 'iso':
+                # 统一日期部分的分隔符后按ISO8601解析
+                subset = subset.str.replace(r'^(\d{4})[/.](\d{1,2})[/.](\d{1,2})', r'\1-\2-\3', regex=True)
+            if name != main_format:
+                converted = _convert_dates(subset, name, dayfirst)
+                result[subset.index] = converted.to_numpy(dtype='datetime64[ns]')
+            formats[values.index.get_indexer(subset.index)] = name
+
+    return result.to_numpy(dtype='datetime64[ns]'), formats
+
+
+def parse_dates(series, dayfirst=False):
+    """把一列日期值向量化地转换为datetime64
+
+    在整列上识别格式（而不是只看前几行），每种格式使用显式格式或str.extract整体转换：
+    - yyyymmdd: 20250109
+    - chinese: 2025年01月09日（年月日后的内容被忽略）
+    - iso: 2025-01-09、2025/1/9、2025.01.09，可带时间
+    - other: 其他格式交给pd.to_datetime推断，推断失败的值再逐个按混合格式解析
+    交易明细中的日期大量重复，先去重，只解析不同的值再映射回每一行。
+
+    参数:
+    - series: 日期列
+    - dayfirst: other格式中无法区分日/月时是否日在前
+
+    返回:
+    - (parsed, report): parsed为datetime64序列（无法解析的为NaT），
+      report为 {'total', 'parsed', 'failed', 'missing', 'formats': {格式: {'parsed', 'failed'}}}
+    """
+    total = len(series)
+    report = {'total': int(total), 'parsed': 0, 'failed': 0, 'missing': 0, 'formats': {}}
+
+    # 已经是日期类型，无需转换
+    if pd.api.types.is_datetime64_any_dtype(series):
+        parsed = series
+        if getattr(parsed.dt, 'tz', None) is not None:
+            parsed = parsed.dt.tz_localize(None)
+        report['missing'] = int(series.isna().sum())
+        report['parsed'] = int(total - report['missing'])
+        if report['parsed']:
+            report['formats']['datetime'] = {'parsed': report['parsed'], 'failed': 0}
+        return parsed, report
+
+    codes, uniques = pd.factorize(series)
+    converted, formats = _parse_distinct_dates(uniques, dayfirst)
+
+    valid = codes >= 0
+    parsed = np.full(total, np.datetime64('NaT'), dtype='datetime64[ns]')
+    parsed[valid] = converted[codes[valid]]
+
+    # 按每个不同值出现的次数汇总各格式的解析情况
+    counts = np.bincount(codes[valid], minlength=len(uniques))
+    ok = ~np.isnat(converted)
+    for name in pd.unique(formats):
+        in_format = formats == name
+        parsed_count = int(counts[in_format & ok].sum())
+        report['formats'][name] = {'parsed': parsed_count, 'failed': int(counts[in_format].sum()) - parsed_count}
+
+    report['missing'] = int(total - valid.sum())
+    report['parsed'] = int(counts[ok].sum())
+    report['failed'] = int(valid.sum()) - report['parsed']
+    return pd.Series(parsed, index=series.index, name=series.name), report
+
+
+# 数值文本清洗规则（预编译，供str.replace / str.extract向量化使用）
+FULLWIDTH_TABLE = str.maketrans('０１２３４５６７８９．，－＋％￥＄（）', '0123456789.,-+%¥$()')
+WHITESPACE_PATTERN = re.compile(r'[\s\u3000\u00a0]+')
+CURRENCY_SYMBOLS = '¥$€£元'
+CURRENCY_CODE_PATTERN = re.compile(r'RMB|CNY|USD|EUR', re.IGNORECASE)
+NEGATIVE_PAREN_PATTERN = re.compile(r'^\((.*)\)$')  # 会计格式的负数，如(1,234.00)
+
+# 中文数量单位对应的倍数
+NUMBER_UNITS = {'万': 1e4, '亿': 1e8}
+
+
+def _replace_where(text, chars, pattern, repl):
+    """只在包含chars中任一字符的值上执行正则替换，其余值保持不变"""
+    mask = np.zeros(len(text), dtype=bool)
+    for char in chars:
+        mask |= text.str.contains(char, regex=False).to_numpy(dtype=bool)
+    if mask.any():
+        text = text.copy()
+        text[mask] = text[mask].str.replace(pattern, repl, regex=True)
+    return text
+
+
+def _to_float(text):
+    """字符串转换为浮点数，先尝试整体astype（快），失败时逐个转换并把无效值设为NaN"""
+    try:
+        return text.astype(float).to_numpy()
+    except (ValueError, TypeError):
+        return pd.to_numeric(text, errors='coerce').to_numpy(dtype=float)
+
+
+def _clean_numeric_text(text, decimal, fullwidth, units):
+    """把数值文本向量化地清洗并转换为浮点数
+
+    每个清洗步骤只在全部文本中出现了相关字符时执行，且只作用于包含这些字符的值。
+
+    返回:
+    - (values, is_percent, unit): values为转换结果（无法转换的为NaN），
+      is_percent为百分比掩码，unit为每个值的数量单位（无单位为None）
+    """
+    present = set(''.join(text.tolist()))
+    unit = np.full(len(text), None, dtype=object)
+
+    if fullwidth and present & set('０１２３４５６７８９．，－＋％￥＄（）'):
+        text = text.str.translate(FULLWIDTH_TABLE)
+        present = set(''.join(text.tolist()))
+    if any(char.isspace() for char in present):
+        text = text.str.replace(WHITESPACE_PATTERN, '', regex=True)
+    for symbol in CURRENCY_SYMBOLS:
+        if symbol in present:
+            text = text.str.replace(symbol, '', regex=False)
+    if present & set('RMBCNYUSDEURrmbcnyusdeur'):
+        text = _replace_where(text, 'RMBCNYUSDEURrmbcnyusdeur', CURRENCY_CODE_PATTERN, '')
+
+    # 百分比：记录掩码后去掉%，转换后统一除以100
+    is_percent = np.zeros(len(text), dtype=bool)
+    if '%' in present:
+        is_percent = text.str.contains('%', regex=False).to_numpy(dtype=bool)
+        text = text.str.replace('%', '', regex=False)
+
+    # 数量单位（万/亿）
+    if units and present & set(NUMBER_UNITS):
+        text = text.copy()
+        for name in NUMBER_UNITS:
+            has_unit = text.str.endswith(name).to_numpy(dtype=bool)
+            if has_unit.any():
+                text[has_unit] = text[has_unit].str[:-len(name)]
+                unit[has_unit] = name
+
+    if '(' in present:
+        text = _replace_where(text, '(', NEGATIVE_PAREN_PATTERN, r'-\1')
+
+    # 千分位与小数分隔符
+    if decimal == ',':
+        if '.' in present:
+            text = text.str.replace('.', '', regex=False)
+        if ',' in present:
+            text = text.str.replace(',', '.', regex=False)
+    elif ',' in present:
+        text = text.str.replace(',', '', regex=False)
+
+    values = _to_float(text)
+    if units:
+        multiplier = pd.Series(unit).map(NUMBER_UNITS).fillna(1.0).to_numpy(dtype=float)
+        values = values * multiplier
+    values[is_percent] /= 100
+    return values, is_percent, unit
+
+
+def coerce_numeric(series, decimal='.', fullwidth=True, units=True):
+    """把一列可能为文本格式的数值向量化地转换为浮点数
+
+    支持千分位分隔符、货币符号（¥$€£、元、RMB等）、百分比、会计格式负数(1,234)，以及：
+    - decimal: 小数分隔符，'.'（默认）或','（如 1.234,56）
+    - fullwidth: 是否把全角数字和符号转换为半角
+    - units: 是否识别万/亿单位后缀（如 1.2万 -> 12000）
+    文本值先去重，只清洗不同的值再映射回每一行。
+
+    返回:
+    - (values, report): values为float64序列（无法转换的为NaN），
+      report为 {'total', 'converted', 'failed', 'missing', 'cleaned', 'percent', 'units', 'failed_samples'}
+    """
+    if decimal not in ('.', ','):
+        raise ValueError(f"不支持的小数分隔符: {decimal}")
+
+    total = len(series)
+    report = {'total': int(total), 'converted': 0, 'failed': 0, 'missing': 0,
+              'cleaned': 0, 'percent': 0, 'units': {}, 'failed_samples': []}
+
+    # 已经是数值类型，或者（小数点为'.'时）可以直接转换
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.astype(float)
+    else:
+        values = None
+        if decimal == '.':
+            try:
+                values = pd.to_numeric(series, errors='raise').astype(float)
+            except (ValueError, TypeError):
+                values = None
+    if values is not None:
+        report['missing'] = int(values.isna().sum())
+        report['converted'] = int(total - report['missing'])
+        return values, report
+
+    # 非文本的值（Excel中的数字单元格）直接转换，文本值去重后清洗
+    is_text = (series.map(type) == str).to_numpy()
+    values = pd.to_numeric(series.where(~is_text), errors='coerce').to_numpy(dtype=float)
+    report['missing'] = int((pd.isna(series.to_numpy()) & ~is_text).sum())
+
+    text_values = series[is_text]
+    if len(text_values):
+        codes, uniques = pd.factorize(text_values)
+        cleaned, is_percent, unit = _clean_numeric_text(pd.Series(uniques, dtype=object), decimal, fullwidth, units)
+        counts = np.bincount(codes, minlength=len(uniques))
+
+        # 空白文本按缺失值处理（只需检查转换失败的值）
+        ok = ~np.isnan(cleaned)
+        blank = np.zeros(len(uniques), dtype=bool)
+        blank[~ok] = pd.Series(uniques[~ok], dtype=object).str.strip().eq('').to_numpy()
+        values[is_text] = cleaned[codes]
+
+        report['missing'] += int(counts[blank].sum())
+        report['cleaned'] = int(counts[ok].sum())
+        report['percent'] = int(counts[ok & is_percent].sum())
+        for name in NUMBER_UNITS:
+            count = int(counts[ok & (unit == name)].sum())
+            if count:
+                report['units'][name] = count
+        failed = ~ok & ~blank
+        report['failed'] = int(counts[failed].sum())
+        report['failed_samples'] = [str(value) for value in uniques[failed][:5]]
+
+    report['converted'] = int(total - report['missing'] - report['failed'])
+    return pd.Series(values, index=series.index, name=series.name), report
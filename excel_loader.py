@@ -0,0 +1,261 @@
+import os
+from itertools import islice
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from sheet_cache import read_excel_cached
+
+
+def clean_sheet_name(sheet_name):
+    """清理工作表名称中的特殊字符，并限制在Excel允许的31个字符以内"""
+    invalid_chars = [':', '/', '\\', '?', '*', '[', ']', "'"]
+    result = str(sheet_name)
+    for char in invalid_chars:
+        result = result.replace(char, '_')
+    return result[:31]
+
+
+def clean_column_name(column):
+    """清理列名：去除首尾空格及不可打印字符（probe_sheet返回给前端的列名和按列读取时的匹配都使用该规则）"""
+    col_str = str(column).strip()
+    return ''.join(c for c in col_str if c.isprintable())
+
+
+def convert_cell(value):
+    """按照pandas读取Excel时dtype=str的规则把单元格值转换为字符串，空单元格返回None"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        if value in ERROR_CODES:
+            return None
+        return value
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def normalize_key(value):
+    """把单元格值规整为比较用的键：转换为字符串并去除首尾空格，空值记为'nan'"""
+    if value is None:
+        return 'nan'
+    return value.strip()
+
+
+def is_valid_key(key):
+    """判断键是否为有效的比较值（非空且不是'nan'）"""
+    return bool(key) and key.lower() != 'nan'
+
+
+def _build_header(header_row, width):
+    """根据表头行生成列名，空列名和重复列名的处理方式与pandas一致"""
+    names = []
+    seen = {}
+    for idx in range(width):
+        value = header_row[idx] if idx < len(header_row) else None
+        name = value if value not in (None, '') else f"Unnamed: {idx}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+SAMPLE_ROWS = 20  # 探测表头时读取的样本行数
+
+
+class SheetSource:
+    """工作表数据源：第一遍只读取关键列，之后按需流式读取需要输出的完整行"""
+
+    def __init__(self, workbook, sheet_name, column):
+        self.workbook = workbook
+        self.sheet_name = sheet_name
+        self.column = column
+        self.columns = []
+        self.keys = []
+        self._column_index = None
+
+    def _iter_raw_rows(self):
+        """逐行读取工作表，返回已转换为字符串的单元格列表
+
+        与pandas一致：中间的空白行保留为空列表，末尾的空白行被丢弃
+        """
+        if self.workbook.frame_cache is not None:
+            df = self.workbook.frame_cache[self.sheet_name]
+            yield [None if pd.isna(v) else str(v) for v in df.columns]
+            for row in df.itertuples(index=False, name=None):
+                yield [None if pd.isna(v) else v for v in row]
+            return
+
+        worksheet = self.workbook.book[self.sheet_name]
+        worksheet.reset_dimensions()
+        blank_rows = 0
+        for row in worksheet.iter_rows(values_only=True):
+            converted = [convert_cell(v) for v in row]
+            while converted and converted[-1] in (None, ''):
+                converted.pop()
+            if not converted:
+                blank_rows += 1
+                continue
+            for _ in range(blank_rows):
+                yield []
+            blank_rows = 0
+            yield converted
+
+    def scan(self):
+        """第一遍扫描：定位表头与关键列，只保留关键列的值
+
+        返回:
+        - bool: 是否找到了指定的列
+        """
+        rows = self._iter_raw_rows()
+        header_row = next(rows, None)
+        if header_row is None:
+            return False
+
+        width = len(header_row)
+        probe = _build_header(header_row, width)
+        if self.column in probe:
+            self._column_index = probe.index(self.column)
+        else:
+            cleaned = [clean_column_name(name) for name in probe]
+            if self.column not in cleaned:
+                return False
+            self._column_index = cleaned.index(self.column)
+
+        col_idx = self._column_index
+        keys = []
+        append = keys.append
+        for row in rows:
+            if len(row) > width:
+                width = len(row)
+            append(normalize_key(row[col_idx] if col_idx < len(row) else None))
+
+        self.columns = _build_header(header_row, width)
+        self.keys = keys
+        return True
+
+    def iter_rows(self, keep=None, clean_key=True):
+        """第二遍流式读取：仅为keep为True的行生成完整的数据行
+
+        参数:
+        - keep: 与keys等长的布尔序列，为None时返回所有行
+        - clean_key: 为True时关键列使用清理后的值，否则保留原始单元格值
+        """
+        width = len(self.columns)
+        col_idx = self._column_index
+        rows = self._iter_raw_rows()
+        next(rows, None)  # 跳过表头
+        for idx, row in enumerate(rows):
+            if keep is not None and not keep[idx]:
+                continue
+            if len(row) < width:
+                row = row + [None] * (width - len(row))
+            if clean_key:
+                row[col_idx] = self.keys[idx]
+            yield row
+
+
+class ExcelWorkbook:
+    """只打开一次的Excel工作簿，供同一文件的多个工作表共享
+
+    .xlsx使用openpyxl只读流式模式；.xls（openpyxl不支持）退回到pandas一次性解析所需工作表。
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.book = None
+        self.frame_cache = None
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext == '.xls':
+            self._excel_file = pd.ExcelFile(file_path)
+            self.sheet_names = list(self._excel_file.sheet_names)
+            self.frame_cache = {}
+        else:
+            self.book = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+            self.sheet_names = list(self.book.sheetnames)
+
+    def resolve_sheet_name(self, sheet_name):
+        """把前端传来的工作表名称（可能是清理后的名称或索引）解析为真实名称"""
+        if sheet_name in self.sheet_names:
+            return sheet_name
+        for name in self.sheet_names:
+            if clean_sheet_name(name) == sheet_name:
+                return name
+        if isinstance(sheet_name, int) and 0 <= sheet_name < len(self.sheet_names):
+            return self.sheet_names[sheet_name]
+        if sheet_name is None and self.sheet_names:
+            return self.sheet_names[0]
+        raise ValueError(f"工作表 {sheet_name} 不存在")
+
+    def probe(self, sheet_name, sample_rows=SAMPLE_ROWS):
+        """只读取表头和前几行样本数据，用于快速获取列名
+
+        列名与pd.read_excel(nrows=1)得到的列名一致（清理后并去掉空列名）。
+
+        返回:
+        - dict: {'sheet_name': 真实工作表名, 'columns': [列名, ...], 'samples': {列名: [样本值, ...]}}
+        """
+        real_name = self.resolve_sheet_name(sheet_name)
+        if self.frame_cache is not None:
+            if real_name in self.frame_cache:
+                df = self.frame_cache[real_name].head(sample_rows)
+            else:
+                df = self._excel_file.parse(real_name, dtype=str, nrows=sample_rows)
+            rows = [list(df.columns)] + [[None if pd.isna(v) else v for v in row]
+                                         for row in df.itertuples(index=False, name=None)]
+        else:
+            source = SheetSource(self, real_name, None)
+            rows = list(islice(source._iter_raw_rows(), sample_rows + 1))
+
+        if not rows:
+            return {'sheet_name': real_name, 'columns': [], 'samples': {}}
+
+        header_row, data_rows = rows[0], rows[1:]
+        # 与pandas读取nrows=1时一致：列数由表头和第一行数据决定
+        width = max(len(header_row), len(data_rows[0]) if data_rows else 0)
+
+        columns = []
+        samples = {}
+        for idx, name in enumerate(_build_header(header_row, width)):
+            column = clean_column_name(name)
+            if not column:
+                continue
+            columns.append(column)
+            samples[column] = [row[idx] for row in data_rows if idx < len(row) and row[idx] not in (None, '')]
+        return {'sheet_name': real_name, 'columns': columns, 'samples': samples}
+
+    def sheet_source(self, sheet_name, column):
+        """创建并扫描工作表数据源，未找到指定列时返回None"""
+        real_name = self.resolve_sheet_name(sheet_name)
+        if self.frame_cache is not None and real_name not in self.frame_cache:
+            # .xls只能整表解析，通过工作表缓存避免重复解析
+            self.frame_cache[real_name] = read_excel_cached(self.file_path, real_name, dtype=str)
+        source = SheetSource(self, real_name, column)
+        if not source.scan():
+            return None
+        return source
+
+    def close(self):
+        """关闭工作簿，释放文件句柄"""
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if self.frame_cache is not None:
+            self._excel_file.close()
+            self.frame_cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def probe_sheet(file_path, sheet_name=None, sample_rows=SAMPLE_ROWS):
+    """打开工作簿并探测指定工作表的列名和样本数据，见ExcelWorkbook.probe"""
+    with ExcelWorkbook(file_path) as workbook:
+        return workbook.probe(sheet_name, sample_rows)
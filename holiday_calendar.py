@@ -0,0 +1,398 @@
+import os
+import json
+import random
+import logging
+import threading
+from types import MappingProxyType
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 额外的节假日数据文件（可选），用于补充更多年份或其他地区的节假日
+HOLIDAY_CALENDAR_FILE = os.environ.get(
+    'HOLIDAY_CALENDAR_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'holidays.json')
+)
+
+DEFAULT_REGION = 'CN'
+
+# 中国主要节假日的精确日期范围和相关信息（2018-2030年）
+# 格式: {节日名称: {年份: [日期(MM-DD)列表], "fixed_range": 每年固定的日期, "extended_range": 节日前后的日期, ...}}
+BUILTIN_HOLIDAYS = {
+    # 春节（农历新年）- 具体日期随年份变化
+    "春节": {
+        2018: ["02-15", "02-16", "02-17", "02-18", "02-19", "02-20", "02-21"],
+        2019: ["02-04", "02-05", "02-06", "02-07", "02-08", "02-09", "02-10"],
+        2020: ["01-24", "01-25", "01-26", "01-27", "01-28", "01-29", "01-30"],
+        2021: ["02-11", "02-12", "02-13", "02-14", "02-15", "02-16", "02-17"],
+        2022: ["01-31", "02-01", "02-02", "02-03", "02-04", "02-05", "02-06"],
+        2023: ["01-21", "01-22", "01-23", "01-24", "01-25", "01-26", "01-27"],
+        2024: ["02-10", "02-11", "02-12", "02-13", "02-14", "02-15", "02-16"],
+        2025: ["01-29", "01-30", "01-31", "02-01", "02-02", "02-03", "02-04"],
+        2026: ["02-17", "02-18", "02-19", "02-20", "02-21", "02-22", "02-23"],
+        2027: ["02-06", "02-07", "02-08", "02-09", "02-10", "02-11", "02-12"],
+        2028: ["01-26", "01-27", "01-28", "01-29", "01-30", "01-31", "02-01"],
+        2029: ["02-13", "02-14", "02-15", "02-16", "02-17", "02-18", "02-19"],
+        2030: ["02-03", "02-04", "02-05", "02-06", "02-07", "02-08", "02-09"],
+        "pre_days": 7,  # 春节前7天
+        "post_days": 7,  # 春节后7天
+        "up_patterns": ["春节前购物高峰", "年货采购期", "春节备货期", "节前消费高峰"],
+        "down_patterns": ["春节期间多数商家休息", "春节后初期消费低迷", "节日消费后的淡季", "春节期间商业活动减少"]
+    },
+
+    # 国庆节黄金周（固定10月1日-7日）
+    "国庆节": {
+        "fixed_range": ["10-01", "10-02", "10-03", "10-04", "10-05", "10-06", "10-07"],
+        "pre_days": 3,
+        "post_days": 3,
+        "up_patterns": ["国庆节促销活动", "长假旅游消费增加", "黄金周消费高峰", "节日庆祝相关消费"],
+        "down_patterns": ["国庆期间部分商家暂停营业", "节日期间商业区客流变化", "供应链受节假日影响"]
+    },
+
+    # 元旦（固定1月1日）
+    "元旦": {
+        "fixed_range": ["01-01"],
+        "extended_range": ["12-30", "12-31", "01-02", "01-03"],  # 考虑元旦前后
+        "pre_days": 2,
+        "post_days": 2,
+        "up_patterns": ["元旦促销", "年末购物", "新年促销活动", "跨年消费"],
+        "down_patterns": ["元旦假期部分商家休息", "新年假期商业活动减少"]
+    },
+
+    # 劳动节（固定5月1日，但假期长度因年而异）
+    "劳动节": {
+        2018: ["05-01"],
+        2019: ["05-01", "05-02", "05-03", "05-04"],
+        2020: ["05-01", "05-02", "05-03", "05-04", "05-05"],
+        2021: ["05-01", "05-02", "05-03", "05-04", "05-05"],
+        2022: ["04-30", "05-01", "05-02", "05-03", "05-04"],
+        2023: ["04-29", "04-30", "05-01", "05-02", "05-03"],
+        2024: ["05-01", "05-02", "05-03", "05-04", "05-05"],
+        2025: ["05-01", "05-02", "05-03", "05-04", "05-05"],  # 预估
+        2026: ["05-01", "05-02", "05-03", "05-04", "05-05"],  # 预估
+        2027: ["05-01", "05-02", "05-03", "05-04", "05-05"],  # 预估
+        2028: ["04-29", "04-30", "05-01", "05-02", "05-03"],  # 预估
+        2029: ["04-28", "04-29", "04-30", "05-01", "05-02"],  # 预估
+        2030: ["05-01", "05-02", "05-03", "05-04", "05-05"],  # 预估
+        "pre_days": 2,
+        "post_days": 2,
+        "up_patterns": ["五一促销活动", "小长假消费增加", "假期旅游带动消费", "假日特惠活动"],
+        "down_patterns": ["劳动节假期部分商家休息", "假期结束后消费低迷", "商业区域人流变化"]
+    },
+
+    # 中秋节（农历节日，每年日期不同）
+    "中秋节": {
+        2018: ["09-24"],
+        2019: ["09-13"],
+        2020: ["10-01"],  # 与国庆重合
+        2021: ["09-21"],
+        2022: ["09-10"],
+        2023: ["09-29"],
+        2024: ["09-17"],
+        2025: ["10-06"],  # 与国庆重合
+        2026: ["09-25"],
+        2027: ["09-15"],
+        2028: ["10-03"],  # 与国庆重合
+        2029: ["09-22"],
+        2030: ["09-12"],
+        "pre_days": 3,
+        "post_days": 1,
+        "up_patterns": ["中秋节礼品销售高峰", "月饼等节日食品销售增加", "中秋团圆消费", "节日礼品采购"],
+        "down_patterns": ["中秋节当天销售下降", "节日期间特定商品销量变化"]
+    },
+
+    # 双十一购物节（固定11月11日）
+    "双十一": {
+        "fixed_range": ["11-11"],
+        "extended_range": ["11-01", "11-02", "11-03", "11-04", "11-05", "11-06", "11-07", "11-08", "11-09", "11-10", "11-12", "11-13", "11-14", "11-15"],
+        "pre_days": 10,  # 双11前10天
+        "post_days": 5,   # 双11后5天
+        "up_patterns": ["双十一购物狂欢节", "大规模促销活动", "预售活动期", "购物节大促"],
+        "down_patterns": ["双十一后消费疲软", "透支消费降低后续购买力", "促销后的销售低谷"]
+    },
+
+    # 双十二（固定12月12日）
+    "双十二": {
+        "fixed_range": ["12-12"],
+        "extended_range": ["12-07", "12-08", "12-09", "12-10", "12-11", "12-13", "12-14", "12-15", "12-16", "12-17"],
+        "pre_days": 5,
+        "post_days": 3,
+        "up_patterns": ["双十二促销活动", "年末购物季", "双十二特惠", "年终促销"],
+        "down_patterns": ["双十二后消费下降", "年末消费逐渐减少"]
+    }
+}
+
+# 索引中每一天的模式类型
+PATTERN_UP = 'up'
+PATTERN_DOWN = 'down'
+PATTERN_MIXED = 'mixed'  # 节日中间的日期，查询时随机给出上升或下降模式
+
+
+def _normalize_holidays(holidays):
+    """把数据文件中的节假日定义规范化：年份键转换为整数"""
+    normalized = {}
+    for name, info in holidays.items():
+        normalized[name] = {
+            int(key) if isinstance(key, str) and key.isdigit() else key: value
+            for key, value in info.items()
+        }
+    return normalized
+
+
+def _classify_day(date, holidays):
+    """按节假日定义判断某一天属于哪个节日，返回 (节日标签, 节日名称, 模式类型) 或None
+
+    规则按节日定义的顺序匹配，与节日当天、扩展范围、节前节后几天的判断顺序保持一致。
+    """
+    date_str = f"{date.month:02d}-{date.day:02d}"
+    year = date.year
+
+    # 检查是否在特定年份的节假日范围内
+    for holiday_name, holiday_info in holidays.items():
+        # 检查固定日期范围（如国庆节、元旦等固定日期的节日）
+        if "fixed_range" in holiday_info and date_str in holiday_info["fixed_range"]:
+            return holiday_name, holiday_name, PATTERN_UP if date.day <= 3 else PATTERN_DOWN
+
+        # 检查扩展日期范围（节日前后几天），前半月认为是节前
+        if "extended_range" in holiday_info and date_str in holiday_info["extended_range"]:
+            if date.day < 15:
+                return f"{holiday_name}前", holiday_name, PATTERN_UP
+            return f"{holiday_name}后", holiday_name, PATTERN_DOWN
+
+        # 检查年份特定的节假日日期（如春节、中秋等农历节日）
+        if year in holiday_info and isinstance(holiday_info[year], list) and date_str in holiday_info[year]:
+            if date_str == holiday_info[year][0]:
+                return f"{holiday_name}开始", holiday_name, PATTERN_UP
+            if date_str == holiday_info[year][-1]:
+                return f"{holiday_name}结束", holiday_name, PATTERN_DOWN
+            return holiday_name, holiday_name, PATTERN_MIXED
+
+    # 检查节日前后的日期
+    date_minus_1 = (date - pd.Timedelta(days=1)).strftime("%m-%d")
+    date_minus_2 = (date - pd.Timedelta(days=2)).strftime("%m-%d")
+    date_plus_1 = (date + pd.Timedelta(days=1)).strftime("%m-%d")
+    date_plus_2 = (date + pd.Timedelta(days=2)).strftime("%m-%d")
+
+    for holiday_name, holiday_info in holidays.items():
+        # 检查固定日期节日的前后几天
+        if "fixed_range" in holiday_info:
+            first_day = holiday_info["fixed_range"][0]
+            last_day = holiday_info["fixed_range"][-1]
+            if date_plus_1 == first_day or date_plus_2 == first_day:
+                return f"{holiday_name}前", holiday_name, PATTERN_UP
+            if date_minus_1 == last_day or date_minus_2 == last_day:
+                return f"{holiday_name}后", holiday_name, PATTERN_DOWN
+
+        # 检查年份特定节日的前后几天
+        if year in holiday_info and isinstance(holiday_info[year], list):
+            first_day = pd.Timestamp(f"{year}-{holiday_info[year][0]}")
+            last_day = pd.Timestamp(f"{year}-{holiday_info[year][-1]}")
+            if 1 <= (first_day - date).days <= holiday_info.get("pre_days", 3):
+                return f"{holiday_name}前", holiday_name, PATTERN_UP
+            if 1 <= (date - last_day).days <= holiday_info.get("post_days", 3):
+                return f"{holiday_name}后", holiday_name, PATTERN_DOWN
+
+    return None
+
+
+def _holiday_days(holidays, year):
+    """某一年中节日当天（不含节前节后）的日期"""
+    days = []
+    for holiday_info in holidays.values():
+        dates = list(holiday_info.get("fixed_range", []))
+        if isinstance(holiday_info.get(year), list):
+            dates += holiday_info[year]
+        for date_str in dates:
+            try:
+                days.append(pd.Timestamp(f"{year}-{date_str}"))
+            except ValueError:  # 如非闰年的02-29
+                pass
+    return days
+
+
+class HolidayCalendar:
+    """节假日日历索引
+
+    每一年的 日期 -> (节日标签, 节日名称, 模式类型) 索引只在第一次用到时构建一次，之后只读；
+    提供单个日期的查询（lookup）和整列日期的向量化查询（holiday_mask / labels）。
+    """
+
+    def __init__(self, holidays, region=DEFAULT_REGION):
+        self.region = region
+        self.holidays = MappingProxyType(_normalize_holidays(holidays))
+        self._years = {}
+        self._lock = threading.Lock()
+
+    def _year_index(self, year):
+        """返回某一年的索引: {'days': {日期序号: 条目}, 'holiday_days': 节日当天的日期序号数组}"""
+        index = self._years.get(year)
+        if index is not None:
+            return index
+        with self._lock:
+            index = self._years.get(year)
+            if index is None:
+                days = {}
+                for date in pd.date_range(f"{year}-01-01", f"{year}-12-31", freq='D'):
+                    entry = _classify_day(date, self.holidays)
+                    if entry is not None:
+                        days[date.toordinal()] = entry
+                holiday_days = np.unique([date.toordinal() for date in _holiday_days(self.holidays, year)])
+                index = MappingProxyType({'days': MappingProxyType(days), 'holiday_days': holiday_days})
+                self._years[year] = index
+        return index
+
+    def patterns(self, holiday_name, pattern_type):
+        """节日对应的上升/下降模式描述"""
+        info = self.holidays.get(holiday_name, {})
+        if pattern_type == PATTERN_MIXED:
+            pattern_type = PATTERN_UP if random.random() > 0.5 else PATTERN_DOWN
+        return info.get("up_patterns" if pattern_type == PATTERN_UP else "down_patterns", [])
+
+    def lookup(self, date):
+        """判断日期是否为节假日
+
+        返回:
+        - (is_holiday, holiday_label, patterns)
+        """
+        if not isinstance(date, pd.Timestamp) or pd.isna(date):
+            return False, None, []
+        entry = self._year_index(date.year)['days'].get(date.toordinal())
+        if entry is None:
+            return False, None, []
+        label, holiday_name, pattern_type = entry
+        return True, label, self.patterns(holiday_name, pattern_type)
+
+    def _ordinals(self, dates):
+        """把一列日期转换为日期序号（与date.toordinal()一致），无效日期为-1"""
+        dates = pd.to_datetime(pd.Series(dates).reset_index(drop=True), errors='coerce')
+        valid = dates.notna().to_numpy()
+        days = np.full(len(dates), -1, dtype=np.int64)
+        # datetime64[D]以1970-01-01为0，toordinal以0001-01-01为1
+        days[valid] = dates[valid].to_numpy().astype('datetime64[D]').astype(np.int64) + 719163
+        return days, dates
+
+    def holiday_mask(self, dates, pre_days=0, post_days=0, include_extended=False):
+        """向量化判断一列日期是否为节假日
+
+        参数:
+        - dates: 日期序列或数组
+        - pre_days / post_days: 把节日前/后若干天也视为节假日
+        - include_extended: 是否包含索引中的节前、节后及扩展范围（与lookup的判断一致）
+
+        返回:
+        - 与dates等长的布尔数组
+        """
+        days, dates = self._ordinals(dates)
+        valid = days >= 0
+        mask = np.zeros(len(days), dtype=bool)
+        if not valid.any():
+            return mask
+
+        years = np.unique(dates[valid].dt.year.to_numpy())
+        # 包含相邻年份，使节前节后窗口可以跨年
+        all_years = np.unique(np.concatenate([years - 1, years, years + 1]))
+        holiday_days = np.unique(np.concatenate([self._year_index(int(year))['holiday_days'] for year in all_years]))
+
+        if len(holiday_days):
+            # 每个日期之后（含当天）最近的节日和之前（含当天）最近的节日
+            position = np.searchsorted(holiday_days, days)
+            next_day = holiday_days[np.minimum(position, len(holiday_days) - 1)]
+            has_next = position < len(holiday_days)
+            prev_position = np.searchsorted(holiday_days, days, side='right') - 1
+            prev_day = holiday_days[np.maximum(prev_position, 0)]
+            has_prev = prev_position >= 0
+            mask = (has_next & (next_day - days >= 0) & (next_day - days <= pre_days)) | \
+                   (has_prev & (days - prev_day >= 0) & (days - prev_day <= post_days))
+
+        if include_extended:
+            indexed = np.concatenate([np.fromiter(self._year_index(int(year))['days'].keys(), dtype=np.int64)
+                                      for year in years])
+            mask |= np.isin(days, indexed)
+
+        return mask & valid
+
+    def labels(self, dates):
+        """向量化查询一列日期的节日标签（与lookup一致），不是节假日的为None"""
+        days, dates = self._ordinals(dates)
+        result = np.full(len(days), None, dtype=object)
+        valid = days >= 0
+        unique_days = np.unique(days[valid])
+        if len(unique_days) == 0:
+            return result
+
+        label_of_day = {}
+        for day in unique_days:
+            date = pd.Timestamp.fromordinal(int(day))
+            entry = self._year_index(date.year)['days'].get(int(day))
+            if entry is not None:
+                label_of_day[int(day)] = entry[0]
+        if label_of_day:
+            result[valid] = pd.Series(days[valid]).map(label_of_day).to_numpy(dtype=object)
+            result[pd.isna(result)] = None
+        return result
+
+
+def load_calendar_file(path=HOLIDAY_CALENDAR_FILE):
+    """读取节假日数据文件
+
+    文件为JSON格式，结构与BUILTIN_HOLIDAYS相同（年份作为字符串键）：
+    {
+        "holidays": {"春节": {"2031": ["01-22", ...]}, ...},    # 补充或覆盖默认地区（CN）的节日
+        "regions": {"HK": {"圣诞节": {"fixed_range": ["12-25"], ...}}}  # 其他地区的完整日历
+    }
+    文件不存在时返回空字典。
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取节假日数据文件 {path} 失败: {str(e)}")
+        return {}
+
+
+def _merge_holidays(base, extra):
+    """合并节日定义，同名节日按字段合并（可以只补充新的年份）"""
+    merged = {name: dict(info) for name, info in base.items()}
+    for name, info in _normalize_holidays(extra).items():
+        merged.setdefault(name, {}).update(info)
+    return merged
+
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def get_calendar(region=DEFAULT_REGION):
+    """获取地区的节假日日历（每个地区只构建一次）"""
+    region = region or DEFAULT_REGION
+    calendar = _calendars.get(region)
+    if calendar is not None:
+        return calendar
+    with _calendars_lock:
+        calendar = _calendars.get(region)
+        if calendar is None:
+            data = load_calendar_file()
+            if region == DEFAULT_REGION:
+                holidays = _merge_holidays(BUILTIN_HOLIDAYS, data.get('holidays', {}))
+            else:
+                regions = data.get('regions', {})
+                if region not in regions:
+                    raise ValueError(f"未找到地区 {region} 的节假日日历")
+                holidays = regions[region]
+            calendar = HolidayCalendar(holidays, region=region)
+            _calendars[region] = calendar
+    return calendar
+
+
+def is_holiday(date, region=DEFAULT_REGION):
+    """判断日期是否为节假日（默认中国主要节假日），返回 (is_holiday, holiday_label, patterns)"""
+    return get_calendar(region).lookup(date)
+
+
+def holiday_mask(dates, pre_days=0, post_days=0, region=DEFAULT_REGION, include_extended=False):
+    """向量化判断一列日期是否为节假日，参数见HolidayCalendar.holiday_mask"""
+    return get_calendar(region).holiday_mask(dates, pre_days=pre_days, post_days=post_days,
+                                             include_extended=include_extended)
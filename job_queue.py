@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# 任务各阶段在总进度中所占的区间（百分比）
+STAGES = {
+    'queued': (0, 0),
+    'reading': (0, 40),
+    'indexing': (40, 50),
+    'writing': (50, 100)
+}
+
+FINISHED_STATUSES = ('done', 'failed')
+
+JOB_TTL = int(os.environ.get('ANALYSIS_JOB_TTL', 2 * 3600))  # 任务及结果文件保留时间（秒）
+SWEEP_INTERVAL = 60  # 两次清理过期任务之间的最小间隔（秒）
+
+
+def _status_path(job_dir):
+    return os.path.join(job_dir, 'status.json')
+
+
+def read_status(job_dir):
+    """读取任务状态文件，不存在或损坏时返回None"""
+    try:
+        with open(_status_path(job_dir), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_status(job_dir, **fields):
+    """更新任务状态文件
+
+    先写临时文件再原子替换，保证其他gunicorn worker读取时不会读到写了一半的文件。
+    """
+    status = read_status(job_dir) or {}
+    status.update(fields)
+    status['updated_at'] = time.time()
+    temp_path = os.path.join(job_dir, f"status.{uuid.uuid4().hex}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, ensure_ascii=False)
+    os.replace(temp_path, _status_path(job_dir))
+    return status
+
+
+class JobProgress:
+    """任务进度回调，在工作进程中调用，把阶段进度写入状态文件
+
+    用法: progress('reading', 0.5) 表示读取阶段完成了一半
+    """
+
+    MIN_INTERVAL = 0.5  # 同一阶段内两次写入状态文件的最小间隔（秒）
+
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        self._stage = None
+        self._last_write = 0
+
+    def __call__(self, stage, fraction=0.0, message=None):
+        now = time.time()
+        if stage == self._stage and now - self._last_write < self.MIN_INTERVAL and fraction < 1:
+            return
+        start, end = STAGES.get(stage, (0, 100))
+        fraction = min(max(fraction, 0.0), 1.0)
+        fields = {'stage': stage, 'progress': int(start + (end - start) * fraction)}
+        if message is not None:
+            fields['message'] = message
+        write_status(self.job_dir, **fields)
+        self._stage = stage
+        self._last_write = now
+
+
+def _run_job(job_dir, result_dir, ttl, func, args, kwargs, cleanup_paths):
+    """在工作进程中执行任务
+
+    任务函数通过progress关键字参数汇报进度；返回结果中的result_file
+    会被移动到任务目录中，按TTL保留而不是下载一次即删除。
+    """
+    try:
+        write_status(job_dir, status='running', stage='reading', progress=0, started_at=time.time())
+        result = func(*args, progress=JobProgress(job_dir), **kwargs)
+
+        if isinstance(result, dict) and result.get('result_file'):
+            source_path = os.path.join(result_dir, result['result_file'])
+            if os.path.exists(source_path):
+                shutil.move(source_path, os.path.join(job_dir, result['result_file']))
+
+        # 保留时间从任务完成时开始计算
+        finished_at = time.time()
+        write_status(job_dir, status='done', stage='done', progress=100,
+                     result=result, finished_at=finished_at, expires_at=finished_at + ttl)
+    except Exception as e:
+        logger.error(f"任务 {os.path.basename(job_dir)} 执行失败: {str(e)}")
+        finished_at = time.time()
+        write_status(job_dir, status='failed', error=str(e),
+                     finished_at=finished_at, expires_at=finished_at + ttl)
+    finally:
+        # 清理任务的输入文件
+        for path in cleanup_paths:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class JobQueue:
+    """后台分析任务队列
+
+    - 任务在有界的进程池中执行，不占用处理请求的web worker
+    - 任务状态保存在 jobs_dir/<job_id>/status.json，多个gunicorn worker共享
+    - 完成的任务及结果文件保留JOB_TTL秒后自动清理
+    仅在支持fork的平台上使用进程池（spawn会重新导入app模块），否则退回到线程池。
+    """
+
+    def __init__(self, jobs_dir, max_workers=None, ttl=JOB_TTL):
+        self.jobs_dir = jobs_dir
+        self.ttl = ttl
+        self.max_workers = max_workers or max(1, min(2, os.cpu_count() or 1))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if 'fork' in multiprocessing.get_all_start_methods():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context('fork')
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='analysis-job'
+                    )
+            return self._executor
+
+    def _reset_executor(self):
+        """进程池中的进程异常退出后，丢弃整个进程池，下次提交时重新创建"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def job_dir(self, job_id):
+        """返回任务目录，job_id格式不正确时返回None"""
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        return os.path.join(self.jobs_dir, job_id)
+
+    def submit(self, func, *args, result_dir=None, cleanup_paths=(), owner=None, **kwargs):
+        """提交任务，返回job_id
+
+        参数:
+        - func: 任务函数，需要接受progress关键字参数，且为模块级函数（进程池需要序列化）
+        - result_dir: 任务函数生成结果文件（返回值中的result_file）所在的目录
+        - cleanup_paths: 任务结束后需要删除的输入文件
+        - owner: 提交任务的用户，查询时用于权限校验
+        """
+        self.sweep()
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir)
+        now = time.time()
+        write_status(job_dir, job_id=job_id, owner=owner, status='queued', stage='queued',
+                     progress=0, created_at=now, expires_at=now + self.ttl)
+
+        task_args = (job_dir, result_dir or self.jobs_dir, self.ttl, func, args, kwargs, list(cleanup_paths))
+        try:
+            future = self._get_executor().submit(_run_job, *task_args)
+        except BrokenProcessPool:
+            self._reset_executor()
+            future = self._get_executor().submit(_run_job, *task_args)
+
+        def on_done(f):
+            # 工作进程崩溃时_run_job没有机会写入失败状态
+            error = f.exception()
+            if error is not None:
+                if isinstance(error, BrokenProcessPool):
+                    self._reset_executor()
+                status = read_status(job_dir)
+                if status and status.get('status') not in FINISHED_STATUSES:
+                    finished_at = time.time()
+                    write_status(job_dir, status='failed', error=f"任务执行异常: {error}",
+                                 finished_at=finished_at, expires_at=finished_at + self.ttl)
+
+        future.add_done_callback(on_done)
+        return job_id
+
+    def get(self, job_id, owner=None):
+        """查询任务状态，任务不存在、已过期或不属于owner时返回None
+
+        owner总是与提交任务时的owner比较（None也只能查询owner为None的任务），
+        未登录用户需要传入会话令牌之类的标识，不能用None跳过校验。
+        """
+        job_dir = self.job_dir(job_id)
+        if job_dir is None:
+            return None
+        status = read_status(job_dir)
+        if status is None:
+            return None
+        if status.get('owner') != owner:
+            return None
+        if status.get('status') in FINISHED_STATUSES and status.get('expires_at', 0) < time.time():
+            return None
+        return status
+
+    def result_path(self, job_id, owner=None):
+        """返回已完成任务的结果文件路径"""
+        status = self.get(job_id, owner)
+        if not status or status.get('status') != 'done':
+            return None
+        result = status.get('result') or {}
+        result_file = result.get('result_file') if isinstance(result, dict) else None
+        if not result_file:
+            return None
+        path = os.path.join(self.job_dir(job_id), os.path.basename(result_file))
+        return path if os.path.exists(path) else None
+
+    def sweep(self, force=False):
+        """删除已过期的任务目录（包括结果文件）"""
+        now = time.time()
+        if not force and now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        try:
+            entries = os.listdir(self.jobs_dir)
+        except OSError:
+            return
+        for job_id in entries:
+            job_dir = os.path.join(self.jobs_dir, job_id)
+            status = read_status(job_dir)
+            if status is None:
+                # 状态文件丢失的目录按修改时间判断是否过期
+                try:
+                    expired = os.path.getmtime(job_dir) + self.ttl < now
+                except OSError:
+                    continue
+            else:
+                expired = status.get('expires_at', 0) < now
+                # 仍在执行的任务延后清理
+                if expired and status.get('status') not in FINISHED_STATUSES:
+                    expired = status.get('updated_at', 0) + self.ttl < now
+            if expired:
+                shutil.rmtree(job_dir, ignore_errors=True)
@@ -0,0 +1,234 @@
+import os
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+LLM_POOL_SIZE = int(os.environ.get('LLM_POOL_SIZE', 10))  # 每个主机保持的长连接数
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))  # 失败后最多重试次数
+LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', 1.0))  # 第n次重试最多等待 base × 2^(n-1) 秒
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', 30.0))  # 单次重试的最长等待时间（秒）
+LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 10))
+LLM_READ_TIMEOUT = float(os.environ.get('LLM_READ_TIMEOUT', 90))
+LLM_BREAKER_THRESHOLD = int(os.environ.get('LLM_BREAKER_THRESHOLD', 5))  # 连续失败多少次后熔断
+LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', 30))  # 熔断后多久允许试探请求（秒）
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """熔断器打开，请求未发送"""
+
+
+class CircuitBreaker:
+    """连续失败的熔断器
+
+    - closed: 正常发送请求，连续失败threshold次后打开
+    - open: 直接拒绝请求，cooldown秒后进入half_open
+    - half_open: 只放行一个试探请求，成功则关闭，失败则重新打开
+    429/5xx集中出现时不再持续请求上游，也不会让用户等待完整的重试过程。
+    """
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否允许发送请求"""
+        with self._lock:
+            if self.state == 'open' and time.time() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._trial_running = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.threshold and self.failures >= self.threshold):
+                if self.state != 'open':
+                    logger.warning(f"LLM接口连续失败{self.failures}次，熔断{self.cooldown}秒")
+                self.state = 'open'
+                self.opened_at = time.time()
+                self._trial_running = False
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened_at': self.opened_at or None
+            }
+
+
+class LLMClient:
+    """LLM接口的长连接HTTP客户端（模块级共享）
+
+    - 一个requests.Session和固定大小的连接池，TLS连接在请求之间复用（keep-alive）
+    - 连接失败和429/5xx按指数退避加随机抖动（full jitter）重试，优先遵守Retry-After
+    - 熔断器在上游连续失败时直接拒绝请求
+    - metrics()返回请求数、重试数、延迟和连接池使用情况
+    接口地址由调用方传入，测试时可以指向本地的桩服务器（见llm_stub_server.py）。
+    """
+
+    def __init__(self, pool_size=LLM_POOL_SIZE, max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE,
+                 backoff_max=LLM_BACKOFF_MAX, timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT),
+                 retry_statuses=RETRY_STATUSES, breaker=None):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.retry_statuses = tuple(retry_statuses)
+        self.breaker = breaker or CircuitBreaker()
+        # 重试由post()处理（urllib3的Retry默认不重试POST，也无法加入抖动和熔断）
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._metrics = {
+            'requests': 0,
+            'attempts': 0,
+            'successes': 0,
+            'failures': 0,
+            'retries': 0,
+            'rejected': 0,
+            'status_codes': {},
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+            'last_latency': None,
+            'last_error': None
+        }
+
+    def _count(self, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                self._metrics[key] += value
+
+    def _backoff(self, attempt, response=None):
+        """第attempt次重试前的等待时间：full jitter，Retry-After优先"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            try:
+                delay = max(delay, min(self.backoff_max, float(retry_after)))
+            except (TypeError, ValueError):
+                pass
+        return delay
+
+    def post(self, url, timeout=None, **kwargs):
+        """发送POST请求，按需重试
+
+        返回最后一次的响应（重试后仍为429/5xx时也返回该响应，由调用方处理）；
+        熔断时抛出CircuitOpenError，连接失败且重试用尽时抛出requests的异常。
+        """
+        timeout = timeout or self.timeout
+        self._count(requests=1)
+        start = time.time()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            attempt = 0
+            while True:
+                if not self.breaker.allow():
+                    self._count(rejected=1)
+                    raise CircuitOpenError('LLM接口暂时不可用（熔断中）')
+
+                response = None
+                error = None
+                self._count(attempts=1)
+                try:
+                    response = self.session.post(url, timeout=timeout, **kwargs)
+                except requests.exceptions.ConnectionError as e:
+                    # 只重试连接失败；读取超时（ReadTimeout）直接抛出：上游可能仍在生成，重试只会让用户再等一个完整的超时
+                    error = e
+                except BaseException:
+                    # 其他异常也要记为失败，否则半开状态的试探请求会一直占着名额，熔断器再也不会放行
+                    self.breaker.record_failure()
+                    raise
+
+                if response is not None:
+                    with self._lock:
+                        codes = self._metrics['status_codes']
+                        codes[str(response.status_code)] = codes.get(str(response.status_code), 0) + 1
+                    if response.status_code not in self.retry_statuses:
+                        self.breaker.record_success()
+                        self._count(successes=1)
+                        return response
+
+                self.breaker.record_failure()
+                # 重试用尽或本次失败触发了熔断时，不再等待，直接返回最后的结果
+                if attempt >= self.max_retries or self.breaker.state == 'open':
+                    if error is not None:
+                        raise error
+                    self._count(failures=1)
+                    return response
+
+                attempt += 1
+                delay = self._backoff(attempt, response)
+                reason = str(error) if error is not None else f"状态码{response.status_code}"
+                print(f"LLM请求失败（{reason}），{delay:.2f}秒后第{attempt}次重试")
+                self._count(retries=1)
+                time.sleep(delay)
+        except Exception as e:
+            with self._lock:
+                self._metrics['failures'] += 1
+                self._metrics['last_error'] = str(e)
+            raise
+        finally:
+            latency = time.time() - start
+            with self._lock:
+                self._in_flight -= 1
+                self._metrics['latency_total'] += latency
+                self._metrics['latency_max'] = max(self._metrics['latency_max'], latency)
+                self._metrics['last_latency'] = latency
+
+    def pool_stats(self):
+        """连接池使用情况：每个主机已建立的连接数、空闲连接数和处理的请求数"""
+        pools = []
+        manager = self._adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'connections_created': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': pool.pool.qsize() if pool.pool is not None else 0,
+                'maxsize': pool.pool.maxsize if pool.pool is not None else self.pool_size
+            })
+        return pools
+
+    def metrics(self):
+        """客户端指标快照"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['status_codes'] = dict(self._metrics['status_codes'])
+            metrics['in_flight'] = self._in_flight
+        completed = metrics['requests'] - metrics['in_flight']
+        metrics['latency_avg'] = round(metrics['latency_total'] / completed, 3) if completed > 0 else None
+        metrics['pools'] = self.pool_stats()
+        metrics['breaker'] = self.breaker.to_dict()
+        return metrics
@@ -0,0 +1,123 @@
+"""本地LLM接口桩服务器（OpenAI兼容的/chat/completions），用于在不调用真实接口的情况下测试AI分析
+
+用法:
+    python llm_stub_server.py --port 8765 --fail-first 2 --fail-status 503 --latency 0.2
+    OPENROUTER_API_URL=http://127.0.0.1:8765/chat/completions OPENROUTER_API_KEY=test python app.py
+
+GET /stats 返回桩服务器收到的请求数和建立的连接数，可以据此确认客户端是否复用了长连接。
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    """桩服务器的配置和计数"""
+
+    def __init__(self, latency=0.0, fail_first=0, fail_rate=0.0, fail_status=503, retry_after=None):
+        self.latency = latency
+        self.fail_first = fail_first  # 前n个请求返回fail_status
+        self.fail_rate = fail_rate  # 之后的请求按该比例随机失败
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        with self.lock:
+            return {'requests': self.requests, 'connections': self.connections}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.state.lock:
+            self.server.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.state.to_dict())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        with state.lock:
+            state.requests += 1
+            count = state.requests
+
+        if state.latency:
+            time.sleep(state.latency)
+
+        if count <= state.fail_first or (state.fail_rate and random.random() < state.fail_rate):
+            headers = {'Retry-After': str(state.retry_after)} if state.retry_after is not None else None
+            self._send_json(state.fail_status, {'error': {'message': f'stub error {state.fail_status}'}}, headers)
+            return
+
+        messages = body.get('messages') or [{}]
+        question = str(messages[-1].get('content', ''))[:50]
+        self._send_json(200, {
+            'id': f'stub-{count}',
+            'object': 'chat.completion',
+            'model': body.get('model') or 'stub',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': f'桩服务器回复（第{count}个请求）：{question}'},
+                'finish_reason': 'stop'
+            }]
+        })
+
+
+def create_server(host='127.0.0.1', port=0, **options):
+    """创建桩服务器（port为0时自动分配端口），调用方负责serve_forever()和shutdown()"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**options)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地LLM接口桩服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的响应延迟（秒）')
+    parser.add_argument('--fail-first', type=int, default=0, help='前n个请求返回失败状态码')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='随机失败的比例（0~1）')
+    parser.add_argument('--fail-status', type=int, default=503, help='失败时返回的状态码')
+    parser.add_argument('--retry-after', type=float, default=None, help='失败响应中的Retry-After（秒）')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, latency=args.latency, fail_first=args.fail_first,
+                           fail_rate=args.fail_rate, fail_status=args.fail_status, retry_after=args.retry_after)
+    print(f"LLM桩服务器运行在 http://{args.host}:{server.server_address[1]}/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import os
+import csv
+import tempfile
+import zipfile
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow为可选依赖，仅Parquet导出需要
+    pa = None
+    pq = None
+
+# 支持的结果文件格式及对应的文件扩展名
+OUTPUT_FORMATS = {
+    'xlsx': '.xlsx',
+    'csv': '.zip',
+    'parquet': '.zip'
+}
+
+PARQUET_BATCH_SIZE = 50000  # Parquet每批写入的行数
+
+
+def result_extension(output_format):
+    """返回结果格式对应的文件扩展名，不支持的格式抛出ValueError"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的结果文件格式: {output_format}")
+    if output_format == 'parquet' and pa is None:
+        raise ValueError("当前环境未安装pyarrow，无法导出Parquet格式")
+    return OUTPUT_FORMATS[output_format]
+
+
+class _XlsxSheet:
+    """openpyxl只写模式的工作表，行直接写入磁盘临时文件"""
+
+    def __init__(self, workbook, name, columns):
+        self._ws = workbook.create_sheet(title=name)
+        header = []
+        for column in columns:
+            cell = WriteOnlyCell(self._ws, value=column)
+            cell.font = Font(bold=True)
+            header.append(cell)
+        self._ws.append(header)
+        self.row_count = 0
+
+    def append(self, row):
+        self._ws.append(row)
+        self.row_count += 1
+
+    def close(self):
+        pass
+
+
+class _CsvSheet:
+    """写入临时CSV文件的工作表，关闭结果文件时打包进zip"""
+
+    def __init__(self, directory, name, columns):
+        fd, self.temp_path = tempfile.mkstemp(suffix='.csv', dir=directory)
+        # 使用utf-8-sig编码，Excel可以直接正确显示中文
+        self._file = os.fdopen(fd, 'w', encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+        self.entry_name = f"{name}.csv"
+        self.row_count = 0
+
+    def append(self, row):
+        self._writer.writerow(['' if value is None else value for value in row])
+        self.row_count += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class _ParquetSheet:
+    """按批写入临时Parquet文件的工作表（所有列均为字符串），关闭结果文件时打包进zip"""
+
+    def __init__(self, directory, name, columns):
+        fd, self.temp_path = tempfile.mkstemp(suffix='.parquet', dir=directory)
+        os.close(fd)
+        self.entry_name = f"{name}.parquet"
+        self._columns = [str(column) for column in columns]
+        self._schema = pa.schema([(column, pa.string()) for column in self._columns])
+        self._writer = pq.ParquetWriter(self.temp_path, self._schema)
+        self._batch = []
+        self.row_count = 0
+
+    def _flush(self):
+        if self._batch:
+            arrays = [pa.array(list(col), type=pa.string()) for col in zip(*self._batch)]
+            self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+            self._batch = []
+
+    def append(self, row):
+        self._batch.append(['' if value is None else str(value) for value in row])
+        self.row_count += 1
+        if len(self._batch) >= PARQUET_BATCH_SIZE:
+            self._flush()
+
+    def close(self):
+        if self._writer is not None:
+            if not self._batch and self.row_count == 0:
+                # 写入空表，保证文件包含表结构
+                self._writer.write_table(self._schema.empty_table())
+            self._flush()
+            self._writer.close()
+            self._writer = None
+
+
+class ResultWriter:
+    """流式结果文件写入器
+
+    行在分类的同时逐行写出，不在内存中保留完整的结果DataFrame：
+    - xlsx: openpyxl只写模式（write_only），每个工作表的数据直接写入临时文件
+    - csv / parquet: 每个工作表一个文件，最终打包为zip，适合超大结果
+    """
+
+    def __init__(self, path, output_format='xlsx'):
+        result_extension(output_format)
+        self.path = path
+        self.output_format = output_format
+        self._sheets = []
+        self._entry_names = set()
+        if output_format == 'xlsx':
+            self._workbook = Workbook(write_only=True)
+        else:
+            self._workbook = None
+
+    def _unique_entry_name(self, name):
+        """保证zip中的文件名不重复"""
+        candidate = name
+        counter = 1
+        while candidate in self._entry_names:
+            candidate = f"{name}_{counter}"
+            counter += 1
+        self._entry_names.add(candidate)
+        return candidate
+
+    def add_sheet(self, name, columns):
+        """新建一个结果工作表并写入表头，返回可以逐行append的工作表对象"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if self.output_format == 'xlsx':
+            sheet = _XlsxSheet(self._workbook, name, columns)
+        elif self.output_format == 'csv':
+            sheet = _CsvSheet(directory, self._unique_entry_name(name), columns)
+        else:
+            sheet = _ParquetSheet(directory, self._unique_entry_name(name), columns)
+        self._sheets.append(sheet)
+        return sheet
+
+    def write_rows(self, name, columns, rows):
+        """写入一个完整的工作表"""
+        sheet = self.add_sheet(name, columns)
+        for row in rows:
+            sheet.append(row)
+        return sheet
+
+    def close(self):
+        """完成写入并生成最终的结果文件"""
+        for sheet in self._sheets:
+            sheet.close()
+        if self.output_format == 'xlsx':
+            if not self._sheets:
+                self._workbook.create_sheet(title='Sheet1')
+            self._workbook.save(self.path)
+        else:
+            with zipfile.ZipFile(self.path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for sheet in self._sheets:
+                    archive.write(sheet.temp_path, arcname=sheet.entry_name)
+        self._cleanup()
+
+    def _cleanup(self):
+        """删除csv/parquet的临时文件"""
+        for sheet in self._sheets:
+            temp_path = getattr(sheet, 'temp_path', None)
+            if temp_path and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+        self._sheets = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for sheet in self._sheets:
+                sheet.close()
+            self._cleanup()
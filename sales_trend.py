@@ -15,7 +15,15 @@ import logging
 import time
 import random
 import openpyxl
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename  # 添加导入secure_filename函数
+from data_cleaning import parse_dates, coerce_numeric
+from holiday_calendar import is_holiday, holiday_mask
+from chart_payload import lttb_indices, encode_dates, line_trace, marker_trace, chart_json
+from upload_store import UploadStore
+from trend_session import TrendSessionStore
+from task_runner import TaskRunner, TaskCancelled
+from stream_ingest import is_streaming_file, stream_daily_aggregate, read_sample, read_columns, count_rows, DailyAggregate
 import plotly
 
 # 定义图表颜色常量
@@ -30,10 +38,12 @@ CHART_COLORS = {
 # 抑制所有pandas UserWarning
 warnings.filterwarnings("ignore", category=UserWarning, module="pandas")
 
-# 创建一个全局字典来跟踪正在进行的分析任务
-ongoing_analyses = {}
-# 创建全局取消标志
-analysis_cancelled = False
+# 分析任务在有界的线程池中执行，每个任务有自己的取消令牌，登记表记录任务的阶段和运行时间
+trend_tasks = TaskRunner(name='sales-trend')
+
+# 上传的文件按内容哈希保存，分析建议、同比检查和各类分析通过file_id共享同一个分析会话
+trend_uploads = UploadStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'sales_trend_store'))
+trend_sessions = TrendSessionStore()
 
 def handle_sales_trend(app):
     """注册销售趋势分析相关路由"""
@@ -42,49 +52,60 @@ def handle_sales_trend(app):
     app.add_url_rule('/api/get_analysis_suggestions', 'get_analysis_suggestions', get_analysis_suggestions, methods=['POST'])
     app.add_url_rule('/api/check_year_over_year_eligibility', 'check_year_over_year_eligibility', check_year_over_year_eligibility, methods=['POST'])
     app.add_url_rule('/api/cancel_analysis', 'cancel_analysis', cancel_analysis, methods=['POST'])
+    app.add_url_rule('/api/analysis_tasks', 'analysis_tasks', analysis_tasks, methods=['GET'])
     return app
 
 def sales_trend_page():
     """渲染销售趋势分析页面"""
     return render_template('sales_trend.html')
 
+def get_task_owner():
+    """任务所属者，与后台任务相同（app.get_job_owner）：登录用户为用户名，未登录时为会话中的随机令牌
+
+    不按IP地址区分：NAT或反向代理后面的多个未登录用户共用一个IP。
+    """
+    from app import get_job_owner
+    return get_job_owner()
+
 def cancel_analysis():
-    """处理取消分析请求"""
+    """处理取消分析请求
+
+    请求中带task_id（或task_ids列表）时只取消这些任务，否则取消当前用户（未登录时为当前会话）的所有任务。
+    页面关闭时前端通过sendBeacon发送同样的请求，遗留的分析不会继续占用工作线程。
+    """
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         analysis_type = data.get('analysis_type')
-        operation = data.get('operation', 'analysis')  # 可能的值: 'analysis', 'file_preprocessing'
-        timestamp = data.get('timestamp')
+        operation = data.get('operation', 'analysis')  # 可能的值: 'analysis', 'file_preprocessing', 'page_closed'
+        if 'task_ids' in data:
+            task_ids = [str(task_id) for task_id in data.get('task_ids') or []]
+        elif data.get('task_id'):
+            task_ids = [str(data['task_id'])]
+        else:
+            task_ids = None
         
         # 记录取消请求
-        print(f"收到取消请求: 类型={analysis_type}, 操作={operation}, 时间戳={timestamp}")
-        
-        # 设置全局取消标志
-        global analysis_cancelled
-        analysis_cancelled = True
+        print(f"收到取消请求: 类型={analysis_type}, 操作={operation}, 任务={task_ids if task_ids is not None else '全部'}")
         
-        # 获取用户名或IP地址作为标识
-        username = session.get('username', '匿名用户')
-        client_ip = request.remote_addr
-        
-        # 针对特定用户的所有分析任务进行取消标记
-        cancel_count = 0
-        for task_id, task_info in list(ongoing_analyses.items()):
-            if task_info.get('username') == username or task_info.get('ip') == client_ip:
-                task_info['cancelled'] = True
-                cancel_count += 1
-                print(f"已将任务 {task_id} 标记为已取消（用户：{username}, IP: {client_ip}）")
+        # 只能取消自己（未登录时为当前会话）的任务
+        owner = get_task_owner()
+        reason = '页面已关闭，分析已取消' if operation == 'page_closed' else '分析已被用户取消'
+        if task_ids is None:
+            cancel_count = trend_tasks.cancel(owner=owner, reason=reason)
+        else:
+            cancel_count = sum(trend_tasks.cancel(task_id, owner=owner, reason=reason) for task_id in task_ids)
         
         if cancel_count > 0:
-            print(f"已取消 {cancel_count} 个正在进行的任务")
+            print(f"已取消 {cancel_count} 个正在进行的任务（用户：{session.get('username') or '匿名用户'}）")
         else:
-            print(f"未找到正在进行的任务，但已设置全局取消标志")
+            print("未找到正在进行的任务")
         
         # 返回成功响应
         return jsonify({
             'success': True,
             'message': '已成功取消请求',
             'cancelled': True,
+            'cancel_count': cancel_count,
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -94,366 +115,372 @@ def cancel_analysis():
             'message': f'取消请求时出错: {str(e)}'
         })
 
+def analysis_tasks():
+    """当前用户（未登录时为当前会话）正在进行的分析任务，包括所处阶段和已运行时间"""
+    return jsonify({'success': True, 'tasks': trend_tasks.tasks(owner=get_task_owner())})
+
+def run_sales_trend_analysis(trend_session, sheet_name, date_column, value_column, analysis_type, time_granularity,
+                             decimal_separator='.', group_column='', task=None):
+    """执行销售趋势分析（在trend_tasks的工作线程中运行）
+
+    各阶段通过task.set_stage记录，读取、聚合和异常检测的循环中调用task.check，
+    任务被取消后抛出TaskCancelled。列不存在或没有有效数据时抛出ValueError。
+    """
+    # 读取工作表并清洗日期列和值列（同一会话中只做一次）
+    task.set_stage('reading')
+    df, date_report, value_report = load_trend_frame(trend_session, sheet_name, date_column, value_column,
+                                                     decimal_separator, group_column, cancel_check=task.check)
+    
+    def build():
+        if group_column:
+            # 分组模式：一次聚合所有分组，趋势、同比/环比和异常评分在所有分组上向量化计算
+            task.set_stage('grouping')
+            return analyze_grouped_sales_trend(df, date_column, value_column, group_column,
+                                               analysis_type, time_granularity, cancel_check=task.check)
+
+        # 根据时间粒度聚合数据（每种粒度在会话中只聚合一次）
+        task.set_stage('aggregating')
+        aggregated = load_trend_aggregate(trend_session, sheet_name, date_column, value_column,
+                                          time_granularity, decimal_separator, cancel_check=task.check)
+        
+        # 根据分析类型进行相应分析
+        task.set_stage(analysis_type)
+        if analysis_type == 'trend':
+            result = analyze_trend(aggregated, date_column, value_column)
+        elif analysis_type == 'year_over_year':
+            result = analyze_year_over_year(aggregated, date_column, value_column, time_granularity)
+        else:
+            result = analyze_month_over_month(aggregated, date_column, value_column, time_granularity)
+        
+        # 检测异常点
+        task.set_stage('anomalies')
+        anomalies, anomaly_summary = detect_anomalies(aggregated, date_column, value_column,
+                                                      time_granularity=time_granularity, return_summary=True,
+                                                      cancel_check=task.check)
+        
+        # 合并结果
+        result['anomalies'] = anomalies
+        result['anomaly_summary'] = anomaly_summary
+        return result
+
+    # 同一会话中已完成的分析直接返回，相同参数的并发请求只计算一次
+    result_key = ('result', sheet_name, date_column, value_column, decimal_separator, group_column,
+                  analysis_type, time_granularity)
+    result = dict(trend_session.get(result_key, build, task.check))
+    result['date_parsing'] = date_report
+    result['value_parsing'] = value_report
+    return result
+
 def analyze_sales_trend():
-    """处理销售趋势分析请求"""
-    # 每次开始新的分析，重置取消标志
-    global analysis_cancelled
-    analysis_cancelled = False
-    
-    # 创建唯一的任务ID
-    task_id = str(uuid.uuid4())
-    
+    """处理销售趋势分析请求
+
+    分析在trend_tasks的工作线程中执行；请求中的task_id用于取消该任务（未提供时自动生成）。
+    """
     start_time = time.time() 
+    analysis_type = request.form.get('analysis_type', 'trend')  # 趋势、同比、环比
+    task = trend_tasks.create(request.form.get('task_id'), owner=get_task_owner(),
+                              label=f'sales_trend:{analysis_type}')
 
     try:
-        # 记录任务信息
-        username = session.get('username', '匿名用户')
-        client_ip = request.remote_addr
-        
-        ongoing_analyses[task_id] = {
-            'cancelled': False,
-            'start_time': datetime.now(),
-            'username': username,
-            'ip': client_ip,
-            'analysis_type': request.form.get('analysis_type', 'trend')
-        }
-        
-        # 检查是否有文件上传
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'message': '请上传销售数据文件'})
-        
-        file = request.files['file']
-        if not file or file.filename == '':
-            return jsonify({'success': False, 'message': '未选择文件'})
-        
         # 获取请求参数
         date_column = request.form.get('date_column', '')
         value_column = request.form.get('value_column', '')
-        analysis_type = request.form.get('analysis_type', 'trend')  # 趋势、同比、环比
         time_granularity = request.form.get('time_granularity', 'day')  # 天、周、月、季度、年
         sheet_name = request.form.get('sheet_name', 0)  # 默认使用第一个工作表
+        decimal_separator = request.form.get('decimal_separator', '.')  # 值列的小数分隔符，'.'或','
+        group_column = request.form.get('group_column', '')  # 可选的分组维度列（门店、SKU、地区等）
         
         if not date_column or not value_column:
             return jsonify({'success': False, 'message': '请选择日期列和值列'})
+        if group_column in (date_column, value_column):
+            return jsonify({'success': False, 'message': '分组列不能与日期列或值列相同'})
+        if analysis_type not in GROUP_RANKING_METRICS:
+            return jsonify({'success': False, 'message': f'不支持的分析类型: {analysis_type}'})
         
-        # 保存文件
-        temp_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 
-                              f"temp_{uuid.uuid4().hex[:8]}_{secure_filename(file.filename)}")
-        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-        file.save(temp_path)
+        # 获取文件：分析建议接口已上传过的文件只需传file_id，工作表和清洗后的列在会话中复用
+        trend_session, error = get_trend_session()
+        if error:
+            return error
+        sheet_name = resolve_trend_sheet(trend_session, sheet_name)
         
         try:
-            # 检查是否已取消 - 检查全局标志和特定任务标志
-            if is_analysis_cancelled(task_id):
-                return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-                
-            # 读取Excel文件，使用指定的工作表
-            df = pd.read_excel(temp_path, sheet_name=sheet_name)
-            
-            # 检查是否已取消
-            if is_analysis_cancelled(task_id):
-                return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-            
-            # 检查列是否存在
-            if date_column not in df.columns:
-                return jsonify({'success': False, 'message': f'日期列 {date_column} 不存在'})
-            if value_column not in df.columns:
-                return jsonify({'success': False, 'message': f'值列 {value_column} 不存在'})
-            
-            # 确保日期列是日期类型
-            try:
-                # 修改日期解析，增强对多种格式的支持
-                # 首先检查是否是数字形式的日期（如20250109）
-                sample_dates = df[date_column].head(10).astype(str)
-                has_numeric_dates = sample_dates.str.match(r'^\d{8}$').any()
-                has_chinese_dates = sample_dates.str.contains(r'年.*月.*日').any()
-                
-                # 预处理特殊格式
-                if has_numeric_dates or has_chinese_dates:
-                    # 创建日期转换函数
-                    def preprocess_date(date_str):
-                        if pd.isna(date_str):
-                            return date_str
-                            
-                        date_str = str(date_str)
-                        # 处理数字形式日期
-                        if re.match(r'^\d{8}$', date_str):
-                            return f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:8]}"
-                        
-                        # 处理中文日期格式
-                        match = re.match(r'(\d+)年(\d+)月(\d+)日', date_str)
-                        if match:
-                            year, month, day = match.groups()
-                            return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                            
-                        # 其他格式不变
-                        return date_str
-                
-                    # 应用预处理
-                    df[date_column] = df[date_column].astype(str).apply(preprocess_date)
-                    
-                    #if has_numeric_dates:
-                        #print("已处理数字形式的日期格式（如20250109）")
-                    #if has_chinese_dates:
-                        #print("已处理中文日期格式（如2025年01月09日）")
-                
-                # 检查是否已取消
-                if is_analysis_cancelled(task_id):
-                    return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-                
-                # 尝试转换为日期时间类型，提供多种格式支持
-                df[date_column] = pd.to_datetime(
-                    df[date_column], 
-                    errors='coerce',            # 无法解析的值设为NaT
-                    format=None,                # 自动推断格式
-                    dayfirst=False              # 默认月/日/年格式，根据数据实际情况可调整
-                )
-                
-                # 检查并处理解析后的NaT值
-                nat_count = df[date_column].isna().sum()
-                if nat_count > 0:
-                    print(f"警告: {nat_count}行日期值无法解析")
-                    
-                # 删除NaT值或填充（根据需要选择）
-                df = df.dropna(subset=[date_column])
-                
-                if len(df) == 0:
-                    return jsonify({'success': False, 'message': f'处理后没有有效的日期数据'})
-            except Exception as e:
-                return jsonify({'success': False, 'message': f'无法将 {date_column} 转换为日期格式: {str(e)}'})
-            
-            # 检查是否已取消
-            if is_analysis_cancelled(task_id):
-                return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-                
-            # 确保值列是数值类型
-            try:
-                # 先尝试直接转换为数值类型
-                try:
-                    df[value_column] = pd.to_numeric(df[value_column], errors='raise')
-                except:
-                    # 如果直接转换失败，尝试处理可能的文本格式数字
-                    print(f"将 {value_column} 列从文本格式转换为数值格式")
-                    
-                    # 创建转换函数，处理常见的非标准数值格式
-                    def convert_to_numeric(val):
-                        if pd.isna(val):
-                            return np.nan
-                        try:
-                            # 如果已经是数值类型，直接返回
-                            if isinstance(val, (int, float)):
-                                return val
-                                
-                            # 处理字符串类型
-                            val_str = str(val)
-                            
-                            # 移除货币符号、千分位分隔符等
-                            val_str = val_str.replace(',', '')  # 去掉千分位分隔符
-                            val_str = re.sub(r'[$¥€£]', '', val_str)  # 去掉货币符号
-                            val_str = val_str.strip()  # 去掉前后空格
-                            
-                            # 处理百分比
-                            if '%' in val_str:
-                                val_str = val_str.replace('%', '')
-                                return float(val_str) / 100
-                                
-                            # 转换为浮点数
-                            return float(val_str)
-                        except:
-                            return np.nan
-                    
-                    # 应用转换函数
-                    df[value_column] = df[value_column].apply(convert_to_numeric)
-                    
-                    # 再次检查转换结果
-                    non_na_count = df[value_column].notna().sum()
-                    if non_na_count == 0:
-                        return jsonify({'success': False, 'message': f'无法将 {value_column} 转换为数值格式，所有值均无效'})
-                    
-                    # 检查无效值比例
-                    na_ratio = 1 - non_na_count / len(df)
-                    if na_ratio > 0.5:  # 如果超过50%的值无效
-                        print(f"警告: {value_column} 列转换后有 {na_ratio:.2%} 的值为无效值")
-                
-                # 过滤掉无效的数值行
-                df = df.dropna(subset=[value_column])
-                if len(df) == 0:
-                    return jsonify({'success': False, 'message': f'处理后没有有效的数值数据'})
-                    
-            except Exception as e:
-                return jsonify({'success': False, 'message': f'无法将 {value_column} 转换为数值格式: {str(e)}'})
-            
-            # 检查是否已取消
-            if is_analysis_cancelled(task_id):
-                return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-            
-            # 对大数据集进行优化
-            df = optimize_large_dataframe(df, date_column, value_column)
-            
-            # 检查是否已取消
-            if is_analysis_cancelled(task_id):
-                return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-            
-            # 根据时间粒度聚合数据
-            df = aggregate_by_time(df, date_column, value_column, time_granularity)
-            
-            # 检查是否已取消
-            if is_analysis_cancelled(task_id):
-                return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-            
-            # 根据分析类型进行相应分析
-            if analysis_type == 'trend':
-                result = analyze_trend(df, date_column, value_column)
-            elif analysis_type == 'year_over_year':
-                result = analyze_year_over_year(df, date_column, value_column, time_granularity)
-            elif analysis_type == 'month_over_month':
-                result = analyze_month_over_month(df, date_column, value_column, time_granularity)
-            else:
-                return jsonify({'success': False, 'message': f'不支持的分析类型: {analysis_type}'})
-            
-            # 检查是否已取消
-            if is_analysis_cancelled(task_id):
-                return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-                
-            # 检测异常点
-            anomalies = detect_anomalies(df, date_column, value_column, time_granularity=time_granularity)
-            
-            # 合并结果
-            result['anomalies'] = anomalies
-            
-            # 检查是否已取消
-            if is_analysis_cancelled(task_id):
-                return jsonify({'success': False, 'message': '分析已被用户取消', 'cancelled': True})
-            
-            processing_time = time.time() - start_time 
-
-            # 记录分析行为
-            try:
-                from app import get_db, logger
-                # 记录分析操作
-                with get_db() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS sales_trend_records (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            username TEXT NOT NULL,
-                            file_name TEXT NOT NULL,
-                            analysis_type TEXT NOT NULL,
-                            time_granularity TEXT NOT NULL,
-                            processing_time REAL DEFAULT 0, 
-                            created_at DATETIME NOT NULL
-                        )
-                    ''')
-                    cursor.execute("PRAGMA table_info(sales_trend_records)")
-                    columns = [column[1] for column in cursor.fetchall()]
-                    has_processing_time = 'processing_time' in columns
-
-                    cursor.execute('''
-                        INSERT INTO sales_trend_records (
-                            username, file_name, analysis_type, time_granularity, processing_time, created_at
-                        ) VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        username, 
-                        file.filename,
-                        analysis_type,
-                        time_granularity,
-                        processing_time,
-                        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    ))
-                    conn.commit()
-                    logger.info(f'记录销售趋势分析 - 用户: {username}, 文件: {file.filename}')
-            except Exception as e:
-                print(f"记录分析操作时出错: {str(e)}")
-            
-            # 清理分析任务状态
-            if task_id in ongoing_analyses:
-                del ongoing_analyses[task_id]
-            
-            return jsonify({
-                'success': True,
-                'message': '分析完成',
-                'data': result
-            })
-            
+            result = trend_tasks.run(task, run_sales_trend_analysis, trend_session, sheet_name,
+                                     date_column, value_column, analysis_type, time_granularity,
+                                     decimal_separator, group_column)
+        except TaskCancelled as e:
+            print(f"分析任务 {task.task_id} 已取消（阶段: {task.stage}，已运行 {task.elapsed:.1f} 秒）")
+            return jsonify({'success': False, 'message': str(e), 'cancelled': True})
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e), 'file_id': trend_session.file_id})
         except Exception as e:
             return jsonify({'success': False, 'message': f'分析过程中出错: {str(e)}'})
-            
-        finally:
-            # 清理临时文件
-            if os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                except:
-                    pass
-            
-            # 清理分析任务状态
-            if task_id in ongoing_analyses:
-                del ongoing_analyses[task_id]
+        
+        processing_time = time.time() - start_time 
+        username = session.get('username') or '匿名用户'
+
+        # 记录分析行为
+        try:
+            from app import get_db, logger
+            # 记录分析操作
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS sales_trend_records (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT NOT NULL,
+                        file_name TEXT NOT NULL,
+                        analysis_type TEXT NOT NULL,
+                        time_granularity TEXT NOT NULL,
+                        processing_time REAL DEFAULT 0, 
+                        created_at DATETIME NOT NULL
+                    )
+                ''')
+                cursor.execute("PRAGMA table_info(sales_trend_records)")
+                columns = [column[1] for column in cursor.fetchall()]
+                has_processing_time = 'processing_time' in columns
+
+                cursor.execute('''
+                    INSERT INTO sales_trend_records (
+                        username, file_name, analysis_type, time_granularity, processing_time, created_at
+                    ) VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    username, 
+                    trend_session.filename,
+                    analysis_type,
+                    time_granularity,
+                    processing_time,
+                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                ))
+                conn.commit()
+                logger.info(f'记录销售趋势分析 - 用户: {username}, 文件: {trend_session.filename}')
+        except Exception as e:
+            print(f"记录分析操作时出错: {str(e)}")
+        
+        return jsonify({
+            'success': True,
+            'message': '分析完成',
+            'file_id': trend_session.file_id,
+            'data': result
+        })
     
     except Exception as e:
-        # 确保清理任务状态
-        if task_id in ongoing_analyses:
-            del ongoing_analyses[task_id]
         return jsonify({'success': False, 'message': f'处理请求时出错: {str(e)}'})
-
-def is_analysis_cancelled(task_id):
-    """检查分析任务是否已被取消"""
-    # 检查全局取消标志
-    if analysis_cancelled:
-        return True
-        
-    # 检查特定任务的取消标志
-    if task_id in ongoing_analyses and ongoing_analyses[task_id].get('cancelled', False):
-        return True
-        
-    return False
+    
+    finally:
+        # 清理分析任务状态
+        trend_tasks.finish(task)
 
 def secure_filename(filename):
     """安全化文件名"""
     # 简单实现，实际应用中可以使用werkzeug.utils.secure_filename
     return filename.replace(' ', '_').replace('/', '_')
 
-def aggregate_by_time(df, date_col, value_col, granularity):
-    """根据时间粒度聚合数据"""
+def get_trend_session():
+    """获取请求对应的分析会话：优先使用file_id引用已上传的文件，否则保存上传的文件
+
+    返回:
+    - (session, error): 出错时session为None，error为错误响应
+    """
+    file_id = request.form.get('file_id')
+    if file_id:
+        entry = trend_uploads.get(file_id)
+        if entry is None:
+            return None, jsonify({'success': False, 'message': '文件已过期，请重新上传', 'file_expired': True})
+    else:
+        if 'file' not in request.files:
+            return None, jsonify({'success': False, 'message': '请上传销售数据文件'})
+
+        file = request.files['file']
+        if not file or file.filename == '':
+            return None, jsonify({'success': False, 'message': '未选择文件'})
+        entry = trend_uploads.put(file)
+
+    return trend_sessions.get(entry['file_id'], entry['path'], entry.get('filename')), None
+
+def get_trend_sheet_names(trend_session):
+    """工作簿中的工作表名称（每个会话只读取一次），CSV文件没有工作表"""
+    if trend_session.path.lower().endswith('.csv'):
+        return []
+    return trend_session.get(('sheet_names',), lambda: pd.ExcelFile(trend_session.path).sheet_names)
+
+def resolve_trend_sheet(trend_session, sheet_name):
+    """工作表序号转换为工作表名称，使分析建议（使用名称）和分析（默认使用序号0）共享同一份缓存"""
+    if isinstance(sheet_name, int):
+        try:
+            return get_trend_sheet_names(trend_session)[sheet_name]
+        except Exception:
+            pass
+    return sheet_name
+
+def load_trend_dates(trend_session, sheet_name, date_column, cancel_check=None):
+    """读取并解析日期列（每个会话中同一工作表的同一列只解析一次）
+
+    cancel_check: 可选的取消检查回调，读取工作表期间定期调用
+
+    返回:
+    - (dates, date_report): dates为去掉无法解析的行之后的日期Series，索引对应工作表中的行；
+      流式读取的大文件（见stream_ingest）只返回每个有数据的日期
+    """
+    def build():
+        if is_streaming_file(trend_session.path):
+            if date_column not in read_columns(trend_session.path, sheet_name):
+                raise ValueError(f'日期列 {date_column} 不存在')
+            aggregate = stream_daily_aggregate(trend_session.path, date_column, sheet_name=sheet_name,
+                                               cancel_check=cancel_check)
+            if aggregate.date_report.get('failed'):
+                print(f"警告: {aggregate.date_report['failed']}行日期值无法解析")
+            return aggregate.to_frame()[date_column], aggregate.date_report
+
+        df = trend_session.read_sheet(sheet_name, cancel_check=cancel_check)
+        if date_column not in df.columns:
+            raise ValueError(f'日期列 {date_column} 不存在')
+        try:
+            # 在整列上识别日期格式并向量化转换（支持20250109、2025年01月09日、2025/1/9等格式）
+            dates, date_report = parse_dates(df[date_column])
+        except Exception as e:
+            raise ValueError(f'无法将 {date_column} 转换为日期格式: {str(e)}')
+
+        nat_count = dates.isna().sum()
+        if nat_count > 0:
+            print(f"警告: {nat_count}行日期值无法解析")
+        return dates.dropna(), date_report
+
+    return trend_session.get(('dates', sheet_name, date_column), build, cancel_check)
+
+def load_trend_frame(trend_session, sheet_name, date_column, value_column, decimal_separator='.', group_column='',
+                     cancel_check=None):
+    """读取并清洗分析所需的列（每个会话中相同的列组合只清洗一次）
+
+    返回:
+    - (df, date_report, value_report): df只包含日期列、值列和分组列，已去掉无效的日期和数值
+      调用方不能修改df。CSV和大型xlsx文件流式读取，df为按天（和分组）汇总后的数据
+
+    列不存在或清洗后没有有效数据时抛出ValueError
+    """
+    def build():
+        if is_streaming_file(trend_session.path):
+            return load_streamed_frame(trend_session, sheet_name, date_column, value_column,
+                                       decimal_separator, group_column, cancel_check)
+
+        dates, date_report = load_trend_dates(trend_session, sheet_name, date_column, cancel_check)
+        df = trend_session.read_sheet(sheet_name, cancel_check=cancel_check)
+        if value_column not in df.columns:
+            raise ValueError(f'值列 {value_column} 不存在')
+        if group_column and group_column not in df.columns:
+            raise ValueError(f'分组列 {group_column} 不存在')
+        if len(dates) == 0:
+            raise ValueError('处理后没有有效的日期数据')
+
+        columns = [value_column, group_column] if group_column else [value_column]
+        df = df.loc[dates.index, columns]
+        df.insert(0, date_column, dates)
+        if cancel_check is not None:
+            cancel_check()
+
+        try:
+            # 向量化转换，处理千分位、货币符号、百分比、全角数字及万/亿单位等文本格式数字
+            df[value_column], value_report = coerce_numeric(df[value_column], decimal=decimal_separator)
+        except Exception as e:
+            raise ValueError(f'无法将 {value_column} 转换为数值格式: {str(e)}')
+
+        if value_report['cleaned'] > 0 or value_report['failed'] > 0:
+            print(f"将 {value_column} 列从文本格式转换为数值格式: {value_report['cleaned']}个文本值已转换, "
+                  f"{value_report['failed']}个无法转换")
+
+            # 再次检查转换结果
+            non_na_count = df[value_column].notna().sum()
+            if non_na_count == 0:
+                raise ValueError(f'无法将 {value_column} 转换为数值格式，所有值均无效')
+
+            # 检查无效值比例
+            na_ratio = 1 - non_na_count / len(df)
+            if na_ratio > 0.5:  # 如果超过50%的值无效
+                print(f"警告: {value_column} 列转换后有 {na_ratio:.2%} 的值为无效值")
+
+        # 过滤掉无效的数值行
+        df = df.dropna(subset=[value_column])
+        if len(df) == 0:
+            raise ValueError('处理后没有有效的数值数据')
+        return df, date_report, value_report
+
+    return trend_session.get(('frame', sheet_name, date_column, value_column, decimal_separator, group_column), build,
+                             cancel_check)
+
+def load_streamed_frame(trend_session, sheet_name, date_column, value_column, decimal_separator='.', group_column='',
+                        cancel_check=None):
+    """流式读取CSV/大型xlsx文件，逐块折叠为按天（和分组）的汇总数据，内存占用与明细行数无关
+
+    返回值和异常与load_trend_frame一致
+    """
+    columns = read_columns(trend_session.path, sheet_name)
+    if date_column not in columns:
+        raise ValueError(f'日期列 {date_column} 不存在')
+    if value_column not in columns:
+        raise ValueError(f'值列 {value_column} 不存在')
+    if group_column and group_column not in columns:
+        raise ValueError(f'分组列 {group_column} 不存在')
+
+    aggregate = stream_daily_aggregate(trend_session.path, date_column, value_column, group_column,
+                                       sheet_name=sheet_name, decimal=decimal_separator, cancel_check=cancel_check)
+    date_report, value_report = aggregate.date_report, aggregate.value_report
+    if date_report.get('parsed', 0) == 0:
+        raise ValueError('处理后没有有效的日期数据')
+    if value_report.get('cleaned', 0) > 0 or value_report.get('failed', 0) > 0:
+        print(f"将 {value_column} 列从文本格式转换为数值格式: {value_report['cleaned']}个文本值已转换, "
+              f"{value_report['failed']}个无法转换")
+        if value_report.get('converted', 0) == 0:
+            raise ValueError(f'无法将 {value_column} 转换为数值格式，所有值均无效')
+
+    df = aggregate.to_frame()
+    if len(df) == 0:
+        raise ValueError('处理后没有有效的数值数据')
+    print(f"流式读取: {aggregate.rows}行明细汇总为{len(df)}行按天的数据")
+    return df, date_report, value_report
+
+def load_trend_aggregate(trend_session, sheet_name, date_column, value_column, time_granularity, decimal_separator='.',
+                         cancel_check=None):
+    """按时间粒度聚合后的数据（每个会话中每种粒度只聚合一次），返回副本，调用方可以修改"""
+    def build():
+        df, _, _ = load_trend_frame(trend_session, sheet_name, date_column, value_column, decimal_separator,
+                                    cancel_check=cancel_check)
+        # 对大数据集进行优化
+        df = optimize_large_dataframe(df.copy(), date_column, value_column)
+        if cancel_check is not None:
+            cancel_check()
+        return aggregate_by_time(df, date_column, value_column, time_granularity)
+
+    key = ('aggregate', sheet_name, date_column, value_column, decimal_separator, time_granularity)
+    return trend_session.get(key, build, cancel_check).copy()
+
+# 时间粒度对应的重采样频率
+TIME_GRANULARITY_FREQ = {
+    'day': 'D',
+    'week': 'W-MON',
+    'month': 'MS',
+    'quarter': 'QS',
+    'year': 'YS'
+}
+
+TIME_GRANULARITY_NAMES = {'day': '日', 'week': '周', 'month': '月', 'quarter': '季度', 'year': '年'}
+
+# 额外聚合支持的聚合函数
+EXTRA_AGGREGATIONS = ('count', 'mean', 'median', 'min', 'max', 'sum', 'nunique')
+
+def aggregate_by_time(df, date_col, value_col, granularity, extra_aggregations=None):
+    """根据时间粒度聚合数据
+    
+    在一次按时间区间的groupby中同时计算汇总值和is_original_data标记（区间内是否有原始数据），
+    不再逐行遍历日期。
+    
+    参数:
+    - extra_aggregations: 同一次聚合中额外计算的列，{输出列名: 聚合函数} 或 {输出列名: (列名, 聚合函数)}，
+      聚合函数为EXTRA_AGGREGATIONS之一，例如 {'order_count': 'count', 'avg_value': 'mean',
+      'customer_count': ('客户', 'nunique')}；只给出聚合函数时作用于值列
+    """
     # 确保日期列是日期类型
     if not pd.api.types.is_datetime64_any_dtype(df[date_col]):
         #print(f"转换日期列 {date_col} 为日期时间类型")
-        # 检查特殊日期格式
-        sample_dates = df[date_col].head(10).astype(str)
-        has_numeric_dates = sample_dates.str.match(r'^\d{8}$').any()
-        has_chinese_dates = sample_dates.str.contains(r'年.*月.*日').any()
-        
-        # 预处理特殊格式
-        if has_numeric_dates or has_chinese_dates:
-            # 创建日期转换函数
-            def preprocess_date(date_str):
-                if pd.isna(date_str):
-                    return date_str
-                    
-                date_str = str(date_str)
-                # 处理数字形式日期
-                if re.match(r'^\d{8}$', date_str):
-                    return f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:8]}"
-                
-                # 处理中文日期格式
-                match = re.match(r'(\d+)年(\d+)月(\d+)日', date_str)
-                if match:
-                    year, month, day = match.groups()
-                    return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                    
-                # 其他格式不变
-                return date_str
-                
-            # 应用预处理
-            df[date_col] = df[date_col].astype(str).apply(preprocess_date)
-            
-            if has_numeric_dates:
-                print("已处理数字形式的日期格式（如20250109）")
-            if has_chinese_dates:
-                print("已处理中文日期格式（如2025年01月09日）")
-        
-        # 转换为日期时间
-        df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
+        df[date_col], _ = parse_dates(df[date_col])
         
         # 删除无效日期
         invalid_dates = df[date_col].isna().sum()
@@ -461,107 +488,59 @@ def aggregate_by_time(df, date_col, value_col, granularity):
             print(f"警告: 删除 {invalid_dates} 行无效日期")
             df = df.dropna(subset=[date_col])
     
-    # 设置日期为索引
-    df_copy = df.copy()
+    # 未知的粒度按日粒度处理
+    freq = TIME_GRANULARITY_FREQ.get(granularity, 'D')
     
-    # 确保设置索引前日期列没有NaT
-    df_copy = df_copy.dropna(subset=[date_col])
+    # 组装命名聚合：汇总值、区间内原始数据行数，以及额外的聚合列
+    aggregations = {
+        value_col: (value_col, 'sum'),
+        '_original_rows': (value_col, 'size')
+    }
+    for name, spec in (extra_aggregations or {}).items():
+        column, func = spec if isinstance(spec, (tuple, list)) else (value_col, spec)
+        if func not in EXTRA_AGGREGATIONS:
+            raise ValueError(f"不支持的聚合函数: {func}")
+        if column not in df.columns:
+            raise ValueError(f"聚合列 {column} 不存在")
+        aggregations[name] = (column, func)
     
-    # 设置日期列为索引，用于时间序列分析
-    df_copy.set_index(date_col, inplace=True)
+    # 按时间区间分组（与resample的区间划分一致，没有数据的区间也会保留）
+    df_agg = df.dropna(subset=[date_col]).groupby(pd.Grouper(key=date_col, freq=freq)).agg(**aggregations)
+    df_agg = df_agg.reset_index()
     
-    # 根据不同的时间粒度重采样
-    if granularity == 'day':
-        df_agg = df_copy.resample('D').sum()
-        
-        # 日粒度使用精确日期匹配标记原始数据点
-        original_dates = set(pd.to_datetime(df[date_col]).dt.strftime('%Y-%m-%d'))
-        df_agg = df_agg.reset_index()
-        df_agg['is_original_data'] = df_agg[date_col].dt.strftime('%Y-%m-%d').isin(original_dates)
-        
-    elif granularity == 'week':
-        df_agg = df_copy.resample('W-MON').sum()
-        
-        # 周粒度：只要该周内有任何原始数据，就将整周标记为原始数据
-        df_agg = df_agg.reset_index()
-        
-        # 获取每个原始数据点所在的周
-        original_weeks = set()
-        for date in pd.to_datetime(df[date_col]):
-            # 获取日期所在周的周一
-            week_start = date - pd.Timedelta(days=date.dayofweek)
-            week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
-            original_weeks.add(week_start)
-            
-        # 标记含有原始数据的周
-        df_agg['is_original_data'] = df_agg[date_col].isin(original_weeks)
-        print(f"周粒度: 检测到{len(original_weeks)}个含有原始数据的周，总周数为{len(df_agg)}")
-        
-    elif granularity == 'month':
-        df_agg = df_copy.resample('MS').sum()
-        
-        # 月粒度：只要该月内有任何原始数据，就将整月标记为原始数据
-        df_agg = df_agg.reset_index()
-        
-        # 获取每个原始数据点所在的月
-        original_months = set()
-        for date in pd.to_datetime(df[date_col]):
-            # 获取日期所在月的第一天
-            month_start = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            original_months.add(month_start)
-            
-        # 标记含有原始数据的月
-        df_agg['is_original_data'] = df_agg[date_col].isin(original_months)
-        print(f"月粒度: 检测到{len(original_months)}个含有原始数据的月，总月数为{len(df_agg)}")
-        
-    elif granularity == 'quarter':
-        df_agg = df_copy.resample('QS').sum()
-        
-        # 季度粒度：只要该季度内有任何原始数据，就将整季度标记为原始数据
-        df_agg = df_agg.reset_index()
-        
-        # 获取每个原始数据点所在的季度
-        original_quarters = set()
-        for date in pd.to_datetime(df[date_col]):
-            # 计算季度开始月份 (1, 4, 7, 10)
-            quarter_month = (date.month - 1) // 3 * 3 + 1
-            # 获取季度的第一天
-            quarter_start = date.replace(month=quarter_month, day=1, hour=0, minute=0, second=0, microsecond=0)
-            original_quarters.add(quarter_start)
-            
-        # 标记含有原始数据的季度
-        df_agg['is_original_data'] = df_agg[date_col].isin(original_quarters)
-        print(f"季度粒度: 检测到{len(original_quarters)}个含有原始数据的季度，总季度数为{len(df_agg)}")
-        
-    elif granularity == 'year':
-        df_agg = df_copy.resample('YS').sum()
-        
-        # 年粒度：只要该年内有任何原始数据，就将整年标记为原始数据
-        df_agg = df_agg.reset_index()
-        
-        # 获取每个原始数据点所在的年
-        original_years = set()
-        for date in pd.to_datetime(df[date_col]):
-            # 获取年份的第一天
-            year_start = date.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            original_years.add(year_start)
-            
-        # 标记含有原始数据的年
-        df_agg['is_original_data'] = df_agg[date_col].isin(original_years)
-        print(f"年粒度: 检测到{len(original_years)}个含有原始数据的年，总年数为{len(df_agg)}")
-        
-    else:
-        df_agg = df_copy.resample('D').sum()
-        df_agg = df_agg.reset_index()
-        # 默认情况下使用日粒度的匹配策略
-        original_dates = set(pd.to_datetime(df[date_col]).dt.strftime('%Y-%m-%d'))
-        df_agg['is_original_data'] = df_agg[date_col].dt.strftime('%Y-%m-%d').isin(original_dates)
+    # 只要区间内有任何原始数据，就将整个区间标记为原始数据
+    df_agg['is_original_data'] = df_agg.pop('_original_rows') > 0
+    
+    if granularity in TIME_GRANULARITY_NAMES and granularity != 'day':
+        unit = TIME_GRANULARITY_NAMES[granularity]
+        print(f"{unit}粒度: 检测到{int(df_agg['is_original_data'].sum())}个含有原始数据的{unit}，总{unit}数为{len(df_agg)}")
     
     # 绘图需要连续的数据点，仍然填充NaN值，但后续分析时会区分原始数据
     df_agg[value_col] = df_agg[value_col].fillna(0)
     
     return df_agg
 
+def trend_chart_xaxis(dates, granularity_type):
+    """根据时间粒度返回趋势图X轴的刻度格式"""
+    if granularity_type == "年":
+        return {'tickformat': '%Y年'}
+    if granularity_type == "季度":
+        # 季度需要自定义刻度
+        return {'tickmode': 'array', 'tickvals': encode_dates(dates),
+                'ticktext': (dates.dt.strftime('%Y年') + 'Q' + dates.dt.quarter.astype(str)).tolist()}
+    if granularity_type == "月":
+        return {'tickformat': '%Y年%m月'}
+    if granularity_type == "周":
+        # 周显示月/日
+        return {'tickformat': '%m/%d'}
+    # 日粒度根据数据范围动态调整格式
+    date_range_days = (dates.max() - dates.min()).days
+    if date_range_days > 365:
+        return {'tickformat': '%Y年%m月'}
+    if date_range_days > 60:
+        return {'tickformat': '%m月%d日'}
+    return {'tickformat': '%m/%d'}
+
 def analyze_trend(df, date_col, value_col):
     """分析销售趋势"""
     # 检查数据量级
@@ -638,94 +617,41 @@ def analyze_trend(df, date_col, value_col):
         df['quarter'] = df[date_col].dt.quarter
         # 构建季度显示文本
         df['date_display'] = df[date_col].dt.strftime('%Y年') + 'Q' + df['quarter'].astype(str) + '季度'
+        hover_template = f'日期: %{{customdata}}<br>{value_col}: %{{y}}<extra></extra>'
+    else:
+        hover_template = f'日期: %{{x|{hover_date_format}}}<br>{value_col}: %{{y}}<extra></extra>'
+    
+    def customdata_of(frame):
+        return frame['date_display'] if granularity_type == "季度" else None
+    
+    # 图表只传输trace数组和共享布局，超长序列用LTTB降采样到CHART_POINT_BUDGET个点以内
+    df_line = df.iloc[lttb_indices(df[date_col], df[value_col])]
     
     # 创建时间序列趋势图 - 根据是否有标记创建不同的图表
     if 'is_original_data' in df.columns:
-        # 创建两个数据集 - 一个用于连续线条(所有点)，一个用于标记实际数据点
-        df_line = df.copy()
-        df_markers = df[df['is_original_data'] == True].copy()
-        
-        # 创建基础连续线条图(不带悬停信息)
-        fig = px.line(df_line, x=date_col, y=value_col, title=f'{value_col}随时间的变化趋势')
-        fig.update_traces(line=dict(color=CHART_COLORS['primary'], width=2))
-        
-        # 根据时间粒度设置合适的悬停模板
-        if granularity_type == "季度":
-            hover_template = f'日期: %{{customdata}}<br>{value_col}: %{{y}}<extra></extra>'
-            hover_data = df_markers['date_display'].tolist()
-        else:
-            hover_template = f'日期: %{{x|{hover_date_format}}}<br>{value_col}: %{{y}}<extra></extra>'
-            hover_data = None
-        
-        # 添加只有原始数据点的散点，启用悬停信息
-        scatter_trace = go.Scatter(
-            x=df_markers[date_col],
-            y=df_markers[value_col],
-            mode='markers',
-            name='实际数据点',
-            hovertemplate=hover_template,
-            marker=dict(size=8, opacity=0.7, color=CHART_COLORS['secondary'])
-        )
-        
-        # 如果是季度格式，添加自定义数据
-        if granularity_type == "季度":
-            scatter_trace.customdata = hover_data
-            
-        fig.add_trace(scatter_trace)
-        
-        # 修改原始线条的悬停设置，隐藏悬停信息
-        fig.data[0].hoverinfo = 'skip'
-        fig.data[0].name = '趋势线'
+        # 连续线条(所有点，不带悬停信息) + 只有原始数据点的散点(启用悬停信息)
+        df_markers = df[df['is_original_data'] == True]
+        df_markers = df_markers.iloc[lttb_indices(df_markers[date_col], df_markers[value_col])]
+        traces = [
+            line_trace(df_line[date_col], df_line[value_col], name='趋势线',
+                       color=CHART_COLORS['primary'], hoverinfo='skip'),
+            marker_trace(df_markers[date_col], df_markers[value_col], name='实际数据点',
+                         color=CHART_COLORS['secondary'], hovertemplate=hover_template,
+                         customdata=customdata_of(df_markers))
+        ]
     else:
         # 如果没有标记，使用标准图表
-        if granularity_type == "季度":
-            fig = px.line(df, x=date_col, y=value_col, 
-                        title=f'{value_col}随时间的变化趋势', 
-                        custom_data=['date_display'])
-            fig.update_traces(hovertemplate=f'日期: %{{customdata}}<br>{value_col}: %{{y}}<extra></extra>',
-                             line=dict(color=CHART_COLORS['primary'], width=2))
-        else:
-            fig = px.line(df, x=date_col, y=value_col, 
-                        title=f'{value_col}随时间的变化趋势')
-            fig.update_traces(hovertemplate=f'日期: %{{x|{hover_date_format}}}<br>{value_col}: %{{y}}<extra></extra>',
-                             line=dict(color=CHART_COLORS['primary'], width=2))
-    
-    fig.update_layout(
-        xaxis_title='日期',
-        yaxis_title=value_col,
-        template='plotly_white',
-        hovermode='closest'
-    )
-    
-    # 格式化X轴刻度显示
-    if granularity_type == "年":
-        fig.update_xaxes(tickformat='%Y年')
-    elif granularity_type == "季度":
-        # 季度需要自定义刻度
-        unique_dates = df[date_col].dt.strftime('%Y年') + 'Q' + df[date_col].dt.quarter.astype(str)
-        fig.update_xaxes(tickmode='array', tickvals=df[date_col], ticktext=unique_dates)
-    elif granularity_type == "月":
-        fig.update_xaxes(tickformat='%Y年%m月')
-    elif granularity_type == "周":
-        # 周显示月/日
-        fig.update_xaxes(tickformat='%m/%d')
-    else:  # 日
-        # 根据数据范围动态调整格式
-        date_range_days = (df[date_col].max() - df[date_col].min()).days
-        if date_range_days > 365:
-            fig.update_xaxes(tickformat='%Y年%m月')
-        elif date_range_days > 60:
-            fig.update_xaxes(tickformat='%m月%d日')
-        else:
-            fig.update_xaxes(tickformat='%m/%d')
-    
-    # 如果数据点太多，优化图表显示
+        traces = [
+            line_trace(df_line[date_col], df_line[value_col], name=value_col, color=CHART_COLORS['primary'],
+                       hovertemplate=hover_template, customdata=customdata_of(df_line))
+        ]
+    
+    xaxis = trend_chart_xaxis(df_line[date_col], granularity_type)
+    xaxis['title'] = {'text': '日期'}
+    # 如果数据点太多，限制显示的刻度数量
     if row_count > 1000:
-        # 限制显示的刻度数量
-        fig.update_xaxes(nticks=20)
-        # 增加标记点的间隔
-        if 'is_original_data' not in df.columns:
-            fig.update_traces(marker=dict(size=3))
+        xaxis['nticks'] = 20
+    chart = chart_json(traces, title=f'{value_col}随时间的变化趋势', xaxis=xaxis, yaxis={'title': {'text': value_col}})
     
     # 统计数据计算策略
     # 非日粒度下，将使用所有数据点计算总值，避免数据丢失
@@ -866,73 +792,37 @@ def analyze_trend(df, date_col, value_col):
     decomposition_result = None
     if len(df) > 6:  # 需要足够的数据点才能进行分解
         try:
-            # 设置适当的频率
-            if len(df) > 12:
-                period = 12  # 假设年度数据，周期为12个月
-            else:
-                period = len(df) // 2
-            
-            # 时间序列分解
-            decomposition = simple_decompose(df[value_col], period)
-            
-            # 创建分解趋势图 - 也需要根据时间粒度调整悬停格式
-            if granularity_type == "季度" and 'date_display' in df.columns:
-                trend_fig = px.line(x=df[date_col], y=decomposition.trend, title='趋势分量', custom_data=df['date_display'])
-                trend_fig.update_traces(hovertemplate='日期: %{customdata}<br>值: %{y}<extra></extra>',
-                                        line=dict(color=CHART_COLORS['primary'], width=2))
-                
-                seasonal_fig = px.line(x=df[date_col], y=decomposition.seasonal, title='季节性分量', custom_data=df['date_display'])
-                seasonal_fig.update_traces(hovertemplate='日期: %{customdata}<br>值: %{y}<extra></extra>',
-                                        line=dict(color=CHART_COLORS['secondary'], width=2))
-                
-                residual_fig = px.line(x=df[date_col], y=decomposition.resid, title='残差分量', custom_data=df['date_display'])
-                residual_fig.update_traces(hovertemplate='日期: %{customdata}<br>值: %{y}<extra></extra>',
-                                        line=dict(color='#f39c12', width=2))
-            else:
-                trend_fig = px.line(x=df[date_col], y=decomposition.trend, title='趋势分量')
-                trend_fig.update_traces(hovertemplate=f'日期: %{{x|{hover_date_format}}}<br>值: %{{y}}<extra></extra>',
-                                        line=dict(color=CHART_COLORS['primary'], width=2))
-                
-                seasonal_fig = px.line(x=df[date_col], y=decomposition.seasonal, title='季节性分量')
-                seasonal_fig.update_traces(hovertemplate=f'日期: %{{x|{hover_date_format}}}<br>值: %{{y}}<extra></extra>',
-                                        line=dict(color=CHART_COLORS['secondary'], width=2))
-                
-                residual_fig = px.line(x=df[date_col], y=decomposition.resid, title='残差分量')
-                residual_fig.update_traces(hovertemplate=f'日期: %{{x|{hover_date_format}}}<br>值: %{{y}}<extra></extra>',
-                                        line=dict(color='#f39c12', width=2))
-            
-            # 同样为分解图设置适当的X轴格式
-            for fig_obj in [trend_fig, seasonal_fig, residual_fig]:
-                if granularity_type == "年":
-                    fig_obj.update_xaxes(tickformat='%Y年')
-                elif granularity_type == "季度":
-                    # 季度需要自定义刻度
-                    fig_obj.update_xaxes(tickmode='array', tickvals=df[date_col], 
-                                      ticktext=df[date_col].dt.strftime('%Y年') + 'Q' + df[date_col].dt.quarter.astype(str))
-                elif granularity_type == "月":
-                    fig_obj.update_xaxes(tickformat='%Y年%m月')
-                elif granularity_type == "周":
-                    fig_obj.update_xaxes(tickformat='%m/%d')
+            # 时间序列分解，按检测到的时间粒度自动识别季节周期（如日数据的7天周期）
+            granularity = {'日': 'day', '周': 'week', '月': 'month', '季度': 'quarter', '年': 'year'}.get(granularity_type, 'day')
+            decomposition = simple_decompose(df[value_col], time_granularity=granularity)
+            
+            # 各分量分别降采样，只传输trace数组 - 悬停格式根据时间粒度调整
+            def component_chart(component, title, color):
+                component = np.asarray(component, dtype=float)
+                positions = lttb_indices(df[date_col], component)
+                dates = df[date_col].iloc[positions]
+                if granularity_type == "季度" and 'date_display' in df.columns:
+                    trace = line_trace(dates, component[positions], color=color,
+                                       hovertemplate='日期: %{customdata}<br>值: %{y}<extra></extra>',
+                                       customdata=df['date_display'].iloc[positions])
                 else:
-                    date_range_days = (df[date_col].max() - df[date_col].min()).days
-                    if date_range_days > 365:
-                        fig_obj.update_xaxes(tickformat='%Y年%m月')
-                    elif date_range_days > 60:
-                        fig_obj.update_xaxes(tickformat='%m月%d日')
-                    else:
-                        fig_obj.update_xaxes(tickformat='%m/%d')
+                    trace = line_trace(dates, component[positions], color=color,
+                                       hovertemplate=f'日期: %{{x|{hover_date_format}}}<br>值: %{{y}}<extra></extra>')
+                # 同样为分解图设置适当的X轴格式
+                return chart_json([trace], title=title, xaxis=trend_chart_xaxis(dates, granularity_type))
             
             decomposition_result = {
-                'trend_chart': trend_fig.to_json(),
-                'seasonal_chart': seasonal_fig.to_json(),
-                'residual_chart': residual_fig.to_json()
+                'trend_chart': component_chart(decomposition.trend, '趋势分量', CHART_COLORS['primary']),
+                'seasonal_chart': component_chart(decomposition.seasonal, '季节性分量', CHART_COLORS['secondary']),
+                'residual_chart': component_chart(decomposition.resid, '残差分量', '#f39c12'),
+                'period': int(decomposition.period)
             }
         except Exception as e:
             print(f"时间序列分解失败: {str(e)}")
             decomposition_result = None
     
     return {
-        'chart': fig.to_json(),
+        'chart': chart,
         'stats': {
             'total': float(total),
             'average': float(avg),
@@ -949,37 +839,157 @@ def analyze_trend(df, date_col, value_col):
         'decomposition': decomposition_result
     }
 
-def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
-    """分析同比增长"""
-    # 确保日期列是datetime类型
-    df[date_col] = pd.to_datetime(df[date_col])
-    
-    # 添加年份列
-    df['year'] = df[date_col].dt.year
-    
-    # 根据时间粒度添加适当的时间列
+# 每年包含的周期数（滚动12期、年复合增长率按此换算为一年）
+PERIODS_PER_YEAR = {'day': 365, 'week': 52, 'month': 12, 'quarter': 4, 'year': 1}
+
+# 同比分析中一年内的周期位置名称
+PERIOD_SLOT_LABELS = {'day': '日期', 'week': '周数', 'month': '月份', 'quarter': '季度', 'year': '年份'}
+
+def safe_divide(numerator, denominator):
+    """逐元素相除，分母为0或缺失时结果为NaN（不产生除零警告）"""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    valid = np.isfinite(denominator) & (denominator != 0)
+    return np.divide(numerator, denominator, out=np.full(np.broadcast(numerator, denominator).shape, np.nan),
+                     where=valid)
+
+def period_slots(dates, time_granularity):
+    """每个日期在一年内的周期位置：日粒度为一年中的第几天，周粒度为ISO周数，月/季度粒度为月份/季度，年粒度为1"""
+    dates = pd.DatetimeIndex(dates)
     if time_granularity == 'day':
-        df['day_of_year'] = df[date_col].dt.dayofyear
-        time_col = 'day_of_year'
-        time_label = '日期'
-    elif time_granularity == 'week':
-        df['week'] = df[date_col].dt.isocalendar().week
-        time_col = 'week'
-        time_label = '周数'
-    elif time_granularity == 'month':
-        df['month'] = df[date_col].dt.month
-        time_col = 'month'
-        time_label = '月份'
-    elif time_granularity == 'quarter':
-        df['quarter'] = df[date_col].dt.quarter
-        time_col = 'quarter'
-        time_label = '季度'
-    else:  # 'year'
-        time_col = 'year'
-        time_label = '年份'
-    
-    # 创建一个空的结果表来存储同比数据
-    years = df['year'].unique()
+        return np.asarray(dates.dayofyear)
+    if time_granularity == 'week':
+        return np.asarray(dates.isocalendar().week, dtype=int)
+    if time_granularity == 'month':
+        return np.asarray(dates.month)
+    if time_granularity == 'quarter':
+        return np.asarray(dates.quarter)
+    return np.ones(len(dates), dtype=int)
+
+def compute_period_growth(df, date_col, value_col, time_granularity='month'):
+    """同比、环比、滚动12期和年复合增长率的统一计算
+
+    输入为aggregate_by_time聚合后的数据（每行一个周期，没有数据的周期值为0）。不修改df。
+    先把各周期按（一年内的周期位置 × 年份）一次性放入矩阵，之后的增长率都是数组运算：
+    - 同比：矩阵中同一周期位置相邻两年的变化率（两年不连续时为NaN）
+    - 环比：与上一个有原始数据的周期相比的变化率
+    - 滚动12期：最近一年（PERIODS_PER_YEAR个周期）的合计，以及与一年前同一窗口相比的变化率
+    - 年复合增长率：第一个和最后一个完整滚动年度合计之间的年均增长率
+    分母为0或缺失时增长率为NaN。
+
+    返回:
+    - dict: 各周期的 dates、values、observed、yoy、mom、rolling、rolling_yoy（numpy数组），
+      年份和周期位置 years、slots，矩阵 matrix、observed_matrix、yoy_matrix，
+      每个周期的矩阵位置 slot_pos、year_pos，以及 yearly_totals、cagr、periods_per_year
+    """
+    order = np.argsort(pd.to_datetime(df[date_col]).to_numpy(), kind='stable')
+    dates = pd.DatetimeIndex(pd.to_datetime(df[date_col]).to_numpy()[order])
+    values = df[value_col].to_numpy(dtype=float)[order]
+    values = np.where(np.isfinite(values), values, 0.0)
+    if 'is_original_data' in df.columns:
+        observed = df['is_original_data'].to_numpy(dtype=bool)[order]
+        if not observed.any():
+            # 没有原始数据标记时使用所有数据
+            observed = np.ones(len(values), dtype=bool)
+    else:
+        observed = np.ones(len(values), dtype=bool)
+
+    # 周期位置 × 年份矩阵（同一位置、同一年份的周期合计）
+    years, year_pos = np.unique(np.asarray(dates.year), return_inverse=True)
+    slots, slot_pos = np.unique(period_slots(dates, time_granularity), return_inverse=True)
+    matrix = np.zeros((len(slots), len(years)))
+    np.add.at(matrix, (slot_pos, year_pos), values)
+    observed_matrix = np.zeros((len(slots), len(years)), dtype=bool)
+    observed_matrix[slot_pos[observed], year_pos[observed]] = True
+
+    # 同比：只比较相邻的两个自然年
+    yoy_matrix = np.full(matrix.shape, np.nan)
+    if len(years) > 1:
+        yoy_matrix[:, 1:] = safe_divide(matrix[:, 1:] - matrix[:, :-1], matrix[:, :-1]) * 100
+        yoy_matrix[:, 1:][:, np.diff(years) != 1] = np.nan
+    yoy = yoy_matrix[slot_pos, year_pos]
+
+    # 环比：在有原始数据的周期之间比较
+    mom = np.full(len(values), np.nan)
+    observed_idx = np.flatnonzero(observed)
+    observed_values = values[observed_idx]
+    mom[observed_idx[1:]] = safe_divide(observed_values[1:] - observed_values[:-1], observed_values[:-1]) * 100
+
+    # 滚动12期合计及其同比
+    periods_per_year = PERIODS_PER_YEAR.get(time_granularity, PERIODS_PER_YEAR['day'])
+    rolling = np.full(len(values), np.nan)
+    rolling_yoy = np.full(len(values), np.nan)
+    cagr = None
+    if len(values) >= periods_per_year:
+        cumsum = np.concatenate(([0.0], np.cumsum(values)))
+        rolling[periods_per_year - 1:] = cumsum[periods_per_year:] - cumsum[:-periods_per_year]
+        rolling_yoy[periods_per_year:] = safe_divide(rolling[periods_per_year:] - rolling[:-periods_per_year],
+                                                     rolling[:-periods_per_year]) * 100
+
+        # 年复合增长率：至少跨越一整年
+        span_years = (len(values) - periods_per_year) / periods_per_year
+        first, last = rolling[periods_per_year - 1], rolling[-1]
+        if span_years >= 1 and first > 0 and last >= 0:
+            cagr = float(((last / first) ** (1 / span_years) - 1) * 100)
+
+    return {
+        'dates': dates,
+        'values': values,
+        'observed': observed,
+        'years': years,
+        'slots': slots,
+        'slot_pos': slot_pos,
+        'year_pos': year_pos,
+        'matrix': matrix,
+        'observed_matrix': observed_matrix,
+        'yoy_matrix': yoy_matrix,
+        'yoy': yoy,
+        'mom': mom,
+        'rolling': rolling,
+        'rolling_yoy': rolling_yoy,
+        'yearly_totals': matrix.sum(axis=0),
+        'cagr': cagr,
+        'periods_per_year': periods_per_year
+    }
+
+def _finite_list(values, decimals=None):
+    """数组转为列表，NaN和无穷大转为None（JSON中为null），指定decimals时四舍五入"""
+    values = np.asarray(values, dtype=float)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    return [float(v) if np.isfinite(v) else None for v in values]
+
+def growth_metrics_payload(growth, time_granularity):
+    """同比、环比、滚动12期和年复合增长率放在同一个结果中，前端切换视图时无需再次请求"""
+    return {
+        'granularity': time_granularity,
+        'periods_per_year': growth['periods_per_year'],
+        'dates': encode_dates(growth['dates']),
+        'values': _finite_list(growth['values'], 4),
+        'observed': growth['observed'].tolist(),
+        'yoy': _finite_list(growth['yoy'], 4),
+        'mom': _finite_list(growth['mom'], 4),
+        'rolling': _finite_list(growth['rolling'], 4),
+        'rolling_yoy': _finite_list(growth['rolling_yoy'], 4),
+        'cagr': growth['cagr']
+    }
+
+def _split_by_sign(labels, values):
+    """按增长率的正负把数据点分成增长、下降、持平三组，缺失值不显示"""
+    labels = np.asarray(labels, dtype=object)
+    values = np.asarray(values, dtype=float)
+    return [(labels[mask].tolist(), values[mask].tolist())
+            for mask in (values > 0, values < 0, values == 0)]
+
+def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
+    """分析同比增长
+
+    同比、环比、滚动12期和年复合增长率由compute_period_growth一次计算，不修改传入的df。
+    返回结果中的growth_metrics包含全部增长指标，前端可以直接切换查看。
+    """
+    growth = compute_period_growth(df, date_col, value_col, time_granularity)
+    years = growth['years']
+    time_label = PERIOD_SLOT_LABELS.get(time_granularity, '年份')
     
     # 只有当时间粒度为"年"时才严格要求至少两年数据
     if time_granularity == 'year' and len(years) < 2:
@@ -989,117 +999,39 @@ def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
     if len(years) < 2:
         print(f"警告: 同比分析数据仅包含{len(years)}年，分析结果可能不完整")
     
-    # 推断当前时间粒度
-    # 根据平均日期差异判断粒度（用于日志和背景信息）
-    if len(df) >= 2:
-        date_diffs = []
-        for i in range(1, min(len(df), 10)):
-            diff = (df[date_col].iloc[i] - df[date_col].iloc[i-1]).days
-            if diff > 0:
-                date_diffs.append(diff)
-        
-        if date_diffs:
-            avg_diff = sum(date_diffs) / len(date_diffs)
-            if avg_diff >= 90:
-                is_daily_granularity = False
-                if avg_diff >= 300:
-                    granularity_type = "年"
-                    hover_date_format = '%Y年'
-                else:
-                    granularity_type = "季度"
-                    hover_date_format = '%Y年Q%q季度'
-            elif avg_diff >= 28:
-                is_daily_granularity = False
-                granularity_type = "月"
-                hover_date_format = '%Y年%m月'
-            elif avg_diff >= 7:
-                is_daily_granularity = False
-                granularity_type = "周"
-                hover_date_format = '%Y年%m月%d日 (第%U周)'
-            else:
-                is_daily_granularity = True
-                granularity_type = "日"
-                hover_date_format = '%Y年%m月%d日'
-        else:
-            is_daily_granularity = True
-            granularity_type = "默认(日)"
-            hover_date_format = '%Y年%m月%d日'
-    else:
-        is_daily_granularity = True
-        granularity_type = "默认(日)"
-        hover_date_format = '%Y年%m月%d日'
-    
-    # 根据时间粒度进行分组
-    if time_granularity == 'year':
-        # 按年分组，此时不需要额外的时间列
-        if 'is_original_data' in df.columns:
-            original_df = df[df['is_original_data'] == True].copy()
-            if len(original_df) > 0:
-                grouped = original_df.groupby(['year'])[value_col].sum().reset_index()
-            else:
-                grouped = df.groupby(['year'])[value_col].sum().reset_index()
-        else:
-            grouped = df.groupby(['year'])[value_col].sum().reset_index()
-        
-        # 重塑数据对于年粒度无需透视
-        pivot_df = grouped.set_index('year')[value_col]
-        
-        # 无需时间名称映射
-        time_names = None
-    else:
-        # 按年和选定的时间粒度分组
-        if 'is_original_data' in df.columns and is_daily_granularity:
-            original_df = df[df['is_original_data'] == True].copy()
-            if len(original_df) > 0:
-                grouped = original_df.groupby(['year', time_col])[value_col].sum().reset_index()
-            else:
-                grouped = df.groupby(['year', time_col])[value_col].sum().reset_index()
-        else:
-            grouped = df.groupby(['year', time_col])[value_col].sum().reset_index()
-        
-        # 重塑数据以便于比较
-        pivot_df = grouped.pivot(index=time_col, columns='year', values=value_col).fillna(0)
-        
-        # 创建时间名称映射，确保键为Python原生类型
-        if time_granularity == 'month':
-            time_names = {
-                int(1): "1月", int(2): "2月", int(3): "3月", int(4): "4月", 
-                int(5): "5月", int(6): "6月", int(7): "7月", int(8): "8月", 
-                int(9): "9月", int(10): "10月", int(11): "11月", int(12): "12月"
-            }
-        elif time_granularity == 'quarter':
-            time_names = {int(1): "Q1", int(2): "Q2", int(3): "Q3", int(4): "Q4"}
-        elif time_granularity == 'week':
-            # 创建周数映射（1-53周）
-            time_names = {int(i): f"{i}周" for i in range(1, 54)}
-        elif time_granularity == 'day':
-            # 对于天粒度，使用每年的第几天，只需显示数字
-            time_names = {int(i): f"{i}天" for i in range(1, 367)}
-        else:
-            # 默认情况，确保所有键都是Python原生类型
-            time_names = {int(i) if isinstance(i, (np.integer, int)) else str(i): str(i) for i in pivot_df.index.tolist()}
-    
-    # 计算同比增长率
+    yoy_matrix = growth['yoy_matrix']
     yoy_changes = {}
     
     if time_granularity == 'year':
-        # 年粒度下的增长率计算
+        # 按年汇总，无需透视
+        pivot_df = pd.Series(growth['matrix'][0], index=years)
         for i in range(1, len(years)):
-            year = int(years[i])  # 确保是Python原生int类型
-            prev_year = int(years[i-1])
-            year_value = float(pivot_df.get(year, 0))
-            prev_year_value = float(pivot_df.get(prev_year, 0))
-            if prev_year_value != 0:
-                yoy_change = (year_value - prev_year_value) / prev_year_value * 100
-                yoy_changes[year] = yoy_change
+            if np.isfinite(yoy_matrix[0, i]):
+                yoy_changes[int(years[i])] = float(yoy_matrix[0, i])
+        x_labels = None
     else:
-        # 其他粒度下的增长率计算
-        for year in years[1:]:
-            year = int(year)  # 确保是Python原生int类型
-            prev_year = int(year - 1)
-            if prev_year in pivot_df.columns:
-                pivot_df[f'{year}_yoy'] = (pivot_df[year] - pivot_df[prev_year]) / pivot_df[prev_year] * 100
-                yoy_changes[year] = float(pivot_df[f'{year}_yoy'].mean())
+        # 周期位置 × 年份的透视表
+        pivot_df = pd.DataFrame(growth['matrix'], index=growth['slots'], columns=years)
+        observed_matrix = growth['observed_matrix']
+        show_observed_only = time_granularity == 'day' and 'is_original_data' in df.columns
+        if show_observed_only:
+            # 日粒度只保留有原始数据的日期位置
+            keep = observed_matrix.any(axis=1)
+            pivot_df = pivot_df[keep]
+            observed_matrix = observed_matrix[keep]
+            yoy_matrix = yoy_matrix[keep]
+        
+        # 时间名称，例如"3月"、"Q2"、"12周"、"45天"
+        name_format = {'day': '{}天', 'week': '{}周', 'month': '{}月', 'quarter': 'Q{}'}.get(time_granularity, '{}')
+        x_labels = [name_format.format(int(t)) for t in pivot_df.index]
+        
+        # 计算同比增长率（与上一自然年的同一周期位置相比）
+        for j in range(1, len(years)):
+            if years[j] - 1 == years[j - 1]:
+                year = int(years[j])
+                pivot_df[f'{year}_yoy'] = yoy_matrix[:, j]
+                changes = yoy_matrix[:, j][np.isfinite(yoy_matrix[:, j])]
+                yoy_changes[year] = float(changes.mean()) if len(changes) else None
     
     # 创建同比图表
     fig = go.Figure()
@@ -1115,14 +1047,10 @@ def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
     
     if time_granularity == 'year':
         # 年粒度下的特殊处理
-        x_values = [int(year) for year in years]  # 确保是Python原生类型
-        y_values = [float(pivot_df.get(int(year), 0)) for year in years]
-        hover_texts = [f'{int(year)}年' for year in years]
-        
         fig.add_trace(go.Bar(
-            x=[f"{year}年" for year in x_values],
-            y=y_values,
-            text=hover_texts,
+            x=[f"{int(year)}年" for year in years],
+            y=pivot_df.tolist(),
+            text=[f'{int(year)}年' for year in years],
             hovertemplate=hover_template,
             marker_color=year_colors[0],
             name=value_col
@@ -1131,11 +1059,10 @@ def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
         # 添加年度增长率
         if yoy_changes:
             growth_years = list(yoy_changes.keys())
-            growth_values = list(yoy_changes.values())
             
             fig.add_trace(go.Scatter(
                 x=[f"{year}年" for year in growth_years],
-                y=growth_values,
+                y=list(yoy_changes.values()),
                 mode='lines+markers',
                 name='同比增长率 (%)',
                 text=[f'{year}年增长率' for year in growth_years],
@@ -1153,61 +1080,22 @@ def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
                 )
             )
     else:
-        # 其他粒度的处理
+        # 其他粒度：每年一条曲线
         for i, year in enumerate(years):
-            if 'is_original_data' in df.columns and is_daily_granularity:
-                # 找出该年份中有实际数据的时间点
-                valid_times = set(df[(df['year'] == year) & (df['is_original_data'] == True)][time_col])
-                
-                # 创建带有自定义文本的数据点
-                x_values = pivot_df.index.tolist()
-                y_values = pivot_df[year].tolist()
-                hover_texts = [f'{year}年' for _ in range(len(x_values))]
-                
-                # 对于非有效时间点，将悬停信息设置为None
-                hover_infos = []
-                for time_point in x_values:
-                    if time_point in valid_times:
-                        hover_infos.append('all')
-                    else:
-                        hover_infos.append('skip')
-                
-                # 添加图表
-                if time_names:
-                    # 使用时间名称映射，确保键被转换为Python原生类型
-                    x_labels = [time_names.get(int(t) if isinstance(t, (np.integer, int)) else str(t), str(t)) for t in x_values]
-                else:
-                    x_labels = [str(t) for t in x_values]
-                
-                fig.add_trace(go.Scatter(
-                    x=x_labels,
-                    y=y_values,
-                    mode='lines+markers',
-                    name=f'{year}年',
-                    text=hover_texts,
-                    hovertemplate=hover_template,
-                    hoverinfo=hover_infos,
-                    marker=dict(size=8, color=year_colors[i % len(year_colors)]),
-                    line=dict(color=year_colors[i % len(year_colors)], width=2)
-                ))
-            else:
-                # 没有标记或非日粒度，显示所有点
-                if time_names:
-                    # 使用时间名称映射，确保键被转换为Python原生类型
-                    x_labels = [time_names.get(int(t) if isinstance(t, (np.integer, int)) else str(t), str(t)) for t in pivot_df.index.tolist()]
-                else:
-                    x_labels = [str(t) for t in pivot_df.index.tolist()]
-                
-                fig.add_trace(go.Scatter(
-                    x=x_labels,
-                    y=pivot_df[year],
-                    mode='lines+markers',
-                    name=f'{year}年',
-                    text=[f'{year}年' for _ in range(len(pivot_df.index))],
-                    hovertemplate=hover_template,
-                    marker=dict(size=8, color=year_colors[i % len(year_colors)]),
-                    line=dict(color=year_colors[i % len(year_colors)], width=2)
-                ))
+            trace = dict(
+                x=x_labels,
+                y=pivot_df[year].tolist(),
+                mode='lines+markers',
+                name=f'{year}年',
+                text=[f'{year}年'] * len(x_labels),
+                hovertemplate=hover_template,
+                marker=dict(size=8, color=year_colors[i % len(year_colors)]),
+                line=dict(color=year_colors[i % len(year_colors)], width=2)
+            )
+            if show_observed_only:
+                # 该年份中没有实际数据的时间点不显示悬停信息
+                trace['hoverinfo'] = np.where(observed_matrix[:, i], 'all', 'skip').tolist()
+            fig.add_trace(go.Scatter(**trace))
     
     # 根据时间粒度调整标题和横轴标签
     title_mapping = {
@@ -1226,135 +1114,33 @@ def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
         hovermode='closest'
     )
     
-    # 创建同比增长率图表
-    yoy_fig = go.Figure()
+    # 转换图表为JSON字符串
+    chart_json = json.dumps({
+        'data': fig.data,
+        'layout': fig.layout
+    }, cls=plotly.utils.PlotlyJSONEncoder)
     
     if time_granularity == 'year':
-        # 年粒度下不显示单独的增长率图表
-        pass
+        # 年粒度下不需要单独的增长率图表
+        yoy_chart_json = None
     else:
+        # 创建同比增长率图表，增长、下降、持平分别用不同颜色的柱状图
+        yoy_fig = go.Figure()
+        hover = f'{time_label}: %{{x}}<br>同比增长率: %{{y:.2f}}%<extra></extra>'
         for year in years[1:]:
-            if f'{year}_yoy' in pivot_df.columns:
-                if 'is_original_data' in df.columns and is_daily_granularity:
-                    # 找出该年份中有实际数据的时间点
-                    valid_times = set(df[(df['year'] == year) & (df['is_original_data'] == True)][time_col])
-                    
-                    # 创建带有自定义文本的数据点
-                    x_values = pivot_df.index.tolist()
-                    y_values = pivot_df[f'{year}_yoy'].tolist()
-                    hover_texts = [f'{year}年同比' for _ in range(len(x_values))]
-                    
-                    # 对于非有效时间点，将悬停信息设置为None
-                    hover_infos = []
-                    for time_point in x_values:
-                        if time_point in valid_times:
-                            hover_infos.append('all')
-                        else:
-                            hover_infos.append('skip')
-                    
-                    # 为正值和负值创建不同的柱状图
-                    positive_x = []
-                    positive_y = []
-                    negative_x = []
-                    negative_y = []
-                    neutral_x = []
-                    neutral_y = []
-                    
-                    for i, (time_point, val) in enumerate(zip(x_values, y_values)):
-                        # 确保time_point是Python原生类型
-                        time_point_key = int(time_point) if isinstance(time_point, (np.integer, int)) else str(time_point)
-                        time_label_str = time_names.get(time_point_key, str(time_point)) if time_names else str(time_point)
-                        if val > 0:
-                            positive_x.append(time_label_str)
-                            positive_y.append(val)
-                        elif val < 0:
-                            negative_x.append(time_label_str)
-                            negative_y.append(val)
-                        else:
-                            neutral_x.append(time_label_str)
-                            neutral_y.append(val)
-                    
-                    # 添加柱状图
-                    if positive_x:
-                        yoy_fig.add_trace(go.Bar(
-                            x=positive_x,
-                            y=positive_y,
-                            name=f'{year}年同比增长',
-                            marker_color=CHART_COLORS['positive'],
-                            hovertemplate=f'{time_label}: %{{x}}<br>同比增长率: %{{y:.2f}}%<extra></extra>'
-                        ))
-                    
-                    if negative_x:
-                        yoy_fig.add_trace(go.Bar(
-                            x=negative_x,
-                            y=negative_y,
-                            name=f'{year}年同比下降',
-                            marker_color=CHART_COLORS['negative'],
-                            hovertemplate=f'{time_label}: %{{x}}<br>同比增长率: %{{y:.2f}}%<extra></extra>'
-                        ))
-                    
-                    if neutral_x:
-                        yoy_fig.add_trace(go.Bar(
-                            x=neutral_x,
-                            y=neutral_y,
-                            name=f'{year}年同比持平',
-                            marker_color=CHART_COLORS['neutral'],
-                            hovertemplate=f'{time_label}: %{{x}}<br>同比增长率: %{{y:.2f}}%<extra></extra>'
-                        ))
-                else:
-                    # 没有标记或非日粒度，分别创建正值和负值柱状图
-                    x_values = pivot_df.index.tolist()
-                    y_values = pivot_df[f'{year}_yoy'].tolist()
-                    
-                    # 为正值和负值创建不同的柱状图
-                    positive_x = []
-                    positive_y = []
-                    negative_x = []
-                    negative_y = []
-                    neutral_x = []
-                    neutral_y = []
-                    
-                    for time_point, val in zip(x_values, y_values):
-                        # 确保time_point是Python原生类型
-                        time_point_key = int(time_point) if isinstance(time_point, (np.integer, int)) else str(time_point)
-                        time_label_str = time_names.get(time_point_key, str(time_point)) if time_names else str(time_point)
-                        if val > 0:
-                            positive_x.append(time_label_str)
-                            positive_y.append(val)
-                        elif val < 0:
-                            negative_x.append(time_label_str)
-                            negative_y.append(val)
-                        else:
-                            neutral_x.append(time_label_str)
-                            neutral_y.append(val)
-                    
-                    # 添加柱状图
-                    if positive_x:
-                        yoy_fig.add_trace(go.Bar(
-                            x=positive_x,
-                            y=positive_y,
-                            name=f'{year}年同比增长',
-                            marker_color=CHART_COLORS['positive'],
-                            hovertemplate=f'{time_label}: %{{x}}<br>同比增长率: %{{y:.2f}}%<extra></extra>'
-                        ))
-                    
-                    if negative_x:
-                        yoy_fig.add_trace(go.Bar(
-                            x=negative_x,
-                            y=negative_y,
-                            name=f'{year}年同比下降',
-                            marker_color=CHART_COLORS['negative'],
-                            hovertemplate=f'{time_label}: %{{x}}<br>同比增长率: %{{y:.2f}}%<extra></extra>'
-                        ))
-                    
-                    if neutral_x:
-                        yoy_fig.add_trace(go.Bar(
-                            x=neutral_x,
-                            y=neutral_y,
-                            name=f'{year}年同比持平',
-                            marker_color=CHART_COLORS['neutral'],
-                            hovertemplate=f'{time_label}: %{{x}}<br>同比增长率: %{{y:.2f}}%<extra></extra>'
-                        ))
+            if f'{year}_yoy' not in pivot_df.columns:
+                continue
+            groups = _split_by_sign(x_labels, pivot_df[f'{year}_yoy'])
+            for (bar_x, bar_y), suffix, color in zip(groups, ('增长', '下降', '持平'),
+                                                     ('positive', 'negative', 'neutral')):
+                if bar_x:
+                    yoy_fig.add_trace(go.Bar(
+                        x=bar_x,
+                        y=bar_y,
+                        name=f'{year}年同比{suffix}',
+                        marker_color=CHART_COLORS[color],
+                        hovertemplate=hover
+                    ))
         
         growth_title_mapping = {
             'day': '日度同比增长率',
@@ -1369,30 +1155,14 @@ def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
             yaxis_title='同比增长率 (%)',
             template='plotly_white'
         )
-    
-    # 转换图表为JSON字符串
-    chart_json = json.dumps({
-        'data': fig.data,
-        'layout': fig.layout
-    }, cls=plotly.utils.PlotlyJSONEncoder)
-    
-    if time_granularity == 'year':
-        # 年粒度下不需要单独的增长率图表
-        yoy_chart_json = None
-    else:
+        
         yoy_chart_json = json.dumps({
             'data': yoy_fig.data,
             'layout': yoy_fig.layout
         }, cls=plotly.utils.PlotlyJSONEncoder)
     
-    # 计算总计和年度均值
-    yearly_totals = {}
-    for year in years:
-        year = int(year)  # 确保是Python原生int类型
-        if time_granularity == 'year':
-            yearly_totals[year] = float(pivot_df.get(year, 0))
-        else:
-            yearly_totals[year] = float(pivot_df[year].sum())
+    # 年度总计
+    yearly_totals = {int(year): float(total) for year, total in zip(years, growth['yearly_totals'])}
     
     # 准备分析结果
     result = {
@@ -1401,175 +1171,106 @@ def analyze_year_over_year(df, date_col, value_col, time_granularity='month'):
         'yoy_chart': yoy_chart_json,
         'stats': {
             'yearly_totals': {str(k): v for k, v in yearly_totals.items()},  # 确保键是字符串
-            'yoy_changes': {str(k): float(v) for k, v in yoy_changes.items()}  # 确保键是字符串
-        }
+            'yoy_changes': {str(k): v for k, v in yoy_changes.items()}  # 确保键是字符串，没有可比数据的年份为None
+        },
+        'growth_metrics': growth_metrics_payload(growth, time_granularity)
     }
     
     if time_granularity != 'year':
-        # 为非年粒度准备数据透视表，确保所有键都是字符串
-        result['pivot_data'] = {}
-        for col in pivot_df.columns:
-            col_key = str(col)  # 确保键是字符串
-            result['pivot_data'][col_key] = {
-                str(idx): float(val) for idx, val in pivot_df[col].items()  # 确保键是字符串
-            }
+        # 为非年粒度准备数据透视表，确保所有键都是字符串，缺失的值和同比为None（JSON中为null）
+        result['pivot_data'] = {
+            str(col): dict(zip(map(str, pivot_df.index), _finite_list(pivot_df[col])))
+            for col in pivot_df.columns
+        }
     
     return result
 
+# 环比分析各时间粒度的标题: (周期名称, 图表标题, 横轴标题)
+MOM_PERIOD_TITLES = {
+    'day': ('日', '日度销售趋势', '日期'),
+    'week': ('周', '周度销售趋势', '周次'),
+    'month': ('月', '月度销售趋势', '年月'),
+    'quarter': ('季度', '季度销售趋势', '季度'),
+    'year': ('年', '年度销售趋势', '年份')
+}
+
+def format_period_display(dates, time_granularity):
+    """周期的显示名称，例如"2025年03月"、"2025年Q1"、"2025年9周（2月25日-3月3日）"等"""
+    dates = pd.DatetimeIndex(dates)
+    if time_granularity == 'day':
+        return list(dates.strftime('%Y年%m月%d日'))
+    if time_granularity == 'quarter':
+        return [f"{year}年Q{quarter}" for year, quarter in zip(dates.year, dates.quarter)]
+    if time_granularity == 'year':
+        return list(dates.strftime('%Y年'))
+    if time_granularity != 'week':
+        return list(dates.strftime('%Y年%m月'))
+    
+    # 周粒度：周数减1以符合用户习惯，并附上日期范围（范围往前调整一周后再加一天）
+    iso = dates.isocalendar()
+    iso_day = iso['day'].to_numpy(dtype=int)
+    week_num = iso['week'].to_numpy(dtype=int) - 1
+    year_to_display = np.asarray(dates.year)
+    start_of_week = dates - pd.to_timedelta(iso_day - 1 + 6, unit='D')
+    end_of_week = start_of_week + pd.Timedelta(days=6)
+    
+    # 如果周数减1后变成0，则应该是上一年的最后一周
+    first_week = week_num == 0
+    if first_week.any():
+        prev_year = year_to_display[first_week] - 1
+        last_day_prev_year = pd.to_datetime(pd.Series(prev_year.astype(str)) + '-12-31')
+        week_num[first_week] = last_day_prev_year.dt.isocalendar().week.to_numpy(dtype=int)
+        year_to_display[first_week] = prev_year
+    
+    # 格式化成"xxxx年y周（x月x日-x月x日）"的形式
+    return [f"{year}年{week}周（{sm}月{sd}日-{em}月{ed}日）" for year, week, sm, sd, em, ed in zip(
+        year_to_display, week_num, start_of_week.month, start_of_week.day, end_of_week.month, end_of_week.day)]
+
 def analyze_month_over_month(df, date_col, value_col, time_granularity='month'):
     """分析环比增长，可根据不同时间粒度进行分析
     
+    同比、环比、滚动12期和年复合增长率由compute_period_growth一次计算，不修改传入的df。
+    环比只在有原始数据的周期之间比较。
+    
     参数:
-    df -- 数据框
+    df -- 数据框（aggregate_by_time聚合后的数据）
     date_col -- 日期列名
     value_col -- 值列名
     time_granularity -- 时间粒度: 'day', 'week', 'month', 'quarter', 'year'
     """
-    # 确保日期列是datetime类型
-    df[date_col] = pd.to_datetime(df[date_col])
-    
-    # 根据指定的时间粒度进行分组
-    if time_granularity == 'day':
-        df['period'] = df[date_col].dt.strftime('%Y-%m-%d')
-        df['period_display'] = df[date_col].dt.strftime('%Y年%m月%d日')
-        period_title = '日'
-        chart_title = '日度销售趋势'
-        xaxis_title = '日期'
-    elif time_granularity == 'week':
-        df['period'] = df[date_col].dt.strftime('%Y-%U')  # ISO周格式
-        # 在显示周信息时添加更多细节
-        df['week_num'] = df[date_col].dt.isocalendar().week
-        
-        # 定义周显示格式函数，需要包含日期范围
-        def format_week_with_range(date_value):
-            if not isinstance(date_value, pd.Timestamp):
-                try:
-                    date_value = pd.to_datetime(date_value)
-                except:
-                    return str(date_value)
-                    
-            # 获取ISO周信息
-            iso_year, iso_week, iso_day = date_value.isocalendar()
-            # 周数减1，以符合用户习惯
-            week_num = iso_week - 1
-            
-            # 计算该周的周一和周日日期
-            start_of_week = date_value - pd.Timedelta(days=iso_day-1)
-            end_of_week = start_of_week + pd.Timedelta(days=6)
-            
-            # 将日期范围往前调整一周
-            start_of_week = start_of_week - pd.Timedelta(weeks=1)
-            end_of_week = end_of_week - pd.Timedelta(weeks=1)
-            
-            # 日期范围加一天
-            start_of_week = start_of_week + pd.Timedelta(days=1)
-            end_of_week = end_of_week + pd.Timedelta(days=1)
-            
-            # 处理年份交界处的周数
-            year_to_display = date_value.year
-            if week_num == 0:
-                # 如果周数减1后变成0，则应该是上一年的最后一周
-                prev_year = year_to_display - 1
-                # 获取上一年最后一天的ISO周信息
-                last_day_prev_year = pd.Timestamp(f"{prev_year}-12-31")
-                _, last_week, _ = last_day_prev_year.isocalendar()
-                week_num = last_week
-                year_to_display = prev_year
-            
-            # 格式化成"xxxx年y周（x月x日-x月x日）"的形式
-            return f"{year_to_display}年{week_num}周（{start_of_week.month}月{start_of_week.day}日-{end_of_week.month}月{end_of_week.day}日）"
-        
-        # 使用带日期范围的周格式
-        df['period_display'] = df[date_col].apply(format_week_with_range)
-        
-        period_title = '周'
-        chart_title = '周度销售趋势'
-        xaxis_title = '周次'
-    elif time_granularity == 'month':
-        df['period'] = df[date_col].dt.strftime('%Y-%m')
-        df['period_display'] = df[date_col].dt.strftime('%Y年%m月')
-        period_title = '月'
-        chart_title = '月度销售趋势'
-        xaxis_title = '年月'
-    elif time_granularity == 'quarter':
-        df['quarter'] = df[date_col].dt.quarter
-        df['period'] = df[date_col].dt.strftime('%Y-') + df['quarter'].astype(str)
-        df['period_display'] = df.apply(lambda x: f"{x[date_col].year}年Q{x['quarter']}", axis=1)
-        period_title = '季度'
-        chart_title = '季度销售趋势'
-        xaxis_title = '季度'
-    elif time_granularity == 'year':
-        df['period'] = df[date_col].dt.strftime('%Y')
-        df['period_display'] = df[date_col].dt.strftime('%Y年')
-        period_title = '年'
-        chart_title = '年度销售趋势'
-        xaxis_title = '年份'
-    else:
+    if time_granularity not in MOM_PERIOD_TITLES:
         # 默认使用月份
-        df['period'] = df[date_col].dt.strftime('%Y-%m')
-        df['period_display'] = df[date_col].dt.strftime('%Y年%m月')
-        period_title = '月'
-        chart_title = '月度销售趋势'
-        xaxis_title = '年月'
-    
-    #print(f"环比分析 - 使用时间粒度: {time_granularity} ({period_title})")
-    
-    # 如果数据有is_original_data标记，仅使用标记为原始数据的点进行分析
-    if 'is_original_data' in df.columns:
-        original_df = df[df['is_original_data'] == True].copy()
-        if len(original_df) > 0:
-            #print(f"环比分析：使用{len(original_df)}个原始数据点（总点数：{len(df)}）")
-            period_data = original_df.groupby(['period', 'period_display'])[value_col].sum().reset_index()
-        else:
-            # 如果没有原始数据点，使用所有数据
-            #print("环比分析：无原始数据点，使用所有数据点")
-            period_data = df.groupby(['period', 'period_display'])[value_col].sum().reset_index()
-    else:
-        # 如果没有标记，使用所有数据点
-        print(f"环比分析：使用所有数据点")
-        period_data = df.groupby(['period', 'period_display'])[value_col].sum().reset_index()
+        df = aggregate_by_time(df[[date_col, value_col]].copy(), date_col, value_col, 'month')
+        time_granularity = 'month'
+    period_title, chart_title, xaxis_title = MOM_PERIOD_TITLES[time_granularity]
     
-    period_data.sort_values('period', inplace=True)
+    growth = compute_period_growth(df, date_col, value_col, time_granularity)
     
-    # 计算环比变化
-    period_data['prev_value'] = period_data[value_col].shift(1)
-    
-    # 添加安全处理，避免除以零
-    def safe_pct_change(current, previous):
-        if pd.isna(previous) or previous == 0:
-            return float('nan')  # 返回NaN而不是触发除以零的警告
-        return (current - previous) / previous * 100
-    
-    # 使用向量化操作安全地计算环比变化率
-    period_data['mom_change'] = period_data.apply(
-        lambda row: safe_pct_change(row[value_col], row['prev_value']), 
-        axis=1
-    )
+    # 仅使用有原始数据的周期进行分析
+    observed = growth['observed']
+    period_display = np.asarray(format_period_display(growth['dates'][observed], time_granularity), dtype=object)
+    period_values = growth['values'][observed]
+    prev_values = np.concatenate(([np.nan], period_values[:-1]))
+    mom_changes = growth['mom'][observed]
     
     # 创建环比趋势图
     fig = go.Figure()
     
-    # 如果数据有is_original_data标记
     if 'is_original_data' in df.columns:
-        # 收集原始数据中存在的周期
-        original_periods = set(df[df['is_original_data'] == True]['period'])
-        
         # 创建所有点的连续线
         fig.add_trace(go.Scatter(
-            x=period_data['period_display'],
-            y=period_data[value_col],
+            x=period_display.tolist(),
+            y=period_values.tolist(),
             mode='lines',
             name='趋势线',
             hoverinfo='skip',
             line=dict(width=2, color=CHART_COLORS['primary'])
         ))
         
-        # 仅在原始数据点上添加带悬停信息的标记
-        orig_period_data = period_data[period_data['period'].isin(original_periods)]
-        
+        # 在原始数据点上添加带悬停信息的标记
         fig.add_trace(go.Scatter(
-            x=orig_period_data['period_display'],
-            y=orig_period_data[value_col],
+            x=period_display.tolist(),
+            y=period_values.tolist(),
             mode='markers',
             name='实际数据点',
             hovertemplate=f'{period_title}: %{{x}}<br>{value_col}: %{{y:,.2f}}<extra></extra>',
@@ -1578,8 +1279,8 @@ def analyze_month_over_month(df, date_col, value_col, time_granularity='month'):
     else:
         # 没有标记，显示所有点
         fig.add_trace(go.Scatter(
-            x=period_data['period_display'],
-            y=period_data[value_col],
+            x=period_display.tolist(),
+            y=period_values.tolist(),
             mode='lines+markers',
             name=value_col,
             hovertemplate=f'{period_title}: %{{x}}<br>{value_col}: %{{y:,.2f}}<extra></extra>',
@@ -1595,129 +1296,19 @@ def analyze_month_over_month(df, date_col, value_col, time_granularity='month'):
         hovermode='closest'
     )
     
-    # 创建环比增长率图表
+    # 创建环比增长率图表，按环比变化的正负分别显示（第一个周期没有环比数据）
     mom_fig = go.Figure()
-    
-    if 'is_original_data' in df.columns:
-        # 收集原始数据中存在的周期
-        original_periods = set(df[df['is_original_data'] == True]['period'])
-        
-        # 分离正值和负值数据点
-        positive_x = []
-        positive_y = []
-        negative_x = []
-        negative_y = []
-        neutral_x = []
-        neutral_y = []
-        
-        for i, row in period_data.iterrows():
-            # 跳过第一个周期，因为它没有环比数据
-            if i == 0 or pd.isna(row['mom_change']):
-                continue
-                
-            period = row['period']
-            period_display = row['period_display']
-            change = row['mom_change']
-            
-            # 按环比变化的正负分类
-            if change > 0:
-                if period in original_periods:
-                    positive_x.append(period_display)
-                    positive_y.append(change)
-            elif change < 0:
-                if period in original_periods:
-                    negative_x.append(period_display)
-                    negative_y.append(change)
-            else:
-                if period in original_periods:
-                    neutral_x.append(period_display)
-                    neutral_y.append(change)
-        
-        # 添加正值柱状图
-        if positive_x:
+    hover = f'{period_title}: %{{x}}<br>环比增长率: %{{y:.2f}}%<extra></extra>'
+    for (bar_x, bar_y), name, color in zip(_split_by_sign(period_display, mom_changes),
+                                           ('环比增长', '环比下降', '环比持平'),
+                                           ('positive', 'negative', 'neutral')):
+        if bar_x:
             mom_fig.add_trace(go.Bar(
-                x=positive_x,
-                y=positive_y,
-                name='环比增长',
-                marker_color=CHART_COLORS['positive'],
-                hovertemplate=f'{period_title}: %{{x}}<br>环比增长率: %{{y:.2f}}%<extra></extra>'
-            ))
-        
-        # 添加负值柱状图
-        if negative_x:
-            mom_fig.add_trace(go.Bar(
-                x=negative_x,
-                y=negative_y,
-                name='环比下降',
-                marker_color=CHART_COLORS['negative'],
-                hovertemplate=f'{period_title}: %{{x}}<br>环比增长率: %{{y:.2f}}%<extra></extra>'
-            ))
-        
-        # 添加零值柱状图
-        if neutral_x:
-            mom_fig.add_trace(go.Bar(
-                x=neutral_x,
-                y=neutral_y,
-                name='环比持平',
-                marker_color=CHART_COLORS['neutral'],
-                hovertemplate=f'{period_title}: %{{x}}<br>环比增长率: %{{y:.2f}}%<extra></extra>'
-            ))
-    else:
-        # 没有标记，显示所有点，但按环比变化的正负分类
-        positive_x = []
-        positive_y = []
-        negative_x = []
-        negative_y = []
-        neutral_x = []
-        neutral_y = []
-        
-        for i, row in period_data.iterrows():
-            # 跳过第一个周期，因为它没有环比数据
-            if i == 0 or pd.isna(row['mom_change']):
-                continue
-                
-            period_display = row['period_display']
-            change = row['mom_change']
-            
-            # 按环比变化的正负分类
-            if change > 0:
-                positive_x.append(period_display)
-                positive_y.append(change)
-            elif change < 0:
-                negative_x.append(period_display)
-                negative_y.append(change)
-            else:
-                neutral_x.append(period_display)
-                neutral_y.append(change)
-        
-        # 添加正值柱状图
-        if positive_x:
-            mom_fig.add_trace(go.Bar(
-                x=positive_x,
-                y=positive_y,
-                name='环比增长',
-                marker_color=CHART_COLORS['positive'],
-                hovertemplate=f'{period_title}: %{{x}}<br>环比增长率: %{{y:.2f}}%<extra></extra>'
-            ))
-        
-        # 添加负值柱状图
-        if negative_x:
-            mom_fig.add_trace(go.Bar(
-                x=negative_x,
-                y=negative_y,
-                name='环比下降',
-                marker_color=CHART_COLORS['negative'],
-                hovertemplate=f'{period_title}: %{{x}}<br>环比增长率: %{{y:.2f}}%<extra></extra>'
-            ))
-        
-        # 添加零值柱状图
-        if neutral_x:
-            mom_fig.add_trace(go.Bar(
-                x=neutral_x,
-                y=neutral_y,
-                name='环比持平',
-                marker_color=CHART_COLORS['neutral'],
-                hovertemplate=f'{period_title}: %{{x}}<br>环比增长率: %{{y:.2f}}%<extra></extra>'
+                x=bar_x,
+                y=bar_y,
+                name=name,
+                marker_color=CHART_COLORS[color],
+                hovertemplate=hover
             ))
     
     mom_fig.update_layout(
@@ -1729,48 +1320,42 @@ def analyze_month_over_month(df, date_col, value_col, time_granularity='month'):
     )
     
     # 汇总统计数据
-    positive_changes = (period_data['mom_change'] > 0).sum()
-    negative_changes = (period_data['mom_change'] < 0).sum()
-    avg_change = period_data['mom_change'].mean()
-    
-    # 查找最大增长和最大下降的周期
-    max_increase_idx = period_data['mom_change'].idxmax()
-    max_decrease_idx = period_data['mom_change'].idxmin()
-    
-    max_increase_period = period_data.loc[max_increase_idx, 'period_display'] if not pd.isna(max_increase_idx) else ""
-    max_decrease_period = period_data.loc[max_decrease_idx, 'period_display'] if not pd.isna(max_decrease_idx) else ""
+    finite = np.isfinite(mom_changes)
+    if finite.any():
+        max_increase_idx = int(np.nanargmax(np.where(finite, mom_changes, np.nan)))
+        max_decrease_idx = int(np.nanargmin(np.where(finite, mom_changes, np.nan)))
+        max_increase = {'value': float(mom_changes[max_increase_idx]), 'period': period_display[max_increase_idx]}
+        max_decrease = {'value': float(mom_changes[max_decrease_idx]), 'period': period_display[max_decrease_idx]}
+        avg_change = float(mom_changes[finite].mean())
+    else:
+        # 没有可计算的环比时为None（JSON中为null），NaN无法被浏览器的JSON.parse解析
+        max_increase = {'value': None, 'period': ""}
+        max_decrease = {'value': None, 'period': ""}
+        avg_change = None
     
     stats = {
-        'positive_changes': int(positive_changes),
-        'negative_changes': int(negative_changes),
-        'average_change': float(avg_change),
-        'max_increase': {
-            'value': float(period_data['mom_change'].max()),
-            'period': max_increase_period
-        },
-        'max_decrease': {
-            'value': float(period_data['mom_change'].min()),
-            'period': max_decrease_period
-        },
-        'period_type': period_title  # 添加周期类型，方便前端显示
+        'positive_changes': int((mom_changes > 0).sum()),
+        'negative_changes': int((mom_changes < 0).sum()),
+        'average_change': avg_change,
+        'max_increase': max_increase,
+        'max_decrease': max_decrease,
+        'period_type': period_title,  # 添加周期类型，方便前端显示
+        'cagr': growth['cagr']
     }
     
     # 构建前端友好的周期数据
-    period_records = []
-    for _, row in period_data.iterrows():
-        record = {
-            'period': row['period_display'],
-            'value': float(row[value_col]),
-            'prev_value': float(row['prev_value']) if not pd.isna(row['prev_value']) else None,
-            'mom_change': float(row['mom_change']) if not pd.isna(row['mom_change']) else None
-        }
-        period_records.append(record)
+    period_records = [
+        {'period': period, 'value': value, 'prev_value': prev_value, 'mom_change': change}
+        for period, value, prev_value, change in zip(period_display.tolist(), _finite_list(period_values),
+                                                     _finite_list(prev_values), _finite_list(mom_changes))
+    ]
     
     return {
         'chart': fig.to_json(),
         'mom_chart': mom_fig.to_json(),
         'stats': stats,
-        'period_data': period_records
+        'period_data': period_records,
+        'growth_metrics': growth_metrics_payload(growth, time_granularity)
     }
 
 def calculate_zscore(series):
@@ -1781,31 +1366,15 @@ def calculate_zscore(series):
         return np.zeros(len(series))
     return (series - mean) / std
 
-def calculate_iqr_score(series):
-    """计算基于IQR（四分位距）的异常分数"""
-    q1 = np.percentile(series, 25)
-    q3 = np.percentile(series, 75)
-    iqr = q3 - q1
-    if iqr == 0:
-        return np.zeros(len(series))
-    # 标准化为类似Z分数的尺度
-    return np.abs(series - np.median(series)) / (iqr / 1.349)  # 1.349 是使IQR与标准差尺度相当的因子
-
-def calculate_mad_score(series):
-    """计算基于MAD（中位数绝对偏差）的异常分数"""
-    median = np.median(series)
-    mad = np.median(np.abs(series - median))
-    if mad == 0:
-        return np.zeros(len(series))
-    # 标准化为类似Z分数的尺度
-    return np.abs(series - median) / (mad * 1.4826)  # 1.4826 是使MAD与标准差尺度相当的常数
-
 def detect_consecutive_anomalies(df, date_col, anomaly_markers, window_size=3, min_anomalies=2):
     """
     检测连续时间窗口内的异常累积
     
+    基于累积和计算每个滑动窗口内的异常数量，并用滑动最大值把窗口强度分配到窗口内的点，
+    时间复杂度O(n)（窗口大小为常数时），不再逐窗口、逐点循环。
+    
     参数:
-    - df: 数据框
+    - df: 数据框，需已按日期排序，且行顺序与anomaly_markers一致
     - date_col: 日期列名
     - anomaly_markers: 异常标记列表 (True/False 或 1/0)
     - window_size: 时间窗口大小，默认为3
@@ -1814,356 +1383,460 @@ def detect_consecutive_anomalies(df, date_col, anomaly_markers, window_size=3, m
     返回:
     - consecutive_anomalies: 连续异常指标 (0-1之间的值，表示连续性强度)
     - is_in_streak: 是否在异常连续区间内的标记
+    - streaks: 连续异常区间列表，每项为 {'start', 'end', 'start_date', 'end_date', 'strength', 'anomaly_count'}，
+      start/end为区间内第一个和最后一个异常点的位置
     """
-    df = df.sort_values(by=date_col).reset_index(drop=True)
-    n = len(df)
+    markers = np.asarray(anomaly_markers, dtype=bool)
+    n = len(markers)
+    window_size = max(1, int(window_size))
     
     # 初始化结果数组
     consecutive_scores = np.zeros(n)
     is_in_streak = np.zeros(n, dtype=bool)
+    streaks = []
     
     # 仅在有足够数据时运行
-    if n >= window_size:
-        #print(f"连续异常检测: 使用{window_size}天窗口，最小异常数{min_anomalies}。强度值含义：")
-        #print(f"  - 1.00: 窗口内所有{window_size}个点均为异常 (极高关注度)")
-        #print(f"  - {min_anomalies/window_size:.2f}: 窗口内有{min_anomalies}个异常点 (中高关注度)")
-        #print(f"  - 0.00: 不在任何连续异常窗口内 (单独异常)")
-        
-        # 滑动窗口检测连续异常
-        total_streaks = 0
-        for i in range(n - window_size + 1):
-            window = anomaly_markers[i:i+window_size]
-            anomaly_count = np.sum(window)
-            
-            # 如果窗口内异常点数量达到阈值
-            if anomaly_count >= min_anomalies:
-                total_streaks += 1
-                # 计算连续指标 - 窗口内异常点比例
-                streak_score = anomaly_count / window_size
-                
-                # 更新窗口内每个点的连续分数
-                for j in range(i, i+window_size):
-                    # 如果当前点已标记为异常，增加其连续分数
-                    if anomaly_markers[j]:
-                        # 多次重叠窗口取最大值
-                        consecutive_scores[j] = max(consecutive_scores[j], streak_score)
-                        is_in_streak[j] = True
-        
-        if total_streaks > 0:
-            #print(f"检测到{total_streaks}个连续异常窗口")
-            # 统计不同强度区间的数量
-            strength_bins = {
-                "高": np.sum((consecutive_scores > 0.9) & is_in_streak),
-                "中高": np.sum((consecutive_scores > 0.6) & (consecutive_scores <= 0.9) & is_in_streak),
-                "中": np.sum((consecutive_scores > 0.3) & (consecutive_scores <= 0.6) & is_in_streak)
-            }
-            for level, count in strength_bins.items():
-                if count > 0:
-                    #print(f"  - {level}强度连续异常: {count}个点")
-                    pass
+    if n < window_size:
+        return consecutive_scores, is_in_streak, streaks
+    
+    # 每个窗口（起点为0..n-window_size）内的异常数量
+    cumulative = np.concatenate(([0], np.cumsum(markers)))
+    window_counts = cumulative[window_size:] - cumulative[:-window_size]
+    qualified = window_counts >= min_anomalies
+    if not qualified.any():
+        return consecutive_scores, is_in_streak, streaks
+    
+    # 窗口强度 - 窗口内异常点比例，未达到阈值的窗口为0
+    window_strength = np.where(qualified, window_counts / window_size, 0.0)
+    
+    # 每个点取所有包含它的窗口（起点为j-window_size+1..j）中的最大强度
+    padded = np.concatenate((np.zeros(window_size - 1), window_strength, np.zeros(window_size - 1)))
+    point_strength = np.lib.stride_tricks.sliding_window_view(padded, window_size).max(axis=1)
+    
+    # 只有异常点本身才计入连续异常
+    is_in_streak = markers & (point_strength > 0)
+    consecutive_scores = np.where(is_in_streak, point_strength, 0.0)
+    
+    # 相互重叠的达标窗口合并为一个连续异常区间
+    starts = np.flatnonzero(qualified)
+    group_starts = np.concatenate(([0], np.flatnonzero(np.diff(starts) >= window_size) + 1))
+    group_ends = np.append(group_starts[1:], len(starts)) - 1
+    group_strength = np.maximum.reduceat(window_strength[starts], group_starts)
+    
+    # 区间内第一个和最后一个异常点（在异常点位置中二分查找）
+    streak_positions = np.flatnonzero(is_in_streak)
+    lower = np.searchsorted(streak_positions, starts[group_starts], side='left')
+    upper = np.searchsorted(streak_positions, starts[group_ends] + window_size - 1, side='right')
+    keep = upper > lower
+    first_points = streak_positions[lower[keep]]
+    last_points = streak_positions[upper[keep] - 1]
+    
+    if df is not None and date_col in df.columns:
+        dates = pd.to_datetime(df[date_col].to_numpy())
+        start_dates = dates[first_points].strftime('%Y-%m-%d')
+        end_dates = dates[last_points].strftime('%Y-%m-%d')
+    else:
+        start_dates = end_dates = [None] * len(first_points)
+    
+    streaks = [
+        {
+            'start': int(start),
+            'end': int(end),
+            'start_date': start_date,
+            'end_date': end_date,
+            'strength': float(strength),
+            'anomaly_count': int(count)
+        }
+        for start, end, start_date, end_date, strength, count in zip(
+            first_points, last_points, start_dates, end_dates, group_strength[keep], (upper - lower)[keep])
+    ]
+    
+    return consecutive_scores, is_in_streak, streaks
+
+# 每个数据点的异常评分结果（结构化数组）
+ANOMALY_SCORE_DTYPE = np.dtype([
+    ('score', 'f8'),       # 综合异常分数
+    ('zscore', 'f8'),      # |Z分数|
+    ('iqr', 'f8'),         # IQR分数
+    ('mad', 'f8'),         # MAD分数
+    ('votes', 'i1'),       # 超过投票阈值的指标数
+    ('direction', 'i1'),   # 异常方向 (1=上升, -1=下降, 0=不是异常)
+    ('is_anomaly', '?')    # 按上升/下降阈值判定的异常标记
+])
+
+DEFAULT_ANOMALY_WEIGHTS = {
+    "zscore": 0.5,
+    "iqr": 0.3,
+    "mad": 0.2
+}
+
+# 分块评分时每个数据点保留的紧凑结果
+ANOMALY_FLAG_DTYPE = np.dtype([
+    ('score', 'f8'),       # 综合异常分数
+    ('votes', 'i1'),       # 超过投票阈值的指标数
+    ('direction', 'i1'),   # 异常方向 (1=上升, -1=下降, 0=不是异常)
+    ('is_anomaly', '?')    # 按上升/下降阈值判定的异常标记
+])
+
+ANOMALY_CHUNK_SIZE = 200000  # 全分辨率异常评分时每块的数据点数
+
+def _anomaly_statistics(matrix):
+    """计算每个序列（每行）的评分统计量：均值、标准差、中位数、IQR、MAD"""
+    with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)  # 全为缺失值的序列
+        
+        # 缺失值填充为各序列的均值后再计算统计量
+        means = np.nanmean(matrix, axis=1, keepdims=True)
+        filled = np.where(np.isnan(matrix), means, matrix)
+        
+        # 标准差与pandas一致使用ddof=1
+        std = np.std(filled, axis=1, ddof=1, keepdims=True)
+        q1, median, q3 = np.percentile(filled, [25, 50, 75], axis=1, keepdims=True)
+        mad = np.median(np.abs(filled - median), axis=1, keepdims=True)
+    return {'mean': means, 'std': std, 'median': median, 'iqr': q3 - q1, 'mad': mad}
+
+def _score_with_statistics(matrix, stats, weights, vote_threshold, min_votes):
+    """按给定的统计量为数据点评分（可以只是序列的一部分），is_anomaly留待阈值确定后标记"""
+    result = np.zeros(matrix.shape, dtype=ANOMALY_SCORE_DTYPE)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        filled = np.where(np.isnan(matrix), stats['mean'], matrix)
+        
+        # 原始Z分数（保留符号方向）
+        raw_zscore = np.where(stats['std'] > 0, (filled - stats['mean']) / stats['std'], 0.0)
+        
+        # IQR分数，1.349 是使IQR与标准差尺度相当的因子
+        deviation = np.abs(filled - stats['median'])
+        iqr_score = np.where(stats['iqr'] > 0, deviation / (stats['iqr'] / 1.349), 0.0)
+        
+        # MAD分数，1.4826 是使MAD与标准差尺度相当的常数
+        mad_score = np.where(stats['mad'] > 0, deviation / (stats['mad'] * 1.4826), 0.0)
     
-    return consecutive_scores, is_in_streak
+    zscore = np.abs(raw_zscore)
+    combined = weights["zscore"] * zscore + weights["iqr"] * iqr_score + weights["mad"] * mad_score
+    
+    # 对异常分数进行投票（至少有min_votes个指标分数超过阈值）
+    votes = (zscore > vote_threshold).astype(np.int8) + (iqr_score > vote_threshold) + (mad_score > vote_threshold)
+    
+    # 异常方向，根据原始Z分数确定
+    candidate = (combined > vote_threshold) & (votes >= min_votes)
+    
+    result['score'] = combined
+    result['zscore'] = zscore
+    result['iqr'] = iqr_score
+    result['mad'] = mad_score
+    result['votes'] = votes
+    result['direction'] = np.where(candidate, np.where(raw_zscore > 0, 1, -1), 0)
+    return result
+
+def _anomaly_thresholds(up_count, down_count, z_threshold, balance):
+    """每个序列的上升/下降阈值，上升异常显著多于下降异常时，为下降异常提供更宽松的阈值，反之亦然"""
+    threshold_up = np.full((len(up_count), 1), float(z_threshold))
+    threshold_down = threshold_up.copy()
+    if balance:
+        more_up = (up_count > down_count * 2) & (down_count > 0)
+        more_down = ~more_up & (down_count > up_count * 2) & (up_count > 0)
+        threshold_down[more_up] *= 0.85
+        threshold_up[more_down] *= 0.85
+    return threshold_up, threshold_down
+
+def _mark_anomalies(result, threshold_up, threshold_down, min_votes):
+    """按上升/下降阈值标记异常点"""
+    direction = result['direction']
+    score = result['score']
+    result['is_anomaly'] = (result['votes'] >= min_votes) & (((direction > 0) & (score > threshold_up)) |
+                                                             ((direction < 0) & (score > threshold_down)))
+    return result
+
+def _score_anomaly_matrix(matrix, weights, z_threshold, vote_threshold, min_votes, balance):
+    """对二维数组逐行（每行一个序列）计算多维度异常评分，全部使用NumPy数组运算"""
+    if matrix.shape[1] == 0:
+        return np.zeros(matrix.shape, dtype=ANOMALY_SCORE_DTYPE)
+    
+    stats = _anomaly_statistics(matrix)
+    result = _score_with_statistics(matrix, stats, weights, vote_threshold, min_votes)
+    threshold_up, threshold_down = _anomaly_thresholds(
+        (result['direction'] > 0).sum(axis=1), (result['direction'] < 0).sum(axis=1), z_threshold, balance
+    )
+    return _mark_anomalies(result, threshold_up, threshold_down, min_votes)
 
-def calculate_multidimensional_anomaly_score(series, weights=None):
+def score_anomalies(values, weights=None, z_threshold=2.5, vote_threshold=2.5, min_votes=2, balance=True):
     """
-    计算多维度异常分数
+    多维度异常评分引擎（Z分数、IQR、MAD，投票与方向判定）
     
     参数:
-    - series: 数据序列
+    - values: 一维数组（一个序列），或二维数组（每行一个等长序列，如每个产品/地区一行）
     - weights: 各维度权重字典，默认为Z-score 0.5, IQR 0.3, MAD 0.2
+    - z_threshold: 判定异常的综合分数阈值
+    - vote_threshold: 单个指标的投票阈值
+    - min_votes: 至少需要的投票数
+    - balance: 上升和下降异常数量悬殊时，是否为较少的一方放宽阈值（z_threshold * 0.85）
     
     返回:
-    - combined_scores: 综合异常分数
-    - individual_scores: 各维度分数字典
-    - threshold_votes: 超过阈值的投票数
-    - directions: 异常方向 (1=上升, -1=下降)
+    - 与values形状相同的结构化数组，字段见ANOMALY_SCORE_DTYPE
     """
-    # 填充缺失值为系列均值
-    series_filled = series.fillna(series.mean())
-    mean_val = series_filled.mean()
-    
-    # 设置默认权重
-    if weights is None:
-        weights = {
-            "zscore": 0.5,
-            "iqr": 0.3,
-            "mad": 0.2
-        }
-    
-    # 计算原始Z分数（保留符号方向）
-    raw_zscore = (series_filled - mean_val) / series_filled.std()
+    matrix = np.asarray(values, dtype=float)
+    is_single = matrix.ndim == 1
+    if is_single:
+        matrix = matrix.reshape(1, -1)
+    elif matrix.ndim != 2:
+        raise ValueError("异常评分只支持一维或二维数组")
+    
+    result = _score_anomaly_matrix(matrix, weights or DEFAULT_ANOMALY_WEIGHTS, z_threshold,
+                                   vote_threshold, min_votes, balance)
+    return result[0] if is_single else result
+
+def score_anomaly_batch(series_list, **kwargs):
+    """
+    批量计算多个序列（长度可以不同）的异常评分
     
-    # 计算各维度分数
-    individual_scores = {
-        "zscore": np.abs(raw_zscore),  # 只取绝对值用于异常评分
-        "iqr": calculate_iqr_score(series_filled),
-        "mad": calculate_mad_score(series_filled)
-    }
+    相同长度的序列合并为一个二维数组一起计算，参数同score_anomalies。
     
-    # 计算综合分数
-    combined_scores = np.zeros(len(series))
-    for score_type, score_values in individual_scores.items():
-        combined_scores += weights[score_type] * score_values
-    
-    # 对异常分数进行投票（至少有两个指标分数超过阈值）
-    threshold_votes = np.zeros(len(series), dtype=int)
-    for score_values in individual_scores.values():
-        threshold_votes += (score_values > 2.5).astype(int)
-    
-    # 确定每个点的异常方向 (1=上升, -1=下降, 0=不是异常)
-    directions = np.zeros(len(series))
-    for i in range(len(series)):
-        if combined_scores[i] > 2.5 and threshold_votes[i] >= 2:
-            # 根据原始Z分数确定方向，保留异常方向信息
-            directions[i] = 1 if raw_zscore[i] > 0 else -1
-    
-    # 返回综合分数、各维度分数、投票结果和方向
-    return combined_scores, individual_scores, threshold_votes, directions
-
-def is_holiday(date):
-    """判断日期是否为中国主要节假日（基于2018-2030年的精确日期）"""
-    if not isinstance(date, pd.Timestamp):
-        return False, None, []
-    
-    # 转换为日期字符串 MM-DD 格式，用于固定日期的节日
-    date_str = f"{date.month:02d}-{date.day:02d}"
-    year = date.year
-    
-    # 定义主要节假日的精确日期范围和相关信息
-    # 格式: {年份: {节日名称: [日期范围(MM-DD格式)列表]}}
-    holiday_dates = {
-        # 春节（农历新年）- 具体日期随年份变化
-        "春节": {
-            2018: ["02-15", "02-16", "02-17", "02-18", "02-19", "02-20", "02-21"],
-            2019: ["02-04", "02-05", "02-06", "02-07", "02-08", "02-09", "02-10"],
-            2020: ["01-24", "01-25", "01-26", "01-27", "01-28", "01-29", "01-30"],
-            2021: ["02-11", "02-12", "02-13", "02-14", "02-15", "02-16", "02-17"],
-            2022: ["01-31", "02-01", "02-02", "02-03", "02-04", "02-05", "02-06"],
-            2023: ["01-21", "01-22", "01-23", "01-24", "01-25", "01-26", "01-27"],
-            2024: ["02-10", "02-11", "02-12", "02-13", "02-14", "02-15", "02-16"],
-            2025: ["01-29", "01-30", "01-31", "02-01", "02-02", "02-03", "02-04"],
-            2026: ["02-17", "02-18", "02-19", "02-20", "02-21", "02-22", "02-23"],
-            2027: ["02-06", "02-07", "02-08", "02-09", "02-10", "02-11", "02-12"],
-            2028: ["01-26", "01-27", "01-28", "01-29", "01-30", "01-31", "02-01"],
-            2029: ["02-13", "02-14", "02-15", "02-16", "02-17", "02-18", "02-19"],
-            2030: ["02-03", "02-04", "02-05", "02-06", "02-07", "02-08", "02-09"],
-            "pre_days": 7,  # 春节前7天
-            "post_days": 7,  # 春节后7天
-            "up_patterns": ["春节前购物高峰", "年货采购期", "春节备货期", "节前消费高峰"],
-            "down_patterns": ["春节期间多数商家休息", "春节后初期消费低迷", "节日消费后的淡季", "春节期间商业活动减少"]
-        },
-        
-        # 国庆节黄金周（固定10月1日-7日）
-        "国庆节": {
-            # 国庆节是固定的每年10月1日至7日
-            "fixed_range": ["10-01", "10-02", "10-03", "10-04", "10-05", "10-06", "10-07"],
-            "pre_days": 3,
-            "post_days": 3,
-            "up_patterns": ["国庆节促销活动", "长假旅游消费增加", "黄金周消费高峰", "节日庆祝相关消费"],
-            "down_patterns": ["国庆期间部分商家暂停营业", "节日期间商业区客流变化", "供应链受节假日影响"]
-        },
-        
-        # 元旦（固定1月1日）
-        "元旦": {
-            "fixed_range": ["01-01"],
-            "extended_range": ["12-30", "12-31", "01-02", "01-03"],  # 考虑元旦前后
-            "pre_days": 2,
-            "post_days": 2,
-            "up_patterns": ["元旦促销", "年末购物", "新年促销活动", "跨年消费"],
-            "down_patterns": ["元旦假期部分商家休息", "新年假期商业活动减少"]
-        },
-        
-        # 劳动节（固定5月1日，但假期长度因年而异）
-        "劳动节": {
-            2018: ["05-01"],
-            2019: ["05-01", "05-02", "05-03", "05-04"],
-            2020: ["05-01", "05-02", "05-03", "05-04", "05-05"],
-            2021: ["05-01", "05-02", "05-03", "05-04", "05-05"],
-            2022: ["04-30", "05-01", "05-02", "05-03", "05-04"],
-            2023: ["04-29", "04-30", "05-01", "05-02", "05-03"],
-            2024: ["05-01", "05-02", "05-03", "05-04", "05-05"],
-            2025: ["05-01", "05-02", "05-03", "05-04", "05-05"],  # 预估
-            2026: ["05-01", "05-02", "05-03", "05-04", "05-05"],  # 预估
-            2027: ["05-01", "05-02", "05-03", "05-04", "05-05"],  # 预估
-            2028: ["04-29", "04-30", "05-01", "05-02", "05-03"],  # 预估
-            2029: ["04-28", "04-29", "04-30", "05-01", "05-02"],  # 预估
-            2030: ["05-01", "05-02", "05-03", "05-04", "05-05"],  # 预估
-            "pre_days": 2,
-            "post_days": 2,
-            "up_patterns": ["五一促销活动", "小长假消费增加", "假期旅游带动消费", "假日特惠活动"],
-            "down_patterns": ["劳动节假期部分商家休息", "假期结束后消费低迷", "商业区域人流变化"]
-        },
-        
-        # 中秋节（农历节日，每年日期不同）
-        "中秋节": {
-            2018: ["09-24"],
-            2019: ["09-13"],
-            2020: ["10-01"],  # 与国庆重合
-            2021: ["09-21"],
-            2022: ["09-10"],
-            2023: ["09-29"],
-            2024: ["09-17"],
-            2025: ["10-06"],  # 与国庆重合
-            2026: ["09-25"],
-            2027: ["09-15"],
-            2028: ["10-03"],  # 与国庆重合
-            2029: ["09-22"],
-            2030: ["09-12"],
-            "pre_days": 3,
-            "post_days": 1,
-            "up_patterns": ["中秋节礼品销售高峰", "月饼等节日食品销售增加", "中秋团圆消费", "节日礼品采购"],
-            "down_patterns": ["中秋节当天销售下降", "节日期间特定商品销量变化"]
-        },
-        
-        # 双十一购物节（固定11月11日）
-        "双十一": {
-            "fixed_range": ["11-11"],
-            "extended_range": ["11-01", "11-02", "11-03", "11-04", "11-05", "11-06", "11-07", "11-08", "11-09", "11-10", "11-12", "11-13", "11-14", "11-15"],
-            "pre_days": 10,  # 双11前10天
-            "post_days": 5,   # 双11后5天
-            "up_patterns": ["双十一购物狂欢节", "大规模促销活动", "预售活动期", "购物节大促"],
-            "down_patterns": ["双十一后消费疲软", "透支消费降低后续购买力", "促销后的销售低谷"]
-        },
-        
-        # 双十二（固定12月12日）
-        "双十二": {
-            "fixed_range": ["12-12"],
-            "extended_range": ["12-07", "12-08", "12-09", "12-10", "12-11", "12-13", "12-14", "12-15", "12-16", "12-17"],
-            "pre_days": 5,
-            "post_days": 3,
-            "up_patterns": ["双十二促销活动", "年末购物季", "双十二特惠", "年终促销"],
-            "down_patterns": ["双十二后消费下降", "年末消费逐渐减少"]
-        }
-    }
+    返回:
+    - 与series_list顺序一致的结构化数组列表
+    """
+    arrays = [np.asarray(series, dtype=float) for series in series_list]
+    results = [None] * len(arrays)
+    
+    by_length = {}
+    for i, array in enumerate(arrays):
+        by_length.setdefault(len(array), []).append(i)
+    
+    for positions in by_length.values():
+        scores = score_anomalies(np.vstack([arrays[i] for i in positions]), **kwargs)
+        for row, i in enumerate(positions):
+            results[i] = scores[row]
+    return results
+
+def score_anomalies_chunked(values, chunk_size=ANOMALY_CHUNK_SIZE, weights=None, z_threshold=2.5,
+                            vote_threshold=2.5, min_votes=2, balance=True, cancel_check=None):
+    """
+    全分辨率、分块计算一个序列的异常评分
     
-    # 检查是否在特定年份的节假日范围内
-    for holiday_name, holiday_info in holiday_dates.items():
-        # 检查固定日期范围（如国庆节、元旦等固定日期的节日）
-        if "fixed_range" in holiday_info and date_str in holiday_info["fixed_range"]:
-            return True, holiday_name, holiday_info["up_patterns"] if date.day <= 3 else holiday_info["down_patterns"]
-        
-        # 检查扩展日期范围（节日前后几天）
-        if "extended_range" in holiday_info and date_str in holiday_info["extended_range"]:
-            # 根据日期判断是节前还是节后
-            if date.day < 15:  # 简化判断，前半月认为是节前
-                return True, f"{holiday_name}前", holiday_info["up_patterns"]
-            else:
-                return True, f"{holiday_name}后", holiday_info["down_patterns"]
-        
-        # 检查年份特定的节假日日期（如春节、中秋等农历节日）
-        if year in holiday_info and isinstance(holiday_info[year], list) and date_str in holiday_info[year]:
-            # 找出该年份该节日的第一天和最后一天
-            first_day = holiday_info[year][0]
-            last_day = holiday_info[year][-1]
-            
-            # 判断是节日的前期、中期还是后期
-            if date_str == first_day:
-                return True, f"{holiday_name}开始", holiday_info["up_patterns"]
-            elif date_str == last_day:
-                return True, f"{holiday_name}结束", holiday_info["down_patterns"]
-            else:
-                return True, holiday_name, holiday_info["up_patterns"] if random.random() > 0.5 else holiday_info["down_patterns"]
-    
-    # 检查节日前后的日期
-    date_minus_1 = (date - pd.Timedelta(days=1)).strftime("%m-%d")
-    date_minus_2 = (date - pd.Timedelta(days=2)).strftime("%m-%d")
-    date_plus_1 = (date + pd.Timedelta(days=1)).strftime("%m-%d")
-    date_plus_2 = (date + pd.Timedelta(days=2)).strftime("%m-%d")
-    
-    for holiday_name, holiday_info in holiday_dates.items():
-        # 检查固定日期节日的前后几天
-        if "fixed_range" in holiday_info:
-            first_day = holiday_info["fixed_range"][0]
-            last_day = holiday_info["fixed_range"][-1]
-            
-            # 检查是否是节日前几天
-            if date_plus_1 == first_day or date_plus_2 == first_day:
-                return True, f"{holiday_name}前", holiday_info["up_patterns"]
-            
-            # 检查是否是节日后几天
-            if date_minus_1 == last_day or date_minus_2 == last_day:
-                return True, f"{holiday_name}后", holiday_info["down_patterns"]
-        
-        # 检查年份特定节日的前后几天
-        if year in holiday_info and isinstance(holiday_info[year], list):
-            first_day = holiday_info[year][0]
-            last_day = holiday_info[year][-1]
-            
-            # 检查节日前的日期
-            pre_dates = [(pd.Timestamp(f"{year}-{first_day}") - pd.Timedelta(days=i)).strftime("%m-%d") for i in range(1, holiday_info.get("pre_days", 3) + 1)]
-            if date_str in pre_dates:
-                return True, f"{holiday_name}前", holiday_info["up_patterns"]
-            
-            # 检查节日后的日期
-            post_dates = [(pd.Timestamp(f"{year}-{last_day}") + pd.Timedelta(days=i)).strftime("%m-%d") for i in range(1, holiday_info.get("post_days", 3) + 1)]
-            if date_str in post_dates:
-                return True, f"{holiday_name}后", holiday_info["down_patterns"]
+    统计量（均值、标准差、分位数、MAD）在整个序列上计算一次，然后逐块评分，
+    每个点只保留紧凑的结果（ANOMALY_FLAG_DTYPE），各维度分数可以之后用score_points按需计算。
+    结果与score_anomalies完全一致。cancel_check为可选的取消检查回调，每块评分前调用一次。
     
-    return False, None, []
+    返回:
+    - (flags, stats): flags为每个点的紧凑评分结果，stats为序列的评分统计量
+    """
+    weights = weights or DEFAULT_ANOMALY_WEIGHTS
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    flags = np.zeros(n, dtype=ANOMALY_FLAG_DTYPE)
+    if n == 0:
+        return flags, None
+    
+    stats = _anomaly_statistics(values.reshape(1, -1))
+    chunk_size = max(1, int(chunk_size))
+    for start in range(0, n, chunk_size):
+        if cancel_check is not None:
+            cancel_check()
+        chunk = _score_with_statistics(values[start:start + chunk_size].reshape(1, -1), stats,
+                                       weights, vote_threshold, min_votes)[0]
+        flags['score'][start:start + chunk_size] = chunk['score']
+        flags['votes'][start:start + chunk_size] = chunk['votes']
+        flags['direction'][start:start + chunk_size] = chunk['direction']
+    
+    direction = flags['direction']
+    threshold_up, threshold_down = _anomaly_thresholds(
+        np.array([np.sum(direction > 0)]), np.array([np.sum(direction < 0)]), z_threshold, balance
+    )
+    _mark_anomalies(flags, threshold_up[0, 0], threshold_down[0, 0], min_votes)
+    return flags, stats
 
-def analyze_business_impact(df, idx, date_col, value_col, direction, time_granularity='day'):
+def score_points(values, positions, stats, weights=None, vote_threshold=2.5, min_votes=2):
+    """按score_anomalies_chunked返回的统计量，计算指定位置的数据点的完整评分（各维度分数）"""
+    values = np.asarray(values, dtype=float)
+    positions = np.asarray(positions, dtype=int)
+    if stats is None or len(positions) == 0:
+        return np.zeros(len(positions), dtype=ANOMALY_SCORE_DTYPE)
+    return _score_with_statistics(values[positions].reshape(1, -1), stats, weights or DEFAULT_ANOMALY_WEIGHTS,
+                                  vote_threshold, min_votes)[0]
+
+# 尖峰/低谷模式检测结果的结构
+SPIKE_PATTERN_DTYPE = np.dtype([
+    ('is_pattern', bool),
+    ('prominence', np.float64),
+    ('kind', np.int8)  # 1=尖峰(先升后降), -1=低谷(先降后升)
+])
+
+SPIKE_PROMINENCE_THRESHOLD = 0.3  # 尖峰显著度阈值
+SPIKE_MAX_GAP_DAYS = 7  # 与前后数据点的最大允许间隔（天），防止长时间无数据的情况
+
+def _relative_rise(values, reference):
+    """values相对reference的变化比例，reference不为正时按1计算"""
+    return (values - reference) / np.where(reference > 0, reference, 1)
+
+def detect_spike_patterns(values, dates, prominence=SPIKE_PROMINENCE_THRESHOLD, max_gap=SPIKE_MAX_GAP_DAYS,
+                          detect_troughs=False):
     """
-    分析销售异常对业务的具体影响，提供业务导向的异常解释
+    检测尖峰模式（突然上升后迅速下降），全部使用数组运算
+    
+    只在有效数据（非NaN且非零）中查找：值高于前后两个有效点，且与前后点的日期间隔不超过max_gap天
+    （前后点或自身的日期缺失时不标记）。
+    显著度为 相对移动平均基线、相对前一点、相对后一点 三个上升比例的均值，超过prominence时标记。
     
     参数:
-    - df: 数据框
-    - idx: 异常点索引
-    - date_col: 日期列名
-    - value_col: 值列名
-    - direction: 异常方向 ('上升' 或 '下降')
-    - time_granularity: 时间粒度，可选值: 'day', 'week', 'month', 'quarter', 'year'
+    - values: 按日期排序的销售值
+    - dates: 与values对应的日期
+    - prominence: 显著度阈值，默认0.3
+    - max_gap: 与前后数据点的最大允许间隔（天），默认7
+    - detect_troughs: 是否同时对称地检测低谷模式（突然下降后迅速恢复）
     
     返回:
-    - business_reasons: 业务导向的解释列表
+    - SPIKE_PATTERN_DTYPE结构数组，与values一一对应
+    """
+    values = np.asarray(values, dtype=float)
+    result = np.zeros(len(values), dtype=SPIKE_PATTERN_DTYPE)
+    
+    valid_mask = ~np.isnan(values) & (values != 0)  # 非NaN且非零值
+    valid_count = int(np.sum(valid_mask))
+    if valid_count <= 5:  # 至少需要5个有效点
+        print(f"有效数据点不足({valid_count}个)，跳过尖峰模式检测")
+        return result
+    
+    valid_indices = np.flatnonzero(valid_mask)
+    valid_values = values[valid_mask]
+    window_size = max(3, min(7, valid_count // 20))  # 窗口大小根据有效数据量调整
+    if valid_count <= window_size * 2:
+        print(f"有效数据点不足({valid_count}个)，无法可靠计算尖峰模式")
+        return result
+    
+    # 移动平均作为基线
+    baseline = np.convolve(valid_values, np.ones(window_size) / window_size, mode='same')
+    
+    # 候选点: 前后各留出window_size个点
+    candidates = np.arange(window_size, valid_count - window_size)
+    current = valid_values[candidates]
+    prev_values = valid_values[candidates - 1]
+    next_values = valid_values[candidates + 1]
+    
+    # 与前后有效数据点的间隔（天），日期缺失或无法解析时无法确认间隔，保守地视为间隔过大
+    valid_dates = np.asarray(pd.to_datetime(np.asarray(dates)[valid_indices], errors='coerce'), dtype='datetime64[ns]')
+    # 按整天数比较（不足一天的部分舍去），与NaT比较的结果为False
+    gap_ok = np.diff(valid_dates) < np.timedelta64(max_gap + 1, 'D')
+    gaps_ok = gap_ok[candidates - 1] & gap_ok[candidates]
+    
+    def mark(is_extreme, overall, kind):
+        selected = gaps_ok & is_extreme & (overall > prominence)
+        positions = valid_indices[candidates[selected]]
+        result['is_pattern'][positions] = True
+        result['prominence'][positions] = overall[selected]
+        result['kind'][positions] = kind
+    
+    # 尖峰: 高于前后两点，综合显著程度 = 相对基线、前一点、后一点的上升比例均值
+    overall = (_relative_rise(current, baseline[candidates]) + _relative_rise(current, prev_values)
+               + _relative_rise(current, next_values)) / 3
+    mark((current > prev_values) & (current > next_values), overall, 1)
+    
+    if detect_troughs:
+        # 低谷: 低于前后两点，显著程度为基线、前一点、后一点相对当前值的下降比例均值
+        overall = -(_relative_rise(current, baseline[candidates]) + _relative_rise(current, prev_values)
+                    + _relative_rise(current, next_values)) / 3
+        mark((current < prev_values) & (current < next_values), overall, -1)
+    
+    return result
+
+# 业务影响分析中与前N个时间单位均值比较的窗口: 粒度 -> (窗口大小, 单位)
+BUSINESS_COMPARE_WINDOWS = {
+    'day': (30, '天'),
+    'week': (8, '周'),
+    'month': (6, '月'),
+    'quarter': (4, '季度'),
+    'year': (3, '年')
+}
+
+# 多维度相关性分析窗口: 粒度 -> (向前的点数, 向后的点数)
+CORRELATION_WINDOWS = {
+    'day': (14, 7),
+    'week': (8, 4),
+    'month': (6, 3),
+    'quarter': (4, 2),
+    'year': (3, 1)
+}
+
+def _build_explain_context(df, date_col, value_col, time_granularity='day'):
     """
-    business_reasons = []
-    date = df.iloc[idx][date_col]
-    value = df.iloc[idx][value_col]
-    
-    # 根据时间粒度设置相应的时间单位描述和比较窗口
-    time_unit_map = {
-        'day': '日',
-        'week': '周',
-        'month': '月',
-        'quarter': '季度',
-        'year': '年'
-    }
-    time_unit = time_unit_map.get(time_granularity, '日')
+    为批量异常解释预先计算整个序列的数组（只计算一次，与异常点数量无关）
     
-    # 根据时间粒度设置比较窗口和描述
-    if time_granularity == 'day':
-        compare_window = 30
-        compare_unit = '天'
-    elif time_granularity == 'week':
-        compare_window = 8
-        compare_unit = '周'
-    elif time_granularity == 'month':
-        compare_window = 6
-        compare_unit = '月'
-    elif time_granularity == 'quarter':
-        compare_window = 4
-        compare_unit = '季度'
-    elif time_granularity == 'year':
-        compare_window = 3
-        compare_unit = '年'
+    df需已按日期排序且索引为0..n-1。包括：滚动基线（前N个点的均值）、上周同日及去年同期的位置、
+    星期几、节假日标记，以及可用于相关性分析的数值维度列。
+    """
+    if pd.api.types.is_datetime64_any_dtype(df[date_col]):
+        dates = df[date_col]
     else:
-        compare_window = 30
-        compare_unit = '天'
+        dates = pd.to_datetime(df[date_col], errors='coerce')
+    values = df[value_col].to_numpy(dtype=float)
+    date_values = dates.to_numpy()
+    compare_window, compare_unit = BUSINESS_COMPARE_WINDOWS.get(time_granularity, (30, '天'))
+    
+    # 滚动基线：每个点之前compare_window个点的均值（不含当前点）
+    baseline = pd.Series(values).rolling(compare_window, min_periods=1).mean().shift(1).to_numpy()
+    
+    def find_positions(target_dates):
+        """在已排序的日期中查找与target_dates完全相同的日期的位置，不存在时为-1"""
+        target = np.asarray(target_dates, dtype='datetime64[ns]')
+        found = np.searchsorted(date_values, target)
+        found = np.minimum(found, max(len(date_values) - 1, 0))
+        matched = (len(date_values) > 0) & (date_values[found] == target) if len(date_values) else np.zeros(len(target), dtype=bool)
+        return np.where(matched, found, -1)
+    
+    # 上周同日、去年同期（周粒度使用52周前）
+    week_ago = find_positions(dates - pd.Timedelta(days=7))
+    if time_granularity == 'week':
+        last_year = find_positions(dates - pd.Timedelta(weeks=52))
+    else:
+        last_year = find_positions(dates - pd.DateOffset(years=1))
     
-    # 确保数据被排序
-    try:
-        df_sorted = df.sort_values(by=date_col).reset_index(drop=True)
-        # 找到当前点在排序后数据中的位置
-        current_pos = df_sorted[df_sorted[date_col] == date].index[0]
-    except:
-        df_sorted = df
-        current_pos = idx
+    # 数值维度列（用于多维度相关性分析）
+    dimensions = [col for col in df.columns
+                  if col != date_col and col != value_col and pd.api.types.is_numeric_dtype(df[col])]
+    
+    return {
+        'dates': dates,
+        'values': values,
+        'value_series': df[value_col],
+        'baseline': baseline,
+        'week_ago': week_ago,
+        'last_year': last_year,
+        'weekday': dates.dt.dayofweek.to_numpy(),
+        'holiday_flags': holiday_mask(dates, include_extended=True),
+        'dimensions': df[dimensions],
+        'time_granularity': time_granularity,
+        'time_unit': TIME_GRANULARITY_NAMES.get(time_granularity, '日'),
+        'compare_window': compare_window,
+        'compare_unit': compare_unit
+    }
+
+def _sort_for_explain(df, date_col, positions):
+    """按日期排序数据（已排序时不复制），并把位置映射到排序后的数据中"""
+    positions = np.asarray(positions, dtype=int)
+    if df[date_col].is_monotonic_increasing:
+        if isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+            return df, positions
+        return df.reset_index(drop=True), positions
+    order = np.argsort(df[date_col].to_numpy(), kind='stable')
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    return df.iloc[order].reset_index(drop=True), inverse[positions]
+
+def _business_impact_reasons(ctx, pos, direction):
+    """根据预先计算的数组，为一个异常点生成业务导向的解释"""
+    business_reasons = []
+    time_granularity = ctx['time_granularity']
+    time_unit = ctx['time_unit']
+    compare_window = ctx['compare_window']
+    compare_unit = ctx['compare_unit']
+    values = ctx['values']
+    date = ctx['dates'].iloc[pos]
+    value = values[pos]
     
     # 获取前一个数据点（如果存在）
     prev_value = None
-    if current_pos > 0:
-        prev_value = df_sorted.iloc[current_pos-1][value_col]
-        prev_date = df_sorted.iloc[current_pos-1][date_col]
+    if pos > 0:
+        prev_value = values[pos - 1]
+        prev_date = ctx['dates'].iloc[pos - 1]
         
         # 根据时间粒度格式化前一个时间点
         if isinstance(prev_date, pd.Timestamp):
@@ -2184,13 +1857,10 @@ def analyze_business_impact(df, idx, date_col, value_col, direction, time_granul
         else:
             prev_time_str = str(prev_date)
     
-    # 1. ROI影响分析
+    # 1. ROI影响分析 - 与前N个时间单位平均值（滚动基线）的偏差百分比
     try:
-        # 计算与前N个时间单位平均值的偏差百分比
-        lookback = compare_window
-        start_idx = max(0, current_pos - lookback)
-        if current_pos > start_idx:
-            prev_avg = df_sorted.iloc[start_idx:current_pos][value_col].mean()
+        if pos > 0:
+            prev_avg = ctx['baseline'][pos]
             if prev_avg > 0:
                 change_pct = (value - prev_avg) / prev_avg * 100
                 
@@ -2222,18 +1892,18 @@ def analyze_business_impact(df, idx, date_col, value_col, direction, time_granul
     
     # 2. 销售路径分析
     try:
-        # 分析销售变化趋势和模式 - 调整窗口大小
-        recent_window = max(3, min(7, compare_window // 2))  # 根据比较窗口调整，但至少3个点，最多7个点
-        start_recent = max(0, current_pos - recent_window)
+        # 分析销售变化趋势和模式 - 根据比较窗口调整，但至少3个点，最多7个点
+        recent_window = max(3, min(7, compare_window // 2))
+        start_recent = max(0, pos - recent_window)
         
-        if current_pos > start_recent + 2:  # 确保有足够数据进行模式分析
-            # 计算与前一周期的环比变化
-            recent_values = df_sorted.iloc[start_recent:current_pos+1][value_col].values
+        if pos > start_recent + 2:  # 确保有足够数据进行模式分析
+            recent_values = values[start_recent:pos + 1]
+            steps = np.diff(recent_values[:-1])
             
             # 销售路径分析 - 检测销售漏斗变化模式
             if direction == '上升':
                 # 检测是否在持续增长后的爆发
-                if len(recent_values) >= 3 and all(recent_values[i] <= recent_values[i+1] for i in range(len(recent_values)-2)):
+                if len(recent_values) >= 3 and np.all(steps >= 0):
                     business_reasons.append(f"销售路径转化顺畅，呈连续{recent_window}个{time_unit}的累积上升趋势突破")
                 
                 # 检测是否是前期投入的延迟转化
@@ -2241,7 +1911,7 @@ def analyze_business_impact(df, idx, date_col, value_col, direction, time_granul
                     business_reasons.append(f"销售漏斗末端转化率提升，前期{time_unit}营销活动开始显效")
             else:  # 下降
                 # 检测是否在持续下降后的崩塌
-                if len(recent_values) >= 3 and all(recent_values[i] >= recent_values[i+1] for i in range(len(recent_values)-2)):
+                if len(recent_values) >= 3 and np.all(steps <= 0):
                     business_reasons.append(f"销售路径持续恶化，客户流失持续{recent_window}个{time_unit}")
                 
                 # 检测是否是销售路径早期环节的问题
@@ -2255,7 +1925,6 @@ def analyze_business_impact(df, idx, date_col, value_col, direction, time_granul
         if isinstance(date, pd.Timestamp):
             # 根据时间粒度提供不同的转化率解释
             if time_granularity == 'day':
-                month = date.month
                 day = date.day
                 weekday = date.dayofweek
                 
@@ -2280,7 +1949,6 @@ def analyze_business_impact(df, idx, date_col, value_col, direction, time_granul
                         business_reasons.append("周五转化率提升，周末前决策加速")
                 
             elif time_granularity == 'week':
-                month = date.month
                 week_in_month = (date.day - 1) // 7 + 1
                 
                 if week_in_month == 1:
@@ -2333,7 +2001,6 @@ def analyze_business_impact(df, idx, date_col, value_col, direction, time_granul
     # 4. 客户行为分析 - 根据时间粒度调整
     try:
         if isinstance(date, pd.Timestamp):
-            # 根据时间粒度提供不同的客户行为解释
             if time_granularity in ['day', 'week', 'month']:
                 # 尝试从日期模式推断客户行为
                 if direction == '上升':
@@ -2368,91 +2035,40 @@ def analyze_business_impact(df, idx, date_col, value_col, direction, time_granul
         
     return business_reasons
 
-def analyze_multidimensional_correlation(df, date_col, value_col, idx, time_granularity='day'):
-    """
-    分析多维度数据与销售异常的相关性，提供更全面的异常原因解释
-    
-    参数:
-    - df: 数据框
-    - date_col: 日期列名
-    - value_col: 销售值列名
-    - idx: 异常点索引
-    - time_granularity: 时间粒度，可选值: 'day', 'week', 'month', 'quarter', 'year'
-    
-    返回:
-    - correlation_insights: 相关性分析结果列表
-    """
+def _correlation_insights(ctx, pos):
+    """根据预先计算的数组，为一个异常点分析多维度数据的相关性"""
     correlation_insights = []
     try:
-        # 获取异常点日期和值
-        abnormal_date = df.iloc[idx][date_col]
-        abnormal_value = df.iloc[idx][value_col]
-        
-        # 确保日期列是时间类型
-        if not pd.api.types.is_datetime64_any_dtype(df[date_col]):
-            df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
+        time_granularity = ctx['time_granularity']
+        values = ctx['values']
+        abnormal_date = ctx['dates'].iloc[pos]
+        abnormal_value = values[pos]
         
         # 根据时间粒度设置分析窗口大小
-        if time_granularity == 'day':
-            lookback_window = 14    # 前14天
-            lookforward_window = 7  # 后7天
-        elif time_granularity == 'week':
-            lookback_window = 8     # 前8周
-            lookforward_window = 4  # 后4周
-        elif time_granularity == 'month':
-            lookback_window = 6     # 前6个月
-            lookforward_window = 3  # 后3个月
-        elif time_granularity == 'quarter':
-            lookback_window = 4     # 前4个季度
-            lookforward_window = 2  # 后2个季度
-        elif time_granularity == 'year':
-            lookback_window = 3     # 前3年
-            lookforward_window = 1  # 后1年
-        else:
-            lookback_window = 14
-            lookforward_window = 7
-        
-        # 确保数据按日期排序
-        df_sorted = df.sort_values(by=date_col).reset_index(drop=True)
-        
-        # 查找异常点在排序后数据中的位置
-        current_pos = df_sorted[df_sorted[date_col] == abnormal_date].index[0]
-        
-        # 设置分析窗口
-        start_idx = max(0, current_pos - lookback_window)
-        end_idx = min(len(df_sorted) - 1, current_pos + lookforward_window)
-        
-        # 提取窗口内的数据
-        window_df = df_sorted.iloc[start_idx:end_idx+1].copy()
-        
-        # 检测潜在的相关维度列
-        potential_dimensions = []
-        
-        # 查找数值类型列作为潜在相关维度
-        for col in df.columns:
-            if col != date_col and col != value_col and pd.api.types.is_numeric_dtype(df[col]):
-                potential_dimensions.append(col)
-        
-        # 如果找到了潜在维度
-        if potential_dimensions:
-            # 分析每个维度与销售值的相关性
+        lookback_window, lookforward_window = CORRELATION_WINDOWS.get(time_granularity, (14, 7))
+        start_idx = max(0, pos - lookback_window)
+        end_idx = min(len(values) - 1, pos + lookforward_window)
+        
+        # 分析窗口内每个数值维度与销售值的相关性
+        dimensions = ctx['dimensions']
+        if len(dimensions.columns) > 0:
+            window_df = dimensions.iloc[start_idx:end_idx + 1]
+            window_values = ctx['value_series'].iloc[start_idx:end_idx + 1]
             correlation_results = {}
             
-            for dim in potential_dimensions:
-                # 计算相关系数
-                if window_df[dim].std() > 0 and window_df[value_col].std() > 0:  # 避免常量列
-                    # 皮尔逊相关系数(线性关系)
-                    pearson_corr = window_df[dim].corr(window_df[value_col], method='pearson')
-                    # 斯皮尔曼相关系数(单调关系)
-                    spearman_corr = window_df[dim].corr(window_df[value_col], method='spearman')
-                    
-                    # 判断相关性强度
+            for dim in dimensions.columns:
+                window_dim = window_df[dim]
+                # 避免常量列
+                if window_dim.std() > 0 and window_values.std() > 0:
+                    # 皮尔逊相关系数(线性关系)和斯皮尔曼相关系数(单调关系)
+                    pearson_corr = window_dim.corr(window_values, method='pearson')
+                    spearman_corr = window_dim.corr(window_values, method='spearman')
                     avg_corr = (abs(pearson_corr) + abs(spearman_corr)) / 2
                     
                     # 计算异常点前后该维度的变化
-                    if current_pos > start_idx:
-                        before_avg = window_df.iloc[:current_pos-start_idx][dim].mean()
-                        point_value = window_df.iloc[current_pos-start_idx][dim]
+                    if pos > start_idx:
+                        before_avg = window_dim.iloc[:pos - start_idx].mean()
+                        point_value = window_dim.iloc[pos - start_idx]
                         
                         if before_avg > 0:  # 避免除零
                             change_pct = (point_value - before_avg) / before_avg * 100
@@ -2473,7 +2089,6 @@ def analyze_multidimensional_correlation(df, date_col, value_col, idx, time_gran
                                    key=lambda x: abs(x[1]['correlation']), 
                                    reverse=True)[:3]
             
-            # 生成相关性洞察
             for dim_name, dim_data in top_dimensions:
                 corr_value = dim_data['correlation']
                 change_pct = dim_data['change_pct']
@@ -2487,10 +2102,7 @@ def analyze_multidimensional_correlation(df, date_col, value_col, idx, time_gran
                     strength = "弱"
                 
                 # 相关方向
-                if dim_data['pearson_corr'] > 0:
-                    direction = "正相关"
-                else:
-                    direction = "负相关"
+                direction = "正相关" if dim_data['pearson_corr'] > 0 else "负相关"
                 
                 # 变化描述
                 if change_pct > 30:
@@ -2505,57 +2117,44 @@ def analyze_multidimensional_correlation(df, date_col, value_col, idx, time_gran
                     change_desc = "变化不大"
                 
                 # 格式化列名为用户友好的名称
-                friendly_name = dim_name.replace('_', ' ').title()
-                
-                # 生成洞察
-                insight = f"{friendly_name}与销售{direction}({strength}关联)，异常点前该指标{change_desc}({abs(change_pct):.1f}%)，可能是异常原因"
-                correlation_insights.append(insight)
+                friendly_name = str(dim_name).replace('_', ' ').title()
+                correlation_insights.append(
+                    f"{friendly_name}与销售{direction}({strength}关联)，异常点前该指标{change_desc}({abs(change_pct):.1f}%)，可能是异常原因"
+                )
         
         # 如果无法找到相关维度，尝试基于时间模式的分析
-        if not correlation_insights:
-            # 分析时间序列模式
+        if not correlation_insights and isinstance(abnormal_date, pd.Timestamp):
             if time_granularity == 'day':
-                # 分析每周模式
-                if isinstance(abnormal_date, pd.Timestamp):
-                    day_of_week = abnormal_date.dayofweek
-                    weekday_names = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
-                    
-                    # 获取过去同一周几的数据
-                    same_weekdays = []
-                    for i in range(current_pos - 1, start_idx - 1, -1):
-                        if i >= 0 and isinstance(df_sorted.iloc[i][date_col], pd.Timestamp):
-                            if df_sorted.iloc[i][date_col].dayofweek == day_of_week:
-                                same_weekdays.append(df_sorted.iloc[i][value_col])
-                    
-                    if same_weekdays:
-                        weekday_avg = sum(same_weekdays) / len(same_weekdays)
-                        if weekday_avg > 0:  # 避免除零
-                            weekday_change = (abnormal_value - weekday_avg) / weekday_avg * 100
-                            
-                            if abs(weekday_change) > 20:
-                                correlation_insights.append(
-                                    f"与过去{len(same_weekdays)}个{weekday_names[day_of_week]}相比，销售变化了{weekday_change:.1f}%，表明周内模式异常"
-                                )
-                
-                # 分析月内模式
-                if isinstance(abnormal_date, pd.Timestamp):
-                    day_of_month = abnormal_date.day
-                    
-                    # 分析是否为月初、月中或月末异常
-                    if day_of_month <= 5:
-                        correlation_insights.append("异常发生在月初(前5天)，可能与月度预算释放或采购周期相关")
-                    elif day_of_month >= 25:
-                        correlation_insights.append("异常发生在月末(后5天)，可能与月度销售目标冲刺或预算耗尽相关")
+                # 分析每周模式：与窗口内过去同一周几的数据比较
+                day_of_week = abnormal_date.dayofweek
+                weekday_names = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+                same_weekday = ctx['weekday'][start_idx:pos] == day_of_week
+                same_weekdays = values[start_idx:pos][same_weekday][::-1].tolist()
+                
+                if same_weekdays:
+                    weekday_avg = sum(same_weekdays) / len(same_weekdays)
+                    if weekday_avg > 0:  # 避免除零
+                        weekday_change = (abnormal_value - weekday_avg) / weekday_avg * 100
+                        
+                        if abs(weekday_change) > 20:
+                            correlation_insights.append(
+                                f"与过去{len(same_weekdays)}个{weekday_names[day_of_week]}相比，销售变化了{weekday_change:.1f}%，表明周内模式异常"
+                            )
+                
+                # 分析是否为月初、月中或月末异常
+                day_of_month = abnormal_date.day
+                if day_of_month <= 5:
+                    correlation_insights.append("异常发生在月初(前5天)，可能与月度预算释放或采购周期相关")
+                elif day_of_month >= 25:
+                    correlation_insights.append("异常发生在月末(后5天)，可能与月度销售目标冲刺或预算耗尽相关")
             
             elif time_granularity == 'month':
                 # 分析季节性模式
-                if isinstance(abnormal_date, pd.Timestamp):
-                    month = abnormal_date.month
-                    season_map = {1: "冬季", 2: "冬季", 3: "春季", 4: "春季", 
-                                 5: "春季", 6: "夏季", 7: "夏季", 8: "夏季", 
-                                 9: "秋季", 10: "秋季", 11: "秋季", 12: "冬季"}
-                    
-                    correlation_insights.append(f"异常发生在{month}月({season_map[month]})，可能受季节性因素影响")
+                month = abnormal_date.month
+                season_map = {1: "冬季", 2: "冬季", 3: "春季", 4: "春季", 
+                             5: "春季", 6: "夏季", 7: "夏季", 8: "夏季", 
+                             9: "秋季", 10: "秋季", 11: "秋季", 12: "冬季"}
+                correlation_insights.append(f"异常发生在{month}月({season_map[month]})，可能受季节性因素影响")
         
         # 如果仍未生成任何洞察，提供一个通用分析
         if not correlation_insights:
@@ -2567,44 +2166,33 @@ def analyze_multidimensional_correlation(df, date_col, value_col, idx, time_gran
     
     return correlation_insights
 
-def suggest_anomaly_reasons(df, idx, date_col, value_col, direction, is_consecutive=False, consecutive_score=0, time_granularity='day'):
-    """为异常点提供可能的解释"""
+def _anomaly_reasons(ctx, pos, direction, is_consecutive=False, consecutive_score=0):
+    """根据预先计算的数组，为一个异常点提供可能的解释"""
     reasons = []
-    date = df.iloc[idx][date_col]
-    value = df.iloc[idx][value_col]
-    
-    # 时间粒度映射为中文单位
-    time_unit_map = {
-        'day': '日',
-        'week': '周',
-        'month': '月',
-        'quarter': '季度',
-        'year': '年'
-    }
-    time_unit = time_unit_map.get(time_granularity, '日')
+    time_granularity = ctx['time_granularity']
+    time_unit = ctx['time_unit']
+    values = ctx['values']
+    n = len(values)
+    date = ctx['dates'].iloc[pos]
+    value = values[pos]
     
     # 处理连续异常信息
     if is_consecutive:
         if consecutive_score >= 0.9:
-            streak_info = f"连续高强度异常 (强度: {consecutive_score:.2f}，所有时间点均异常)"
-            reasons.append(streak_info)
+            reasons.append(f"连续高强度异常 (强度: {consecutive_score:.2f}，所有时间点均异常)")
             reasons.append(f"可能是持续性系统问题或重大商业活动{time_unit}级影响")
         elif consecutive_score >= 0.7:
-            streak_info = f"连续中高强度异常 (强度: {consecutive_score:.2f}，大部分时间点异常)"
-            reasons.append(streak_info)
+            reasons.append(f"连续中高强度异常 (强度: {consecutive_score:.2f}，大部分时间点异常)")
             reasons.append(f"可能是正在发展的{time_unit}度趋势变化或持续性市场波动")
         else:
-            streak_info = f"连续异常 (强度: {consecutive_score:.2f}，部分时间点异常)"
-            reasons.append(streak_info)
+            reasons.append(f"连续异常 (强度: {consecutive_score:.2f}，部分时间点异常)")
             reasons.append(f"可能是短期{time_unit}度市场波动的开始或局部业务调整")
     
-    # 1. 检查是否为节假日
-    if isinstance(date, pd.Timestamp):
+    # 1. 检查是否为节假日（整列的节假日标记已预先计算）
+    if isinstance(date, pd.Timestamp) and ctx['holiday_flags'][pos]:
         is_hol, holiday_name, patterns = is_holiday(date)
         if is_hol:
-            if direction == '上升' and patterns:
-                reasons.append(f"{holiday_name}: {random.choice(patterns)}")
-            elif direction == '下降' and patterns:
+            if patterns:
                 reasons.append(f"{holiday_name}: {random.choice(patterns)}")
             else:
                 reasons.append(f"{holiday_name}期间{time_unit}销售{direction}")
@@ -2632,13 +2220,9 @@ def suggest_anomaly_reasons(df, idx, date_col, value_col, direction, is_consecut
     
     # 4. 检查前后变化幅度
     try:
-        # 找到前一个和后一个记录的索引
-        date_sorted = df.sort_values(by=date_col)
-        current_idx = date_sorted.index.get_indexer([df.index[idx]])[0]
-        
-        if current_idx > 0 and current_idx < len(date_sorted) - 1:
-            prev_value = date_sorted.iloc[current_idx-1][value_col]
-            next_value = date_sorted.iloc[current_idx+1][value_col]
+        if 0 < pos < n - 1:
+            prev_value = values[pos - 1]
+            next_value = values[pos + 1]
             
             prev_change = (value - prev_value) / prev_value if prev_value != 0 else 0
             next_change = (next_value - value) / value if value != 0 else 0
@@ -2646,13 +2230,12 @@ def suggest_anomaly_reasons(df, idx, date_col, value_col, direction, is_consecut
             # 检查销售模式
             if direction == '上升':
                 # 如果是突然的上升异常点，且不是连续上升中
-                if prev_change > 0.3 and not (current_idx > 1 and date_sorted.iloc[current_idx-2][value_col] < prev_value):
+                if prev_change > 0.3 and not (pos > 1 and values[pos - 2] < prev_value):
                     reasons.append(f"突发性{time_unit}销售高峰，可能是促销活动或大客户订单")
                     
                 # 检查是否是持续上升中的加速点
-                if current_idx > 1 and prev_value > date_sorted.iloc[current_idx-2][value_col]:
-                    # 安全检查以避免除以零
-                    prev_prev_value = date_sorted.iloc[current_idx-2][value_col]
+                if pos > 1 and prev_value > values[pos - 2]:
+                    prev_prev_value = values[pos - 2]
                     if prev_prev_value != 0:  # 确保不会除以零
                         prev_prev_change = (prev_value - prev_prev_value) / prev_prev_value
                         if prev_change > 2 * prev_prev_change:
@@ -2660,10 +2243,9 @@ def suggest_anomaly_reasons(df, idx, date_col, value_col, direction, is_consecut
                 
             elif direction == '下降':
                 # 检查这是否是高峰之后的下降
-                window_size = min(5, current_idx)
+                window_size = min(5, pos)
                 if window_size >= 3:
-                    # 检查前几天是否有明显的高峰
-                    window_values = date_sorted.iloc[current_idx-window_size:current_idx][value_col].values
+                    window_values = values[pos - window_size:pos]
                     peak_idx = np.argmax(window_values)
                     peak_value = window_values[peak_idx]
                     
@@ -2673,25 +2255,19 @@ def suggest_anomaly_reasons(df, idx, date_col, value_col, direction, is_consecut
                         time_unit_text = {'day': '天', 'week': '周', 'month': '月', 'quarter': '季度', 'year': '年'}.get(time_granularity, '个时间单位')
                         reasons.append(f"临时促销活动后的{time_unit}销量回落（距离峰值约{days_since_peak}{time_unit_text}）")
                 
-                # 对比同环比下降
-                if current_idx >= 7 and isinstance(date, pd.Timestamp) and time_granularity == 'day':
-                    try:
-                        # 对比上周同一天
-                        week_ago_idx = date_sorted[date_sorted[date_col] == date - pd.Timedelta(days=7)].index
-                        if len(week_ago_idx) > 0:
-                            week_ago_value = date_sorted.loc[week_ago_idx[0], value_col]
-                            week_change = (value - week_ago_value) / week_ago_value if week_ago_value != 0 else 0
-                            if week_change < -0.3:
-                                reasons.append(f"环比上周同期下降{abs(week_change)*100:.1f}%")
-                    except:
-                        pass
+                # 对比上周同一天
+                if pos >= 7 and isinstance(date, pd.Timestamp) and time_granularity == 'day':
+                    week_ago_pos = ctx['week_ago'][pos]
+                    if week_ago_pos >= 0:
+                        week_ago_value = values[week_ago_pos]
+                        week_change = (value - week_ago_value) / week_ago_value if week_ago_value != 0 else 0
+                        if week_change < -0.3:
+                            reasons.append(f"环比上周同期下降{abs(week_change)*100:.1f}%")
             
-            # 以下是之前的检测逻辑，但进行了修改
             # 检查是否是局部峰值后的下降
             if next_change < -0.2:
                 # 只有当前不是最高点时，才可能是"销量回落"
                 if direction == '下降' and prev_change < 0:
-                    # 表示已经开始下降
                     reasons.append(f"下降趋势延续，可能是临时促销效应{time_unit}消退")
             # 检查是否是低谷后的反弹        
             elif prev_change < -0.3 and next_change > 0.2:
@@ -2709,23 +2285,29 @@ def suggest_anomaly_reasons(df, idx, date_col, value_col, direction, is_consecut
                     reasons.append(f"显著的持续{time_unit}下滑趋势，可能面临市场挑战或竞争加剧")
                 else:
                     reasons.append(f"{time_unit}销售持续下滑趋势")
+        
+        # 对比去年同期
+        last_year_pos = ctx['last_year'][pos]
+        if last_year_pos >= 0 and values[last_year_pos] > 0:
+            year_change = (value - values[last_year_pos]) / values[last_year_pos]
+            if direction == '上升' and year_change > 0.3:
+                reasons.append(f"较去年同期增长{year_change*100:.1f}%")
+            elif direction == '下降' and year_change < -0.3:
+                reasons.append(f"较去年同期下降{abs(year_change)*100:.1f}%")
     except Exception as e:
         print(f"分析前后变化时出错: {str(e)}")
     
     # 5. 业务导向的异常解析
-    business_reasons = analyze_business_impact(df, idx, date_col, value_col, direction, time_granularity)
-    # 如果有业务相关的原因解释，添加到原因列表
+    business_reasons = _business_impact_reasons(ctx, pos, direction)
     if business_reasons:
-        # 添加分隔标题
         reasons.append("业务影响分析:")
         # 添加业务原因（最多3个，避免信息过多）
         for br in business_reasons[:3]:
             reasons.append(f"· {br}")
     
     # 6. 多维度数据相关性分析
-    multidim_insights = analyze_multidimensional_correlation(df, date_col, value_col, idx, time_granularity)
+    multidim_insights = _correlation_insights(ctx, pos)
     if multidim_insights:
-        # 添加分隔标题
         reasons.append("多维度相关性分析:")
         # 添加相关性洞察（最多3个）
         for insight in multidim_insights[:3]:
@@ -2742,10 +2324,97 @@ def suggest_anomaly_reasons(df, idx, date_col, value_col, direction, is_consecut
     
     return reasons
 
-def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutive=True, time_granularity='day'):
+def explain_anomalies(df, positions, date_col, value_col, directions, is_consecutive=None, consecutive_scores=None,
+                      time_granularity='day', cancel_check=None):
+    """
+    批量为异常点提供可能的解释
+    
+    整个序列的滚动基线、上周同日/去年同期、星期几和节假日标记只计算一次，
+    每个异常点只读取这些数组及固定大小的窗口，耗时与 序列长度 + 异常点数量 成正比。
+    
+    参数:
+    - df: 数据框
+    - positions: 异常点在df中的位置列表
+    - date_col: 日期列名
+    - value_col: 值列名
+    - directions: 每个异常点的方向 ('上升' 或 '下降')
+    - is_consecutive: 每个异常点是否在连续异常区间内（可选）
+    - consecutive_scores: 每个异常点的连续异常强度（可选）
+    - time_granularity: 时间粒度，可选值: 'day', 'week', 'month', 'quarter', 'year'
+    - cancel_check: 可选的取消检查回调，每个异常点分析前调用一次
+    
+    返回:
+    - 与positions顺序一致的原因列表
+    """
+    if len(positions) == 0:
+        return []
+    df_sorted, sorted_positions = _sort_for_explain(df, date_col, positions)
+    ctx = _build_explain_context(df_sorted, date_col, value_col, time_granularity)
+    
+    if is_consecutive is None:
+        is_consecutive = [False] * len(positions)
+    if consecutive_scores is None:
+        consecutive_scores = [0] * len(positions)
+    
+    reasons = []
+    for pos, direction, consecutive, score in zip(sorted_positions, directions, is_consecutive, consecutive_scores):
+        if cancel_check is not None:
+            cancel_check()
+        reasons.append(_anomaly_reasons(ctx, int(pos), direction, bool(consecutive), score))
+    return reasons
+
+def analyze_business_impact(df, idx, date_col, value_col, direction, time_granularity='day'):
+    """
+    分析销售异常对业务的具体影响，提供业务导向的异常解释
+    
+    参数:
+    - df: 数据框
+    - idx: 异常点索引
+    - date_col: 日期列名
+    - value_col: 值列名
+    - direction: 异常方向 ('上升' 或 '下降')
+    - time_granularity: 时间粒度，可选值: 'day', 'week', 'month', 'quarter', 'year'
+    
+    返回:
+    - business_reasons: 业务导向的解释列表
+    """
+    df_sorted, positions = _sort_for_explain(df, date_col, [idx])
+    ctx = _build_explain_context(df_sorted, date_col, value_col, time_granularity)
+    return _business_impact_reasons(ctx, int(positions[0]), direction)
+
+def analyze_multidimensional_correlation(df, date_col, value_col, idx, time_granularity='day'):
+    """
+    分析多维度数据与销售异常的相关性，提供更全面的异常原因解释
+    
+    参数:
+    - df: 数据框
+    - date_col: 日期列名
+    - value_col: 销售值列名
+    - idx: 异常点索引
+    - time_granularity: 时间粒度，可选值: 'day', 'week', 'month', 'quarter', 'year'
+    
+    返回:
+    - correlation_insights: 相关性分析结果列表
+    """
+    df_sorted, positions = _sort_for_explain(df, date_col, [idx])
+    ctx = _build_explain_context(df_sorted, date_col, value_col, time_granularity)
+    return _correlation_insights(ctx, int(positions[0]))
+
+def suggest_anomaly_reasons(df, idx, date_col, value_col, direction, is_consecutive=False, consecutive_score=0, time_granularity='day'):
+    """为异常点提供可能的解释（单个异常点，多个异常点请使用explain_anomalies）"""
+    return explain_anomalies(df, [idx], date_col, value_col, [direction], [is_consecutive], [consecutive_score],
+                             time_granularity)[0]
+
+def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutive=True, time_granularity='day',
+                     top_k=20, chunk_size=ANOMALY_CHUNK_SIZE, return_summary=False,
+                     spike_prominence=SPIKE_PROMINENCE_THRESHOLD, spike_max_gap=SPIKE_MAX_GAP_DAYS,
+                     detect_troughs=False, cancel_check=None):
     """
     检测销售数据中的异常点，使用多维度异常评分，包括连续异常检测
     
+    所有数据点都参与评分（全分辨率，按chunk_size分块计算），只有最显著的top_k个异常点
+    进入逐点的原因分析。
+    
     参数:
     - df: 数据框
     - date_col: 日期列名
@@ -2753,15 +2422,15 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
     - z_threshold: 异常阈值，默认2.5
     - detect_consecutive: 是否检测连续异常，默认True
     - time_granularity: 时间粒度，可选值: 'day', 'week', 'month', 'quarter', 'year'
+    - top_k: 进行原因分析并返回的最大异常点数量，默认20
+    - chunk_size: 分块评分时每块的数据点数
+    - return_summary: 为True时返回 (anomalies, summary)，summary包含评分和分析的点数
+    - spike_prominence: 尖峰模式的显著度阈值，默认0.3
+    - spike_max_gap: 尖峰与前后数据点的最大允许间隔（天），默认7
+    - detect_troughs: 是否同时检测低谷模式（突然下降后迅速恢复），默认False
+    - cancel_check: 可选的取消检查回调，在分块评分和逐点分析的循环中调用，任务取消时由它抛出异常
     """
-    # 检查数据量，大数据集进行抽样
-    if len(df) > 10000:
-        # 对于大数据集，仅取周期性样本
-        sampling_rate = max(1, len(df) // 5000)  # 最多5000个样本点
-        df_sample = df.iloc[::sampling_rate].copy()
-        print(f"异常检测: 数据量大，从{len(df)}行抽样到{len(df_sample)}行")
-    else:
-        df_sample = df.copy()
+    df_sample = df.copy()
     
     # 确保日期列是时间类型 - 对业务分析很重要
     try:
@@ -2769,161 +2438,53 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
             df_sample[date_col] = pd.to_datetime(df_sample[date_col], errors='coerce')
     except Exception as e:
         print(f"转换日期列时出错: {str(e)}")
+    
+    # 按日期排序一次，之后所有按位置的数组都与排序后的数据对应
+    df_sample = df_sample.sort_values(by=date_col, kind='stable').reset_index(drop=True)
+    values = df_sample[value_col].to_numpy(dtype=float)
         
-    # 使用多维度异常评分
-    combined_scores, individual_scores, threshold_votes, anomaly_directions = calculate_multidimensional_anomaly_score(
-        df_sample[value_col]
-    )
+    # 使用多维度异常评分（上升和下降异常数量悬殊时，为较少的一方放宽阈值）
+    flags, score_stats = score_anomalies_chunked(values, chunk_size=chunk_size, z_threshold=z_threshold,
+                                                 cancel_check=cancel_check)
+    combined_scores = flags['score']
+    threshold_votes = flags['votes']
+    anomaly_directions = flags['direction']
     
     #print("\n===== 异常检测均衡性分析 =====")
     # 统计上升和下降的异常
     up_anomalies = np.sum(anomaly_directions > 0)
     down_anomalies = np.sum(anomaly_directions < 0)
-    total_potential = np.sum((combined_scores > z_threshold) & (threshold_votes >= 2))
-    #print(f"检测到的潜在异常总数: {total_potential}")
-    
-    # 安全计算百分比，避免除以零
-    up_percent = (up_anomalies/total_potential*100) if total_potential > 0 else 0
-    down_percent = (down_anomalies/total_potential*100) if total_potential > 0 else 0
     
-    #print(f"上升异常: {up_anomalies} ({up_percent:.1f}%)")
-    #print(f"下降异常: {down_anomalies} ({down_percent:.1f}%)")
-    
-    if total_potential > 0 and up_anomalies > down_anomalies * 2 and down_anomalies > 0:
+    if up_anomalies > down_anomalies * 2 and down_anomalies > 0:
         print("警告: 检测到的上升异常显著多于下降异常，可能存在偏差")
-        # 调整下降异常的敏感度
-        z_threshold_down = z_threshold * 0.85  # 为下降异常提供更宽松的阈值
-        print(f"正在调整下降异常阈值为: {z_threshold_down:.2f} (标准阈值: {z_threshold})")
+        print(f"正在调整下降异常阈值为: {z_threshold * 0.85:.2f} (标准阈值: {z_threshold})")
     elif down_anomalies > up_anomalies * 2 and up_anomalies > 0:
         print("警告: 检测到的下降异常显著多于上升异常，可能存在偏差")
-        # 调整上升异常的敏感度
-        z_threshold_up = z_threshold * 0.85  # 为上升异常提供更宽松的阈值
-        print(f"正在调整上升异常阈值为: {z_threshold_up:.2f} (标准阈值: {z_threshold})")
-    else:
-        z_threshold_up = z_threshold_down = z_threshold
-        #print("检测平衡正常，上升和下降异常分布合理")
+        print(f"正在调整上升异常阈值为: {z_threshold * 0.85:.2f} (标准阈值: {z_threshold})")
     
-    # 找出超过阈值的基础异常点 - 区分上升和下降
-    anomaly_markers = np.zeros(len(df_sample), dtype=bool)
-    for i in range(len(df_sample)):
-        if anomaly_directions[i] > 0:  # 上升异常
-            anomaly_markers[i] = (combined_scores[i] > z_threshold_up) and (threshold_votes[i] >= 2)
-        elif anomaly_directions[i] < 0:  # 下降异常
-            anomaly_markers[i] = (combined_scores[i] > z_threshold_down) and (threshold_votes[i] >= 2)
+    # 超过阈值的基础异常点 - 区分上升和下降
+    anomaly_markers = flags['is_anomaly']
     
     # 新增: 检测尖峰模式异常 (上升后立即下降的模式)
     #print("\n===== 尖峰模式检测 =====")
     #print("检测销售数据中的尖峰模式(突然上升后迅速下降)")
     
-    # 初始化尖峰模式标记
+    # 数据已按日期排序，尖峰/低谷检测全部使用数组运算
+    spikes = detect_spike_patterns(values, df_sample[date_col].to_numpy(), prominence=spike_prominence,
+                                   max_gap=spike_max_gap, detect_troughs=detect_troughs)
     pattern_markers = {
-        "spike_pattern": np.zeros(len(df_sample), dtype=bool),  # 是否为尖峰模式
-        "spike_prominence": np.zeros(len(df_sample))            # 尖峰显著程度
+        "spike_pattern": spikes['is_pattern'],    # 是否为尖峰（或低谷）模式
+        "spike_prominence": spikes['prominence'],  # 尖峰显著程度
+        "spike_kind": spikes['kind']               # 1=尖峰, -1=低谷
     }
     
-    # 确保数据按日期排序
-    df_sorted = df_sample.sort_values(by=date_col).reset_index(drop=True)
-    
-    # 提取销售值并处理无效数据
-    values = df_sorted[value_col].values
-    dates = df_sorted[date_col].values
-    
-    # 检查无效数据
-    valid_mask = ~np.isnan(values) & (values != 0)  # 非NaN且非零值
-    #print(f"检测到{np.sum(~valid_mask)}个无效数据点(NaN或零值)，将在尖峰检测中排除")
-    
-    # 只在有足够有效数据点的情况下进行尖峰检测
-    if np.sum(valid_mask) > 5:  # 至少需要5个有效点
-        # 创建有效数据的副本以进行计算
-        valid_indices = np.where(valid_mask)[0]
-        valid_values = values[valid_mask]
-        valid_dates = dates[valid_mask]
-        
-        # 计算移动平均线(作为基线)，仅使用有效数据
-        window_size = max(3, min(7, len(valid_values) // 20))  # 窗口大小根据有效数据量调整
-        if len(valid_values) > window_size * 2:
-            # 计算移动平均作为基线
-            baseline = np.convolve(valid_values, np.ones(window_size)/window_size, mode='same')
-            
-            # 查找潜在尖峰（仅在有效数据中查找）
-            spike_count = 0
-            for i in range(window_size, len(valid_values) - window_size):
-                # 确保前后点都是有效的连续数据
-                if i > 0 and i < len(valid_values) - 1:
-                    # 获取真实索引
-                    real_idx = valid_indices[i]
-                    # 获取前后的真实索引
-                    prev_real_idx = valid_indices[i-1] if i-1 >= 0 else None
-                    next_real_idx = valid_indices[i+1] if i+1 < len(valid_indices) else None
-                    
-                    # 计算前后数据点的间隔（以天为单位）
-                    date_gaps_ok = True
-                    if prev_real_idx is not None and next_real_idx is not None:
-                        try:
-                            # 将日期转换为datetime对象
-                            current_date = pd.to_datetime(dates[real_idx])
-                            prev_date = pd.to_datetime(dates[prev_real_idx])
-                            next_date = pd.to_datetime(dates[next_real_idx])
-                            
-                            # 计算日期间隔（天数）
-                            days_to_prev = (current_date - prev_date).days
-                            days_to_next = (next_date - current_date).days
-                            
-                            # 确保日期间隔合理（防止长时间无数据的情况）
-                            max_gap = 7  # 最大允许间隔7天
-                            if days_to_prev > max_gap or days_to_next > max_gap:
-                                date_gaps_ok = False
-                        except:
-                            # 日期转换失败，保守处理
-                            date_gaps_ok = False
-                    
-                    # 只有当日期间隔合理时才进行尖峰检测
-                    if date_gaps_ok and valid_values[i] > valid_values[i-1] and valid_values[i] > valid_values[i+1]:
-                        # 计算相对于移动平均的显著程度
-                        prominence = (valid_values[i] - baseline[i]) / (baseline[i] if baseline[i] > 0 else 1)
-                        
-                        # 计算相对于前后点的显著程度
-                        rel_to_prev = (valid_values[i] - valid_values[i-1]) / (valid_values[i-1] if valid_values[i-1] > 0 else 1)
-                        rel_to_next = (valid_values[i] - valid_values[i+1]) / (valid_values[i+1] if valid_values[i+1] > 0 else 1)
-                        
-                        # 综合显著程度
-                        overall_prominence = (prominence + rel_to_prev + rel_to_next) / 3
-                        
-                        # 如果尖峰足够显著，标记为尖峰模式
-                        if overall_prominence > 0.3:  # 尖峰显著度阈值
-                            # 找到排序前的索引（在原始df_sample中的位置）
-                            orig_idx = df_sorted.index[real_idx]
-                            # 标记为尖峰模式
-                            pattern_markers["spike_pattern"][orig_idx] = True
-                            pattern_markers["spike_prominence"][orig_idx] = overall_prominence
-                            spike_count += 1
-            
-            #print(f"检测到{spike_count}个尖峰模式")
-            
-            # 尖峰显著度分布
-            if spike_count > 0:
-                high_prom = np.sum(pattern_markers["spike_prominence"] > 0.6)
-                med_prom = np.sum((pattern_markers["spike_prominence"] > 0.4) & (pattern_markers["spike_prominence"] <= 0.6))
-                low_prom = np.sum((pattern_markers["spike_prominence"] > 0.3) & (pattern_markers["spike_prominence"] <= 0.4))
-                
-                #print(f"尖峰显著度分布:")
-                #print(f"- 高显著度(>0.6): {high_prom}个")
-                #print(f"- 中显著度(0.4-0.6): {med_prom}个")
-                #print(f"- 低显著度(0.3-0.4): {low_prom}个")
-        else:
-            print(f"有效数据点不足({np.sum(valid_mask)}个)，无法可靠计算尖峰模式")
-    else:
-        print(f"有效数据点不足({np.sum(valid_mask)}个)，跳过尖峰模式检测")
-    
     # 将尖峰模式添加到异常标记中
-    combined_anomaly_markers = anomaly_markers.copy()
-    for i in range(len(df_sample)):
-        if pattern_markers["spike_pattern"][i]:
-            combined_anomaly_markers[i] = True
+    combined_anomaly_markers = anomaly_markers | pattern_markers["spike_pattern"]
     
     # 执行连续异常检测（如果启用）
     consecutive_scores = np.zeros(len(df_sample))
     is_in_streak = np.zeros(len(df_sample), dtype=bool)
+    anomaly_streaks = []
     
     if detect_consecutive and len(df_sample) >= 3:
         #print("\n===== 连续异常检测 =====")
@@ -2934,15 +2495,8 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
             if not pd.api.types.is_datetime64_any_dtype(df_sample[date_col]):
                 df_sample[date_col] = pd.to_datetime(df_sample[date_col], errors='coerce')
             
-            # 排序数据 
-            df_sample = df_sample.sort_values(by=date_col).reset_index(drop=False)
-            
-            # 获取原始索引的映射
-            original_index = df_sample['index'].values
-            df_sample = df_sample.drop(columns=['index'])
-            
             # 检测连续异常 - 使用合并后的异常标记
-            consecutive_scores, is_in_streak = detect_consecutive_anomalies(
+            consecutive_scores, is_in_streak, anomaly_streaks = detect_consecutive_anomalies(
                 df_sample, 
                 date_col, 
                 combined_anomaly_markers,
@@ -2998,42 +2552,31 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
     final_spike = 0  # 新增：尖峰异常统计
     
     # 限制异常点数量，避免过多
-    if len(anomalies_idx) > 20:
-        #print(f"\n检测到{len(anomalies_idx)}个异常点，将只显示最显著的20个")
+    flagged_count = len(anomalies_idx)
+    if len(anomalies_idx) > top_k:
+        #print(f"\n检测到{len(anomalies_idx)}个异常点，将只显示最显著的{top_k}个")
         # 创建组合分数，包含连续异常加权和尖峰模式优先级
         final_scores = combined_scores.copy()
         if detect_consecutive:
             final_scores += consecutive_scores * 1.5  # 连续异常权重更高
         
-        # 提升尖峰模式的优先级
-        for i in range(len(df_sample)):
-            if pattern_markers["spike_pattern"][i]:
-                # 尖峰显著度越高，优先级越高
-                final_scores[i] += pattern_markers["spike_prominence"][i] * 2.0
+        # 提升尖峰模式的优先级（尖峰显著度越高，优先级越高）
+        spike_mask = pattern_markers["spike_pattern"]
+        final_scores[spike_mask] += pattern_markers["spike_prominence"][spike_mask] * 2.0
             
         # 分别为不同类型异常排序
-        up_idx = [idx for idx in anomalies_idx if anomaly_directions[idx] > 0 and not pattern_markers["spike_pattern"][idx]]
-        down_idx = [idx for idx in anomalies_idx if anomaly_directions[idx] < 0 and not pattern_markers["spike_pattern"][idx]]
-        spike_idx = [idx for idx in anomalies_idx if pattern_markers["spike_pattern"][idx]]
+        is_spike = spike_mask[anomalies_idx]
+        up_idx = anomalies_idx[(anomaly_directions[anomalies_idx] > 0) & ~is_spike]
+        down_idx = anomalies_idx[(anomaly_directions[anomalies_idx] < 0) & ~is_spike]
+        spike_idx = anomalies_idx[is_spike]
         
         # 按显著程度排序
-        if len(up_idx) > 0:
-            up_sorted = up_idx[np.argsort(final_scores[up_idx])[::-1]]
-        else:
-            up_sorted = []
-            
-        if len(down_idx) > 0:
-            down_sorted = down_idx[np.argsort(final_scores[down_idx])[::-1]]
-        else:
-            down_sorted = []
-            
-        if len(spike_idx) > 0:
-            spike_sorted = spike_idx[np.argsort(pattern_markers["spike_prominence"][spike_idx])[::-1]]
-        else:
-            spike_sorted = []
+        up_sorted = up_idx[np.argsort(final_scores[up_idx])[::-1]]
+        down_sorted = down_idx[np.argsort(final_scores[down_idx])[::-1]]
+        spike_sorted = spike_idx[np.argsort(pattern_markers["spike_prominence"][spike_idx])[::-1]]
         
         # 平衡选择不同类型的异常
-        total_slots = min(20, len(anomalies_idx))
+        total_slots = min(top_k, len(anomalies_idx))
         
         # 计算各类型异常的占比
         total_anomalies = len(up_idx) + len(down_idx) + len(spike_idx)
@@ -3062,9 +2605,9 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
             #print(f"平衡选择: {up_slots}个上升异常，{down_slots}个下降异常，{spike_slots}个尖峰模式异常")
             
             # 选择最终要展示的异常点
-            selected_up = up_sorted[:up_slots] if up_slots > 0 else []
-            selected_down = down_sorted[:down_slots] if down_slots > 0 else []
-            selected_spike = spike_sorted[:spike_slots] if spike_slots > 0 else []
+            selected_up = up_sorted[:up_slots]
+            selected_down = down_sorted[:down_slots]
+            selected_spike = spike_sorted[:spike_slots]
             
             # 合并选定的点
             anomalies_idx = np.concatenate((selected_up, selected_down, selected_spike)) if len(selected_up) + len(selected_down) + len(selected_spike) > 0 else anomalies_idx
@@ -3075,7 +2618,7 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
             final_spike = len(selected_spike)
         else:
             # 如果按类型分类后没有异常，则使用原始排序
-            sorted_idx = np.argsort(final_scores[anomalies_idx])[::-1][:20]
+            sorted_idx = np.argsort(final_scores[anomalies_idx])[::-1][:top_k]
             anomalies_idx = anomalies_idx[sorted_idx]
     else:
         # 计算最终选择的不同类型异常数量
@@ -3146,17 +2689,44 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
         else:
             return date_value.strftime('%Y-%m-%d')  # 默认使用日期格式
     
-    for idx in anomalies_idx:
+    # 每个点所在的连续异常区间
+    streak_of_point = {}
+    for streak in anomaly_streaks:
+        for position in range(streak['start'], streak['end'] + 1):
+            streak_of_point[position] = streak
+    
+    # 只为需要分析的异常点计算各维度分数
+    anomalies_idx = np.asarray(anomalies_idx, dtype=int)
+    point_scores = score_points(values, anomalies_idx, score_stats)
+    
+    # 常规异常的原因一次性批量生成，整个序列的基线等只计算一次
+    regular_idx = [int(idx) for idx in anomalies_idx if not pattern_markers["spike_pattern"][idx]]
+    regular_reasons = dict(zip(regular_idx, explain_anomalies(
+        df_sample, regular_idx, date_col, value_col,
+        ['上升' if anomaly_directions[idx] > 0 else '下降' for idx in regular_idx],
+        is_consecutive=[is_in_streak[idx] for idx in regular_idx],
+        consecutive_scores=[consecutive_scores[idx] for idx in regular_idx],
+        time_granularity=time_granularity,
+        cancel_check=cancel_check
+    )))
+    
+    for position, idx in enumerate(anomalies_idx):
+        if cancel_check is not None:
+            cancel_check()
         anomaly_date = df_sample.iloc[idx][date_col]
         value = df_sample.iloc[idx][value_col]
         
         # 获取各维度分数
-        zscore = individual_scores["zscore"][idx]
-        iqr_score = individual_scores["iqr"][idx]
-        mad_score = individual_scores["mad"][idx]
+        zscore = point_scores["zscore"][position]
+        iqr_score = point_scores["iqr"][position]
+        mad_score = point_scores["mad"][position]
         
         # 判断异常类型和方向
-        if pattern_markers["spike_pattern"][idx]:
+        if pattern_markers["spike_pattern"][idx] and pattern_markers["spike_kind"][idx] < 0:
+            # 低谷模式异常
+            anomaly_type = "低谷模式"
+            direction = "低谷"  # 特殊方向标记
+        elif pattern_markers["spike_pattern"][idx]:
             # 尖峰模式异常
             anomaly_type = "尖峰模式"
             direction = "尖峰"  # 特殊方向标记
@@ -3185,8 +2755,8 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
             # 添加业务影响分析
             try:
                 # 尖峰后续趋势分析
-                df_sorted = df_sample.sort_values(by=date_col).reset_index(drop=True)
-                current_pos = df_sorted[df_sorted[date_col] == anomaly_date].index[0]
+                df_sorted = df_sample  # 数据已按日期排序
+                current_pos = int(idx)
                 
                 # 获取尖峰点前后的数据进行分析
                 pre_spike_idx = max(0, current_pos - 2)
@@ -3204,12 +2774,35 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
                         reasons.append(f"尖峰后销售回归至基准水平，属于典型的短期促销模式")
             except Exception as e:
                 print(f"尖峰后续分析出错: {str(e)}")
+        elif anomaly_type == "低谷模式":
+            # 低谷模式：突然下降后迅速恢复
+            prominence = pattern_markers["spike_prominence"][idx]
+            reasons = [
+                f"检测到销售低谷模式(显著度: {prominence:.2f})",
+                f"突然下降后快速恢复的模式，典型的断货、系统故障或临时停业特征"
+            ]
+            
+            if prominence > 0.6:
+                reasons.append(f"非常显著的低谷，建议核查当{TIME_GRANULARITY_NAMES.get(time_granularity, '日')}的供应和系统状态")
+            elif prominence > 0.4:
+                reasons.append(f"中等显著的低谷，可能是临时缺货或渠道中断")
+            else:
+                reasons.append(f"轻微低谷，可能是短暂的客流波动")
+            
+            # 低谷前后的销售水平对比
+            current_pos = int(idx)
+            if 0 < current_pos < len(values) - 1:
+                pre_value = values[max(0, current_pos - 2)]
+                post_value = values[min(len(values) - 1, current_pos + 2)]
+                if post_value < pre_value:
+                    reasons.append(f"低谷后销售未恢复至之前水平，影响可能仍在持续")
+                elif post_value > pre_value:
+                    reasons.append(f"低谷后销售高于之前水平，可能存在被延后的需求集中释放")
+                else:
+                    reasons.append(f"低谷后销售回归至基准水平，属于一次性的短期影响")
         else:
             # 常规异常处理
-            reasons = suggest_anomaly_reasons(df_sample, idx, date_col, value_col, direction, 
-                                          is_consecutive=is_in_streak[idx], 
-                                          consecutive_score=consecutive_scores[idx],
-                                          time_granularity=time_granularity)
+            reasons = regular_reasons[int(idx)]
         
         # 使用根据时间粒度格式化的日期
         formatted_date = format_date_by_granularity(anomaly_date, time_granularity)
@@ -3228,56 +2821,300 @@ def detect_anomalies(df, date_col, value_col, z_threshold=2.5, detect_consecutiv
             'anomaly_type': anomaly_type,  # 新增：异常类型
             'consecutive': float(consecutive_scores[idx]) if detect_consecutive else 0,
             'is_in_streak': bool(is_in_streak[idx]) if detect_consecutive else False,
+            'streak': streak_of_point.get(int(idx)) if is_in_streak[idx] else None,  # 所在的连续异常区间
             'spike_prominence': float(pattern_markers["spike_prominence"][idx]) if pattern_markers["spike_pattern"][idx] else 0.0,  # 新增：尖峰显著度
             'reasons': reasons
         }
         
         anomalies.append(anomaly_info)
     
+    if return_summary:
+        summary = {
+            'total_points': int(len(df)),
+            'scored_points': int(len(values)),
+            'flagged_points': int(flagged_count),
+            'explained_points': int(len(anomalies)),
+            'streak_count': int(len(anomaly_streaks))
+        }
+        print(f"异常检测: 评分{summary['scored_points']}个点，标记{summary['flagged_points']}个异常，"
+              f"分析其中{summary['explained_points']}个")
+        return anomalies, summary
     return anomalies
 
+# 分组（多序列）分析
+GROUP_TREND_TOP_N = 10  # 每个排行榜返回的分组数
+GROUP_DETAIL_COUNT = 5  # 进行完整异常分析（含原因）的分组数
+GROUP_DETAIL_ANOMALIES = 5  # 每个详细分析分组返回的异常点数量
+GROUP_POOL_MIN_POINTS = 50000  # 详细分析的数据点总数超过该值时并行执行
+GROUP_DETAIL_WORKERS = int(os.environ.get('GROUP_DETAIL_WORKERS', max(1, min(4, os.cpu_count() or 1))))
+
+# 所有请求共用的分组详细分析线程池（不在处理请求的线程中fork进程）
+# 取消时排队的分组直接丢弃，正在执行的分组在detect_anomalies的下一次cancel_check时中断
+group_detail_executor = ThreadPoolExecutor(max_workers=GROUP_DETAIL_WORKERS, thread_name_prefix='group-trend')
+
+# 各分析类型用于排名涨跌幅的指标
+GROUP_RANKING_METRICS = {
+    'trend': 'trend_slope',
+    'year_over_year': 'yoy_change',
+    'month_over_month': 'mom_change'
+}
+
+def aggregate_groups_by_time(df, date_col, value_col, group_col, granularity):
+    """
+    按分组和时间粒度在一次groupby中聚合所有分组
+    
+    返回:
+    - periods: 所有分组共用的连续时间区间（DatetimeIndex）
+    - groups: 分组标签
+    - matrix: [区间数, 分组数] 的汇总值，每个分组从第一个到最后一个有数据的区间之间没有数据的区间为0，之外为NaN
+    - observed: 与matrix形状相同，区间内是否有原始数据
+    """
+    freq = TIME_GRANULARITY_FREQ.get(granularity, 'D')
+    data = df.dropna(subset=[date_col, group_col])
+    aggregated = data.groupby([group_col, pd.Grouper(key=date_col, freq=freq)])[value_col].sum()
+    if aggregated.empty:
+        return pd.DatetimeIndex([]), pd.Index([]), np.zeros((0, 0)), np.zeros((0, 0), dtype=bool)
+    
+    table = aggregated.unstack(group_col)
+    periods = pd.date_range(table.index.min(), table.index.max(), freq=freq)
+    table = table.reindex(periods)
+    
+    observed = table.notna().to_numpy()
+    first = observed.argmax(axis=0)
+    last = len(periods) - 1 - observed[::-1].argmax(axis=0)
+    rows = np.arange(len(periods))[:, None]
+    active = (rows >= first) & (rows <= last)
+    matrix = np.where(active, table.fillna(0).to_numpy(dtype=float), np.nan)
+    return periods, table.columns, matrix, observed
+
+def _group_trend_metrics(periods, matrix, granularity):
+    """对所有分组同时计算汇总、增长率、趋势斜率、环比和同比（按列的向量化计算）"""
+    active = ~np.isnan(matrix)
+    columns = np.arange(matrix.shape[1])
+    counts = active.sum(axis=0)
+    filled = np.where(active, matrix, 0.0)
+    first_idx = active.argmax(axis=0)
+    last_idx = len(periods) - 1 - active[::-1].argmax(axis=0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = filled.sum(axis=0)
+        average = total / np.maximum(counts, 1)
+        
+        # 增长率：最后一期相对第一期（与analyze_trend一致）
+        first_val = matrix[first_idx, columns]
+        last_val = matrix[last_idx, columns]
+        growth_rate = np.where(first_val != 0, (last_val - first_val) / first_val * 100, 0.0)
+        
+        # 线性趋势斜率（最小二乘），换算为每期变化占均值的百分比
+        x = np.where(active, np.arange(len(periods))[:, None], 0.0)
+        sum_x = x.sum(axis=0)
+        denominator = counts * (x * x).sum(axis=0) - sum_x ** 2
+        slope = np.where(denominator > 0, (counts * (x * filled).sum(axis=0) - sum_x * total) / denominator, 0.0)
+        trend_slope = np.where(average != 0, slope / np.abs(average) * 100, 0.0)
+        
+        # 环比：最后一期相对前一期
+        prev_idx = last_idx - 1
+        prev_val = matrix[np.maximum(prev_idx, 0), columns]
+        mom_change = np.where((prev_idx >= first_idx) & (prev_val != 0), (last_val - prev_val) / prev_val * 100, np.nan)
+        
+        # 同比：最后一期相对去年同期（周粒度使用52周前）
+        if granularity == 'week':
+            last_year_dates = periods[last_idx] - pd.Timedelta(weeks=52)
+        else:
+            last_year_dates = periods[last_idx] - pd.DateOffset(years=1)
+        last_year_idx = periods.get_indexer(last_year_dates)
+        last_year_val = matrix[np.maximum(last_year_idx, 0), columns]
+        yoy_change = np.where((last_year_idx >= first_idx) & (last_year_val != 0),
+                              (last_val - last_year_val) / last_year_val * 100, np.nan)
+    
+    return {
+        'total': total,
+        'average': average,
+        'periods': counts,
+        'first_idx': first_idx,
+        'last_idx': last_idx,
+        'growth_rate': growth_rate,
+        'trend_slope': trend_slope,
+        'mom_change': mom_change,
+        'yoy_change': yoy_change
+    }
+
+def _group_detail(task, cancel_check=None):
+    """对单个分组进行完整的异常检测（含原因分析）；cancel_check传给detect_anomalies，任务取消时中断"""
+    label, dates, values, original, date_col, value_col, granularity = task
+    df = pd.DataFrame({date_col: dates, value_col: values, 'is_original_data': original})
+    try:
+        anomalies = detect_anomalies(df, date_col, value_col, time_granularity=granularity,
+                                     top_k=GROUP_DETAIL_ANOMALIES, cancel_check=cancel_check)
+    except TaskCancelled:
+        raise
+    except Exception as e:
+        print(f"分组 {label} 异常分析出错: {str(e)}")
+        anomalies = []
+    return label, anomalies
+
+def _run_group_details(tasks, cancel_check=None):
+    """执行分组的详细分析，数据量大时在共用的线程池（group_detail_executor）中并行执行
+
+    cancel_check: 可选的取消检查回调，传给每个分组的异常检测；取消时排队的分组不再执行，
+    正在执行的分组在下一次检查时中断
+    """
+    if len(tasks) < 2 or sum(len(task[2]) for task in tasks) < GROUP_POOL_MIN_POINTS:
+        results = []
+        for task in tasks:
+            if cancel_check is not None:
+                cancel_check()
+            results.append(_group_detail(task, cancel_check))
+        return results
+
+    futures = [group_detail_executor.submit(_group_detail, task, cancel_check) for task in tasks]
+    try:
+        return [future.result() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+
+def analyze_grouped_sales_trend(df, date_col, value_col, group_col, analysis_type='trend', time_granularity='day',
+                                top_n=GROUP_TREND_TOP_N, detail_count=GROUP_DETAIL_COUNT, z_threshold=2.5,
+                                cancel_check=None):
+    """
+    分组（多序列）销售趋势分析，例如按门店、SKU或地区
+    
+    一次groupby聚合所有分组，趋势、同比/环比和异常评分在所有分组上向量化计算，
+    只有排名靠前的detail_count个分组进行完整的异常原因分析（数据量大时并行）。
+    
+    参数:
+    - df: 已清洗日期列和值列的数据框
+    - date_col: 日期列名
+    - value_col: 值列名
+    - group_col: 分组维度列名
+    - analysis_type: 'trend'、'year_over_year' 或 'month_over_month'，决定涨跌排名使用的指标
+    - time_granularity: 时间粒度，可选值: 'day', 'week', 'month', 'quarter', 'year'
+    - top_n: 每个排行榜返回的分组数
+    - detail_count: 进行完整异常分析的分组数
+    - z_threshold: 异常阈值
+    - cancel_check: 可选的取消检查回调，在聚合、评分和详细分析之间调用
+    
+    返回:
+    - dict: groups（每个分组的汇总）、rankings（排行榜）、details（详细分析的分组）
+    """
+    ranking_metric = GROUP_RANKING_METRICS.get(analysis_type)
+    if ranking_metric is None:
+        raise ValueError(f"不支持的分析类型: {analysis_type}")
+    
+    periods, groups, matrix, observed = aggregate_groups_by_time(df, date_col, value_col, group_col, time_granularity)
+    if len(groups) == 0:
+        raise ValueError("没有可分析的分组数据")
+    print(f"分组分析: {len(groups)}个分组，{len(periods)}个{TIME_GRANULARITY_NAMES.get(time_granularity, '日')}")
+    if cancel_check is not None:
+        cancel_check()
+    
+    metrics = _group_trend_metrics(periods, matrix, time_granularity)
+    first_idx = metrics['first_idx']
+    last_idx = metrics['last_idx']
+    
+    # 各分组有数据的区间内的异常评分（等长的序列合并为二维数组一起计算）
+    series_list = [matrix[first_idx[g]:last_idx[g] + 1, g] for g in range(len(groups))]
+    scores = score_anomaly_batch(series_list, z_threshold=z_threshold)
+    if cancel_check is not None:
+        cancel_check()
+    up_anomalies = np.array([int(np.sum(s['is_anomaly'] & (s['direction'] > 0))) for s in scores])
+    down_anomalies = np.array([int(np.sum(s['is_anomaly'] & (s['direction'] < 0))) for s in scores])
+    
+    def to_float(value):
+        return None if np.isnan(value) else float(value)
+    
+    summaries = []
+    for g, label in enumerate(groups):
+        summaries.append({
+            'group': str(label),
+            'total': float(metrics['total'][g]),
+            'average': float(metrics['average'][g]),
+            'periods': int(metrics['periods'][g]),
+            'original_periods': int(observed[:, g].sum()),
+            'first_date': periods[first_idx[g]].strftime('%Y-%m-%d'),
+            'last_date': periods[last_idx[g]].strftime('%Y-%m-%d'),
+            'growth_rate': float(metrics['growth_rate'][g]),
+            'trend_slope': float(metrics['trend_slope'][g]),
+            'mom_change': to_float(metrics['mom_change'][g]),
+            'yoy_change': to_float(metrics['yoy_change'][g]),
+            'anomaly_count': int(up_anomalies[g] + down_anomalies[g]),
+            'up_anomalies': int(up_anomalies[g]),
+            'down_anomalies': int(down_anomalies[g])
+        })
+    
+    # 排行榜
+    ranking_values = metrics[ranking_metric]
+    ranked = np.flatnonzero(~np.isnan(ranking_values))
+    ranked = ranked[np.argsort(ranking_values[ranked], kind='stable')]
+    anomaly_count = up_anomalies + down_anomalies
+    rankings = {
+        'metric': ranking_metric,
+        'top_gainers': [summaries[g] for g in ranked[::-1] if ranking_values[g] > 0][:top_n],
+        'top_decliners': [summaries[g] for g in ranked if ranking_values[g] < 0][:top_n],
+        'most_anomalies': [summaries[g] for g in np.argsort(-anomaly_count, kind='stable') if anomaly_count[g] > 0][:top_n],
+        'top_total': [summaries[g] for g in np.argsort(-metrics['total'], kind='stable')][:top_n]
+    }
+    
+    # 异常最多的分组和涨跌幅最大的分组进行完整的异常原因分析
+    detail_groups = []
+    for item in rankings['most_anomalies'] + rankings['top_gainers'][:1] + rankings['top_decliners'][:1]:
+        if item['group'] not in detail_groups:
+            detail_groups.append(item['group'])
+    detail_groups = detail_groups[:detail_count]
+    
+    position = {str(label): g for g, label in enumerate(groups)}
+    tasks = []
+    for label in detail_groups:
+        g = position[label]
+        span = slice(first_idx[g], last_idx[g] + 1)
+        tasks.append((label, periods[span], matrix[span, g], observed[span, g], date_col, value_col, time_granularity))
+    
+    details = []
+    for (label, anomalies), task in zip(_run_group_details(tasks, cancel_check), tasks):
+        details.append({
+            'group': label,
+            'dates': [d.strftime('%Y-%m-%d') for d in task[1]],
+            'values': task[2].tolist(),
+            'anomalies': anomalies
+        })
+    
+    return {
+        'grouped': True,
+        'group_column': group_col,
+        'group_count': len(groups),
+        'period_count': len(periods),
+        'groups': summaries,
+        'rankings': rankings,
+        'details': details
+    }
+
 def get_analysis_suggestions():
-    """根据上传的数据文件，提供分析建议"""
+    """根据上传的数据文件，提供分析建议
+
+    在请求线程中执行，同样登记到trend_tasks，可以通过task_id取消（例如解析大文件期间）
+    """
+    task = trend_tasks.create(request.form.get('task_id'), owner=get_task_owner(),
+                              label='sales_trend:suggestions')
     try:
-        # 重置取消标志 - 每次新的请求都重置
-        global analysis_cancelled
-        analysis_cancelled = False
-        
-        # 创建唯一的任务ID
-        task_id = str(uuid.uuid4())
-        
-        # 获取用户信息
-        username = session.get('username', '匿名用户')
-        client_ip = request.remote_addr
-        
-        # 记录任务
-        ongoing_analyses[task_id] = {
-            'cancelled': False,
-            'start_time': datetime.now(),
-            'username': username,
-            'ip': client_ip,
-            'operation': 'file_preprocessing'
-        }
-        
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'message': '请上传数据文件'})
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'message': '未选择文件'})
+        task.set_stage('uploading')
         
         # 获取用户选择的工作表（如果有）
         sheet_name = request.form.get('sheet_name', None)
         #print(f"用户选择的工作表: {sheet_name}")
         
-        # 保存文件
-        temp_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 
-                              f"temp_{uuid.uuid4().hex[:8]}_{secure_filename(file.filename)}")
-        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-        file.save(temp_path)
+        # 保存文件（按内容哈希保存，之后的请求通过file_id复用同一个分析会话）
+        trend_session, error = get_trend_session()
+        if error:
+            return error
+        
+        # 同一文件、同一工作表的建议已生成过时直接返回
+        cached_response = trend_session.peek(('suggestions', sheet_name))
+        if cached_response is not None:
+            return jsonify(cached_response)
         
         # 检查是否取消
-        if is_analysis_cancelled(task_id):
+        if task.cancelled:
             print("文件保存后检测到取消请求，中止处理")
             return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
         
@@ -3285,11 +3122,10 @@ def get_analysis_suggestions():
         sheet_names = []
         try:
             # 使用pandas获取所有工作表名称
-            xl = pd.ExcelFile(temp_path)
-            sheet_names = xl.sheet_names
+            sheet_names = get_trend_sheet_names(trend_session)
             
             # 检查是否取消
-            if is_analysis_cancelled(task_id):
+            if task.cancelled:
                 print("工作表检查后检测到取消请求，中止处理")
                 return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
             
@@ -3314,98 +3150,27 @@ def get_analysis_suggestions():
             multiple_sheets = False
         
         # 再次检查是否取消
-        if is_analysis_cancelled(task_id):
+        if task.cancelled:
             print("工作表确认后检测到取消请求，中止处理")
             return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
         
         try:
-            # 读取Excel文件，先尝试识别数据量级
-            try:
-                # 只读取头部获取列信息
-                df_sample = pd.read_excel(temp_path, nrows=5, sheet_name=selected_sheet)
-                
-                # 检查是否取消
-                if is_analysis_cancelled(task_id):
-                    print("样本读取后检测到取消请求，中止处理")
-                    return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
-                
-                # 估算数据行数 (仅适用于单表单Excel，多表单会有所不同)
-                try:
-                    # 尝试使用xlrd（仅支持旧版.xls格式）
-                    workbook = xlrd.open_workbook(temp_path, on_demand=True)
-                    if isinstance(selected_sheet, str):
-                        try:
-                            sheet = workbook.sheet_by_name(selected_sheet)
-                        except:
-                            # 如果找不到指定名称的工作表，使用第一个
-                            sheet = workbook.sheet_by_index(0)
-                    else:
-                        sheet = workbook.sheet_by_index(0)
-                    estimated_rows = sheet.nrows - 1  # 减去标题行
-                    workbook.release_resources()
-                    #print(f"使用xlrd估算行数: {estimated_rows}")
-                except Exception as xlrd_error:
-                    # 检查是否取消
-                    if is_analysis_cancelled(task_id):
-                        print("行数估算过程中检测到取消请求，中止处理")
-                        return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
-                    
-                    # xlrd失败，尝试使用openpyxl（支持新版.xlsx格式）
-                    try:
-                        workbook = openpyxl.load_workbook(temp_path, read_only=True)
-                        if isinstance(selected_sheet, str) and selected_sheet in workbook.sheetnames:
-                            sheet = workbook[selected_sheet]
-                        else:
-                            # 使用活动工作表
-                            sheet = workbook.active
-                        # openpyxl在read_only模式下无法直接获取行数，使用最大行作为估计
-                        estimated_rows = sheet.max_row - 1  # 减去标题行
-                        workbook.close()
-                        #print(f"使用openpyxl估算行数: {estimated_rows}")
-                    except Exception as openpyxl_error:
-                        # 检查是否取消
-                        if is_analysis_cancelled(task_id):
-                            print("行数估算过程中检测到取消请求，中止处理")
-                            return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
-                        
-                        # 如果两种方法都失败，通过pandas读取行数
-                        print(f"估算行数失败，使用pandas读取全部数据: {str(xlrd_error)}")
-                        df = pd.read_excel(temp_path, sheet_name=selected_sheet)
-                        estimated_rows = len(df)
-                        #print(f"通过pandas获取行数: {estimated_rows}")
-                        # 已经读取了完整数据，标记已读取
-                        df_already_loaded = True
-                    
-                #print(f"估算行数: {estimated_rows}")
-                
-                # 检查是否取消
-                if is_analysis_cancelled(task_id):
-                    print("行数估算后检测到取消请求，中止处理")
-                    return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
-                
-                # 数据量超大时进行抽样
-                sample_size = 10000  # 抽样大小
-                if not locals().get('df_already_loaded', False):  # 检查是否已读取
-                    if estimated_rows > 50000:
-                        #print(f"检测到大数据集: 约 {estimated_rows} 行，将进行抽样分析")
-                        df = pd.read_excel(temp_path, sheet_name=selected_sheet, 
-                                          skiprows=lambda x: x > 0 and x % (estimated_rows // sample_size + 1) != 0)
-                    else:
-                        df = pd.read_excel(temp_path, sheet_name=selected_sheet)
-                    
-            except Exception as e:
-                # 检查是否取消
-                if is_analysis_cancelled(task_id):
-                    print("行数估算失败处理中检测到取消请求，中止处理")
-                    return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
-                
-                print(f"估算行数时出错: {str(e)}")
-                # 如果无法估算，直接读取全部数据
-                df = pd.read_excel(temp_path, sheet_name=selected_sheet)
+            task.set_stage('reading')
+            if is_streaming_file(trend_session.path):
+                # CSV和大型xlsx文件只读取前几行识别列类型，分析时再流式读取
+                df = read_sample(trend_session.path, selected_sheet)
+                estimated_rows = count_rows(trend_session.path, selected_sheet) or len(df)
+            else:
+                # 完整读取工作表（结果进入工作表缓存，之后的同比检查和分析不再重新解析）
+                df = trend_session.read_sheet(selected_sheet, cancel_check=task.check)
                 estimated_rows = len(df)
+            # 数据量超大时等间隔抽样进行列类型检测
+            if len(df) > 50000:
+                step = len(df) // 10000 + 1
+                df = df.iloc[step - 1::step].reset_index(drop=True)
             
             # 检查是否取消
-            if is_analysis_cancelled(task_id):
+            if task.cancelled:
                 print("数据加载后检测到取消请求，中止处理")
                 return jsonify({'success': False, 'message': '操作已取消', 'cancelled': True})
             
@@ -3434,7 +3199,7 @@ def get_analysis_suggestions():
                         if len(sample_vals) > 0:
                             # 尝试转换为日期
                             try:
-                                converted_dates = pd.to_datetime(sample_vals, errors='coerce')
+                                converted_dates, _ = parse_dates(sample_vals)
                                 # 检查转换成功率，至少80%能成功转换才认为是日期列
                                 success_rate = converted_dates.notna().mean()
                                 if success_rate >= 0.8:
@@ -3471,7 +3236,7 @@ def get_analysis_suggestions():
                             if date_match_rate > 0.5:  # 如果超过50%符合日期模式
                                 # 尝试转换
                                 try:
-                                    converted_dates = pd.to_datetime(sample_vals, errors='coerce')
+                                    converted_dates, _ = parse_dates(sample_vals)
                                     success_rate = converted_dates.notna().mean()
                                     if success_rate >= 0.8:
                                         #print(f"列 '{col}' 虽然名称不含日期关键词，但检测为日期列，转换成功率: {success_rate:.2f}")
@@ -3636,10 +3401,20 @@ def get_analysis_suggestions():
                         'description': '分析销售额随时间的变化趋势'
                     })
                     
-                    # 检查是否有跨年数据
+                    # 解析完整的日期列（结果缓存在会话中，选择该列进行分析时不再重新解析）
+                    dates = None
                     if len(date_columns) > 0:
                         try:
-                            dates = pd.to_datetime(df[date_columns[0]], errors='coerce')
+                            dates, _ = load_trend_dates(trend_session, selected_sheet, date_columns[0],
+                                                        cancel_check=task.check)
+                        except TaskCancelled:
+                            raise
+                        except Exception:
+                            dates = None
+                    
+                    # 检查是否有跨年数据
+                    if dates is not None:
+                        try:
                             years = dates.dt.year.unique()
                             if len(years) > 1:
                                 recommended_analysis.append({
@@ -3651,10 +3426,9 @@ def get_analysis_suggestions():
                             pass
                     
                     # 检查是否有跨月数据
-                    if len(date_columns) > 0:
+                    if dates is not None:
                         try:
-                            dates = pd.to_datetime(df[date_columns[0]], errors='coerce')
-                            year_months = dates.dt.strftime('%Y-%m').unique()
+                            year_months = dates.dt.to_period('M').unique()
                             if len(year_months) > 1:
                                 recommended_analysis.append({
                                     'type': 'month_over_month',
@@ -3677,34 +3451,103 @@ def get_analysis_suggestions():
                 'row_count': actual_row_count,  # 添加行数信息
                 'sheet_names': sheet_names,     # 添加工作表列表
                 'multiple_sheets': multiple_sheets,  # 是否有多个工作表
-                'selected_sheet': selected_sheet     # 当前选择的工作表
+                'selected_sheet': selected_sheet,    # 当前选择的工作表
+                'file_id': trend_session.file_id     # 之后的请求只需传file_id，无需重新上传
             }
+            trend_session.put(('suggestions', sheet_name), response_data)
             
             #print(f"返回给前端的完整响应: {response_data}")
             return jsonify(response_data)
             
+        except TaskCancelled as e:
+            print(f"文件预处理已取消（阶段: {task.stage}，已运行 {task.elapsed:.1f} 秒）")
+            return jsonify({'success': False, 'message': str(e), 'cancelled': True})
         except Exception as e:
             return jsonify({'success': False, 'message': f'分析文件时出错: {str(e)}'})
-        
-        finally:
-            # 清理临时文件
-            if os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                except:
-                    pass
             
+    except TaskCancelled as e:
+        return jsonify({'success': False, 'message': str(e), 'cancelled': True})
     except Exception as e:
         return jsonify({'success': False, 'message': f'处理请求时出错: {str(e)}'})
+    finally:
+        trend_tasks.finish(task)
 
 # 添加自定义分解函数
-def simple_decompose(series, period):
-    """简单的时间序列分解函数，替代statsmodels.tsa.seasonal.seasonal_decompose"""
-    # 确保series有适当的索引
-    if not isinstance(series.index, pd.DatetimeIndex):
-        #print("警告: 时间序列分解需要DatetimeIndex，尝试转换")
-        # 尝试创建简单的数字索引
-        series = pd.Series(series.values, index=pd.RangeIndex(start=0, stop=len(series)))
+# 各时间粒度常见的季节周期（按优先顺序）
+SEASONAL_PERIOD_CANDIDATES = {
+    'day': (7, 30, 365),
+    'week': (52, 13, 4),
+    'month': (12, 6, 3),
+    'quarter': (4,),
+    'year': ()
+}
+
+SEASONALITY_MIN_ACF = 0.2  # 自相关系数超过该值才认为存在该周期的季节性
+SEASONALITY_PRIMARY_MARGIN = 0.15  # 其他常见周期的自相关系数比首选周期高出该值时才取代首选周期
+
+def _autocorrelation(values, max_lag):
+    """用FFT一次计算0..max_lag所有滞后的自相关系数"""
+    centered = values - values.mean()
+    n = len(centered)
+    spectrum = np.fft.rfft(centered, n=2 * n)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum))[:max_lag + 1]
+    return acf / acf[0] if acf[0] > 0 else np.zeros(max_lag + 1)
+
+def detect_seasonal_period(series, time_granularity=None):
+    """
+    检测序列的主要季节周期
+    
+    自相关在一阶差分后的序列上计算：原始序列中的趋势会让自相关随滞后单调衰减，
+    最短的候选周期总是得分最高（带增长趋势的月度数据会被识别为3个月）。
+    先检查该时间粒度常见的周期：首选周期（日粒度7天、周粒度52周、月粒度12个月）的自相关系数
+    超过SEASONALITY_MIN_ACF时优先使用，除非其他常见周期明显更强（高出SEASONALITY_PRIMARY_MARGIN）；
+    都不明显时取自相关函数中最高的显著局部峰值；仍然没有时退回到粒度的默认周期或 12
+    （数据不足时为数据长度的一半）。周期至多为数据长度的一半。
+    """
+    values = np.asarray(series, dtype=float)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    max_period = n // 2
+    if max_period < 2:
+        return max(max_period, 1)
+    
+    acf = _autocorrelation(np.diff(values), max_period)
+    candidates = [p for p in SEASONAL_PERIOD_CANDIDATES.get(time_granularity, ()) if 2 <= p <= max_period]
+    
+    # 1. 粒度的常见周期，首选周期优先
+    if candidates:
+        primary = candidates[0]
+        best = max(candidates, key=lambda p: acf[p])
+        if acf[primary] > SEASONALITY_MIN_ACF and acf[best] - acf[primary] < SEASONALITY_PRIMARY_MARGIN:
+            return primary
+        if acf[best] > SEASONALITY_MIN_ACF:
+            return best
+    
+    # 2. 自相关函数的最高局部峰值（需超出噪声的随机波动范围 约3/√n，避免短序列中的偶然峰值）
+    if max_period >= 3:
+        lags = np.arange(2, max_period)
+        min_peak = max(SEASONALITY_MIN_ACF, 3 / np.sqrt(n))
+        peaks = lags[(acf[lags] >= acf[lags - 1]) & (acf[lags] >= acf[lags + 1]) & (acf[lags] > min_peak)]
+        if len(peaks) > 0:
+            return int(peaks[np.argmax(acf[peaks])])
+    
+    # 3. 默认周期
+    if candidates:
+        return candidates[0]
+    return 12 if n > 12 else max_period
+
+def simple_decompose(series, period=None, robust=False, time_granularity=None):
+    """
+    简单的时间序列分解函数，替代statsmodels.tsa.seasonal.seasonal_decompose
+    
+    参数:
+    - series: 时间序列
+    - period: 季节周期，为None时用detect_seasonal_period自动检测
+    - robust: 为True时季节分量使用各周期位置的中位数（对离群点不敏感），否则使用均值
+    - time_granularity: 数据的时间粒度，用于自动检测周期
+    """
+    if period is None:
+        period = detect_seasonal_period(series, time_granularity)
     
     # 计算移动平均作为趋势
     trend = series.rolling(window=period, center=True).mean()
@@ -3712,42 +3555,33 @@ def simple_decompose(series, period):
     # 去除趋势获得季节性+残差
     detrended = series - trend
     
-    # 计算季节性成分
-    if hasattr(series.index, 'month'):
-        # 如果索引有月份属性，按月分组
-        seasonal_groups = detrended.groupby(series.index.month)
+    # 每个点的季节位置：周期为12且有日期索引时按月份，否则按周期内的位置
+    if period == 12 and isinstance(series.index, pd.DatetimeIndex):
+        positions = series.index.month
     else:
-        # 否则按周期位置分组
-        seasonal_groups = detrended.groupby(np.arange(len(series)) % period)
-    
-    seasonal_means = seasonal_groups.mean()
-    seasonal = np.zeros_like(series)
+        positions = np.arange(len(series)) % period
     
-    for i in range(len(series)):
-        if hasattr(series.index, 'month'):
-            month = series.index[i].month
-            seasonal[i] = seasonal_means.get(month, 0)
-        else:
-            idx = i % period
-            seasonal[i] = seasonal_means.get(idx, 0)
-    
-    seasonal = pd.Series(seasonal, index=series.index)
+    # 计算各季节位置的均值（或中位数），再按位置广播回整个序列
+    seasonal_groups = detrended.groupby(positions)
+    seasonal_means = seasonal_groups.median() if robust else seasonal_groups.mean()
+    seasonal = pd.Series(seasonal_means.reindex(positions).to_numpy(), index=series.index)
     
     # 计算残差
     resid = series - trend - seasonal
     
     # 创建返回对象，模拟statsmodels的返回结构
     class DecomposeResult:
-        def __init__(self, trend, seasonal, resid):
+        def __init__(self, trend, seasonal, resid, period):
             self.trend = trend
             self.seasonal = seasonal
             self.resid = resid
+            self.period = period
     
-    return DecomposeResult(trend, seasonal, resid)
+    return DecomposeResult(trend, seasonal, resid, period)
 
 # 添加大数据优化函数
 def optimize_large_dataframe(df, date_column, value_column):
-    """优化大型数据集以提高性能"""
+    """优化大型数据集以提高性能：明细数据按天汇总（与流式读取的大文件得到相同的按天数据）"""
     # 获取行数
     row_count = len(df)
     
@@ -3757,102 +3591,43 @@ def optimize_large_dataframe(df, date_column, value_column):
         
     #print(f"优化大数据集: {row_count}行")
     
-    # 1. 仅保留必要的列
-    if len(df.columns) > 2:
-        df = df[[date_column, value_column]].copy()
-        
-    # 2. 转换日期列
-    df[date_column] = pd.to_datetime(df[date_column], errors='coerce')
-    
-    # 3. 数据聚合与降采样
-    # 按日期聚合，合并同一天的记录
-    df = df.groupby(df[date_column].dt.date).agg({value_column: 'sum'}).reset_index()
-    
-    # 对于超大数据集进行时间降采样
-    if row_count > 500000:
-        date_min = df[date_column].min()
-        date_max = df[date_column].max()
-        date_span = (date_max - date_min).days
-        
-        # 确定合适的采样间隔
-        if date_span > 1000:  # 超过3年数据
-            # 按周聚合
-            df[date_column] = pd.to_datetime(df[date_column])
-            df['week'] = df[date_column].dt.isocalendar().week
-            df['year'] = df[date_column].dt.isocalendar().year
-            df = df.groupby(['year', 'week']).agg({
-                date_column: 'first',  # 保留每周第一天
-                value_column: 'sum'    # 合计销售额
-            }).reset_index(drop=True)
-        elif date_span > 365:  # 超过1年数据
-            # 按3天聚合
-            df[date_column] = pd.to_datetime(df[date_column])
-            df['period'] = (df[date_column] - date_min).dt.days // 3
-            df = df.groupby('period').agg({
-                date_column: 'first',  # 保留每个时间段第一天
-                value_column: 'sum'    # 合计销售额
-            }).reset_index(drop=True)
-    
-    return df 
-    return df 
+    # 仅保留必要的列，按日期聚合，合并同一天的记录
+    # 按天的数据点数只与时间跨度有关，之后按所选的时间粒度聚合，不再额外降采样
+    aggregate = DailyAggregate(date_column, value_column)
+    aggregate.add(df[[date_column, value_column]])
+    return aggregate.to_frame()
 
 def check_year_over_year_eligibility():
     """检查数据是否满足同比分析要求（至少包含两年的数据）"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'message': '未上传文件'})
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'message': '未选择文件'})
-        
-        if not file.filename.endswith(('.xlsx', '.xls')):
-            return jsonify({'success': False, 'message': '文件格式不正确，请上传Excel文件'})
-        
         date_column = request.form.get('date_column')
         if not date_column:
             return jsonify({'success': False, 'message': '未指定日期列'})
             
         sheet_name = request.form.get('sheet_name', 0)  # 默认使用第一个工作表
         
-        # 保存上传的文件
-        temp_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 
-                              f"temp_{uuid.uuid4().hex[:8]}_{secure_filename(file.filename)}")
-        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-        file.save(temp_path)
+        # 获取文件（分析建议接口已上传过的文件只需传file_id）
+        trend_session, error = get_trend_session()
+        if error:
+            return error
+        
+        if not (trend_session.filename or '').lower().endswith(('.xlsx', '.xls', '.csv')):
+            return jsonify({'success': False, 'message': '文件格式不正确，请上传Excel或CSV文件'})
+        sheet_name = resolve_trend_sheet(trend_session, sheet_name)
         
         try:
-            # 尝试将日期列转换为日期类型
-            df = pd.read_excel(temp_path, sheet_name=sheet_name)
-            
-            # 检查日期列是否存在
-            if date_column not in df.columns:
-                return jsonify({'success': False, 'message': f'指定的日期列 "{date_column}" 不存在'})
-            
-            # 转换为日期时间
-            df[date_column] = pd.to_datetime(df[date_column], errors='coerce')
-            
-            # 删除无效日期
-            invalid_dates = df[date_column].isna().sum()
-            if invalid_dates > 0:
-                print(f"警告: 删除 {invalid_dates} 行无效日期")
-                df = df.dropna(subset=[date_column])
+            # 解析日期列并删除无效日期（与分析使用同一份缓存的解析结果）
+            try:
+                dates, _ = load_trend_dates(trend_session, sheet_name, date_column)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)})
             
             # 检查是否有至少两年的数据
-            if df[date_column].dt.year.nunique() >= 2:
-                return jsonify({'success': True, 'has_enough_data': True})
-            else:
-                return jsonify({'success': True, 'has_enough_data': False})
+            has_enough_data = bool(dates.dt.year.nunique() >= 2)
+            return jsonify({'success': True, 'has_enough_data': has_enough_data, 'file_id': trend_session.file_id})
         
         except Exception as e:
             return jsonify({'success': False, 'message': f'检查数据时出错: {str(e)}'})
     except Exception as e:
         print(f"检查同比分析条件时出错: {str(e)}")
-        return jsonify({'success': False, 'message': str(e)})
-    finally:
-        # 清理临时文件
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
\ No newline at end of file
+        return jsonify({'success': False, 'message': str(e)})
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""解析后Excel工作表的列式磁盘缓存
+
+工作表以Arrow Feather格式缓存并以内存映射方式读取（pyarrow是项目依赖）。
+只有Feather无法表示的工作表（如同一列混有数字和文本、列名不是字符串）才退回pickle格式。
+"""
+import io
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+SHEET_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'sheet_cache')
+SHEET_CACHE_MAX_BYTES = int(os.environ.get('SHEET_CACHE_MAX_BYTES', 4 * 1024 * 1024 * 1024))  # 默认4GB
+SHEET_CACHE_TTL = int(os.environ.get('SHEET_CACHE_TTL', 7 * 24 * 3600))  # 默认保留7天
+CHUNK_SIZE = 1024 * 1024
+SWEEP_INTERVAL = 300  # 两次清理之间的最小间隔（秒）
+
+# 文件哈希缓存: (路径, 大小, 修改时间) -> SHA-256，避免同一个文件重复计算哈希
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(file_path):
+    """计算文件内容的SHA-256，文件未变化时直接返回缓存的结果"""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    result = digest.hexdigest()
+
+    with _digest_lock:
+        if len(_digest_cache) > 1024:
+            _digest_cache.clear()
+        _digest_cache[key] = result
+    return result
+
+
+class _CancellableFile(io.FileIO):
+    """每次读取前调用cancel_check的文件对象
+
+    openpyxl只读模式边解析边从zip中读取数据，把它交给pd.read_excel后，
+    解析大工作表的过程中会不断调用cancel_check，任务取消时立即中断解析。
+    """
+
+    def __init__(self, file_path, cancel_check):
+        super().__init__(file_path, 'rb')
+        self._cancel_check = cancel_check
+
+    def read(self, size=-1):
+        self._cancel_check()
+        return super().read(size)
+
+    def readinto(self, buffer):
+        self._cancel_check()
+        return super().readinto(buffer)
+
+
+def _dtype_policy(dtype):
+    """把dtype参数转换为缓存键中的类型策略"""
+    if dtype is None:
+        return 'infer'
+    if dtype is str or dtype == 'str':
+        return 'str'
+    raise ValueError(f"工作表缓存不支持的dtype: {dtype}")
+
+
+class SheetCache:
+    """解析后工作表的列式磁盘缓存
+
+    每个工作表只用openpyxl解析一次，之后从缓存文件读取：
+    - 缓存按 文件内容SHA-256 / 工作表 / 类型策略 区分，同一文件重复上传也能命中
+    - 使用Feather格式并以内存映射方式读取，Feather无法表示的工作表退回pickle格式
+    - 按最近使用时间淘汰，受总大小和存活时间限制
+    """
+
+    def __init__(self, root=SHEET_CACHE_DIR, max_bytes=SHEET_CACHE_MAX_BYTES, ttl=SHEET_CACHE_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._last_sweep = 0
+
+    def _cache_base(self, digest, sheet_name, dtype):
+        # 工作表索引和同名的工作表名称使用不同的键
+        sheet_key = f"i:{sheet_name}" if isinstance(sheet_name, int) else f"n:{sheet_name}"
+        sheet_hash = hashlib.sha1(sheet_key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.root, digest, f"{sheet_hash}_{_dtype_policy(dtype)}")
+
+    def _load(self, base):
+        """读取缓存文件，不存在时返回None"""
+        for ext in ('.feather', '.pkl'):
+            path = base + ext
+            if not os.path.exists(path):
+                continue
+            try:
+                if ext == '.feather':
+                    df = feather.read_table(path, memory_map=True).to_pandas()
+                    # Arrow把字符串列中的空值还原为None，统一转换为与pd.read_excel一致的NaN
+                    for column in df.columns[df.dtypes == object]:
+                        df[column] = df[column].fillna(np.nan)
+                else:
+                    df = pd.read_pickle(path)
+                os.utime(path)  # 记录最近使用时间
+                return df
+            except Exception as e:
+                logger.warning(f"读取工作表缓存 {path} 失败: {str(e)}")
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return None
+
+    def _store(self, base, df):
+        """写入缓存文件，使用Feather格式；列名或数据类型不被Feather支持时退回pickle"""
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        temp_path = f"{base}.{uuid.uuid4().hex}.tmp"
+        try:
+            try:
+                feather.write_feather(df.reset_index(drop=True), temp_path)
+                os.replace(temp_path, base + '.feather')
+                return
+            except Exception as e:
+                logger.info(f"工作表无法以Feather格式缓存，改用pickle: {str(e)}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            df.to_pickle(temp_path)
+            os.replace(temp_path, base + '.pkl')
+        except Exception as e:
+            logger.warning(f"写入工作表缓存失败: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def contains(self, file_path, sheet_name=0, dtype=None):
+        """工作表是否已经缓存"""
+        base = self._cache_base(file_digest(file_path), sheet_name, dtype)
+        return any(os.path.exists(base + ext) for ext in ('.feather', '.pkl'))
+
+    def read_excel(self, file_path, sheet_name=0, dtype=None, cancel_check=None):
+        """读取工作表，等价于pd.read_excel(file_path, sheet_name=sheet_name, dtype=dtype)
+
+        只支持单个工作表（名称或索引）和dtype为None/str，未命中缓存时解析并写入缓存。
+        cancel_check: 可选的回调，解析过程中定期调用，抛出的异常会中断解析（不写入缓存）
+        """
+        if sheet_name is None or isinstance(sheet_name, (list, tuple)):
+            raise ValueError("工作表缓存一次只能读取一个工作表")
+
+        base = self._cache_base(file_digest(file_path), sheet_name, dtype)
+        df = self._load(base)
+        if df is not None:
+            return df
+
+        if cancel_check is None:
+            df = pd.read_excel(file_path, sheet_name=sheet_name, dtype=dtype)
+        else:
+            cancel_check()
+            with _CancellableFile(file_path, cancel_check) as f:
+                df = pd.read_excel(f, sheet_name=sheet_name, dtype=dtype)
+        self._store(base, df)
+        self.sweep()
+        return df
+
+    def sweep(self, force=False):
+        """删除过期的缓存文件，并按最近使用时间淘汰直到总大小不超过max_bytes"""
+        now = time.time()
+        if not force and now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+
+        files = []
+        try:
+            digests = os.listdir(self.root)
+        except OSError:
+            return
+        for digest in digests:
+            digest_dir = os.path.join(self.root, digest)
+            try:
+                names = os.listdir(digest_dir)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(digest_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime + self.ttl < now:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            try:
+                os.rmdir(digest_dir)  # 只删除已经清空的目录
+            except OSError:
+                pass
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+# 默认的共享缓存实例，各分析模块通过read_excel_cached读取工作表
+sheet_cache = SheetCache()
+
+
+def read_excel_cached(file_path, sheet_name=0, dtype=None, cancel_check=None):
+    """通过共享的工作表缓存读取Excel工作表，参数与pd.read_excel一致"""
+    return sheet_cache.read_excel(file_path, sheet_name=sheet_name, dtype=dtype, cancel_check=cancel_check)
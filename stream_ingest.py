@@ -0,0 +1,250 @@
+import io
+import os
+import codecs
+import logging
+import numpy as np
+import pandas as pd
+import openpyxl
+from data_cleaning import parse_dates, coerce_numeric
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_ROWS = int(os.environ.get('STREAM_CHUNK_ROWS', 200000))  # 每块读取的行数
+STREAM_MIN_BYTES = int(os.environ.get('STREAM_MIN_BYTES', 20 * 1024 * 1024))  # xlsx超过该大小时流式读取，默认20MB
+STREAM_SAMPLE_ROWS = 10000  # 流式文件识别列类型时读取的前几行
+CANCEL_CHECK_ROWS = 10000  # 逐行读取xlsx时每隔多少行检查一次是否取消
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+
+
+def is_streaming_file(file_path):
+    """是否按流式方式读取：CSV总是流式读取，xlsx超过STREAM_MIN_BYTES时流式读取（xls不支持逐行读取）"""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.csv':
+        return True
+    return ext == '.xlsx' and os.path.getsize(file_path) >= STREAM_MIN_BYTES
+
+
+def detect_csv_encoding(file_path):
+    """识别CSV文件的编码：能按UTF-8解码时使用utf-8-sig（兼容BOM），否则按GB18030（兼容GBK）读取"""
+    with open(file_path, 'rb') as f:
+        data = f.read(ENCODING_SAMPLE_BYTES)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(data, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'gb18030'
+
+
+class _FallbackTextFile(io.TextIOBase):
+    """按detect_csv_encoding识别的编码逐块解码CSV的文本文件对象
+
+    编码识别只采样文件开头，开头全是ASCII的GBK文件会被识别为UTF-8。
+    读取过程中一旦遇到无法按UTF-8解码的字节，就从解码失败的那一块开始
+    改用GB18030解码文件剩余部分，已经返回的文本不受影响，不会重复或丢失数据。
+    """
+
+    def __init__(self, file_path, block_size=ENCODING_SAMPLE_BYTES):
+        self._file = open(file_path, 'rb')
+        self._block_size = block_size
+        self._encoding = detect_csv_encoding(file_path)
+        self._decoder = codecs.getincrementaldecoder(self._encoding)()
+        self._text = ''
+        self._eof = False
+
+    @property
+    def encoding(self):
+        """当前使用的编码，中途改用GB18030后为gb18030"""
+        return self._encoding
+
+    def readable(self):
+        return True
+
+    def _decode(self, block, final):
+        pending = self._decoder.getstate()[0]
+        try:
+            return self._decoder.decode(block, final)
+        except UnicodeDecodeError:
+            if self._encoding == 'gb18030':
+                raise
+            logger.warning(f"{self._file.name} 中途出现无法按UTF-8解码的内容，剩余部分改用GB18030读取")
+            self._encoding = 'gb18030'
+            self._decoder = codecs.getincrementaldecoder('gb18030')()
+            return self._decoder.decode(pending + block, final)
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._text) < size):
+            block = self._file.read(self._block_size)
+            self._eof = not block
+            self._text += self._decode(block, final=self._eof)
+        if size is None or size < 0:
+            size = len(self._text)
+        text, self._text = self._text[:size], self._text[size:]
+        return text
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _is_csv(file_path):
+    return os.path.splitext(file_path)[1].lower() == '.csv'
+
+
+def read_sample(file_path, sheet_name=0, nrows=STREAM_SAMPLE_ROWS):
+    """只读取文件的前nrows行（列名与pd.read_excel/pd.read_csv读取整个文件时一致）"""
+    if _is_csv(file_path):
+        with _FallbackTextFile(file_path) as f:
+            return pd.read_csv(f, nrows=nrows)
+    return pd.read_excel(file_path, sheet_name=sheet_name, nrows=nrows)
+
+
+def read_columns(file_path, sheet_name=0):
+    """文件的列名列表"""
+    return list(read_sample(file_path, sheet_name, nrows=0).columns)
+
+
+def count_rows(file_path, sheet_name=0):
+    """不解析数据估算数据行数（不含表头）：CSV按换行符计数，xlsx读取工作表的尺寸信息，无法获取时返回None"""
+    if _is_csv(file_path):
+        lines = 0
+        last = b'\n'
+        with open(file_path, 'rb') as f:
+            while True:
+                block = f.read(ENCODING_SAMPLE_BYTES)
+                if not block:
+                    break
+                lines += block.count(b'\n')
+                last = block[-1:]
+        if last != b'\n':
+            lines += 1
+        return max(0, lines - 1)
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if isinstance(sheet_name, str) else workbook.worksheets[sheet_name]
+        return max(0, sheet.max_row - 1) if sheet.max_row else None
+    finally:
+        workbook.close()
+
+
+def iter_chunks(file_path, columns, sheet_name=0, chunk_rows=STREAM_CHUNK_ROWS, cancel_check=None):
+    """分块读取文件中指定的列，每块为一个只包含columns的DataFrame
+
+    CSV使用pd.read_csv的chunksize分块读取，xlsx使用openpyxl只读模式逐行读取，
+    任何时候内存中最多只有一块数据。cancel_check为可选的取消检查回调。
+    """
+    if _is_csv(file_path):
+        with _FallbackTextFile(file_path) as f, pd.read_csv(f, usecols=columns, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                if cancel_check is not None:
+                    cancel_check()
+                yield chunk[columns]
+        return
+
+    # 按pandas解析出的列名（重复列名会被重命名）定位各列的位置
+    header = read_columns(file_path, sheet_name)
+    positions = [header.index(column) for column in columns]
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if isinstance(sheet_name, str) else workbook.worksheets[sheet_name]
+        rows = []
+        for row in sheet.iter_rows(min_row=2, values_only=True):
+            rows.append(tuple(row[p] if p < len(row) else None for p in positions))
+            if len(rows) >= chunk_rows:
+                if cancel_check is not None:
+                    cancel_check()
+                yield pd.DataFrame(rows, columns=columns)
+                rows = []
+            elif cancel_check is not None and len(rows) % CANCEL_CHECK_ROWS == 0:
+                cancel_check()
+        if rows:
+            yield pd.DataFrame(rows, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _merge_counts(total, report):
+    """把一块数据的解析报告累加到总报告中"""
+    for key, value in report.items():
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, np.integer)):
+            total[key] = total.get(key, 0) + int(value)
+        elif isinstance(value, dict):
+            merged = total.setdefault(key, {})
+            for name, count in value.items():
+                if isinstance(count, dict):
+                    _merge_counts(merged.setdefault(name, {}), count)
+                else:
+                    merged[name] = merged.get(name, 0) + count
+        elif isinstance(value, list):
+            total[key] = (total.get(key, []) + value)[:5]
+    return total
+
+
+class DailyAggregate:
+    """把逐块读取的明细数据按天（以及可选的分组列）累加
+
+    每块数据解析日期、清洗数值后立即按天汇总并与之前的结果相加，
+    内存占用只与不同的天数（×分组数）有关，与明细行数无关。
+    value_column为None时统计每天的记录数。
+    """
+
+    def __init__(self, date_column, value_column=None, group_column=None, decimal='.'):
+        self.date_column = date_column
+        self.value_column = value_column
+        self.group_column = group_column or None
+        self.decimal = decimal
+        self.rows = 0
+        self.date_report = {}
+        self.value_report = {}
+        self._totals = None
+
+    def add(self, chunk):
+        """累加一块数据"""
+        self.rows += len(chunk)
+        dates, date_report = parse_dates(chunk[self.date_column])
+        _merge_counts(self.date_report, date_report)
+        valid = dates.notna().to_numpy()
+
+        if self.value_column is None:
+            values = pd.Series(1.0, index=chunk.index[valid])
+        else:
+            values, value_report = coerce_numeric(chunk.loc[valid, self.value_column], decimal=self.decimal)
+            _merge_counts(self.value_report, value_report)
+        values = values.dropna()
+        if len(values) == 0:
+            return
+
+        days = dates.loc[values.index].dt.normalize().rename(self.date_column)
+        keys = [days] if self.group_column is None else [days, chunk.loc[values.index, self.group_column]]
+        totals = values.groupby(keys, sort=False).sum()
+        self._totals = totals if self._totals is None else self._totals.add(totals, fill_value=0)
+
+    def to_frame(self):
+        """按日期排序的汇总结果，列为 日期列、值列（未指定值列时为'count'）和分组列"""
+        value_name = self.value_column or 'count'
+        columns = [self.date_column, value_name] + ([self.group_column] if self.group_column else [])
+        if self._totals is None:
+            return pd.DataFrame(columns=columns)
+        df = self._totals.rename(value_name).reset_index()
+        df.columns = [self.date_column] + ([self.group_column] if self.group_column else []) + [value_name]
+        return df[columns].sort_values(self.date_column, kind='stable').reset_index(drop=True)
+
+
+def stream_daily_aggregate(file_path, date_column, value_column=None, group_column=None, sheet_name=0, decimal='.',
+                           chunk_rows=STREAM_CHUNK_ROWS, cancel_check=None):
+    """流式读取CSV/xlsx文件并按天汇总
+
+    只读取日期列、值列和分组列，每块数据读取后立即折叠进按天的汇总结果，
+    可以处理数百万到上千万行、无法整体载入内存的交易明细。
+
+    返回:
+    - DailyAggregate: to_frame()为按天汇总的数据，date_report/value_report为整个文件的解析报告，rows为明细行数
+    """
+    columns = [date_column] + [c for c in (value_column, group_column) if c]
+    aggregate = DailyAggregate(date_column, value_column, group_column, decimal)
+    for chunk in iter_chunks(file_path, columns, sheet_name, chunk_rows, cancel_check):
+        aggregate.add(chunk)
+    logger.info(f"流式汇总 {os.path.basename(file_path)}: {aggregate.rows}行明细")
+    return aggregate
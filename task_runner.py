@@ -0,0 +1,163 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+TASK_MAX_WORKERS = int(os.environ.get('TASK_MAX_WORKERS', max(1, min(4, os.cpu_count() or 1))))
+TASK_MAX_RUNTIME = int(os.environ.get('TASK_MAX_RUNTIME', 600))  # 单个任务最长运行时间（秒），超时后自动取消
+POLL_INTERVAL = 0.5  # 等待任务结果时检查超时的间隔（秒）
+
+
+class TaskCancelled(Exception):
+    """任务已被取消（用户取消、页面关闭或超时）"""
+
+
+class TaskHandle:
+    """一个分析任务的登记信息和取消令牌
+
+    任务函数在分块读取、聚合、异常检测等循环中调用check()（或把它作为cancel_check回调传下去），
+    任务被取消后在下一次检查时抛出TaskCancelled，工作线程随即释放。
+    """
+
+    def __init__(self, task_id, owner=None, label=None):
+        self.task_id = task_id
+        self.owner = owner
+        self.label = label
+        self.created_at = time.time()
+        self.started_at = None
+        self.stage = 'queued'
+        self.stage_started_at = self.created_at
+        self.cancel_reason = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self, reason='分析已被用户取消'):
+        if not self._cancelled.is_set():
+            self.cancel_reason = reason
+            self._cancelled.set()
+
+    def check(self):
+        """任务已取消时抛出TaskCancelled"""
+        if self._cancelled.is_set():
+            raise TaskCancelled(self.cancel_reason)
+
+    def set_stage(self, stage):
+        """记录任务当前所处的阶段，同时检查是否已取消"""
+        self.check()
+        self.stage = stage
+        self.stage_started_at = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.created_at
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            'task_id': self.task_id,
+            'owner': self.owner,
+            'label': self.label,
+            'stage': self.stage,
+            'cancelled': self.cancelled,
+            'elapsed': round(now - self.created_at, 2),
+            'stage_elapsed': round(now - self.stage_started_at, 2)
+        }
+
+
+class TaskRunner:
+    """分析任务的执行器和登记表
+
+    - 任务在有界的线程池中执行，同时运行的分析数量受TASK_MAX_WORKERS限制
+    - 每个任务有自己的取消令牌，取消只影响指定的任务（或指定用户的任务）
+    - 登记表按（owner, task_id）登记，客户端提供的task_id只在同一个owner内有效；
+      owner由调用方提供（登录用户为用户名，未登录时为会话令牌），不按IP区分：
+      NAT或反向代理后面的多个用户共用一个IP
+    - 登记表记录每个任务的阶段和已运行时间；超过max_runtime的任务自动取消，
+      用户离开页面后遗留的分析不会长时间占用工作线程
+    使用线程池而不是进程池：分析需要读写本进程中的分析会话缓存（trend_session）。
+    """
+
+    def __init__(self, max_workers=TASK_MAX_WORKERS, max_runtime=TASK_MAX_RUNTIME, name='analysis-task'):
+        self.max_workers = max_workers
+        self.max_runtime = max_runtime
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_id=None, owner=None, label=None):
+        """登记一个新任务并返回其TaskHandle；同一owner同一task_id的旧任务会被取消，其他owner的任务不受影响"""
+        task_id = str(task_id) if task_id else uuid.uuid4().hex
+        handle = TaskHandle(task_id, owner=owner, label=label)
+        key = (owner, task_id)
+        with self._lock:
+            previous = self._tasks.get(key)
+            if previous is not None:
+                previous.cancel('已被新的请求替代')
+            self._tasks[key] = handle
+        return handle
+
+    def finish(self, handle):
+        """从登记表中移除任务"""
+        key = (handle.owner, handle.task_id)
+        with self._lock:
+            if self._tasks.get(key) is handle:
+                del self._tasks[key]
+
+    def get(self, task_id, owner=None):
+        with self._lock:
+            return self._tasks.get((owner, task_id))
+
+    def run(self, handle, func, *args, **kwargs):
+        """在线程池中执行func(*args, task=handle, **kwargs)并等待结果
+
+        任务被取消或超时时抛出TaskCancelled；任务结束后（无论成功与否）从登记表中移除。
+        """
+        def run_task():
+            handle.started_at = time.time()
+            handle.set_stage('running')
+            return func(*args, task=handle, **kwargs)
+
+        try:
+            handle.check()
+            future = self._executor.submit(run_task)
+            while True:
+                done, _ = wait([future], timeout=POLL_INTERVAL)
+                if done:
+                    return future.result()
+                if self.max_runtime and handle.elapsed > self.max_runtime and not handle.cancelled:
+                    logger.warning(f"任务 {handle.task_id} 运行超过 {self.max_runtime} 秒（阶段: {handle.stage}），自动取消")
+                    handle.cancel(f'分析超过{self.max_runtime}秒未完成，已自动取消')
+        finally:
+            self.finish(handle)
+
+    def cancel(self, task_id=None, owner=None, reason='分析已被用户取消'):
+        """取消owner的任务：指定task_id时只取消该任务，否则取消owner的所有任务（owner为None时不取消任何任务）
+
+        返回:
+        - int: 被取消的任务数
+        """
+        if owner is None:
+            return 0
+        with self._lock:
+            if task_id:
+                handle = self._tasks.get((owner, str(task_id)))
+                candidates = [handle] if handle is not None else []
+            else:
+                candidates = [handle for (key_owner, _), handle in self._tasks.items() if key_owner == owner]
+
+        for handle in candidates:
+            handle.cancel(reason)
+        return len(candidates)
+
+    def tasks(self, owner=None):
+        """登记表中的任务（阶段、已运行时间等）；指定owner时只返回该owner的任务"""
+        with self._lock:
+            items = list(self._tasks.items())
+        return [handle.to_dict() for (key_owner, _), handle in items if owner is None or key_owner == owner]
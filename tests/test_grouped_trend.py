@@ -0,0 +1,104 @@
+"""分组（多序列）销售趋势分析的测试"""
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import sales_trend
+from sales_trend import aggregate_groups_by_time, analyze_grouped_sales_trend
+from task_runner import TaskCancelled
+
+
+def make_frame():
+    """A: 1~10日递增，4、5日无数据；B: 3~8日递减；C: 1~10日持平；另有分组为空的行"""
+    rows = []
+    for day in range(1, 11):
+        if day not in (4, 5):
+            rows.append(('A', day, 10.0 * day))
+        rows.append(('C', day, 50.0))
+    for day in range(3, 9):
+        rows.append(('B', day, 100.0 - 10 * day))
+    rows.append((np.nan, 5, 1000.0))
+    df = pd.DataFrame(rows, columns=['门店', 'day', '销售额'])
+    df['日期'] = pd.Timestamp('2024-01-01') + pd.to_timedelta(df['day'] - 1, unit='D')
+    return df.drop(columns='day')
+
+
+class AggregateGroupsTest(unittest.TestCase):
+
+    def test_gaps_and_group_spans(self):
+        periods, groups, matrix, observed = aggregate_groups_by_time(make_frame(), '日期', '销售额', '门店', 'day')
+
+        self.assertEqual(list(groups), ['A', 'B', 'C'])  # 分组为空的行被忽略
+        self.assertEqual(len(periods), 10)
+        a, b = list(groups).index('A'), list(groups).index('B')
+        # 分组区间内没有数据的日期为0且标记为非原始数据
+        self.assertEqual(matrix[3, a], 0)
+        self.assertEqual(matrix[4, a], 0)
+        self.assertFalse(observed[3, a])
+        self.assertTrue(observed[2, a])
+        # 分组第一个数据之前和最后一个数据之后为NaN
+        self.assertTrue(np.isnan(matrix[:2, b]).all())
+        self.assertTrue(np.isnan(matrix[8:, b]).all())
+        self.assertEqual(matrix[2, b], 70.0)
+        self.assertEqual(np.nansum(matrix), make_frame().dropna(subset=['门店'])['销售额'].sum())
+
+    def test_empty_frame(self):
+        df = pd.DataFrame({'日期': pd.to_datetime([]), '销售额': [], '门店': []})
+        periods, groups, matrix, observed = aggregate_groups_by_time(df, '日期', '销售额', '门店', 'day')
+        self.assertEqual(len(groups), 0)
+        self.assertEqual(matrix.shape, (0, 0))
+
+
+class AnalyzeGroupedTest(unittest.TestCase):
+
+    def test_rankings(self):
+        result = analyze_grouped_sales_trend(make_frame(), '日期', '销售额', '门店', time_granularity='day')
+
+        self.assertEqual(result['group_count'], 3)
+        rankings = result['rankings']
+        self.assertEqual(rankings['metric'], 'trend_slope')
+        self.assertEqual([g['group'] for g in rankings['top_gainers']], ['A'])
+        self.assertEqual([g['group'] for g in rankings['top_decliners']], ['B'])
+        self.assertEqual([g['group'] for g in rankings['top_total']], ['C', 'A', 'B'])
+
+        summaries = {g['group']: g for g in result['groups']}
+        self.assertEqual(summaries['A']['periods'], 10)
+        self.assertEqual(summaries['A']['original_periods'], 8)
+        self.assertEqual(summaries['B']['first_date'], '2024-01-03')
+        self.assertEqual(summaries['B']['last_date'], '2024-01-08')
+        # 不足一年的数据没有同比，返回None而不是NaN
+        self.assertIsNone(summaries['A']['yoy_change'])
+        self.assertEqual(summaries['C']['trend_slope'], 0)
+
+    def test_unknown_analysis_type(self):
+        with self.assertRaises(ValueError):
+            analyze_grouped_sales_trend(make_frame(), '日期', '销售额', '门店', analysis_type='forecast')
+
+    def test_cancel_stops_parallel_details(self):
+        """并行的详细分析在取消后中断，共用线程池中不留下仍在运行的分组"""
+        cancelled = threading.Event()
+
+        def cancel_check():
+            if cancelled.is_set():
+                raise TaskCancelled('分析已被用户取消')
+
+        original = sales_trend.detect_anomalies
+
+        def detect_then_cancel(*args, **kwargs):
+            cancelled.set()
+            return original(*args, **kwargs)
+
+        with mock.patch.object(sales_trend, 'GROUP_POOL_MIN_POINTS', 0), \
+                mock.patch.object(sales_trend, 'detect_anomalies', side_effect=detect_then_cancel):
+            with self.assertRaises(TaskCancelled):
+                analyze_grouped_sales_trend(make_frame(), '日期', '销售额', '门店', time_granularity='day',
+                                            cancel_check=cancel_check)
+        # 线程池中的任务都已结束或被取消
+        sales_trend.group_detail_executor.submit(lambda: None).result(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""同比/环比分析结果的JSON序列化测试（结果中不能出现NaN）"""
+import json
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from sales_trend import analyze_year_over_year, analyze_month_over_month
+
+
+def assert_strict_json(result):
+    """结果及其中的图表JSON都能被浏览器的JSON.parse解析（不含NaN/Infinity）"""
+    json.dumps(result, allow_nan=False)
+    for key in ('chart', 'yoy_chart', 'mom_chart'):
+        if isinstance(result.get(key), str):
+            json.loads(result[key], parse_constant=lambda constant: (_ for _ in ()).throw(ValueError(constant)))
+
+
+class GrowthJsonTest(unittest.TestCase):
+
+    def setUp(self):
+        # 两年的日数据，每季度最后一个月没有数据
+        dates = pd.date_range('2023-01-01', '2024-12-31', freq='D')
+        dates = dates[dates.month % 3 != 0]
+        values = np.random.default_rng(0).random(len(dates)) * 100
+        self.df = pd.DataFrame({'日期': dates, '销售额': values, 'is_original_data': True})
+
+    def test_gapped_data_has_no_nan(self):
+        for granularity in ('day', 'week', 'month'):
+            with self.subTest(granularity=granularity):
+                yoy = analyze_year_over_year(self.df.copy(), '日期', '销售额', granularity)
+                assert_strict_json(yoy)
+                self.assertIn('2024_yoy', yoy['pivot_data'])
+                assert_strict_json(analyze_month_over_month(self.df.copy(), '日期', '销售额', granularity))
+
+    def test_single_period_month_over_month(self):
+        df = pd.DataFrame({'日期': pd.to_datetime(['2024-01-01']), '销售额': [5.0]})
+        result = analyze_month_over_month(df, '日期', '销售额', 'month')
+        assert_strict_json(result)
+        self.assertIsNone(result['stats']['average_change'])
+        self.assertIsNone(result['stats']['max_increase']['value'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""JobQueue任务归属校验的测试"""
+import os
+import time
+import tempfile
+import unittest
+
+from job_queue import JobQueue
+
+
+def write_result(result_dir, progress=None):
+    """写出一个结果文件的任务函数（模块级，进程池可以序列化）"""
+    with open(os.path.join(result_dir, 'result.txt'), 'w') as f:
+        f.write('ok')
+    return {'result_file': 'result.txt'}
+
+
+class JobOwnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(os.path.join(self.tmp.name, 'jobs'), max_workers=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def wait_done(self, job_id, owner):
+        for _ in range(100):
+            status = self.queue.get(job_id, owner)
+            if status and status.get('status') in ('done', 'failed'):
+                return status
+            time.sleep(0.05)
+        self.fail('任务未完成')
+
+    def test_only_owner_can_read_job(self):
+        result_dir = os.path.join(self.tmp.name, 'out')
+        os.makedirs(result_dir)
+        job_id = self.queue.submit(write_result, result_dir, result_dir=result_dir, owner='anonymous:token-a')
+        self.assertEqual(self.wait_done(job_id, 'anonymous:token-a')['status'], 'done')
+        self.assertIsNotNone(self.queue.result_path(job_id, 'anonymous:token-a'))
+
+        # 其他未登录会话、其他用户以及不带owner的查询都看不到该任务
+        for owner in ('anonymous:token-b', 'alice', None):
+            self.assertIsNone(self.queue.get(job_id, owner))
+            self.assertIsNone(self.queue.result_path(job_id, owner))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""LLMClient的连接复用、重试和熔断测试（使用llm_stub_server.py作为上游）"""
+import time
+import threading
+import unittest
+
+import requests
+
+from llm_client import LLMClient, CircuitBreaker, CircuitOpenError
+from llm_stub_server import create_server
+
+
+class LLMClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = create_server()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/chat/completions"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connection(self):
+        client = LLMClient()
+        for _ in range(5):
+            self.assertEqual(client.post(self.url, json={}).status_code, 200)
+        self.assertEqual(self.server.state.to_dict(), {'requests': 5, 'connections': 1})
+        self.assertEqual(client.metrics()['pools'][0]['connections_created'], 1)
+
+    def test_retries_retry_status(self):
+        self.server.state.fail_first = 2
+        client = LLMClient(backoff_base=0.01)
+        self.assertEqual(client.post(self.url, json={}).status_code, 200)
+        metrics = client.metrics()
+        self.assertEqual(metrics['retries'], 2)
+        self.assertEqual(metrics['status_codes'], {'503': 2, '200': 1})
+
+    def test_half_open_timeout_reopens_breaker(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=0.2)
+        client = LLMClient(max_retries=0, timeout=(1, 0.2), breaker=breaker)
+
+        # 连续两次503后熔断
+        self.server.state.fail_first = 2
+        for _ in range(2):
+            self.assertEqual(client.post(self.url, json={}).status_code, 503)
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            client.post(self.url, json={})
+
+        # 冷却后的试探请求读取超时：熔断器应重新打开，而不是一直停在half_open
+        self.server.state.latency = 0.5
+        time.sleep(0.25)
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            client.post(self.url, json={})
+        self.assertEqual(breaker.state, 'open')
+
+        # 上游恢复后，下一次试探请求成功并关闭熔断器
+        self.server.state.latency = 0
+        time.sleep(0.25)
+        self.assertEqual(client.post(self.url, json={}).status_code, 200)
+        self.assertEqual(breaker.state, 'closed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""SheetCache的Feather缓存测试"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from sheet_cache import SheetCache
+
+
+class SheetCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = SheetCache(root=os.path.join(self.tmp.name, 'cache'))
+        self.path = os.path.join(self.tmp.name, 'sales.xlsx')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def cache_files(self):
+        return sorted(os.path.splitext(name)[1] for _, _, files in os.walk(self.cache.root) for name in files)
+
+    def test_feather_round_trip_matches_read_excel(self):
+        pd.DataFrame({
+            '日期': pd.date_range('2024-01-01', periods=5),
+            '销量': [1, 2, 3, 4, 5],
+            '金额': [1.5, np.nan, 3.0, 4.25, 5.0],
+            '门店': ['A', None, 'B', 'C', 'A']
+        }).to_excel(self.path, index=False)
+
+        for dtype in (None, str):
+            expected = pd.read_excel(self.path, dtype=dtype)
+            pd.testing.assert_frame_equal(self.cache.read_excel(self.path, dtype=dtype), expected)
+            # 第二次读取命中Feather缓存
+            pd.testing.assert_frame_equal(self.cache.read_excel(self.path, dtype=dtype), expected)
+        self.assertEqual(self.cache_files(), ['.feather', '.feather'])
+
+    def test_mixed_column_falls_back_to_pickle(self):
+        pd.DataFrame({'编号': [1, 'A-2', 3], '值': [1, 2, 3]}).to_excel(self.path, index=False)
+
+        expected = pd.read_excel(self.path)
+        self.cache.read_excel(self.path)
+        pd.testing.assert_frame_equal(self.cache.read_excel(self.path), expected)
+        self.assertEqual(self.cache_files(), ['.pkl'])
+
+
+if __name__ == '__main__':
+    unittest.main()
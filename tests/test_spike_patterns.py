@@ -0,0 +1,49 @@
+"""detect_spike_patterns尖峰/低谷检测的测试"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from sales_trend import detect_spike_patterns
+
+
+class SpikePatternTest(unittest.TestCase):
+
+    def setUp(self):
+        self.values = np.full(30, 100.0)
+        self.values[15] = 300.0  # 尖峰
+        self.values[22] = 20.0  # 低谷
+        self.dates = pd.date_range('2024-01-01', periods=30).to_numpy()
+
+    def flagged(self, dates, **kwargs):
+        result = detect_spike_patterns(self.values, dates, **kwargs)
+        return {int(i): int(result['kind'][i]) for i in np.flatnonzero(result['is_pattern'])}
+
+    def test_spike_and_trough(self):
+        self.assertEqual(self.flagged(self.dates), {15: 1})
+        self.assertEqual(self.flagged(self.dates, detect_troughs=True), {15: 1, 22: -1})
+
+    def test_long_gap_to_neighbour_is_not_flagged(self):
+        dates = self.dates.copy()
+        dates[16:] += np.timedelta64(8, 'D')
+        self.assertEqual(self.flagged(dates), {})
+
+        # 7天的间隔仍在允许范围内
+        dates = self.dates.copy()
+        dates[16:] += np.timedelta64(6, 'D')
+        self.assertEqual(self.flagged(dates), {15: 1})
+
+    def test_missing_neighbour_date_fails_gap_check(self):
+        for missing in (14, 15, 16):
+            with self.subTest(missing=missing):
+                dates = self.dates.astype(object)
+                dates[missing] = None
+                self.assertEqual(self.flagged(dates), {})
+
+        dates = self.dates.astype(str).astype(object)
+        dates[16] = '不是日期'
+        self.assertEqual(self.flagged(dates), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""stream_ingest流式读取和按天汇总的测试"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from stream_ingest import stream_daily_aggregate, read_sample, detect_csv_encoding
+
+
+class StreamIngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        n = 500
+        self.df = pd.DataFrame({
+            '日期': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 40, n), unit='D')
+                    + pd.to_timedelta(rng.integers(0, 86400, n), unit='s'),
+            '销售额': np.round(rng.random(n) * 100, 2),
+            '地区': rng.choice(['华东', '华南', '华北'], n)
+        })
+        self.df.loc[[3, 50], '销售额'] = np.nan
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def expected(self):
+        """一次性读取全部数据后按天、按地区汇总的结果"""
+        valid = self.df.dropna(subset=['销售额'])
+        return (valid.groupby([valid['日期'].dt.normalize(), '地区'])['销售额'].sum()
+                .reset_index().sort_values(['日期', '地区']).reset_index(drop=True))
+
+    def aggregate(self, file_path, chunk_rows):
+        frame = stream_daily_aggregate(file_path, '日期', '销售额', '地区', chunk_rows=chunk_rows).to_frame()
+        return frame[['日期', '地区', '销售额']].sort_values(['日期', '地区']).reset_index(drop=True)
+
+    def assert_totals(self, actual):
+        expected = self.expected()
+        pd.testing.assert_series_equal(actual['日期'], expected['日期'], check_dtype=False)
+        self.assertEqual(list(actual['地区']), list(expected['地区']))
+        np.testing.assert_allclose(actual['销售额'].to_numpy(float), expected['销售额'].to_numpy())
+
+    def test_chunked_totals_match_single_pass(self):
+        path = self.path('sales.csv')
+        self.df.to_csv(path, index=False)
+        single = self.aggregate(path, chunk_rows=len(self.df) + 1)
+        chunked = self.aggregate(path, chunk_rows=7)
+        pd.testing.assert_frame_equal(chunked, single)
+        self.assert_totals(chunked)
+
+    def test_csv_and_xlsx_streaming_agree(self):
+        csv_path, xlsx_path = self.path('sales.csv'), self.path('sales.xlsx')
+        self.df.to_csv(csv_path, index=False)
+        self.df.to_excel(xlsx_path, index=False)
+        from_csv = self.aggregate(csv_path, chunk_rows=64)
+        from_xlsx = self.aggregate(xlsx_path, chunk_rows=64)
+        pd.testing.assert_frame_equal(from_xlsx, from_csv, check_dtype=False)
+        self.assert_totals(from_xlsx)
+
+    def test_gbk_after_ascii_sample_falls_back_to_gb18030(self):
+        # 前1MB以上全是ASCII，编码识别为UTF-8，中文地区名出现在采样范围之后
+        path = self.path('sales.csv')
+        ascii_rows = ''.join(f'2024-01-{i % 28 + 1:02d},1,A\n' for i in range(80000))
+        gbk_rows = ''.join(f'2024-02-{i % 28 + 1:02d},2,华东\n' for i in range(100))
+        with open(path, 'wb') as f:
+            f.write('date,value,region\n'.encode('gbk'))
+            f.write(ascii_rows.encode('gbk'))
+            f.write(gbk_rows.encode('gbk'))
+        self.assertGreater(len(ascii_rows), 1024 * 1024)
+        self.assertEqual(detect_csv_encoding(path), 'utf-8-sig')
+
+        aggregate = stream_daily_aggregate(path, 'date', 'value', 'region', chunk_rows=10000)
+        frame = aggregate.to_frame()
+        self.assertEqual(aggregate.rows, 80100)
+        self.assertEqual(frame.groupby('region')['value'].sum().to_dict(), {'A': 80000, '华东': 200})
+        self.assertEqual(len(read_sample(path)), 10000)
+
+    def test_utf8_with_bom(self):
+        path = self.path('sales.csv')
+        self.df.to_csv(path, index=False, encoding='utf-8-sig')
+        self.assertEqual(list(read_sample(path).columns), ['日期', '销售额', '地区'])
+        self.assert_totals(self.aggregate(path, chunk_rows=100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""TaskRunner按owner隔离任务的测试"""
+import unittest
+
+from task_runner import TaskRunner
+
+
+class TaskOwnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = TaskRunner(max_workers=1)
+
+    def test_owners_are_isolated(self):
+        # 同一NAT后面的登录用户和两个未登录会话（owner为各自的会话令牌）
+        alice = self.runner.create('t1', owner='alice')
+        bob = self.runner.create('t2', owner='bob')
+        anonymous_a = self.runner.create('t3', owner='anonymous:token-a')
+        anonymous_b = self.runner.create('t4', owner='anonymous:token-b')
+
+        self.assertEqual(self.runner.cancel(owner='alice'), 1)
+        self.assertTrue(alice.cancelled)
+        self.assertFalse(bob.cancelled)
+
+        # 按task_id也不能取消或查看其他owner的任务
+        self.assertEqual(self.runner.cancel('t2', owner='alice'), 0)
+        self.assertFalse(bob.cancelled)
+        self.assertEqual([t['task_id'] for t in self.runner.tasks(owner='alice')], ['t1'])
+
+        # 未登录会话之间同样隔离
+        self.assertEqual([t['task_id'] for t in self.runner.tasks(owner='anonymous:token-a')], ['t3'])
+        self.assertEqual(self.runner.cancel(owner='anonymous:token-a'), 1)
+        self.assertTrue(anonymous_a.cancelled)
+        self.assertFalse(anonymous_b.cancelled)
+        self.assertFalse(bob.cancelled)
+
+    def test_cancel_without_owner_cancels_nothing(self):
+        handle = self.runner.create('t1', owner='alice')
+        self.assertEqual(self.runner.cancel(), 0)
+        self.assertEqual(self.runner.cancel('t1'), 0)
+        self.assertFalse(handle.cancelled)
+
+    def test_colliding_task_id_does_not_cancel_other_owner(self):
+        bob = self.runner.create('same', owner='bob')
+        alice = self.runner.create('same', owner='alice')
+        self.assertFalse(bob.cancelled)
+
+        # 同一owner重复提交同一task_id时替换旧任务
+        again = self.runner.create('same', owner='alice')
+        self.assertTrue(alice.cancelled)
+        self.assertFalse(again.cancelled)
+
+        self.runner.finish(bob)
+        self.assertIsNone(self.runner.get('same', owner='bob'))
+        self.assertIs(self.runner.get('same', owner='alice'), again)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""TrendSession按键计算/缓存和TrendSessionStore淘汰的测试"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import sales_trend
+from task_runner import TaskHandle, TaskCancelled
+from trend_session import TrendSession, TrendSessionStore
+
+
+class TrendSessionGetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = TrendSession('file', 'sales.xlsx')
+
+    def test_concurrent_requests_build_once(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def build():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.session.get('key', build)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['value'] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.session.get('key', lambda: 'other'), 'value')
+
+    def test_other_keys_and_waiters_are_not_blocked_by_build(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_build():
+            started.set()
+            release.wait(5)
+            return 'slow'
+
+        builder = threading.Thread(target=self.session.get, args=('slow', slow_build))
+        builder.start()
+        started.wait(5)
+        try:
+            # 其他键的计算和缓存读取不需要等待正在进行的计算
+            self.assertEqual(self.session.get('fast', lambda: 'fast'), 'fast')
+            self.assertIsNone(self.session.peek('slow'))
+
+            # 等待同一个键的请求在任务取消后立即返回
+            task = TaskHandle('waiter')
+            threading.Timer(0.3, task.cancel).start()
+            begin = time.time()
+            with self.assertRaises(TaskCancelled):
+                self.session.get('slow', lambda: 'duplicate', task.check)
+            self.assertLess(time.time() - begin, 2)
+        finally:
+            release.set()
+            builder.join(5)
+        self.assertEqual(self.session.peek('slow'), 'slow')
+
+    def test_failed_build_is_not_cached(self):
+        def failing():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            self.session.get('key', failing)
+        self.assertEqual(self.session.get('key', lambda: 'retried'), 'retried')
+
+
+class TrendSessionStoreTest(unittest.TestCase):
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        store = TrendSessionStore(max_bytes=3000, ttl=3600)
+        first = store.get('a', 'a.xlsx')
+        first.put('data', pd.Series(np.zeros(250)))  # 约2KB
+        second = store.get('b', 'b.xlsx')
+        second.put('data', pd.Series(np.zeros(250)))
+        store.get('a', 'a.xlsx')  # a最近使用，超出预算时淘汰b
+
+        store.get('c', 'c.xlsx')
+        self.assertIs(store.get('a', 'a.xlsx'), first)
+        self.assertIsNot(store.get('b', 'b.xlsx'), second)
+
+    def test_most_recent_session_is_kept_even_over_budget(self):
+        store = TrendSessionStore(max_bytes=10, ttl=3600)
+        session = store.get('a', 'a.xlsx')
+        session.put('data', pd.Series(np.zeros(250)))
+        self.assertIs(store.get('a', 'a.xlsx'), session)
+
+    def test_idle_sessions_expire(self):
+        store = TrendSessionStore(max_bytes=1 << 30, ttl=60)
+        session = store.get('a', 'a.xlsx')
+        self.assertIs(store.get('a', 'a.xlsx'), session)
+        session.last_access -= 61
+        self.assertIsNot(store.get('a', 'a.xlsx'), session)
+
+    def test_new_path_replaces_session(self):
+        store = TrendSessionStore()
+        session = store.get('a', 'old.xlsx')
+        self.assertIsNot(store.get('a', 'new.xlsx'), session)
+
+
+class AnalysisResultMemoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'sales.xlsx')
+        pd.DataFrame({
+            '日期': pd.date_range('2024-01-01', periods=60),
+            '销售额': np.arange(60, dtype=float) + 100
+        }).to_excel(self.path, index=False)
+        self.session = TrendSession('file', self.path, 'sales.xlsx')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_analysis(self, analysis_type='trend', granularity='day'):
+        return sales_trend.run_sales_trend_analysis(self.session, 'Sheet1', '日期', '销售额', analysis_type,
+                                                    granularity, task=TaskHandle('t'))
+
+    def test_result_key_is_memoised(self):
+        with mock.patch('sales_trend.analyze_trend', wraps=sales_trend.analyze_trend) as analyze, \
+                mock.patch('sales_trend.detect_anomalies', wraps=sales_trend.detect_anomalies) as detect:
+            first = self.run_analysis()
+            second = self.run_analysis()
+            self.assertEqual(analyze.call_count, 1)
+            self.assertEqual(detect.call_count, 1)
+
+            # 调用方修改返回结果不影响缓存
+            first['extra'] = True
+            self.assertNotIn('extra', self.run_analysis())
+            self.assertEqual(second['anomaly_summary'], first['anomaly_summary'])
+            self.assertIn('date_parsing', second)
+
+            # 参数不同时重新计算
+            self.run_analysis(granularity='week')
+            self.assertEqual(analyze.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
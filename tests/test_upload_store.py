@@ -0,0 +1,108 @@
+"""UploadStore按内容寻址存储、过期和淘汰的测试"""
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from werkzeug.datastructures import FileStorage
+
+from upload_store import UploadStore
+
+
+def upload(content, filename='sales.xlsx'):
+    return FileStorage(stream=io.BytesIO(content), filename=filename)
+
+
+class UploadStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'uploads')
+        self.store = UploadStore(self.root, max_bytes=1 << 30, ttl=3600)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def listing(self):
+        return sorted(os.listdir(self.root))
+
+    def age(self, path, seconds):
+        past = time.time() - seconds
+        os.utime(path, (past, past))
+
+    def test_put_deduplicates_identical_content(self):
+        first = self.store.put(upload(b'same content', 'a.xlsx'))
+        self.store.set_columns(first['file_id'], 'Sheet1', ['日期', '销售额'])
+        second = self.store.put(upload(b'same content', 'b.xlsx'))
+
+        self.assertEqual(first['file_id'], second['file_id'])
+        self.assertEqual(first['path'], second['path'])
+        self.assertEqual(self.listing(), [first['file_id']])  # 没有残留的临时文件
+        self.assertEqual(sorted(os.listdir(os.path.dirname(first['path']))), ['data.xlsx', 'meta.json'])
+        with open(second['path'], 'rb') as f:
+            self.assertEqual(f.read(), b'same content')
+
+        # 元数据保留，文件名更新为最近一次上传的名称
+        self.assertEqual(second['filename'], 'b.xlsx')
+        self.assertEqual(second['columns'], {'Sheet1': ['日期', '销售额']})
+        self.assertEqual(second['created_at'], first['created_at'])
+
+        other = self.store.put(upload(b'other content'))
+        self.assertNotEqual(other['file_id'], first['file_id'])
+        self.assertEqual(len(self.listing()), 2)
+
+    def test_get_expires_after_ttl(self):
+        entry = self.store.put(upload(b'content'))
+        file_id = entry['file_id']
+        self.assertEqual(self.store.get(file_id)['path'], entry['path'])
+
+        self.store.update(file_id, last_access=time.time() - 3601)
+        self.assertIsNone(self.store.get(file_id))
+
+    def test_get_refreshes_access_time(self):
+        file_id = self.store.put(upload(b'content'))['file_id']
+        self.store.update(file_id, last_access=time.time() - 3000)
+        self.assertIsNotNone(self.store.get(file_id))
+        self.assertGreater(self.store.get(file_id)['last_access'], time.time() - 60)
+
+    def test_get_rejects_invalid_or_missing_entries(self):
+        entry = self.store.put(upload(b'content'))
+        self.assertIsNone(self.store.get('../' + entry['file_id'][3:]))
+        self.assertIsNone(self.store.get('0' * 64))
+        os.remove(entry['path'])
+        self.assertIsNone(self.store.get(entry['file_id']))
+
+    def test_evict_removes_stale_tmp_files_and_expired_entries(self):
+        stale_tmp = os.path.join(self.root, 'stale.upload.tmp')
+        fresh_tmp = os.path.join(self.root, 'fresh.upload.tmp')
+        for path in (stale_tmp, fresh_tmp):
+            with open(path, 'wb') as f:
+                f.write(b'partial upload')
+        self.age(stale_tmp, 3601)
+
+        expired = self.store.put(upload(b'expired'))['file_id']
+        kept = self.store.put(upload(b'kept'))['file_id']
+        self.store.update(expired, last_access=time.time() - 3601)
+
+        self.store.evict(force=True)
+        self.assertEqual(self.listing(), sorted(['fresh.upload.tmp', kept]))
+
+    def test_evict_by_size_removes_least_recently_used(self):
+        store = UploadStore(self.root, max_bytes=2800, ttl=3600)  # 每个条目约1.2KB，只能保留两个
+        ids = [store.put(upload(bytes([i]) * 1000))['file_id'] for i in range(3)]
+        # 刚访问过的条目受MIN_RESIDENCY保护
+        store.evict(force=True)
+        self.assertEqual(len(self.listing()), 3)
+
+        for offset, file_id in zip((900, 600, 400), ids):
+            store.update(file_id, last_access=time.time() - offset)
+        store.get(ids[0])  # ids[0]重新变为最近使用
+        with mock.patch('upload_store.MIN_RESIDENCY', 0):
+            store.evict(force=True)
+        self.assertEqual(self.listing(), sorted([ids[0], ids[2]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+import pandas as pd
+from sheet_cache import read_excel_cached
+
+logger = logging.getLogger(__name__)
+
+TREND_SESSION_MAX_BYTES = int(os.environ.get('TREND_SESSION_MAX_BYTES', 1024 * 1024 * 1024))  # 默认1GB
+TREND_SESSION_TTL = int(os.environ.get('TREND_SESSION_TTL', 3600))  # 会话闲置1小时后释放
+BUILD_WAIT_INTERVAL = 0.2  # 等待其他请求计算同一结果时检查是否取消的间隔（秒）
+
+
+def _estimate_bytes(value):
+    """估算缓存结果占用的内存（DataFrame/Series按列数据计算，容器递归计算）"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(index=True).sum()) if isinstance(value, pd.DataFrame) \
+            else int(value.memory_usage(index=True))
+    if isinstance(value, dict):
+        return sum(_estimate_bytes(v) for v in value.values()) + sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_bytes(v) for v in value) + sys.getsizeof(value)
+    return sys.getsizeof(value)
+
+
+class TrendSession:
+    """一个上传文件（按内容SHA-256区分）在销售趋势各接口之间共享的分析会话
+
+    分析建议、同比条件检查和各类分析（趋势、同比、环比）使用同一个会话：
+    - 工作表通过磁盘上的工作表缓存读取，同一文件只解析一次
+    - 清洗后的日期列/值列、各时间粒度的聚合结果等按键缓存在内存中，由调用方提供计算函数
+    - 会话锁只保护缓存字典，计算在锁外进行；同一个键同时只有一个请求在计算，其他请求等待该键的事件
+    """
+
+    def __init__(self, file_id, path, filename=None):
+        self.file_id = file_id
+        self.path = path
+        self.filename = filename
+        self.nbytes = 0
+        self.last_access = time.time()
+        self._cache = {}
+        self._building = {}  # 正在计算的键 -> 计算完成（成功或失败）时触发的threading.Event
+        self._lock = threading.Lock()
+
+    def read_sheet(self, sheet_name=0, cancel_check=None):
+        """读取工作表，等价于pd.read_excel(path, sheet_name=sheet_name)
+
+        cancel_check: 可选的取消检查回调，解析期间定期调用（见sheet_cache.read_excel_cached）
+        """
+        return read_excel_cached(self.path, sheet_name=sheet_name, cancel_check=cancel_check)
+
+    def peek(self, key):
+        """返回key对应的缓存结果，不存在时返回None"""
+        with self._lock:
+            self.last_access = time.time()
+            return self._cache.get(key)
+
+    def put(self, key, value):
+        """缓存key对应的结果"""
+        with self._lock:
+            if key not in self._cache:
+                self.nbytes += _estimate_bytes(value)
+            self._cache[key] = value
+            self.last_access = time.time()
+        return value
+
+    def get(self, key, build, cancel_check=None):
+        """返回key对应的缓存结果，不存在时调用build()计算并缓存
+
+        同一个键的并发请求会等待第一个请求计算完成，不会重复计算；不同键的计算互不阻塞。
+        等待期间每隔BUILD_WAIT_INTERVAL秒调用一次cancel_check，任务取消时不再等待。
+        build抛出的异常不会被缓存，等待的请求会重新尝试计算。
+        """
+        while True:
+            with self._lock:
+                if key in self._cache:
+                    self.last_access = time.time()
+                    return self._cache[key]
+                event = self._building.get(key)
+                if event is None:
+                    event = self._building[key] = threading.Event()
+                    break
+
+            while not event.wait(BUILD_WAIT_INTERVAL):
+                if cancel_check is not None:
+                    cancel_check()
+
+        try:
+            return self.put(key, build())
+        finally:
+            with self._lock:
+                del self._building[key]
+            event.set()
+
+
+class TrendSessionStore:
+    """按file_id管理分析会话，按最近使用时间淘汰，受总内存和闲置时间限制"""
+
+    def __init__(self, max_bytes=TREND_SESSION_MAX_BYTES, ttl=TREND_SESSION_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_id, path, filename=None):
+        """获取文件对应的会话，不存在时创建"""
+        with self._lock:
+            now = time.time()
+            session = self._sessions.get(file_id)
+            if session is None or session.path != path or session.last_access + self.ttl < now:
+                session = TrendSession(file_id, path, filename)
+                self._sessions[file_id] = session
+            elif filename:
+                session.filename = filename
+            self._sessions.move_to_end(file_id)
+            session.last_access = now
+            # 先把请求的会话标记为最近使用再淘汰，避免刚取到的会话被淘汰
+            self._evict()
+            return session
+
+    def discard(self, file_id):
+        """释放文件对应的会话"""
+        with self._lock:
+            self._sessions.pop(file_id, None)
+
+    def _evict(self):
+        now = time.time()
+        for file_id, session in list(self._sessions.items()):
+            if session.last_access + self.ttl < now:
+                del self._sessions[file_id]
+
+        # 按最近使用时间从旧到新淘汰，最近使用的会话总是保留
+        total = sum(session.nbytes for session in self._sessions.values())
+        while total > self.max_bytes and len(self._sessions) > 1:
+            file_id, session = self._sessions.popitem(last=False)
+            total -= session.nbytes
+            logger.info(f"销售趋势会话缓存超出大小限制，释放 {file_id}")
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CACHE_MAX_BYTES = int(os.environ.get('UPLOAD_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 默认2GB
+CHUNK_SIZE = 1024 * 1024  # 计算哈希时每次读取1MB
+EVICT_INTERVAL = 60  # 两次淘汰检查之间的最小间隔（秒）
+MIN_RESIDENCY = 300  # 最近5分钟内访问过的文件可能正在被分析，不因大小限制被淘汰
+
+
+def _write_json(path, data):
+    """先写临时文件再原子替换，避免其他进程读到写了一半的文件"""
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _temp_file_in(directory):
+    """在存储目录中创建临时文件，保证之后可以原子地重命名"""
+    path = os.path.join(directory, f"{uuid.uuid4().hex}.upload.tmp")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    return fd, path
+
+
+class UploadStore:
+    """按文件内容（SHA-256）寻址的上传文件存储
+
+    同一个工作簿在 /get_sheets、/get_columns、/analyze 之间只需要上传和解析一次：
+    - 每个文件保存在 root/<sha256>/ 目录下，meta.json记录原始文件名、工作表列表和各工作表的表头
+    - 之后的请求通过file_id（即内容的SHA-256）引用文件
+    - 按最近访问时间淘汰（LRU），同时受总大小和存活时间（TTL）限制
+    存储完全基于文件系统，多个gunicorn worker之间共享。
+    """
+
+    def __init__(self, root, max_bytes=UPLOAD_CACHE_MAX_BYTES, ttl=24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._last_evict = 0
+        os.makedirs(root, exist_ok=True)
+
+    def entry_dir(self, file_id):
+        """返回文件的存储目录，file_id格式不正确时返回None"""
+        if not file_id or len(file_id) != 64 or not all(c in '0123456789abcdef' for c in file_id):
+            return None
+        return os.path.join(self.root, file_id)
+
+    def _meta_path(self, file_id):
+        return os.path.join(self.entry_dir(file_id), 'meta.json')
+
+    def put(self, file):
+        """保存上传的文件（werkzeug FileStorage），内容相同的文件只保存一份
+
+        返回:
+        - dict: 文件条目（包含file_id、path、filename等）
+        """
+        ext = os.path.splitext(file.filename or '')[1].lower()
+        fd, temp_path = _temp_file_in(self.root)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            file_id = digest.hexdigest()
+            entry_dir = self.entry_dir(file_id)
+            data_path = os.path.join(entry_dir, f"data{ext}")
+            os.makedirs(entry_dir, exist_ok=True)
+            if os.path.exists(data_path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, data_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            meta = _read_json(self._meta_path(file_id)) or {
+                'file_id': file_id,
+                'size': size,
+                'created_at': time.time(),
+                'sheets': None,
+                'columns': {}
+            }
+            meta['filename'] = file.filename
+            meta['ext'] = ext
+            meta['last_access'] = time.time()
+            _write_json(self._meta_path(file_id), meta)
+
+        self.evict()
+        return self._entry(file_id, meta)
+
+    def _entry(self, file_id, meta):
+        entry = dict(meta)
+        entry['path'] = os.path.join(self.entry_dir(file_id), f"data{meta.get('ext', '')}")
+        return entry
+
+    def get(self, file_id):
+        """按file_id获取文件条目并刷新访问时间，不存在或已过期时返回None"""
+        entry_dir = self.entry_dir(file_id)
+        if entry_dir is None:
+            return None
+        with self._lock:
+            meta = _read_json(self._meta_path(file_id))
+            if meta is None:
+                return None
+            if meta.get('last_access', 0) + self.ttl < time.time():
+                return None
+            entry = self._entry(file_id, meta)
+            if not os.path.exists(entry['path']):
+                return None
+            meta['last_access'] = time.time()
+            _write_json(self._meta_path(file_id), meta)
+        return entry
+
+    def update(self, file_id, **fields):
+        """更新文件的元数据（如sheets列表）"""
+        with self._lock:
+            meta = _read_json(self._meta_path(file_id))
+            if meta is None:
+                return
+            meta.update(fields)
+            _write_json(self._meta_path(file_id), meta)
+
+    def set_columns(self, file_id, sheet_name, columns, suggested_column=None):
+        """缓存某个工作表的表头及建议的分析列"""
+        with self._lock:
+            meta = _read_json(self._meta_path(file_id))
+            if meta is None:
+                return
+            meta.setdefault('columns', {})[str(sheet_name)] = columns
+            meta.setdefault('suggested_columns', {})[str(sheet_name)] = suggested_column
+            _write_json(self._meta_path(file_id), meta)
+
+    def _dir_size(self, entry_dir):
+        total = 0
+        for dirpath, _, filenames in os.walk(entry_dir):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        return total
+
+    def evict(self, force=False):
+        """淘汰过期条目，然后按最近访问时间从旧到新淘汰，直到总大小不超过max_bytes"""
+        now = time.time()
+        if not force and now - self._last_evict < EVICT_INTERVAL:
+            return
+        self._last_evict = now
+
+        entries = []
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            entry_dir = os.path.join(self.root, name)
+            if not os.path.isdir(entry_dir):
+                # 清理残留的临时文件
+                if name.endswith('.tmp') and os.path.getmtime(entry_dir) + self.ttl < now:
+                    try:
+                        os.remove(entry_dir)
+                    except OSError:
+                        pass
+                continue
+            meta = _read_json(os.path.join(entry_dir, 'meta.json'))
+            last_access = meta.get('last_access', 0) if meta else os.path.getmtime(entry_dir)
+            if last_access + self.ttl < now:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            entries.append((last_access, self._dir_size(entry_dir), entry_dir))
+
+        total = sum(size for _, size, _ in entries)
+        for last_access, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes or last_access + MIN_RESIDENCY > now:
+                break
+            logger.info(f"上传缓存超出大小限制，淘汰 {os.path.basename(entry_dir)}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size